@@ -0,0 +1,49 @@
+import asyncio
+import contextlib
+from contextvars import ContextVar
+
+request_id = ContextVar("request_id", default=None)
+
+
+@contextlib.asynccontextmanager
+async def session(name):
+    await asyncio.sleep(0.01)
+    yield name
+    await asyncio.sleep(0.01)
+
+
+async def fetch(seconds):
+    await asyncio.sleep(seconds)
+    return seconds
+
+
+async def pages(n):
+    for i in range(n):
+        await asyncio.sleep(0.02)
+        yield i
+
+
+def parse(page):
+    return page * 2
+
+
+async def handle(i):
+    async with session(f"user{i}"):
+        r = await asyncio.gather(fetch(0.05 * i), fetch(0.1))
+        async for page in pages(2):
+            parse(page)
+    return r
+
+
+async def serve(i):
+    request_id.set(f"req{i}")
+    return await handle(i)
+
+
+async def main():
+    # three requests served concurrently on one event loop
+    return await asyncio.gather(*(serve(i) for i in range(1, 4)))
+
+
+if __name__ == "__main__":
+    print(asyncio.run(main()))
@@ -0,0 +1,23 @@
+import asyncio
+
+import hiq
+
+
+def run_main():
+    with hiq.HiQStatusContext():
+        driver = hiq.HiQLatency(
+            hiq_table_or_path=[
+                ["main", "", "handle", "handle"],
+                ["main", "", "session", "session"],
+                ["main", "", "fetch", "fetch"],
+                ["main", "", "pages", "pages"],
+                ["main", "", "parse", "parse"],
+            ],
+            hiq_id_func=lambda: hiq.mod("main").request_id.get(),
+        )
+        asyncio.run(hiq.mod("main").main())
+        driver.show(show_key=True)
+
+
+if __name__ == "__main__":
+    run_main()
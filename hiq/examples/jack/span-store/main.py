@@ -0,0 +1,18 @@
+import time
+
+
+def func1():
+    time.sleep(0.15)
+    func2()
+
+
+def func2():
+    time.sleep(0.25)
+
+
+def main():
+    func1()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import hiq
+from hiq.hiq_utils import HiQIdGenerator
+from hiq.span_store import SpanStore
+
+here = os.path.dirname(os.path.realpath(__file__))
+
+
+def run_main():
+    with hiq.HiQStatusContext():
+        driver = hiq.HiQLatency(f"{here}/hiq.conf", max_hiq_size=0)
+        ids = []
+        for _ in range(4):
+            driver.get_tau_id = HiQIdGenerator()
+            ids.append(driver.get_tau_id())
+            hiq.mod("main").main()
+        # evict the last request and send what is pending to Jack
+        driver.disable_hiq()
+        driver.flush_jack()
+
+    # any process can open the store to look up a request
+    store = SpanStore(os.environ["HIQ_JACK_STORE_PATH"], readonly=True)
+    print(store.get_forest(ids[2])["time"].get_graph())
+    print(len(store.query(name="__main")), "trees of main")
+
+
+if __name__ == "__main__":
+    os.environ["JACK"] = "1"
+    os.environ["NO_JACK_LOG"] = "1"
+    os.environ["HIQ_JACK_STORE"] = "1"
+    os.environ["HIQ_JACK_STORE_PATH"] = tempfile.mkdtemp(prefix="jack_store_")
+    run_main()
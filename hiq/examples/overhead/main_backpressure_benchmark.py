@@ -0,0 +1,114 @@
+"""Jack and LMK with a stalled exporter process
+
+Stops the Jack and LMK processes(SIGSTOP), like a slow OCI Streaming endpoint or
+a full disk would, sends them much more than their capacity, and resumes them.
+For every overflow policy it prints the time spent on the request thread and the
+counters of `driver.get_export_stats()`, which show that the memory stays bounded:
+what does not fit is dropped and counted. A failing LMK handler shows that export
+errors are counted and reported without stopping the exporter.
+"""
+import os
+import signal
+import tempfile
+import time
+
+home = tempfile.mkdtemp()
+os.environ["HOME"] = home
+os.environ["NO_JACK_LOG"] = "1"
+
+import hiq
+from hiq.jack import Jack
+from hiq.monkeyking import LogMonkeyKing
+from hiq.overflow import OVERFLOW_POLICIES
+from hiq.tree import Tree
+
+N = int(os.environ.get("N", 20_000))  # trees for Jack, N * 10 events for LMK
+CAPACITY = N // 10
+
+
+def new_forest(i):
+    t = Tree(tid="time")
+    t.start("__handler", i)
+    t.end("__handler", i + 1.0)
+    return {"time": t}
+
+
+def stalled(exporter, send, flush):
+    os.kill(exporter.consumer.pid, signal.SIGSTOP)
+    start = time.perf_counter()
+    send()
+    on_thread = time.perf_counter() - start
+    os.kill(exporter.consumer.pid, signal.SIGCONT)
+    assert flush(timeout=60)
+    return on_thread
+
+
+def run_jack(policy):
+    os.environ["JACK"] = "1"
+    os.environ["HIQ_JACK_OVERFLOW"] = policy
+    os.environ["HIQ_JACK_CAPACITY"] = str(CAPACITY)
+    os.environ["HIQ_JACK_RING_MB"] = "1"
+    os.environ["HIQ_JACK_BLOCK_MS"] = "5"
+    jack = Jack()
+    jack.overhead_meter = hiq.overhead.OverheadMeter()
+    jack.check_oh_counter = 0
+    forests = [new_forest(i) for i in range(N)]
+
+    def send():
+        for i in range(0, N, 8):
+            jack.send_trees_to_jack(forests[i : i + 8])
+
+    on_thread = stalled(jack, send, jack.flush_jack)
+    stats = jack.jack_stats()
+    jack.close_jack()
+    jack.consumer.terminate()
+    return on_thread / (N // 8), stats
+
+
+def failing_handler(data, pid):
+    if data["name"] == "__bad":
+        raise RuntimeError("disk is full")
+    return str(data)
+
+
+def run_lmk(policy, handler=None):
+    os.environ["LMK"] = "1"
+    os.environ["HIQ_LMK_OVERFLOW"] = policy
+    os.environ["HIQ_LMK_CAPACITY"] = str(CAPACITY * 10)
+    os.environ["HIQ_LMK_RING_MB"] = "1"
+    os.environ["HIQ_LMK_BLOCK_MS"] = "5"
+    os.environ["HIQ_LMK_FORMAT"] = "jsonl" if handler is None else "text"
+    lmk = LogMonkeyKing(lmk_path=f"{home}/lmk.jsonl", lmk_handler=handler, lmk_logger=None)
+    tree = Tree(tid="time", queue_lmk=lmk.queue_lmk)
+    n = N * 10 if handler is None else 10
+
+    def send():
+        for i in range(n // 2):
+            name = "__bad" if handler and i == 2 else "__leaf"
+            tree.start(name, i)
+            tree.end(name, i + 0.5)
+
+    on_thread = stalled(lmk, send, lmk.flush_lmk)
+    stats = lmk.lmk_stats()
+    lmk.close_lmk()
+    lmk.consumer.terminate()
+    return on_thread / n, stats
+
+
+def run_main():
+    for policy in OVERFLOW_POLICIES:
+        us, stats = run_jack(policy)
+        print(f"jack {policy:>12}: {us * 1e6:8.2f}us/batch of 8 forests, {stats}")
+        assert stats["depth"] == 0 and stats["enqueued"] == N
+        assert stats["exported"] + stats["dropped"] == N
+        us, stats = run_lmk(policy)
+        print(f"lmk  {policy:>12}: {us * 1e6:8.2f}us/event, {stats}")
+        assert stats["depth"] == 0 and stats["enqueued"] == N * 10
+        assert stats["exported"] + stats["dropped"] == N * 10
+    _, stats = run_lmk(OVERFLOW_POLICIES[0], failing_handler)
+    print(f"lmk with a failing handler: {stats}")
+    assert stats["failed"] == 10 and stats["exported"] == 0
+
+
+if __name__ == "__main__":
+    run_main()
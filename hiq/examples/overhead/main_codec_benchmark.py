@@ -0,0 +1,67 @@
+"""Binary encoding of HiQ trees vs the text format
+
+Builds trees of 1k nodes like a traced request records them, then prints the
+size and the encode/decode time of the text format(`Tree.repr()` and
+`Tree(s)`), of the text format compressed by zlib, and of `hiq.codec`.
+"""
+import os
+import random
+import time
+import zlib
+
+from hiq.codec import dumps, loads
+from hiq.tree import Tree
+
+N = int(os.environ.get("N", 200))  # trees
+NODES = 1000
+
+
+def new_tree(seed):
+    rnd = random.Random(seed)
+    t = Tree(tid="time", extra={"req": f"req-{seed}"})
+    now, names, started = time.time(), [], 0
+    while started < NODES:
+        if len(names) < 8 and rnd.random() < 0.55:
+            names.append(f"__func_{rnd.randint(0, 40)}")
+            t.start(names[-1], now, {"size": rnd.randint(0, 1 << 20)} if rnd.random() < 0.1 else {})
+            started += 1
+        elif names:
+            t.end(names.pop(), now)
+        now += rnd.random() / 1000
+    while names:
+        t.end(names.pop(), now)
+    return t
+
+
+def bench(name, encode, decode, trees):
+    start = time.perf_counter()
+    data = [encode(t) for t in trees]
+    t_enc = time.perf_counter() - start
+    start = time.perf_counter()
+    for d in data:
+        decode(d)
+    t_dec = time.perf_counter() - start
+    size = sum(len(d) for d in data) / len(data)
+    print(
+        f"{name:>10}: {size / 1024:7.1f}KB/tree, encode {t_enc / len(trees) * 1e3:6.2f}ms, "
+        f"decode {t_dec / len(trees) * 1e3:6.2f}ms"
+    )
+
+
+def run_main():
+    trees = [new_tree(i) for i in range(N)]
+    for t in trees:
+        assert loads(dumps(t)).repr() == t.repr()
+    bench("text", lambda t: t.repr().encode(), lambda b: Tree(b.decode()), trees)
+    bench(
+        "text+zlib",
+        lambda t: zlib.compress(t.repr().encode()),
+        lambda b: Tree(zlib.decompress(b).decode()),
+        trees,
+    )
+    bench("binary", dumps, loads, trees)
+    bench("bin+zlib", lambda t: zlib.compress(dumps(t)), lambda b: loads(zlib.decompress(b)), trees)
+
+
+if __name__ == "__main__":
+    run_main()
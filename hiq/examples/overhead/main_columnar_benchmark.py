@@ -0,0 +1,90 @@
+"""One columnar tree vs one tree per metric function
+
+A driver with four metric functions records each request either as one
+latency tree whose nodes carry the other metrics in a vector(the default), or
+as one tree per metric function(`HIQ_COLUMNAR=0`). This prints the cost per
+call and the memory per request of both layouts, and checks that the views of
+the columnar layout show the same values as the trees of the other one.
+"""
+import gc
+import os
+import time
+
+import hiq
+from hiq.constants import KEY_LATENCY
+
+N = int(os.environ.get("N", 50_000))  # requests
+calls = 0
+
+
+def counter():
+    return calls
+
+
+def leaf(x):
+    global calls
+    calls += 1
+    return x + 1
+
+
+def handler(x):
+    return leaf(x) + leaf(x + 1) + leaf(x + 2)
+
+
+def req_id():
+    return current_request
+
+
+current_request = 0
+
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def run(columnar):
+    global current_request, calls
+    os.environ["HIQ_COLUMNAR"] = "1" if columnar else "0"
+    calls = 0
+    driver = hiq.HiQLatency(
+        hiq_table_or_path=[
+            [__name__, "", "handler", "handler"],
+            [__name__, "", "leaf", "leaf"],
+        ],
+        metric_funcs=[time.time, time.process_time, time.monotonic, counter],
+        hiq_id_func=req_id,
+        max_hiq_size=N,
+    )
+    gc.collect()
+    mem = rss()
+    start = time.perf_counter()
+    for i in range(N):
+        current_request = i
+        handler(i)
+    elapsed = time.perf_counter() - start
+    mem = rss() - mem
+    layout = "columnar" if columnar else "per metric"
+    print(
+        f"{layout:>10}: {elapsed / N / 4 * 1e6:6.2f}us/call, {mem / N:6.0f}B/request, "
+        f"{len(driver.tau[0])} tree(s) recorded per request"
+    )
+    last = driver.tau[N - 1]
+    values = [
+        (n.name, n.start, n.end) for n in last["counter"].root.nodes[0].nodes
+    ]
+    driver.disable_hiq(reset_trace=True)
+    return values
+
+
+def run_main():
+    with hiq.HiQStatusContext():
+        per_metric = run(columnar=False)
+        columnar = run(columnar=True)
+    os.environ.pop("HIQ_COLUMNAR")
+    assert per_metric == columnar, (per_metric, columnar)
+    print(f"counter view of the last request: {columnar}")
+
+
+if __name__ == "__main__":
+    run_main()
@@ -0,0 +1,59 @@
+"""A/B comparison of two builds with `hiq.compare`
+
+Writes two Jack logs of `N` requests each(100000 by default), where the
+candidate build makes `__infer` 10% slower and drops `__cache`, then compares
+them by call path. Prints the time of the comparison, the table and the
+differential flame summary.
+"""
+import os
+import random
+import tempfile
+import time
+
+import hiq
+from hiq.tree import Tree
+
+N = int(os.environ.get("N", 100_000))
+
+
+def write_log(path, rnd, slow=1.0, cache=True):
+    # the trees of a few hundred requests, shifted in time, are enough
+    texts = []
+    for i in range(500):
+        t = Tree(extra={}, tid=str(i))
+        now = 0.0
+        t.start("__main", now)
+        t.start("__load", now)
+        now += rnd.uniform(0.010, 0.012)
+        t.end("__load", now)
+        for _ in range(rnd.randint(2, 4)):
+            t.start("__infer", now)
+            now += rnd.uniform(0.020, 0.030) * slow
+            t.end("__infer", now)
+        if cache:
+            t.start("__cache", now)
+            now += 0.0005
+            t.end("__cache", now)
+        t.end("__main", now + 0.001)
+        texts.append(t.repr())
+    with open(path, "w") as f:
+        for i in range(N):
+            f.write(f"time,{texts[rnd.randrange(len(texts))]}\n")
+
+
+def main():
+    rnd = random.Random(11)
+    with tempfile.TemporaryDirectory() as d:
+        base, cand = os.path.join(d, "base.log"), os.path.join(d, "cand.log")
+        write_log(base, rnd)
+        write_log(cand, rnd, slow=1.1, cache=False)
+        start = time.monotonic()
+        r = hiq.compare(base, cand)
+        elapsed = time.monotonic() - start
+    print(r.table())
+    print(r.flame())
+    print(f"{N} vs {N} requests: {elapsed:.2f}s, passed: {r.passed}")
+
+
+if __name__ == "__main__":
+    main()
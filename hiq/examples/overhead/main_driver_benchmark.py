@@ -0,0 +1,83 @@
+"""Per-call tracing overhead: specialized wrappers vs the generic inserter
+
+The generic inserter below is how every traced call used to be wrapped: it looks
+up `TRACE_TYPE` and `LOG_MONKEY_FILE` and calls `get_tree` once per metric
+function on every call. `HiQBase._compile` resolves all of these when the driver
+is enabled.
+"""
+import os
+import time
+
+import hiq
+from hiq.constants import TRACING_TYPE_HIQ
+from hiq.hiq_utils import call_decorated, get_global_hiq_status
+
+N = int(os.environ.get("N", 200_000))
+
+
+def fun(x):
+    return x + 1
+
+
+def req_id():
+    return current_request
+
+
+current_request = 0
+
+
+def generic_inserter(s, f):
+    def __x(*args, **kwargs):
+        if not get_global_hiq_status():
+            return f(*args, **kwargs)
+        f_name = f.__name__
+        s.pre_processing(f_name, args, kwargs)
+        result = None
+        try:
+            result = call_decorated(
+                f,
+                args,
+                kwargs,
+                tracing_type=os.environ.get("TRACE_TYPE", TRACING_TYPE_HIQ),
+            )
+        except Exception as e:
+            s.handle_exception(f_name, e)
+        s.post_processing(f_name)
+        s.update_overhead()
+        return result
+
+    return __x
+
+
+def per_call_ns(f, n=N):
+    global current_request
+    start = time.perf_counter_ns()
+    for i in range(n):
+        # every call is a new request, like in a busy web service
+        current_request = i
+        f(i)
+    return (time.perf_counter_ns() - start) / n
+
+
+def bench(driver_cls, title):
+    with hiq.HiQStatusContext():
+        driver = driver_cls(hiq_id_func=req_id)
+        base = per_call_ns(fun)
+        generic = per_call_ns(generic_inserter(driver, fun)) - base
+        driver.reset()
+        specialized = per_call_ns(driver.inserter(fun)) - base
+        driver.disable_hiq(reset_trace=True)
+    print(
+        f"{title:>8}: generic {generic / 1e3:7.2f}us/call, "
+        f"specialized {specialized / 1e3:7.2f}us/call, "
+        f"{generic / specialized:5.2f}x"
+    )
+
+
+def run_main():
+    bench(hiq.HiQLatency, "latency")
+    bench(hiq.HiQMemory, "memory")
+
+
+if __name__ == "__main__":
+    run_main()
@@ -0,0 +1,115 @@
+"""Jack transport: a multiprocessing queue vs the shared-memory ring
+
+Sends the trees of `N` evicted requests in batches of 8, like a busy web worker
+does, and prints the time spent on the request thread per batch and the trees
+per second taken by the Jack process, for the previous transport(a
+`multiprocessing.Queue` of `repr()` strings, logged line by line, copied below)
+and for the ring, with and without compression. Logs go to a temporary folder.
+"""
+import logging
+import os
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+from multiprocessing import Process, Queue, Value
+
+home = tempfile.mkdtemp()
+os.environ["HOME"] = home
+
+import hiq
+from hiq.tree import Tree
+
+N = int(os.environ.get("N", 20_000))  # requests
+BATCH = 8
+# keep every tree: the ring is measured, not the overflow policy
+os.environ.setdefault("HIQ_JACK_CAPACITY", str(N))
+
+
+def new_forest(i):
+    t = Tree(tid="time")
+    now = 1637008247.0 + i
+    for j in range(10):
+        t.start("__handler", now + j)
+        for k in range(4):
+            t.start("__leaf", now + j + k * 0.1)
+            t.end("__leaf", now + j + k * 0.1 + 0.05)
+        t.end("__handler", now + j + 0.9)
+    return {"time": t}
+
+
+def queue_consumer(queue, done, log_file):
+    """the previous consumer: a log record per tree"""
+    handler = RotatingFileHandler(log_file, maxBytes=500 * 1024 * 1024, backupCount=20)
+    logger = logging.getLogger("queue")
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    while True:
+        data = queue.get()
+        for key, value in (i for d in data for i in d.items()):
+            logger.info(key + "," + value)
+            with done.get_lock():
+                done.value += 1
+
+
+def run_queue(forests):
+    queue, done = Queue(), Value("l", 0)
+    consumer = Process(target=queue_consumer, args=(queue, done, f"{home}/queue.log"))
+    consumer.daemon = True
+    consumer.start()
+    start = time.perf_counter()
+    on_thread = 0.0
+    for i in range(0, len(forests), BATCH):
+        t = time.perf_counter()
+        # what `send_trees_to_jack` did on the request thread
+        queue.put_nowait([{k: v.repr() for k, v in f.items()} for f in forests[i : i + BATCH]])
+        on_thread += time.perf_counter() - t
+    while done.value < len(forests):
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    consumer.terminate()
+    return on_thread, elapsed
+
+
+def run_ring(forests, codec):
+    os.environ["JACK"] = "1"
+    os.environ["HIQ_JACK_COMPRESS"] = codec
+    jack = hiq.jack.Jack()
+    jack.overhead_meter = hiq.overhead.OverheadMeter()
+    jack.check_oh_counter = 0
+    start = time.perf_counter()
+    on_thread = 0.0
+    for i in range(0, len(forests), BATCH):
+        t = time.perf_counter()
+        jack.send_trees_to_jack(forests[i : i + BATCH])
+        on_thread += time.perf_counter() - t
+    assert jack.flush_jack(timeout=600)
+    elapsed = time.perf_counter() - start
+    jack.close_jack()
+    jack.consumer.terminate()
+    jack.consumer = None
+    return on_thread, elapsed
+
+
+def report(name, forests, on_thread, elapsed):
+    batches = len(forests) / BATCH
+    print(
+        f"{name:>12}: {on_thread / batches * 1e6:8.2f}us/batch on the request thread, "
+        f"{len(forests) / elapsed:9.0f} trees/s"
+    )
+    return len(forests) / elapsed
+
+
+def run_main():
+    forests = [new_forest(i) for i in range(N)]
+    with open(os.devnull, "w"):
+        base = report("queue", forests, *run_queue(forests))
+        for codec in ("none", "zlib"):
+            rate = report(f"ring {codec}", forests, *run_ring(forests, codec))
+            print(f"{'':>12}  {rate / base:.1f}x")
+    lines = sum(1 for _ in open(f"{home}/.hiq/log_jack.log"))
+    assert lines == 2 * N, lines
+    print(f"{lines} trees logged by Jack in {home}/.hiq/log_jack.log")
+
+
+if __name__ == "__main__":
+    run_main()
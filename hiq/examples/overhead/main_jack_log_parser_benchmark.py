@@ -0,0 +1,127 @@
+"""Parsing Jack logs: the character by character `_c` vs the one pass one
+
+Writes `MB` megabytes(100 by default) of log lines in the format of `_d`, with
+names which have separators in them too, then parses them with the previous
+implementation of `node_utils._c`(copied below) and with `node_utils.iter_nodes`,
+and checks that both give the same trees where the previous one can parse them.
+"""
+import ast
+import os
+import random
+import tempfile
+import time
+
+import itree
+from hiq.node_utils import _d, b64_str_to_dict, iter_nodes
+
+MB = int(os.environ.get("MB", 100))
+CHECK = 20_000  # lines compared
+
+
+def _parse_node_v0(s):
+    _start, _end, _extra = s.split(",")
+    if _extra and _extra != "inf":
+        _extra = b64_str_to_dict(_extra)
+    return float(_start), float(_end), _extra or {}
+
+
+def _c_v0(bs):
+    """the previous implementation of `node_utils._c`"""
+    stk_ = [itree.create_virtual_node()]
+    s = ""
+    for ch in bs:
+        if ch == "{":
+            if len(stk_) == 1:
+                stk_.append(itree._itree.Node("", 0, 0, {}))
+                stk_[0].append(stk_[1])
+            else:
+                if s:
+                    kv = s.split(":")
+                    stk_[-1].name = kv[0][1:-1]
+                    stk_[-1].start, stk_[-1].end, stk_[-1].extra = _parse_node_v0(kv[1])
+                    s = ""
+                t = itree._itree.Node("", 0, 0, {})
+                stk_[-1].append(t)
+                stk_.append(t)
+        elif ch == "}":
+            if s:
+                kv = s.split(":")
+                stk_[-1].name = kv[0][1:-1]
+                stk_[-1].start, stk_[-1].end, stk_[-1].extra = _parse_node_v0(kv[1])
+                s = ""
+            if len(stk_) > 1:
+                stk_.pop()
+        else:
+            s += ch
+    assert len(stk_) == 1, "bad tree data"
+    return itree._itree.consolidate(stk_[0])
+
+
+def new_line(rnd, names):
+    now = 1637008247.9725869 + rnd.random() * 1e6
+    root = itree._itree.Node("None", now, now, {})
+    stk = [root]
+    for _ in range(rnd.randint(5, 60)):
+        if len(stk) < 6 and rnd.random() < 0.6:
+            extra = {"img": "/tmp/a.jpg", "size": rnd.randint(0, 1 << 20)} if rnd.random() < 0.1 else {}
+            n = itree._itree.Node(rnd.choice(names), now, now, extra)
+            stk[-1].append(n)
+            stk.append(n)
+        elif len(stk) > 1:
+            stk.pop().end = now
+        now += rnd.random()
+    while len(stk) > 1:
+        stk.pop().end = now
+    root.end = now
+    return "time,v2,0," + _d(root) + "\n"
+
+
+def shape(n):
+    return (n.name, n.start, n.end, dict(n.extra), [shape(c) for c in n.nodes])
+
+
+def run_main():
+    rnd = random.Random(0)
+    plain = [f"__func_{i}" for i in range(40)]
+    # a node name cannot have a comma
+    odd = ["__f{x}", "__key:value", '__say "hi"']
+    path = os.path.join(tempfile.gettempdir(), f"hiq_jack_{MB}mb.log")
+    if not os.path.exists(path) or os.path.getsize(path) < MB * 1024 * 1024:
+        with open(path, "w") as f:
+            size = 0
+            while size < MB * 1024 * 1024:
+                line = new_line(rnd, plain + odd if rnd.random() < 0.01 else plain)
+                size += f.write(line)
+    print(f"{os.path.getsize(path) / 1024 / 1024:.0f}MB of log in {path}")
+
+    start = time.perf_counter()
+    failed = 0
+    with open(path) as f:
+        for line in f:
+            try:
+                _c_v0(line[line.index("{") :].rstrip())
+            except Exception:
+                failed += 1
+    t0 = time.perf_counter() - start
+    print(f"previous _c: {t0:6.2f}s, {failed} lines failed")
+
+    start = time.perf_counter()
+    with open(path) as f:
+        count = sum(1 for _ in iter_nodes(f, strict=True))
+    t1 = time.perf_counter() - start
+    print(f"iter_nodes:  {t1:6.2f}s, {count} lines, {t0 / t1:.1f}x")
+
+    with open(path) as f:
+        lines = [f.readline() for _ in range(CHECK)]
+    odd_names = 0
+    for line, node in zip(lines, iter_nodes(lines, strict=True)):
+        try:
+            expected = shape(_c_v0(line[line.index("{") :].rstrip()))
+        except Exception:
+            odd_names += 1
+            continue
+        assert shape(node) == expected, line
+    print(f"same trees in the first {CHECK} lines, {odd_names} have names the previous _c cannot parse")
+
+if __name__ == "__main__":
+    run_main()
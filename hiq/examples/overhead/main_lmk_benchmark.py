@@ -0,0 +1,120 @@
+"""Log Monkey King: a multiprocessing queue per event vs buffered frames
+
+Records `N` start and end events on a tree, like `Tree.start()`/`Tree.end()` do
+for a driver with `LMK=1`, and prints the time spent on the request thread per
+event and the events per second written by the LMK process. The previous
+transport(a `multiprocessing.Queue` message per event, formatted one by one and
+copied below) is compared with the event buffers, for the text, JSON lines and
+binary formats. Logs go to a temporary folder.
+"""
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+from multiprocessing import Process, Queue, Value
+
+import hiq
+from hiq.lmk_events import iter_lmk_file
+from hiq.monkeyking import LogMonkeyKing
+from hiq.tree import Tree
+
+N = int(os.environ.get("N", 100_000))  # events
+home = tempfile.mkdtemp()
+
+
+def file_logger(name):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.FileHandler(f"{home}/{name}.log"))
+    return logger
+
+
+def old_handler(data, pid):
+    """the previous `lmk_data_handler`"""
+    dt = datetime.fromtimestamp(data["value"]).strftime(r"%Y-%m-%d %H:%M:%S.%f")
+    monkey = "🐵" if data["is_start"] else "🙈"
+    return f"{dt} - [{data['id_']}] [🆔 {pid}] {monkey} [{data['name'][2:]}]"
+
+
+def queue_consumer(queue, done):
+    logger = file_logger("queue")
+    pid = os.getpid()
+    while True:
+        data = queue.get()
+        logger.info(old_handler(data, pid))
+        with done.get_lock():
+            done.value += 1
+
+
+def record(tree):
+    now = time.time()
+    start = time.perf_counter()
+    for i in range(N // 2):
+        tree.start("__leaf", now + i)
+        tree.end("__leaf", now + i + 0.5)
+    return time.perf_counter() - start
+
+
+def run_queue():
+    queue, done = Queue(), Value("l", 0)
+    consumer = Process(target=queue_consumer, args=(queue, done))
+    consumer.daemon = True
+    consumer.start()
+
+    class _Queue(object):
+        # what `Tree.start()` and `Tree.end()` did
+        def add(self, tid, name, value, extra, is_start):
+            queue.put_nowait(
+                dict(id_=tid, name=name, value=value, extra=extra, is_start=is_start)
+            )
+
+    start = time.perf_counter()
+    on_thread = record(Tree(tid="time", queue_lmk=_Queue()))
+    while done.value < N:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    consumer.terminate()
+    return on_thread, elapsed
+
+
+def run_buffered(fmt):
+    os.environ["LMK"] = "1"
+    os.environ["HIQ_LMK_FORMAT"] = fmt
+    path = f"{home}/lmk.{fmt}"
+    lmk = LogMonkeyKing(
+        lmk_path=None if fmt == "text" else path,
+        lmk_logger=file_logger("text") if fmt == "text" else None,
+    )
+    start = time.perf_counter()
+    on_thread = record(Tree(tid="time", queue_lmk=lmk.queue_lmk))
+    assert lmk.flush_lmk(timeout=60)
+    elapsed = time.perf_counter() - start
+    lmk.close_lmk()
+    lmk.consumer.terminate()
+    if fmt == "binary":
+        assert sum(1 for _ in iter_lmk_file(path)) == N
+    else:
+        with open(f"{home}/text.log" if fmt == "text" else path) as f:
+            assert sum(1 for _ in f) == N
+    return on_thread, elapsed
+
+
+def report(name, on_thread, elapsed):
+    print(
+        f"{name:>10}: {on_thread / N * 1e6:6.2f}us/event on the request thread, "
+        f"{N / elapsed:10.0f} events/s"
+    )
+    return N / elapsed
+
+
+def run_main():
+    base = report("queue", *run_queue())
+    for fmt in ("text", "jsonl", "binary"):
+        speed = report(fmt, *run_buffered(fmt))
+        print(f"{'':>12}{speed / base:.1f}x")
+    print(f"logs in {home}")
+
+
+if __name__ == "__main__":
+    run_main()
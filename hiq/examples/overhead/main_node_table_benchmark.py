@@ -0,0 +1,84 @@
+"""Statistics of many trees: a walk per tree vs `hiq.node_table`
+
+Builds `N` trees(20000 by default) of about 20 nodes, then computes the count,
+sum and p99 of the span of every node name with `Tree.duration_by_name_s` and
+the spans of a walk per tree, and with `NodeTable.group_by`, from the trees and
+from their text as Jack logs it. Checks that both give the same numbers.
+"""
+import os
+import random
+import statistics
+import time
+from collections import defaultdict
+
+from hiq.node_table import NodeTable
+from hiq.tree import Tree
+
+N = int(os.environ.get("N", 20_000))
+
+
+def new_tree(rnd, i):
+    t = Tree(extra={}, tid=str(i))
+    now = 1637008247.0 + i
+    t.start("__main", now)
+    for j in range(rnd.randint(3, 8)):
+        t.start(f"__step_{j}", now)
+        for _ in range(rnd.randint(1, 3)):
+            t.start("__query", now)
+            now += rnd.random() * 0.01
+            t.end("__query", now)
+        now += rnd.random() * 0.001
+        t.end(f"__step_{j}", now)
+    t.end("__main", now + 0.001)
+    return t
+
+
+def per_tree(trees):
+    spans = defaultdict(list)
+    for _, t in trees:
+        t.duration_by_name_s()
+        stk = list(t.root.nodes)
+        while stk:
+            n = stk.pop()
+            spans[n.name].append(n.end - n.start)
+            stk.extend(n.nodes)
+    return {
+        k: (len(v), sum(v), statistics.quantiles(v, n=100, method="inclusive")[98])
+        for k, v in spans.items()
+    }
+
+
+def main():
+    rnd = random.Random(7)
+    trees = [(i, new_tree(rnd, i)) for i in range(N)]
+    lines = [f"time,{t.repr()}\n" for _, t in trees]
+
+    start = time.monotonic()
+    expected = per_tree(trees)
+    t_walk = time.monotonic() - start
+
+    start = time.monotonic()
+    table = NodeTable.from_trees(trees)
+    stats = table.group_by("name")
+    t_trees = time.monotonic() - start
+
+    start = time.monotonic()
+    from_log = NodeTable.from_jack_log(lines)
+    from_log.group_by("path")
+    t_log = time.monotonic() - start
+
+    for k, (count, total, p99) in expected.items():
+        s = stats[k]
+        assert s["count"] == count and abs(s["sum"] - total) < 1e-6 and abs(s["p99"] - p99) < 1e-9, k
+    for i in ("req", "depth", "start", "end"):
+        assert (from_log.nodes[i] == table.nodes[i]).all()
+    assert from_log.group_by("path").keys() == table.group_by("path").keys()
+
+    print(table)
+    print(f"  walk per tree: {t_walk:6.2f}s")
+    print(f"     node table: {t_trees:6.2f}s  {t_walk / t_trees:.1f}x")
+    print(f" from Jack text: {t_log:6.2f}s  {t_walk / t_log:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""OpenTelemetry: spans opened inline vs built from the HiQ trees
+
+Runs `N` requests of a handler with `M` traced leaf calls under
+`TRACE_TYPE=opentelemetry`, and prints the time per request on the request
+thread, when every traced call opens a span inline and when the spans are built
+from the trees on a background thread(`HIQ_OTM_DEFERRED=1`). The spans go to a
+`BatchSpanProcessor` with an exporter which only counts them.
+"""
+import os
+import time
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+
+import hiq
+from hiq.otm_export import get_otm_exporter
+
+N = int(os.environ.get("N", 2_000))  # requests
+M = 10  # leaf calls per request
+
+
+class CountingExporter(SpanExporter):
+    def __init__(self):
+        self.count = 0
+
+    def export(self, spans):
+        self.count += len(spans)
+        return SpanExportResult.SUCCESS
+
+
+def leaf():
+    pass
+
+
+def handler():
+    for _ in range(M):
+        leaf()
+
+
+def run(deferred):
+    os.environ["TRACE_TYPE"] = "opentelemetry"
+    os.environ["HIQ_OTM_DEFERRED"] = "1" if deferred else "0"
+    driver = hiq.HiQLatency(
+        hiq_table_or_path=[["__main__", "", "handler", "handler"], ["__main__", "", "leaf", "leaf"]],
+        max_hiq_size=30,
+    )
+    ids = iter(range(N))
+    driver.get_tau_id = lambda: next_id
+    start = time.perf_counter()
+    for next_id in ids:
+        handler()
+    on_thread = time.perf_counter() - start
+    if deferred:
+        get_otm_exporter().flush(timeout=600)
+    trace.get_tracer_provider().force_flush()
+    driver.disable_hiq()
+    return on_thread
+
+
+def run_main():
+    exporter = CountingExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(BatchSpanProcessor(exporter, max_queue_size=N * (M + 1)))
+    trace.set_tracer_provider(provider)
+    for deferred in (False, True):
+        exporter.count = 0
+        on_thread = run(deferred)
+        name = "deferred" if deferred else "inline"
+        print(f"{name:>10}: {on_thread / N * 1e6:8.1f}us/request on the request thread, {exporter.count} spans")
+
+
+if __name__ == "__main__":
+    run_main()
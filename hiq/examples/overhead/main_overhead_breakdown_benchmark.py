@@ -0,0 +1,68 @@
+"""Tracing overhead by target tag and by stage
+
+Traces a request handler, a leaf function with its arguments captured, and a
+leaf function which is not, then prints the cost per request with the stages off
+(the default) and on, and the breakdown of the overhead which `show()` prints.
+"""
+import os
+import time
+
+import hiq
+
+N = int(os.environ.get("N", 50_000))  # requests
+
+
+def leaf(x):
+    return x + 1
+
+
+def leaf_with_args(x, name="a"):
+    return x + 2
+
+
+def handler(x):
+    return leaf(x) + leaf(x + 1) + leaf_with_args(x, name="b")
+
+
+def req_id():
+    return current_request
+
+
+current_request = 0
+
+
+def run(stages):
+    global current_request
+    driver = hiq.HiQLatency(
+        hiq_table_or_path=[
+            [__name__, "", "handler", "handler"],
+            [__name__, "", "leaf", "leaf"],
+            [__name__, "", "leaf_with_args", "leaf_with_args"],
+        ],
+        hiq_id_func=req_id,
+        max_hiq_size=100,
+        extra_metrics={hiq.ExtraMetrics.ARGS},
+    )
+    driver.set_overhead_breakdown(stages=stages, reset=True)
+    start = time.perf_counter()
+    for i in range(N):
+        current_request = i
+        handler(i)
+    elapsed = (time.perf_counter() - start) / N * 1e6
+    breakdown = driver.get_overhead_breakdown()
+    assert breakdown["__leaf"]["calls"] == 2 * N, breakdown
+    total_us = sum(d["total"] for d in breakdown.values()) / N / 1e3
+    print(f"stages {'on' if stages else 'off'}: {elapsed:6.2f}us/request, {total_us:6.2f}us of overhead")
+    table = driver.overhead_meter.table()
+    driver.disable_hiq(reset_trace=True)
+    return table
+
+
+def run_main():
+    with hiq.HiQStatusContext():
+        run(stages=False)
+        print(run(stages=True))
+
+
+if __name__ == "__main__":
+    run_main()
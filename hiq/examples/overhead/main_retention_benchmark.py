@@ -0,0 +1,67 @@
+"""Retention of the hiq map under a stream of requests
+
+Each request gets a new id, like in a busy web service, so the hiq map keeps
+evicting the oldest requests. With a count bound and with a byte budget, this
+prints the cost per request, the process memory and the size of the hiq map for
+every window of requests: all of them should stay flat.
+"""
+import os
+import time
+
+import hiq
+from hiq.constants import RETENTION_FIFO, RETENTION_LRU
+
+N = int(os.environ.get("N", 100_000))  # requests
+WINDOW = N // 5
+
+
+def leaf(x):
+    return sum(range(x % 7 + 20))
+
+
+def handler(x):
+    return leaf(x) + leaf(x + 1) + leaf(x + 2)
+
+
+def req_id():
+    return current_request
+
+
+current_request = 0
+
+
+def run(title, **retention):
+    global current_request
+    driver = hiq.HiQLatency(
+        hiq_table_or_path=[
+            [__name__, "", "handler", "handler"],
+            [__name__, "", "leaf", "leaf"],
+        ],
+        hiq_id_func=req_id,
+    )
+    driver.set_retention(**retention)
+    print(f"{title}:")
+    start = time.perf_counter()
+    for i in range(N):
+        current_request = i
+        handler(i)
+        if (i + 1) % WINDOW == 0:
+            now = time.perf_counter()
+            print(
+                f"  {i + 1:>8} requests: {(now - start) / WINDOW * 1e6:6.2f}us/request, "
+                f"rss {hiq.get_memory_mb():8.2f}MB, {len(driver.tau):>6} requests kept, "
+                f"~{driver.tau.nbytes / 1024:8.1f}KB"
+            )
+            start = now
+    driver.disable_hiq(reset_trace=True)
+
+
+def run_main():
+    with hiq.HiQStatusContext():
+        run("count bound, fifo", max_size=1000)
+        run("1MB budget, fifo", max_size=N, max_bytes=1 << 20, policy=RETENTION_FIFO)
+        run("1MB budget, lru", max_size=N, max_bytes=1 << 20, policy=RETENTION_LRU)
+
+
+if __name__ == "__main__":
+    run_main()
@@ -0,0 +1,102 @@
+"""Head-based sampling of requests
+
+Every request gets a new id and calls a small tree of traced functions. This
+prints the cost per request without HiQ, with every request recorded, and with
+1% of the requests sampled, then checks the other policies: a rate limit per
+endpoint and the id pattern which is always sampled.
+"""
+import os
+import time
+
+import hiq
+
+N = int(os.environ.get("N", 100_000))  # requests
+
+
+def leaf(x):
+    return x + 1
+
+
+def handler(x):
+    return leaf(x) + leaf(x + 1) + leaf(x + 2)
+
+
+def other(x):
+    return leaf(x)
+
+
+def req_id():
+    return current_request
+
+
+current_request = 0
+
+
+def per_request_us(name="handler"):
+    global current_request
+    f = globals()[name]
+    start = time.perf_counter()
+    for i in range(N):
+        current_request = i
+        f(i)
+    return (time.perf_counter() - start) / N * 1e6
+
+
+def new_driver():
+    return hiq.HiQLatency(
+        hiq_table_or_path=[
+            [__name__, "", "handler", "handler"],
+            [__name__, "", "other", "other"],
+            [__name__, "", "leaf", "leaf"],
+        ],
+        hiq_id_func=req_id,
+        max_hiq_size=N,
+    )
+
+
+def run_main():
+    global current_request
+    with hiq.HiQStatusContext():
+        base = per_request_us()
+        print(f"no hiq:          {base:6.2f}us/request")
+
+        driver = new_driver()
+        print(f"all sampled:     {per_request_us():6.2f}us/request, {len(driver.tau)} trees")
+        driver.disable_hiq(reset_trace=True)
+
+        driver = new_driver()
+        driver.set_sampling(probability=0.01)
+        t = per_request_us()
+        print(f"1% sampled:      {t:6.2f}us/request, {len(driver.tau)} trees, {driver.sampler}")
+        for k, forest in driver.tau.items():
+            # a sampled request is recorded in full
+            assert forest[hiq.KEY_LATENCY].count == 4, forest
+        driver.disable_hiq(reset_trace=True)
+
+        driver = new_driver()
+        driver.set_sampling(rate=100)
+        start = time.perf_counter()
+        per_request_us()
+        per_request_us("other")
+        elapsed = time.perf_counter() - start
+        roots = [
+            n.name
+            for forest in driver.tau.values()
+            for n in forest[hiq.KEY_LATENCY].root.nodes
+        ]
+        print(
+            f"100/s/endpoint:  {roots.count('__handler')} handler and {roots.count('__other')} "
+            f"other traces in {elapsed:.2f}s"
+        )
+        driver.disable_hiq(reset_trace=True)
+
+        driver = new_driver()
+        driver.set_sampling(id_pattern=r"^\d*00$")
+        per_request_us()
+        assert all(str(k).endswith("00") for k in driver.tau), list(driver.tau)
+        print(f"id pattern:      {len(driver.tau)} trees, {driver.sampler}")
+        driver.disable_hiq(reset_trace=True)
+
+
+if __name__ == "__main__":
+    run_main()
@@ -0,0 +1,78 @@
+"""Tracing the same request from many threads at once
+
+Every worker thread serves requests which share one request id(`None`), the
+worst case for the recording layer: before private per-thread stacks, the
+start/end events of the threads interleaved on one tree stack and corrupted it.
+For each thread count, this prints the traced cost per request and checks that
+every `handler` node ends up at the top level with its two `leaf` children.
+"""
+import os
+import threading
+import time
+
+import hiq
+
+M = int(os.environ.get("M", 1000))  # requests per thread
+THREADS = [1, 2, 4, 8, 16, 32, 64]
+
+
+def leaf(x):
+    return sum(range(x % 7 + 50))
+
+
+def handler(x):
+    return leaf(x) + leaf(x + 1)
+
+
+def serve(barrier):
+    barrier.wait()
+    for i in range(M):
+        handler(i)
+
+
+def run_threads(n):
+    barrier = threading.Barrier(n + 1)
+    threads = [threading.Thread(target=serve, args=(barrier,)) for _ in range(n)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def check(tree, n) -> str:
+    top = tree.root.nodes
+    handlers = [i for i in top if i.name == "__handler"]
+    nested = all(
+        len(h.nodes) == 2 and all(j.name == "__leaf" for j in h.nodes)
+        for h in handlers
+    )
+    ok = len(top) == len(handlers) == n * M and nested
+    return "ok" if ok else f"CORRUPTED({len(top)} top nodes)"
+
+
+def run_main():
+    with hiq.HiQStatusContext():
+        print(f"{'threads':>8} {'untraced':>12} {'traced':>12} {'tree':>8}")
+        for n in THREADS:
+            base = run_threads(n) / (n * M)
+            driver = hiq.HiQLatency(
+                hiq_table_or_path=[
+                    [__name__, "", "handler", "handler"],
+                    [__name__, "", "leaf", "leaf"],
+                ],
+                hiq_id_func=lambda: None,
+            )
+            traced = run_threads(n) / (n * M)
+            tree = driver.get_metrics_by_k0(None)
+            driver.disable_hiq()
+            print(
+                f"{n:>8} {base * 1e6:>10.2f}us {traced * 1e6:>10.2f}us "
+                f"{check(tree, n):>8}"
+            )
+
+
+if __name__ == "__main__":
+    run_main()
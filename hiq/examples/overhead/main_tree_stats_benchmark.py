@@ -0,0 +1,98 @@
+"""Summarizing a large tree: the walks with `visited` lists vs `Tree.stats`
+
+Builds a tree of `N` nodes(2000 by default), like a loop over model runs, then
+sums the spans by name and the spans of the leaves by name with the previous
+implementations of `tree_duration_by_name_s` and `tree_leaf_duration_by_name_s`
+(copied below), and with the current ones, which share one cached walk.
+"""
+import os
+import time
+from collections import defaultdict
+
+from hiq.tree import Tree
+
+N = int(os.environ.get("N", 2000))
+
+
+def duration_by_name_s_v0(sf) -> dict:
+    visited = [sf.root]
+    stack = [sf.root]
+    res = defaultdict(float)
+    res[sf.root.name] = sf.root.span()
+    while stack:
+        nd = stack[-1]
+        if nd not in visited:
+            visited.append(nd)
+        remove_from_stack = True
+        for nex in nd.nodes:
+            if nex not in visited:
+                stack.append(nex)
+                res[nex.name] += nex.span()
+                remove_from_stack = False
+                break
+        if remove_from_stack:
+            stack.pop()
+    return dict(res)
+
+
+def leaf_duration_by_name_s_v0(sf):
+    visited = [sf.root]
+    stack = [sf.root]
+    res = defaultdict(float)
+    while stack:
+        nd = stack[-1]
+        if nd not in visited:
+            visited.append(nd)
+        remove_from_stack = True
+        for nex in nd.nodes:
+            if nex not in visited:
+                stack.append(nex)
+                remove_from_stack = False
+                break
+        if remove_from_stack and stack:
+            if stack[-1] and not stack[-1].nodes:
+                res[stack[-1].name] += stack[-1].span()
+            stack.pop()
+    return dict(res)
+
+
+def new_tree():
+    t = Tree(extra={}, tid="ort")
+    now = 0.0
+    t.start("__main", now)
+    for i in range(N // 2):
+        t.start("__run", now)
+        t.start("__ort_run", now + 0.001)
+        now += 0.01 + (i % 7) * 0.001
+        t.end("__ort_run", now)
+        now += 0.001
+        t.end("__run", now)
+    t.end("__main", now)
+    return t
+
+
+def main():
+    t = new_tree()
+    start = time.monotonic()
+    expected = duration_by_name_s_v0(t), leaf_duration_by_name_s_v0(t)
+    t_v0 = time.monotonic() - start
+
+    start = time.monotonic()
+    r = t.duration_by_name_s(), t.leaf_duration_by_name_s()
+    t_v1 = time.monotonic() - start
+
+    start = time.monotonic()
+    t.duration_by_name_s(), t.leaf_duration_by_name_s(), t.get_duration_by_node_name("__run")
+    t_cached = time.monotonic() - start
+
+    for a, b in zip(expected, r):
+        assert a.keys() == b.keys()
+        assert all(abs(a[k] - b[k]) < 1e-6 for k in a if k != "None")
+    print(f"{t.count} nodes")
+    print(f"  visited lists: {t_v0 * 1e3:9.2f}ms")
+    print(f"       one walk: {t_v1 * 1e3:9.2f}ms  {t_v0 / t_v1:.0f}x")
+    print(f"         cached: {t_cached * 1e3:9.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
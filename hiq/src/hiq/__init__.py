@@ -22,6 +22,7 @@ if vinfo.major < 3 or (vinfo.major == 3 and vinfo.minor < 8):
 from .hiq_utils import (
     set_global_hiq_status,
     get_global_hiq_status,
+    get_global_hiq_generation,
     HiQStatusContext,
 )
 from .utils import (
@@ -75,6 +76,13 @@ try:
 except ImportError:
     pass
 from .base import HiQLatency, HiQSimple, HiQMemory
+
+try:
+    from .trace_compare import compare
+except ImportError:
+    # it needs numpy
+    pass
+
 from .server_flask import HiQFlaskLatency, HiQFlaskMemory, HiQFlaskLatencyOtel
 from hiq.framework.fastapi import (
     HiQFastAPILatency,
@@ -113,6 +121,7 @@ __all__ = [
     "HiQMemory",
     "HiQStatusContext",
     "get_global_hiq_status",
+    "get_global_hiq_generation",
     "set_global_hiq_status",
     "SingletonMeta",
     "SingletonBase",
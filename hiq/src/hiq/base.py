@@ -6,9 +6,9 @@
 
 __author__ = None
 
-import collections
+import asyncio
+import contextlib
 import gc
-import inspect
 import io
 import os
 import re
@@ -16,25 +16,52 @@ import sys
 import time
 import traceback
 from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from threading import Lock, get_ident
+from functools import update_wrapper
+from time import perf_counter_ns
 from copy import deepcopy
 from typing import *
 
 import hiq
 import itree
+from hiq.columnar import MetricForest, metric_items
 from hiq.constants import *
 from hiq.hiq_utils import (
     _is_callable,
     call_decorated,
     func_args_handler,
+    get_decorated_caller,
     get_global_hiq_status,
     get_hiq_table,
+    get_status_word,
     get_tau_id,
     HiQIdGenerator,
 )
 from hiq.jack import Jack
 from hiq.monkeyking import LogMonkeyKing
+from hiq.overhead import (
+    OH_CALLS,
+    OH_EXTRA,
+    OH_ID,
+    OH_METRIC,
+    OH_STATUS,
+    OH_TOTAL,
+    OH_TREE,
+    OverheadMeter,
+)
+from hiq.retention import TauStore
+from hiq.sampling import HiQSampler
+from hiq.sketch import LatencyStats
 from hiq.tree import Tree
-from hiq.utils import _check_overhead, _get_full_argspecs, is_hiqed
+from hiq.utils import (
+    _check_overhead,
+    _get_full_argspecs,
+    get_env_bool,
+    get_env_float,
+    get_env_int,
+    is_hiqed,
+)
 from hiq.memory import get_memory_mb, total_gpu_memory_mb
 
 here = os.path.dirname(os.path.realpath(__file__))
@@ -107,6 +134,65 @@ class HiQException(Exception):
     pass
 
 
+def _http_content_len(_r) -> int:
+    return len(_r.content) if (_r and _r.status_code < 400) else 0
+
+
+# task frames visible in the current context: {id(driver): (frame, cursor)}. The
+# cursor maps a metric name to the (tree, node) open in the frame. The entry is
+# `_UNSAMPLED` in a request which is not sampled.
+_task_frames: ContextVar[Optional[dict]] = ContextVar("hiq_task_frames", default=None)
+# every function decorated by `contextlib.asynccontextmanager` shares this code
+_ACM_CODE = contextlib.asynccontextmanager(lambda: None).__code__
+
+
+# `locate()` of `HiQBase._compile`: the call records into the frame of its thread
+_NESTED = object()
+# the request is not sampled, see `HiQBase.set_sampling`
+_UNSAMPLED = object()
+# taken only when a private frame is merged, never on the path of a traced call
+_merge_lock = Lock()
+
+
+def _skip_request(sid):
+    """mark the current context as in a request not sampled by driver `sid`"""
+    frames = _task_frames.get()
+    frames = dict(frames) if frames else {}
+    frames[sid] = _UNSAMPLED
+    return _task_frames.set(frames)
+
+
+def _current_task():
+    """the running asyncio task, or the id of the current thread"""
+    loop = asyncio._get_running_loop()
+    if loop is None:
+        return get_ident()
+    return asyncio.current_task(loop)
+
+
+class _TaskFrame(object):
+    """the private metric trees of one thread, asyncio task or async generator
+
+    Threads and tasks serving the same request interleave, so they cannot share
+    the stack of the request tree. Only one thread at a time records into the
+    request trees directly(`HiQBase.tau_owner`), the others record into their own
+    trees. When the outermost traced call finishes, the completed nodes are
+    appended under `parents`, the nodes open in the spawning task when this task
+    was created, or under the roots of the `request` trees.
+    """
+
+    __slots__ = ("task", "forest", "parents", "request", "req_id", "root")
+
+    def __init__(sf, task, forest, parents, request, req_id, root=False):
+        sf.task = task
+        sf.forest = forest
+        sf.parents = parents
+        sf.request = request
+        sf.req_id = req_id
+        # the outermost call of the frame is the root call of the request
+        sf.root = root
+
+
 class HiQBase(itree.ForestStats, LogMonkeyKing):
     __metaclass__ = ABC
     __no_none_key__ = False
@@ -140,7 +226,7 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
             hiq_id_func (Callable, optional): a callable to generate unique id for tau, the hiq map. Defaults to hiq.hiq_utils.get_tau_id.
             func_args_handler(Callable, optional): a callable to convert function args/kwargs into a string. Defaults to hiq.hiq_utils.func_args_handler.
             target_path (str, optional): the directory of the target code. Defaults to None.
-            max_hiq_size (int, optional): the max size of hiq map. if the number is exceeded, tree will be sent to LMK. Defaults to 30.
+            max_hiq_size (int, optional): the max size of hiq map. if the number is exceeded, tree will be sent to LMK. Defaults to 30. A memory budget and the retention policy are set by `set_retention()`, or by env variables `HIQ_MAX_BYTES`, `HIQ_RETENTION` and `HIQ_JACK_BATCH`.
             verbose (bool, optional): when verbose is true, more information will be recorded, like the full stack trace of exception will be recorded in HiQ tree node. Defaults to False.
             fast_fail (bool, optional): when it is true, raise exception to the upper level, don't swallow exceptions. Defaults to True.
             tpl (str, optional): hiq tpl path. Defaults to None.
@@ -154,9 +240,16 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
             print("process 🆔 {}".format(os.getpid()))
         if target_path and target_path not in sys.path:
             sys.path.append(target_path)
-        sf.tau = collections.defaultdict(dict)
-        sf.count = 0
         sf.max_hiq_size = max_hiq_size
+        sf.tau = TauStore(
+            max_size=max_hiq_size,
+            max_bytes=get_env_int("HIQ_MAX_BYTES", 0),
+            policy=os.environ.get("HIQ_RETENTION", RETENTION_FIFO),
+            batch=get_env_int("HIQ_JACK_BATCH", 8),
+        )
+        # request id -> id of the thread recording into the request trees
+        sf.tau_owner = {}
+        sf.count = 0
         hiq_quadruple = get_hiq_table(hiq_table_or_path)
         # for t in extra_hiq_table:
         #    hiq_quadruple.append(t)
@@ -171,6 +264,15 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
         sf.__load_hiq_tpl(tpl)
         sf.metric_funcs = metric_funcs
         sf.__load_extra_metrics(extra_hiq_table)
+        sf.sampler = None
+        sf.__load_sampling()
+        sf.prometheus = None
+        sf.__load_prometheus()
+        sf.overhead_meter = OverheadMeter(stages=get_env_bool("HIQ_OVERHEAD_STAGES"))
+        sf.latency_stats = LatencyStats()
+        sf.stats_on = get_env_bool("HIQ_STATS", True)
+        sf.columnar = False
+        sf.otm_exporter = None
         sf.enable_hiq()
         sf.check_oh_counter = 0
 
@@ -181,19 +283,57 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
         self.disable_hiq()
 
     def __load_hiq_tpl(sf, tpl):
-        if tpl and os.path.exists(tpl):
-            sf.load_tpl(tpl)
+        """load a legacy wrapper template. Without it, wrappers are built by `_compile`."""
+        if not tpl:
             return
-        tpl = f"{here}/{TAU_TPL_LOC}"
-        if os.path.exists(tpl):
-            sf.load_tpl(tpl)
-            return
-        tpl = f"{here}/{TAU_PKL_LOC}"
-        if os.path.exists(tpl):
+        if tpl.endswith(".pk") and os.path.exists(tpl):
             sf.itree_tpl = hiq.mod("pickle").load(open(tpl, "rb"))
+        elif os.path.exists(tpl):
+            sf.load_tpl(tpl)
         if not sf.itree_tpl:
             raise Exception(f"🈚️ empty tau tpl. tpl:{tpl}")
 
+    def __load_sampling(sf):
+        """sampling policy from env variables `HIQ_SAMPLE_PROBABILITY`, `HIQ_SAMPLE_RATE`
+        and `HIQ_SAMPLE_ID`, then from the `@sample` rows of the hiq conf, like:
+
+            "@sample", "probability", "0.01"
+            "@sample", "rate", "10"
+            "@sample", "id", "^debug-"
+        """
+        conf = {}
+        if "HIQ_SAMPLE_PROBABILITY" in os.environ:
+            conf["probability"] = get_env_float("HIQ_SAMPLE_PROBABILITY")
+        if "HIQ_SAMPLE_RATE" in os.environ:
+            conf["rate"] = get_env_float("HIQ_SAMPLE_RATE")
+        if os.environ.get("HIQ_SAMPLE_ID"):
+            conf["id_pattern"] = os.environ["HIQ_SAMPLE_ID"]
+        for row in sf.hiq_directives:
+            if row[0] == "@prometheus":
+                continue
+            if row[0] != "@sample" or len(row) < 3:
+                raise ValueError(f"🦉 unknown hiq conf directive: {row}")
+            key, value = row[1], row[2]
+            if key == "probability":
+                conf["probability"] = float(value)
+            elif key == "rate":
+                conf["rate"] = float(value)
+            elif key == "id":
+                conf["id_pattern"] = value
+            else:
+                raise ValueError(f"🦉 unknown sampling option: {key}")
+        if conf:
+            sf.set_sampling(**conf)
+
+    def __load_prometheus(sf):
+        """metric type, buckets and labels of the prometheus tracing type, see
+        `hiq.prometheus`"""
+        rows = [row for row in sf.hiq_directives if row[0] == "@prometheus"]
+        if rows or os.environ.get("TRACE_TYPE") == TRACING_TYPE_PROM:
+            from hiq.prometheus import PrometheusConf
+
+            sf.prometheus = PrometheusConf.from_env(rows)
+
     def __load_extra_metrics(sf, extra_hiq_table):
         if TAU_TABLE_DIO_RD in extra_hiq_table:
             sf.metric_funcs.append(sf.get_dio_bytes_r)
@@ -210,11 +350,15 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
 
     def _verify_input(sf, hiq_quadruple):
         sf.hiq_quadruple = []
+        sf.hiq_directives = []
         tag_names = set()
         for i in hiq_quadruple:
             i = list(i)
             if len(i) > 0 and i[0].startswith("#"):
                 continue
+            if len(i) > 0 and i[0].startswith("@"):
+                sf.hiq_directives.append(i)
+                continue
             if len(i) != 4 or not isinstance(i[3], str) or len(i[3]) < 1:
                 raise ValueError("🦉 tau table must have exact 4 columns")
             i[3] = (
@@ -232,42 +376,122 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
             sf.hiq_quadruple.append(i)
 
     def set_extra_metrics(sf, extra_metrics: Iterable[ExtraMetrics]):
-        """set extra metric information so that these information will enter the span node"""
+        """set extra metric information so that these information will enter the span node
+
+        Wrappers are specialized for the extra metrics when they are created, so an
+        enabled driver is re-enabled to pick up the change.
+        """
+        enabled = sf.enabled
+        if enabled:
+            sf.disable_hiq()
         sf.extra_metrics = extra_metrics
+        if enabled:
+            sf.enable_hiq()
+
+    def set_retention(s, max_size=None, max_bytes=None, policy=None, batch=None):
+        """set how many requests are kept in the hiq map
+
+        Args:
+            max_size (int, optional): the max number of requests, same as `max_hiq_size`.
+            max_bytes (int, optional): the estimated memory budget of the kept trees in bytes, 0 means no budget.
+            policy (str, optional): evict the oldest request first(`RETENTION_FIFO`), or the least recently completed one(`RETENTION_LRU`).
+            batch (int, optional): the number of evicted requests sent to Jack at once.
+        """
+        if max_size is not None:
+            s.max_hiq_size = s.tau.max_size = max_size
+        if max_bytes is not None:
+            s.tau.max_bytes = max_bytes
+        if policy is not None:
+            if policy not in (RETENTION_FIFO, RETENTION_LRU):
+                raise ValueError(f"🦉 unknown retention policy: {policy}")
+            s.tau.policy = policy
+        if batch is not None:
+            s.tau.batch = max(1, batch)
+
+    def set_sampling(s, probability=None, rate=None, id_pattern=None):
+        """set the head-based sampling policy of requests
+
+        The decision is made when the root call of a request starts. The calls of
+        a request which is not sampled skip all the tree work, and the tracing
+        backends of `TRACE_TYPE` too. Call it without arguments to record every
+        request again.
+
+        Args:
+            probability (float, optional): the probability to sample a request. Defaults to 1.0, or 0 when only `id_pattern` is set.
+            rate (float, optional): the max traces per second per endpoint(the tag of the root call). Defaults to no limit.
+            id_pattern (str, optional): a regex, requests with matching id are always sampled.
+        """
+        if probability is None and not rate and not id_pattern:
+            s.sampler = None
+            return
+        if probability is None:
+            probability = 0.0 if id_pattern and not rate else 1.0
+        s.sampler = HiQSampler(probability, rate or 0, id_pattern)
+
+    def _sampled(s, req_id, f_name: str) -> bool:
+        """decide if the request is sampled, when a call starts outside of any traced call"""
+        sampler = s.sampler
+        if sampler is None or s.tau_owner.get(req_id) == get_ident():
+            return True
+        return sampler(req_id, f_name)
+
+    def _ship_evicted(s, force=False):
+        """send the evicted trees to Jack once a batch is complete"""
+        batch = s.tau.drain(force)
+        if batch and hasattr(s, "send_trees_to_jack"):
+            s.send_trees_to_jack(batch)
+
+    def _new_tree(s, fn: str, extra=None) -> Tree:
+        return Tree(
+            extra=dict(extra) if extra else {},
+            tid=fn,
+            monotonic=fn == KEY_LATENCY,
+            queue_lmk=s.queue_lmk,
+        )
+
+    def _new_forest(s, extra=None) -> Dict[str, Tree]:
+        """the metric trees of a new request, a `MetricForest` for a columnar driver"""
+        names = [f.__name__ for f in s.metric_funcs]
+        if s.columnar:
+            tree = s._new_tree(KEY_LATENCY, extra)
+            return MetricForest(tree, names[1:], s.attach_timestamp)
+        return {name: s._new_tree(name, extra) for name in names}
+
+    def _get_forest(s, extra=None) -> Dict[str, Tree]:
+        """find the metric trees of the current request, one per metric function"""
+        return s._forest_of(s._tau_id(), extra)
+
+    def _forest_of(s, req_id, extra=None) -> Dict[str, Tree]:
+        """find or create the metric trees of request `req_id`
+
+        A new forest is complete before it is published with `setdefault`, so
+        threads starting the same request concurrently end up with one forest.
+        """
+        forest = s.tau.get(req_id)
+        if forest is None:
+            if not req_id and HiQBase.__no_none_key__:
+                print(f"warning: tau id is {req_id}")
+            forest = s.tau.put(req_id, s._new_forest(extra))
+            if s.tau.evicted:
+                s._ship_evicted()
+        elif not isinstance(forest, MetricForest) and len(forest) < len(s.metric_funcs):
+            for func in s.metric_funcs:
+                if func.__name__ not in forest:
+                    forest[func.__name__] = s._new_tree(func.__name__, extra)
+        elif extra:
+            for t in forest.values():
+                t.extra.update(extra)
+        return forest
 
     def get_tree(s, func: Callable, extra=None) -> Tree:
         """find the hiq tree, and attach extra on the tree if necessary
         Note: the extra information here will enter into tree level. To pass extra into node level, use `Tree.start()`.
         """
-        if not extra:
-            extra = {}
-        if s.get_tau_id is None:
-            s.get_tau_id = HiQIdGenerator()
-        req_id = s.get_tau_id()
-        if not req_id and HiQBase.__no_none_key__:
-            print(f"warning: tau id is {req_id}")
+        forest = s._get_forest(extra)
         fn = func.__name__
-        if req_id not in s.tau or fn not in s.tau[req_id]:
-            if fn in [KEY_LATENCY]:
-                s.tau[req_id][fn] = Tree(
-                    extra=extra,
-                    tid=fn,
-                    queue_lmk=s.queue_lmk,
-                )
-            else:
-                s.tau[req_id][fn] = Tree(
-                    extra=extra,
-                    tid=fn,
-                    monotonic=False,
-                    queue_lmk=s.queue_lmk,
-                )
-        if extra:
-            s.tau[req_id][fn].extra.update(extra)
-        r = s.tau[req_id][fn]
-        if len(s.tau) > s.max_hiq_size + 1:
-            d = s.tau.pop(list(s.tau.keys())[0])
-            if hasattr(s, "send_trees_to_jack"):
-                s.send_trees_to_jack(d)
+        r = forest.get(fn)
+        if r is None:
+            r = forest[fn] = s._new_tree(fn, extra)
         return r
 
     @_check_overhead
@@ -344,12 +568,7 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
         Raises:
             e: the original exception
         """
-        node_extra = {KEY_EXC_SUM: e}
-        if s.verbose:
-            sio = io.StringIO()
-            traceback.print_exc(file=sio)
-            trace_msg = sio.getvalue()
-            node_extra[KEY_EXC_TRA] = trace_msg
+        node_extra = s._exception_extra(e)
         if s.fast_fail:
             for func in s.metric_funcs:
                 if func.__name__ == KEY_LATENCY:
@@ -366,54 +585,659 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
                 tmp.end(f_name, func(), extra=deepcopy(node_extra))
             raise e
 
-    def inserter(s, f, *_args, **_kwargs):
-        """If function signature has no positional argument, we can use this inserter directly."""
+    def _exception_extra(s, e: BaseException) -> dict:
+        node_extra = {KEY_EXC_SUM: e}
+        if s.verbose:
+            sio = io.StringIO()
+            traceback.print_exc(file=sio)
+            trace_msg = sio.getvalue()
+            node_extra[KEY_EXC_TRA] = trace_msg
+        return node_extra
 
-        def __x(*args, **kwargs):
-            if not get_global_hiq_status():
-                # print(f"👻 tau is disabled: {f.__name__}")
-                # s.disable_hiq()
-                return f(*args, **kwargs)
-            # print(f"{f_name=}")
-            f_name = f.__name__
-            s.pre_processing(f_name, args, kwargs)
-            result = None
+    def _tau_id(s):
+        if s.get_tau_id is None:
+            s.get_tau_id = HiQIdGenerator()
+        return s.get_tau_id()
+
+    def _new_frame(s, req_id, request: Dict[str, Tree], entry=None) -> _TaskFrame:
+        """create the private trees of the current thread or asyncio task
+
+        `entry` is the frame entry inherited from the spawning task. Without it,
+        the frame goes under the nodes open in the request trees if this thread
+        records into them(e.g. a traced function calling `asyncio.run`), else
+        under their roots. Without it and without a thread recording into the
+        request trees, the frame holds the root call of the request.
+        """
+        parents = entry[1] if entry is not None else None
+        owner = s.tau_owner.get(req_id)
+        if parents is None and owner == get_ident():
+            parents = {n: (t, t.stk[-1]) for n, t in request.items() if t.n_open > 0}
+        tree = request.get(KEY_LATENCY)
+        if tree is not None and "overhead_start" not in tree.extra:
+            tree.extra["overhead_start"] = s.overhead_us
+        forest = {name: s._new_tree(name) for name in request}
+        root = entry is None and owner is None
+        return _TaskFrame(_current_task(), forest, parents or None, request, req_id, root)
+
+    def _enter_task(
+        s, tree_extra=None, own=False, f_name=None, acc=None
+    ) -> Tuple[Optional[_TaskFrame], bool]:
+        """find the frame of the current asyncio task, or create one
+
+        `own` always creates a frame, which async generators need because they
+        are suspended and resumed by their consumer. Returns the frame and if it
+        was created. In a request which is not sampled, the frame is None and the
+        flag tells if the call is the root call of the request. `acc` gets the
+        overhead of the id and tree stages, see `hiq.overhead`.
+        """
+        frames = _task_frames.get()
+        entry = frames.get(id(s)) if frames else None
+        if entry is _UNSAMPLED:
+            return None, False
+        if entry is not None and not own and entry[0].task == _current_task():
+            return entry[0], False
+        if acc is not None:
+            t = perf_counter_ns()
+        req_id = s._tau_id()
+        if entry is None and s.sampler is not None and not s._sampled(req_id, f_name):
+            return None, True
+        if acc is not None:
+            now = perf_counter_ns()
+            acc[OH_ID] += now - t
+            t = now
+        frame = s._new_frame(req_id, s._forest_of(req_id, tree_extra), entry)
+        if acc is not None:
+            acc[OH_TREE] += perf_counter_ns() - t
+        return frame, True
+
+    def _leave_task(s, frame: _TaskFrame, ordered=False):
+        """append the completed nodes of `frame` to the trees it was created in
+
+        With `ordered`, siblings under a parent node are kept in the order they
+        started. This is only safe when no other thread records under it.
+        """
+        parents = frame.parents
+        with _merge_lock:
+            for name, tree in frame.forest.items():
+                if parents and name in parents:
+                    target, node = parents[name]
+                else:
+                    target = frame.request[name]
+                    node = target.root
+                nodes = tree.root.nodes
+                for n in nodes:
+                    node.append(n)
+                target.count += tree.count
+                if ordered and parents and name == KEY_LATENCY and nodes:
+                    children = node.nodes
+                    if (
+                        len(children) > len(nodes)
+                        and children[-len(nodes) - 1].start > nodes[0].start
+                    ):
+                        node.nodes = sorted(children, key=lambda n: n.start)
+        tree = frame.request.get(KEY_LATENCY)
+        if tree is not None and tree.n_open == 0 and "overhead_start" in tree.extra:
+            tree.extra["overhead"] = s.overhead_us - tree.extra["overhead_start"]
+        s.tau.touch(frame.req_id, frame.request)
+        if s.tau.evicted:
+            s._ship_evicted()
+
+    def _root_done(s, req_id, tree: Tree, f_name: str, latency=None):
+        """the root call `f_name` of request `req_id` has returned
+
+        Called on the thread and in the context of the root call, where the OTel
+        span of the request is current. `latency` goes to the sketch of the
+        endpoint, if given.
+        """
+        if latency is not None:
+            s.latency_stats.endpoint(f_name).add(latency)
+        if s.otm_exporter is not None:
+            s.otm_exporter.put(req_id, tree)
+
+    def _extra_capture(s, f_name: str, acc=None) -> Optional[Callable]:
+        """build the node-extra collector for `f_name`, or None if no extra is wanted
+
+        `acc` gets the overhead of the extra stage, see `hiq.overhead`.
+        """
+        want_args = ExtraMetrics.ARGS in s.extra_metrics
+        want_file = ExtraMetrics.FILE in s.extra_metrics or bool(
+            os.environ.get("LOG_MONKEY_FILE", False)
+        )
+        want_func = ExtraMetrics.FUNC in s.extra_metrics
+        if not (want_args or want_file or want_func):
+            return None
+        get_func_args = s.get_func_args
+
+        def __capture(args, kwargs) -> dict:
+            if acc is not None:
+                t = perf_counter_ns()
+            node_extra = {}
+            if want_args:
+                if args:
+                    node_extra["args"] = get_func_args(args, f_name)
+                if kwargs:
+                    node_extra["kwargs"] = get_func_args(kwargs, f_name)
+            if want_file or want_func:
+                # 0: __capture, 1: the wrapper, 2: the caller of the target
+                caller = sys._getframe(2)
+                if want_file:
+                    node_extra["file"] = f"{caller.f_code.co_filename}:{caller.f_lineno}"
+                if want_func:
+                    node_extra["function"] = caller.f_code.co_name
+            if acc is not None:
+                acc[OH_EXTRA] += perf_counter_ns() - t
+            return node_extra
+
+        return __capture
+
+    def _compile(s, f: Callable, f_name: str, tree_extra=None) -> Callable:
+        """build the tracing wrapper of `f`, specialized for this driver
+
+        The metric functions, the tracing backend(`TRACE_TYPE`) and the extra
+        metric flags are resolved here, once, instead of on every call. A driver
+        tracing latency first gets a wrapper with a single tree and no copies of
+        node extra, the other metrics go to a vector in the node(the columnar
+        layout, see `hiq.columnar`). Call `disable_hiq()`/`enable_hiq()` to pick up new settings.
+
+        Coroutine functions, async generator functions and async context managers
+        get async wrappers, see `_compile_async`.
+        """
+        if (
+            inspect.iscoroutinefunction(f)
+            or inspect.isasyncgenfunction(f)
+            or getattr(f, "__code__", None) is _ACM_CODE
+        ):
+            return s._compile_async(f, f_name, tree_extra)
+        call = get_decorated_caller(
+            f,
+            os.environ.get("TRACE_TYPE", TRACING_TYPE_HIQ),
+            span_name=f_name,
+            prometheus=s.prometheus,
+        )
+        status = get_status_word()
+        forest_of = s._forest_of
+        task_frames = _task_frames
+        meter = s.overhead_meter
+        acc = meter.of(f_name)
+        stages = meter.stages
+        capture = s._extra_capture(f_name, acc if stages else None)
+        verbose = s.verbose
+        sid = id(s)
+        metric_funcs = tuple(s.metric_funcs)
+        sketch = s.latency_stats.target(f_name) if s.stats_on else None
+
+        def locate(frames):
+            """find the trees to record into: (forest, request id, frame, token)
+
+            The thread owning the request records into the request trees. Other
+            threads get a private frame for their outermost call, and the calls
+            nested in it record into the frame(request id is `_NESTED`). The
+            forest is None at the root call of a request which is not sampled.
+            """
+            entry = None
+            if frames is not None:
+                entry = frames.get(sid)
+                if entry is not None and entry[0].task == _current_task():
+                    return entry[0].forest, _NESTED, None, None
+            if stages:
+                t = perf_counter_ns()
+            get_id = s.get_tau_id
+            req_id = get_id() if get_id is not None else s._tau_id()
+            if (
+                entry is None
+                and s.sampler is not None
+                and not s._sampled(req_id, f_name)
+            ):
+                return None, None, None, _skip_request(sid)
+            if stages:
+                now = perf_counter_ns()
+                acc[OH_ID] += now - t
+                t = now
+            forest = forest_of(req_id, tree_extra)
+            me = get_ident()
+            # a thread started from a traced coroutine, e.g. by `asyncio.to_thread`,
+            # records under the node which started it
+            if (entry is None or entry[1] is None) and s.tau_owner.setdefault(
+                req_id, me
+            ) == me:
+                if stages:
+                    acc[OH_TREE] += perf_counter_ns() - t
+                return forest, req_id, None, None
+            frame = s._new_frame(req_id, forest, entry)
+            if stages:
+                acc[OH_TREE] += perf_counter_ns() - t
+            frames = dict(frames) if frames else {}
+            frames[sid] = (frame, None)
+            return frame.forest, _NESTED, frame, task_frames.set(frames)
+
+        head = metric_funcs[0].__name__
+
+        def settle(forest, req_id, frame, token, latency=None):
+            """called after the nodes of a call are ended, with its latency"""
+            if token is not None:
+                task_frames.reset(token)
+                s._leave_task(frame)
+                return
+            tree = forest[head]
+            if req_id is not _NESTED and tree.n_open == 0:
+                # the root call of the request, on the thread owning it
+                s.tau_owner.pop(req_id, None)
+                if head == KEY_LATENCY:
+                    tree.extra["overhead"] = s.overhead_us - tree.extra["overhead_start"]
+                    s._root_done(req_id, tree, f_name, latency if sketch is not None else None)
+                s.tau.touch(req_id, forest)
+                if s.tau.evicted:
+                    s._ship_evicted()
+
+        def failed(e):
+            """node extra of the exception `e`, None if it is swallowed"""
+            if isinstance(e, Exception):
+                if verbose:
+                    print(traceback.format_exc())
+                if not s.fast_fail:
+                    return None
+            return s._exception_extra(e)
+
+        def unsampled(token, args, kwargs):
+            """the root call of a request which is not sampled, `token` marks the request"""
             try:
-                result = call_decorated(
-                    f,
-                    args,
-                    kwargs,
-                    tracing_type=os.environ.get("TRACE_TYPE", TRACING_TYPE_HIQ),
-                )
-            except Exception as e:
-                s.handle_exception(f_name, e)
-            s.post_processing(f_name)
-            s.update_overhead()
-            return result
+                return f(*args, **kwargs)
+            finally:
+                task_frames.reset(token)
+
+        if metric_funcs[0].__name__ == KEY_LATENCY and (
+            len(metric_funcs) == 1 or s.columnar
+        ):
+            metric = metric_funcs[0]
+            others = metric_funcs[1:]
+            if stages:
+                metric = meter.timed(metric, acc, OH_METRIC)
+                others = tuple(meter.timed(m, acc, OH_METRIC) for m in others)
 
-        return __x
+            def __x(*args, **kwargs):
+                if stages:
+                    ts = perf_counter_ns()
+                words = status.words
+                if words is None:
+                    words = status.attach()
+                if not words[HIQ_STATUS_IDX_ON]:
+                    return f(*args, **kwargs)
+                frames = task_frames.get()
+                if frames is not None and frames.get(sid) is _UNSAMPLED:
+                    return f(*args, **kwargs)
+                t0 = perf_counter_ns()
+                if stages:
+                    acc[OH_STATUS] += t0 - ts
+                forest, req_id, frame, token = locate(frames)
+                if forest is None:
+                    return unsampled(token, args, kwargs)
+                tree = forest[KEY_LATENCY]
+                if "overhead_start" not in tree.extra:
+                    tree.extra["overhead_start"] = s.overhead_us
+                node_extra = capture(args, kwargs) if capture else {}
+                if others:
+                    vec = node_extra[EXTRA_METRICS_KEY] = [m() for m in others]
+                t1 = metric()
+                tree.start(f_name, t1, node_extra)
+                acc[OH_TOTAL] += perf_counter_ns() - t0
+                try:
+                    result = call(*args, **kwargs)
+                except BaseException as e:
+                    t0 = perf_counter_ns()
+                    exc_extra = failed(e)
+                    if exc_extra is not None:
+                        if others:
+                            node_extra[EXTRA_METRICS_KEY] = (*vec, *[m() for m in others])
+                        t2 = metric()
+                        tree.end(f_name, t2, exc_extra)
+                        if sketch is not None:
+                            sketch.add(t2 - t1)
+                        settle(forest, req_id, frame, token, t2 - t1)
+                        acc[OH_TOTAL] += perf_counter_ns() - t0
+                        acc[OH_CALLS] += 1
+                        raise
+                    result = None
+                    acc[OH_TOTAL] += perf_counter_ns() - t0
+                t0 = perf_counter_ns()
+                if others:
+                    node_extra[EXTRA_METRICS_KEY] = (*vec, *[m() for m in others])
+                t2 = metric()
+                tree.end(f_name, t2, {})
+                if sketch is not None:
+                    sketch.add(t2 - t1)
+                settle(forest, req_id, frame, token, t2 - t1)
+                acc[OH_TOTAL] += perf_counter_ns() - t0
+                acc[OH_CALLS] += 1
+                return result
 
-    def inserter_with_extra(s, extra=None, *_args, **_kwargs):
-        def wrap(f):
-            f_name = f.__name__
-            tracing_type = os.environ.get("TRACE_TYPE", TRACING_TYPE_HIQ)
+        else:
+            attach_timestamp = s.attach_timestamp
+            plan = tuple(
+                (
+                    func.__name__,
+                    meter.timed(func, acc, OH_METRIC) if stages else func,
+                    func.__name__ == KEY_LATENCY,
+                )
+                for func in metric_funcs
+            )
+
+            def end(forest, t1, node_extra=None):
+                """end the nodes of a call, returns its latency"""
+                latency = None
+                for name, func, is_latency in plan:
+                    extra = dict(node_extra) if node_extra else {}
+                    if attach_timestamp and not is_latency:
+                        extra[EXTRA_END_TIME_KEY] = time.time()
+                    value = func()
+                    forest[name].end(f_name, value, extra)
+                    if is_latency:
+                        latency = value - t1
+                        if sketch is not None:
+                            sketch.add(latency)
+                return latency
 
             def __x(*args, **kwargs):
-                if not get_global_hiq_status():
-                    print("👻 hiq is disabled (extra): {f_name}")
-                    # s.disable_hiq()
+                if stages:
+                    ts = perf_counter_ns()
+                words = status.words
+                if words is None:
+                    words = status.attach()
+                if not words[HIQ_STATUS_IDX_ON]:
+                    return f(*args, **kwargs)
+                frames = task_frames.get()
+                if frames is not None and frames.get(sid) is _UNSAMPLED:
                     return f(*args, **kwargs)
-                s.pre_processing(f_name, args, kwargs, tree_extra=extra)
-                result = None
+                t0 = perf_counter_ns()
+                if stages:
+                    acc[OH_STATUS] += t0 - ts
+                forest, req_id, frame, token = locate(frames)
+                if forest is None:
+                    return unsampled(token, args, kwargs)
+                node_extra = capture(args, kwargs) if capture else None
+                t1 = None
+                for name, func, is_latency in plan:
+                    tree = forest[name]
+                    extra = dict(node_extra) if node_extra else {}
+                    if is_latency:
+                        if "overhead_start" not in tree.extra:
+                            tree.extra["overhead_start"] = s.overhead_us
+                    elif attach_timestamp:
+                        extra[EXTRA_START_TIME_KEY] = time.time()
+                    value = func()
+                    tree.start(f_name, value, extra)
+                    if is_latency:
+                        t1 = value
+                acc[OH_TOTAL] += perf_counter_ns() - t0
                 try:
-                    result = call_decorated(f, args, kwargs, tracing_type=tracing_type)
-                except Exception as e:
-                    s.handle_exception(f_name, e)
-                s.post_processing(f_name)
-                s.update_overhead()
+                    result = call(*args, **kwargs)
+                except BaseException as e:
+                    t0 = perf_counter_ns()
+                    exc_extra = failed(e)
+                    if exc_extra is not None:
+                        settle(forest, req_id, frame, token, end(forest, t1, exc_extra))
+                        acc[OH_TOTAL] += perf_counter_ns() - t0
+                        acc[OH_CALLS] += 1
+                        raise
+                    result = None
+                    acc[OH_TOTAL] += perf_counter_ns() - t0
+                t0 = perf_counter_ns()
+                settle(forest, req_id, frame, token, end(forest, t1))
+                acc[OH_TOTAL] += perf_counter_ns() - t0
+                acc[OH_CALLS] += 1
                 return result
 
-            return __x
+        update_wrapper(__x, f, assigned=("__module__", "__doc__"), updated=())
+        return __x
+
+    def _compile_async(s, f: Callable, f_name: str, tree_extra=None) -> Callable:
+        """build the tracing wrapper of a coroutine function, an async generator
+        function or an `asynccontextmanager` function
+
+        A node spans the awaited work: the coroutine until it returns, the async
+        generator from the first item until it is exhausted or closed, the
+        context manager from `__aenter__` to `__aexit__`. Nodes are recorded in
+        the trees of the running asyncio task(`_TaskFrame`), so concurrent tasks
+        on one event loop build separate and correctly nested trees.
+        """
+        status = get_status_word()
+        meter = s.overhead_meter
+        acc = meter.of(f_name)
+        stage_acc = acc if meter.stages else None
+        sketch = s.latency_stats.target(f_name) if s.stats_on else None
+        capture = s._extra_capture(f_name, stage_acc)
+        verbose = s.verbose
+        attach_timestamp = s.attach_timestamp
+        sid = id(s)
+        metric_funcs, others = s.metric_funcs, ()
+        if s.columnar:
+            metric_funcs, others = metric_funcs[:1], tuple(metric_funcs[1:])
+        if meter.stages:
+            metric_funcs = [meter.timed(m, acc, OH_METRIC) for m in metric_funcs]
+            others = tuple(meter.timed(m, acc, OH_METRIC) for m in others)
+        plan = tuple(
+            (func.__name__, func, func.__name__ == KEY_LATENCY)
+            for func in metric_funcs
+        )
+
+        def is_on():
+            words = status.words
+            if words is None:
+                words = status.attach()
+            return words[HIQ_STATUS_IDX_ON]
+
+        def open_(frame, node_extra):
+            forest = frame.forest
+            for name, func, is_latency in plan:
+                extra = dict(node_extra) if node_extra else {}
+                if attach_timestamp and not is_latency:
+                    extra[EXTRA_START_TIME_KEY] = time.time()
+                if others:
+                    extra[EXTRA_METRICS_KEY] = [m() for m in others]
+                forest[name].start(f_name, func(), extra)
+            return {name: (tree, tree.stk[-1]) for name, tree in forest.items()}
+
+        def close(frame, own, cursor, exc_extra=None):
+            # the start of the latency node, before `cursor` is ended
+            t1 = cursor[KEY_LATENCY][1].start if KEY_LATENCY in cursor else None
+            if others:
+                node_extra = cursor[KEY_LATENCY][1].extra
+                node_extra[EXTRA_METRICS_KEY] = (
+                    *node_extra[EXTRA_METRICS_KEY],
+                    *[m() for m in others],
+                )
+            forest = frame.forest
+            latency = None
+            for name, func, is_latency in plan:
+                extra = dict(exc_extra) if exc_extra else {}
+                if attach_timestamp and not is_latency:
+                    extra[EXTRA_END_TIME_KEY] = time.time()
+                value = func()
+                forest[name].end(f_name, value, extra)
+                if is_latency:
+                    latency = value - t1
+                    if sketch is not None:
+                        sketch.add(latency)
+            if own:
+                s._leave_task(frame, ordered=True)
+                tree = frame.request.get(KEY_LATENCY)
+                if frame.root and tree is not None:
+                    # on the task of the root call, after its nodes are merged
+                    s._root_done(
+                        frame.req_id, tree, f_name, latency if sketch is not None else None
+                    )
+
+        def push(frame, cursor):
+            frames = _task_frames.get()
+            frames = dict(frames) if frames else {}
+            frames[sid] = (frame, cursor)
+            return _task_frames.set(frames)
+
+        def failed(e):
+            """node extra of the exception `e`, None if it is swallowed"""
+            if isinstance(e, Exception):
+                if verbose:
+                    print(traceback.format_exc())
+                if not s.fast_fail:
+                    return None
+            return s._exception_extra(e)
+
+        if inspect.isasyncgenfunction(f):
+
+            async def __x(*args, **kwargs):
+                agen = f(*args, **kwargs)
+                if not is_on():
+                    async for item in agen:
+                        yield item
+                    return
+                t0 = perf_counter_ns()
+                frame, _ = s._enter_task(tree_extra, own=True, f_name=f_name, acc=stage_acc)
+                if frame is None:
+                    # the calls in its body decide on their own
+                    async for item in agen:
+                        yield item
+                    return
+                node_extra = capture(args, kwargs) if capture else None
+                cursor = open_(frame, node_extra)
+                acc[OH_TOTAL] += perf_counter_ns() - t0
+                exc_extra = None
+                send, value = agen.asend, None
+                try:
+                    while True:
+                        # the consumer may resume us from another task
+                        frame.task = _current_task()
+                        token = push(frame, cursor)
+                        try:
+                            item = await send(value)
+                        except StopAsyncIteration:
+                            return
+                        except BaseException as e:
+                            exc_extra = failed(e)
+                            if exc_extra is None:
+                                return
+                            raise
+                        finally:
+                            _task_frames.reset(token)
+                        try:
+                            send, value = agen.asend, (yield item)
+                        except GeneratorExit:
+                            await agen.aclose()
+                            raise
+                        except BaseException as e:
+                            send, value = agen.athrow, e
+                finally:
+                    t0 = perf_counter_ns()
+                    close(frame, True, cursor, exc_extra)
+                    acc[OH_TOTAL] += perf_counter_ns() - t0
+                    acc[OH_CALLS] += 1
+
+        elif inspect.iscoroutinefunction(f):
+            call = get_decorated_caller(
+                f,
+                os.environ.get("TRACE_TYPE", TRACING_TYPE_HIQ),
+                span_name=f_name,
+                prometheus=s.prometheus,
+            )
+
+            async def __x(*args, **kwargs):
+                if not is_on():
+                    return await f(*args, **kwargs)
+                t0 = perf_counter_ns()
+                frame, own = s._enter_task(tree_extra, f_name=f_name, acc=stage_acc)
+                if frame is None:
+                    if not own:
+                        return await f(*args, **kwargs)
+                    token = _skip_request(sid)
+                    try:
+                        return await f(*args, **kwargs)
+                    finally:
+                        _task_frames.reset(token)
+                node_extra = capture(args, kwargs) if capture else None
+                cursor = open_(frame, node_extra)
+                token = push(frame, cursor)
+                acc[OH_TOTAL] += perf_counter_ns() - t0
+                exc_extra = None
+                try:
+                    return await call(*args, **kwargs)
+                except BaseException as e:
+                    exc_extra = failed(e)
+                    if exc_extra is not None:
+                        raise
+                finally:
+                    t0 = perf_counter_ns()
+                    _task_frames.reset(token)
+                    close(frame, own, cursor, exc_extra)
+                    acc[OH_TOTAL] += perf_counter_ns() - t0
+                    acc[OH_CALLS] += 1
+
+        else:
+
+            @contextlib.asynccontextmanager
+            async def __x(*args, **kwargs):
+                if not is_on():
+                    async with f(*args, **kwargs) as value:
+                        yield value
+                    return
+                t0 = perf_counter_ns()
+                frame, own = s._enter_task(tree_extra, f_name=f_name, acc=stage_acc)
+                if frame is None:
+                    token = _skip_request(sid) if own else None
+                    try:
+                        async with f(*args, **kwargs) as value:
+                            yield value
+                    finally:
+                        if token is not None:
+                            _task_frames.reset(token)
+                    return
+                node_extra = capture(args, kwargs) if capture else None
+                # set here, the frame stays visible in the body of `async with`
+                cursor = open_(frame, node_extra)
+                token = push(frame, cursor)
+                acc[OH_TOTAL] += perf_counter_ns() - t0
+                exc_extra, entered, raised = None, False, None
+                try:
+                    cm = f(*args, **kwargs)
+                    value = await cm.__aenter__()
+                    entered = True
+                    try:
+                        yield value
+                    except BaseException as e:
+                        # raised in the body of `async with`, not by the target
+                        raised, exc_extra = e, s._exception_extra(e)
+                        if not await cm.__aexit__(type(e), e, e.__traceback__):
+                            raise
+                        exc_extra = None
+                    else:
+                        await cm.__aexit__(None, None, None)
+                except BaseException as e:
+                    if e is raised:
+                        raise
+                    # `fast_fail` only decides on the target's own exceptions
+                    exc_extra = failed(e)
+                    if exc_extra is not None:
+                        raise
+                    if raised is not None:
+                        exc_extra = s._exception_extra(raised)
+                        raise raised
+                finally:
+                    t0 = perf_counter_ns()
+                    _task_frames.reset(token)
+                    close(frame, own, cursor, exc_extra)
+                    acc[OH_TOTAL] += perf_counter_ns() - t0
+                    acc[OH_CALLS] += 1
+                if not entered:
+                    # swallowed in `__aenter__`, the body gets None like a swallowed call
+                    yield None
+
+        update_wrapper(__x, f, assigned=("__module__", "__doc__"), updated=())
+        return __x
+
+    def inserter(s, f, *_args, **_kwargs):
+        """If function signature has no positional argument, we can use this inserter directly."""
+        return s._compile(f, f.__name__)
+
+    def inserter_with_extra(s, extra=None, *_args, **_kwargs):
+        def wrap(f):
+            return s._compile(f, f.__name__, tree_extra=extra)
 
         return wrap
 
@@ -435,6 +1259,27 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
             if not get_global_hiq_status():
                 print("🌚 global hiq switch is off")
                 return s
+            # metrics after latency go to a vector in the latency node, unless
+            # `HIQ_COLUMNAR=0` asks for one tree per metric function
+            s.columnar = (
+                len(s.metric_funcs) > 1
+                and s.metric_funcs[0].__name__ == KEY_LATENCY
+                and not s.itree_tpl
+                and get_env_bool("HIQ_COLUMNAR", True)
+            )
+            # node extras count in the memory estimate of the hiq map
+            n_extra = len(set(s.extra_metrics)) + (2 if s.attach_timestamp else 0)
+            if s.columnar:
+                n_extra += 1
+            s.tau.node_bytes = HIQ_NODE_BYTES + n_extra * HIQ_EXTRA_BYTES
+            # spans built from the trees off the request thread, see `hiq.otm_export`
+            s.otm_exporter = None
+            if os.environ.get("TRACE_TYPE") == TRACING_TYPE_OTM and get_env_bool(
+                "HIQ_OTM_DEFERRED"
+            ):
+                from hiq.otm_export import get_otm_exporter
+
+                s.otm_exporter = get_otm_exporter()
             s.custom()
             for m, c, f, t in s.hiq_quadruple:
                 s._h(m, c, f, t)
@@ -463,6 +1308,7 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
                 s.__disable_c(module_name, class_name, func_name, tag)
         s.custom_disable()
         s.enabled = False
+        s._ship_evicted(force=True)
         if reset_trace:
             s.reset()
 
@@ -493,92 +1339,85 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
         Args:
             s (HiQBase): self object of HiQBase
         """
-        s.tau = collections.defaultdict(dict)
+        s._ship_evicted(force=True)
+        s.tau = s.tau.empty_copy()
+        s.tau_owner = {}
         s.check_oh_counter = 0
 
+    def _with_io_counter(s, f: Callable, tag: str) -> Callable:
+        """count the bytes moved by the built-in I/O targets, see `extra_hiq_table`"""
+        if tag == HIQ_FUNC_PREFIX + HIQ_FUNC_DIO_RD:
+            counter, size = "dio_bytes_r", len
+        elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_DIO_WT:
+            counter, size = "dio_bytes_w", len
+        elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_SIO_RD:
+            counter, size = "sio_bytes_r", len
+        elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_SIO_WT:
+            counter, size = "sio_bytes_w", len
+        elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_NIO_GET:
+            counter, size = "nio_bytes_r", _http_content_len
+        elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_NIO_POS:
+            counter, size = "nio_bytes_w", _http_content_len
+        else:
+            return f
+
+        def __io(*args, **kwargs):
+            _r = f(*args, **kwargs)
+            setattr(s, counter, getattr(s, counter) + size(_r))
+            return _r
+
+        return __io
+
+    def _patch(s, module_name, class_name, func_name, tag, wrapper):
+        """replace the target with its wrapper. C types go through `enable_c`."""
+        _m = hiq.mod(module_name)
+        owner = getattr(_m, class_name) if class_name else _m
+        if is_hiqed(getattr(owner, func_name), func_name):
+            msg = (
+                f"🅳 {module_name}.{class_name}.{func_name} cannot be hiqed twice. "
+                "Please check your hiq table."
+            )
+            raise HiQException(msg)
+        try:
+            if f"{module_name}.{class_name}.{func_name}" in HIQ_C_SET:
+                setattr(s, f"o_{tag}", s.enable_c(module_name, class_name, func_name, wrapper))
+            else:
+                setattr(owner, func_name, wrapper)
+        except TypeError as e:
+            try:
+                setattr(s, f"o_{tag}", s.enable_c(module_name, class_name, func_name, wrapper))
+            except Exception as e:
+                if s.verbose:
+                    print(traceback.format_exc())
+
     def _h(s, module_name, class_name, func_name, tag: str = ""):
         try:
             class_func = f"{class_name}.{func_name}"
             if not class_name:
                 class_func = func_name
-            d = f"m_ = hiq.mod('{module_name}').{class_func}"
-            itree.exe(d, locals())
-            assert hasattr(locals()["m_"], "__call__"), "a callable is needed"
+            _m = hiq.mod(module_name)
+            m_ = getattr(getattr(_m, class_name) if class_name else _m, func_name)
+            assert hasattr(m_, "__call__"), "a callable is needed"
             if not tag:
                 tag += str(s.count)
             # already defined in the custom
             if _is_callable(tag):
                 d = f"""hiq.mod('{module_name}').{class_func} = {tag}"""
                 itree.exe(d, locals())
+            elif s.itree_tpl:
+                s._h_tpl(module_name, class_func, tag, m_)
             else:
-                itree.exe(f"s.o_{tag} = m_", locals())
-                spec_with_default, spec_wo_default = _get_full_argspecs(locals()["m_"])
-
-                if inspect.ismethod(locals()["m_"]):
-                    spec_with_default = spec_with_default[
-                        spec_with_default.find(",") + 1 :
-                    ]
-                    spec_wo_default = spec_wo_default[spec_wo_default.find(",") + 1 :]
-                    # spec_with_default += ",*args,**kwargs"
-                    # spec_wo_default += ",*args,**kwargs"
-
-                assert (
-                    re.match(r"^[\w\.]+$", tag)
-                    and ";" not in spec_with_default
-                    and ";" not in spec_wo_default
-                    and ";" not in module_name
-                    and ";" not in class_func
-                ), "no hacker"
-                signature = spec_with_default
-                if spec_with_default:
-                    signature += ","
-                if signature.startswith("**"):
-                    signature = "s=s," + signature
-                elif ",**" in signature:
-                    i = signature.find(",**")
-                    signature = signature[:i] + ",s=s" + signature[i:]
-                else:
-                    signature += "s=s"
-                if signature.endswith(","):
-                    signature = signature[:-1]
-                if "." in class_func:
-                    _class_name = class_func.split(".")[0]
-                    _funct_name = class_func.split(".")[1]
+                # a static or class method is wrapped as the function under the
+                # descriptor, and the wrapper goes back under the same descriptor
+                desc = inspect.getattr_static(getattr(_m, class_name), func_name, None) if class_name else None
+                if isinstance(desc, (staticmethod, classmethod)):
+                    setattr(s, f"o_{tag}", desc)
+                    wrapper = s._compile(s._with_io_counter(desc.__func__, tag), tag)
+                    wrapper = type(desc)(wrapper)
                 else:
-                    _class_name = "🦉"
-                    _funct_name = class_func
-                if not s.itree_tpl:
-                    raise Exception("empty tau tpl")
-                d = s.itree_tpl.format(
-                    tag=tag,
-                    signature=signature,
-                    spec_wo_default=spec_wo_default,
-                    module_name=module_name,
-                    _class_name=_class_name,
-                    _funct_name=_funct_name,
-                )
-                d = d.replace(".🦉", "")
-                if tag == HIQ_FUNC_PREFIX + HIQ_FUNC_DIO_RD:
-                    d = d.replace("🐚", "s.dio_bytes_r += len(_r)")
-                elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_DIO_WT:
-                    d = d.replace("🐚", "s.dio_bytes_w += len(_r)")
-                elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_SIO_RD:
-                    d = d.replace("🐚", "s.sio_bytes_r += len(_r)")
-                elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_SIO_WT:
-                    d = d.replace("🐚", "s.sio_bytes_w += len(_r)")
-                elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_NIO_GET:
-                    d = d.replace(
-                        "🐚",
-                        "s.nio_bytes_r += len(_r.content) if (_r and _r.status_code < 400) else 0",
-                    )
-                elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_NIO_POS:
-                    d = d.replace(
-                        "🐚",
-                        "s.nio_bytes_w += len(_r.content) if (_r and _r.status_code < 400) else 0",
-                    )
-                else:
-                    d = d.replace("🐚", "")
-                itree.exe(d, locals())
+                    setattr(s, f"o_{tag}", m_)
+                    wrapper = s._compile(s._with_io_counter(m_, tag), tag)
+                s._patch(module_name, class_name, func_name, tag, wrapper)
         except Exception as e:
             print(f"🦉 {module_name}.{class_name}.{func_name} is not traced({e})")
             if s.verbose:
@@ -587,6 +1426,71 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
         finally:
             s.count += 1
 
+    def _h_tpl(s, module_name, class_func, tag, m_):
+        """legacy: generate the wrapper from the template passed in as `tpl`"""
+        itree.exe(f"s.o_{tag} = m_", locals())
+        spec_with_default, spec_wo_default = _get_full_argspecs(m_)
+
+        if inspect.ismethod(m_):
+            spec_with_default = spec_with_default[spec_with_default.find(",") + 1 :]
+            spec_wo_default = spec_wo_default[spec_wo_default.find(",") + 1 :]
+
+        assert (
+            re.match(r"^[\w\.]+$", tag)
+            and ";" not in spec_with_default
+            and ";" not in spec_wo_default
+            and ";" not in module_name
+            and ";" not in class_func
+        ), "no hacker"
+        signature = spec_with_default
+        if spec_with_default:
+            signature += ","
+        if signature.startswith("**"):
+            signature = "s=s," + signature
+        elif ",**" in signature:
+            i = signature.find(",**")
+            signature = signature[:i] + ",s=s" + signature[i:]
+        else:
+            signature += "s=s"
+        if signature.endswith(","):
+            signature = signature[:-1]
+        if "." in class_func:
+            _class_name = class_func.split(".")[0]
+            _funct_name = class_func.split(".")[1]
+        else:
+            _class_name = "🦉"
+            _funct_name = class_func
+        d = s.itree_tpl.format(
+            tag=tag,
+            signature=signature,
+            spec_wo_default=spec_wo_default,
+            module_name=module_name,
+            _class_name=_class_name,
+            _funct_name=_funct_name,
+        )
+        d = d.replace(".🦉", "")
+        if tag == HIQ_FUNC_PREFIX + HIQ_FUNC_DIO_RD:
+            d = d.replace("🐚", "s.dio_bytes_r += len(_r)")
+        elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_DIO_WT:
+            d = d.replace("🐚", "s.dio_bytes_w += len(_r)")
+        elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_SIO_RD:
+            d = d.replace("🐚", "s.sio_bytes_r += len(_r)")
+        elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_SIO_WT:
+            d = d.replace("🐚", "s.sio_bytes_w += len(_r)")
+        elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_NIO_GET:
+            d = d.replace(
+                "🐚",
+                "s.nio_bytes_r += len(_r.content) if (_r and _r.status_code < 400) else 0",
+            )
+        elif tag == HIQ_FUNC_PREFIX + HIQ_FUNC_NIO_POS:
+            d = d.replace(
+                "🐚",
+                "s.nio_bytes_w += len(_r.content) if (_r and _r.status_code < 400) else 0",
+            )
+        else:
+            d = d.replace("🐚", "")
+        itree.exe(d, locals())
+
     def empty(s):
         return not s.tau
 
@@ -608,21 +1512,103 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
             r.append((k0, t.root.span(), t.root.start, t.root.end))
         return r
 
+    def get_node_table(s, metrics_key=KEY_LATENCY):
+        """the nodes of the trees of `metrics_key` of all the requests in one
+        NumPy array, like `driver.get_node_table().group_by("path")`, see
+        `hiq.node_table`. It needs `numpy`."""
+        from hiq.node_table import NodeTable
+
+        return NodeTable.from_tau(s.tau, metrics_key)
+
+    def get_critical_path_summary(s, metrics_key=KEY_LATENCY, by="name") -> Dict[str, Dict[str, dict]]:
+        """the critical paths of the trees of `metrics_key` of all the requests,
+        by endpoint, see `hiq.critical_path.critical_path_summary`"""
+        from hiq.critical_path import critical_path_summary
+
+        return critical_path_summary(
+            (forest[metrics_key] for forest in s.tau.values() if metrics_key in forest), by=by
+        )
+
     def get_metrics_by_k0(s, k0=None, metrics_key=KEY_LATENCY) -> Union[Tree, None]:
         return s.tau[k0][metrics_key] if k0 in s.tau else None
 
     def show(s, ignore_empty_tree=False, show_key=False, time_format=FORMAT_DATETIME):
         for k0 in s.tau:
-            for k1 in s.tau[k0]:
-                if not isinstance(s.tau[k0][k1], Tree):
+            for k1, tree in metric_items(s.tau[k0]):
+                if not isinstance(tree, Tree):
                     continue
-                s.tau[k0][k1].consolidate()
-                span = abs(s.tau[k0][k1].root.span())
+                tree.consolidate()
+                span = abs(tree.root.span())
                 # print(f"{span=:.9f}")
                 if not ignore_empty_tree or span > 1e-6:
                     if show_key:
                         print(f"🔑 k0: {k0}, 🗝 k1: {k1}")
-                    print(s.tau[k0][k1].get_graph(time_format=time_format))
+                    print(tree.get_graph(time_format=time_format))
+        table = s.overhead_meter.table()
+        if table:
+            print(table)
+
+    @property
+    def overhead_us(s) -> int:
+        """the tracing overhead so far in micro-seconds, summed from the nanosecond counters"""
+        return s.overhead_meter.total_ns() // 1000
+
+    def stats(s) -> LatencyStats:
+        """get the streaming latency statistics of the targets and the endpoints
+
+        Every traced call adds its latency to the sketch of its target tag, and
+        every completed request adds its latency to the sketch of its root call,
+        the endpoint. Unlike the trees in `tau`, they cover all the calls since
+        the driver started, in constant memory. Turn them off with env variable
+        `HIQ_STATS=0` before the driver is created.
+
+        Returns:
+            LatencyStats: see `hiq.sketch`, like `driver.stats().summary()["endpoints"]` or `driver.stats().to_dict()` to merge them with the ones of other processes.
+        """
+        return s.latency_stats
+
+    def get_overhead_breakdown(s) -> Dict[str, Dict[str, int]]:
+        """get the tracing overhead by target tag, in nanoseconds
+
+        The overhead of the driver itself, like sending trees to Jack, is under
+        tags like `<send_trees_to_jack>`.
+
+        Returns:
+            Dict[str, Dict[str, int]]: `{tag: {"calls": n, "total": ns}}`, with the time of each stage in `hiq.overhead.OVERHEAD_STAGES` when stages are on.
+        """
+        return s.overhead_meter.breakdown()
+
+    def get_export_stats(s) -> Dict[str, Dict[str, int]]:
+        """get the counters of the enabled exporters, Jack in trees and LMK in events
+
+        Returns:
+            Dict[str, Dict[str, int]]: `{"jack": counters, "lmk": counters}`, the counters are described in `hiq.overflow`.
+        """
+        r = {}
+        if getattr(s, "jack_ring", None) is not None:
+            r["jack"] = s.jack_stats()
+        if s.lmk_ring is not None:
+            r["lmk"] = s.lmk_stats()
+        return r
+
+    def set_overhead_breakdown(s, stages=True, reset=False):
+        """split the tracing overhead by stage, or stop splitting it
+
+        Stages cost a few clock reads per traced call. The wrappers of the targets
+        are rebuilt if HiQ is enabled.
+
+        Args:
+            stages (bool, optional): split by stage. Defaults to True.
+            reset (bool, optional): zero the counters. Defaults to False.
+        """
+        meter = s.overhead_meter
+        if reset:
+            meter.reset()
+        if meter.stages != stages:
+            meter.stages = stages
+            if s.enabled:
+                s.disable_hiq()
+                s.enable_hiq()
 
     def get_overhead(s, format_=OverHeadFormat.ABS) -> float:
         """get tracing latency overhead in absolute format or percentage format
@@ -643,7 +1629,7 @@ class HiQBase(itree.ForestStats, LogMonkeyKing):
     def get_overhead_us(s) -> float:
         """get tracing latency overhead in unit of micro-second
 
-        How to calculate latency overhead? The latency overhead is attached to the latency tree. the latency overhead calculation is based on monotonic time and has unit of micro-second. When a HiQ system is instantiated, the initial overhead is 0. Every time a target function is called, we accumulate the overhead. When we finish a level-2 node in the HiQ tree, we update the `overhead` in the tree to get the final overhead of that trace.
+        How to calculate latency overhead? The latency overhead is attached to the latency tree. the latency overhead is counted by `perf_counter_ns` per target tag, see `get_overhead_breakdown()`, and reported in micro-second. When a HiQ system is instantiated, the initial overhead is 0. Every time a target function is called, we accumulate the overhead. When we finish a level-2 node in the HiQ tree, we update the `overhead` in the tree to get the final overhead of that trace.
 
         Returns:
             float: absolute value in micro-second
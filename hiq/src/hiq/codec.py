@@ -0,0 +1,386 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+"""Binary encoding of HiQ trees
+
+The text format of `Tree.repr()` writes every value as a decimal string and
+every extra as `str(dict)`. This is a compact, versioned alternative. Version 1
+layout, where integers are LEB128 varints and signed ones are zigzag encoded:
+
+    stream  := b"HQB" version:u8 record*
+    record  := length:varint key:value tree
+    tree    := tid:str pid:str mode count depth monotonic:u8 zin:f64 exponent:u8 extra:value node
+    node    := name:str flags:u8 start end [nid] [extra:value] n_children node*
+    str     := index                    # in the string table of the stream, or
+             | len(table) len utf8      # a new string, defined where it is first used
+    value   := tag:u8 payload           # None, bool, int, float, str, bytes, list, tuple, dict
+
+A value of another type is written as the string of its `repr()`. `start` is
+the zigzag delta of `start * 10**exponent` from the start of the parent node,
+and `end` the delta from `start`, unless the flags mark a raw f64(inf, nan, or a
+value which is not exact at `exponent` decimals). The exponent of a tree, 0, 3,
+6 or 9, is the smallest one at which its values are exact, so decoding gives
+back the same tree.
+
+`TreeEncoder` and `TreeDecoder` work on a stream of records, `dumps()`/`loads()`
+on one tree and `dumps_forest()`/`loads_forest()` on the trees of a request.
+"""
+
+import io
+import math
+import struct
+from typing import BinaryIO, Dict, Iterator, Tuple
+
+from hiq.tree import Tree
+import itree
+
+HIQ_BINARY_MAGIC = b"HQB"
+HIQ_BINARY_VERSION = 1
+
+_T_NONE, _T_FALSE, _T_TRUE, _T_INT, _T_FLOAT, _T_STR = range(6)
+_T_BYTES, _T_LIST, _T_TUPLE, _T_DICT, _T_REPR = range(6, 11)
+
+# node flags
+_F_START_RAW = 1
+_F_END_RAW = 2
+_F_NID = 4
+_F_EXTRA = 8
+
+_EXPONENTS = (0, 3, 6, 9)
+_f64 = struct.Struct("<d")
+
+
+def _scaled(v: float, p: int):
+    """`v * p` as an int if `v` is exact at that scale, else None"""
+    if not math.isfinite(v):
+        return None
+    q = round(v * p)
+    if q / p == v:
+        return q
+    # `v * p` is rounded, try the exact product
+    n, d = v.as_integer_ratio()
+    q = (2 * n * p + d) // (2 * d)
+    return q if q / p == v else None
+
+
+def _exponent(root) -> int:
+    """the smallest exponent at which the start/end values under `root` are exact"""
+    i = 0
+    stk = [root]
+    while stk:
+        n = stk.pop()
+        for v in (n.start, n.end):
+            if not math.isfinite(v):
+                continue
+            while i < len(_EXPONENTS) - 1 and _scaled(v, 10 ** _EXPONENTS[i]) is None:
+                i += 1
+        stk.extend(n.nodes)
+    return _EXPONENTS[i]
+
+
+def _header(tree) -> list:
+    """pid, mode, count, depth, monotonic and zin threshold of `tree`, which are
+    only exposed by the text format: serialize it without its nodes"""
+    root = tree.root
+    tree.root = None
+    try:
+        s = tree.repr()
+    finally:
+        tree.root = root
+    return s[s.index("^") + 1 :].split(",", 7)
+
+
+class TreeEncoder(object):
+    """Write trees to a binary stream, one record per tree
+
+    Strings are interned across the stream: a name is written once, then
+    referred to by index.
+
+    Args:
+        stream (BinaryIO): a writable binary stream.
+    """
+
+    def __init__(sf, stream: BinaryIO):
+        sf.stream = stream
+        sf.strings = {}
+        stream.write(HIQ_BINARY_MAGIC + bytes((HIQ_BINARY_VERSION,)))
+
+    def write(sf, tree: Tree, key=None):
+        """write `tree` as a record, with a key like a metric name"""
+        buf = bytearray()
+        sf._value(buf, key)
+        _, pid, mode, count, depth, monotonic, zin, _ = _header(tree)
+        sf._str(buf, tree.tid)
+        sf._str(buf, pid)
+        _uint(buf, int(mode))
+        _uint(buf, int(count))
+        _uint(buf, int(depth))
+        buf.append(int(monotonic))
+        buf += _f64.pack(float(zin))
+        root = tree.root
+        e = _exponent(root)
+        buf.append(e)
+        sf._value(buf, dict(tree.extra))
+        sf._node(buf, root, 10**e, 0)
+        out = bytearray()
+        _uint(out, len(buf))
+        sf.stream.write(out + buf)
+
+    def write_forest(sf, forest: Dict[str, Tree]):
+        """write the trees of a request, keyed by metric name"""
+        for k, tree in forest.items():
+            sf.write(tree, k)
+
+    def _str(sf, buf: bytearray, s: str):
+        i = sf.strings.get(s)
+        if i is not None:
+            _uint(buf, i)
+            return
+        i = sf.strings[s] = len(sf.strings)
+        _uint(buf, i)
+        b = s.encode("utf-8")
+        _uint(buf, len(b))
+        buf += b
+
+    def _node(sf, buf: bytearray, n, p: int, base: int):
+        sf._str(buf, n.name)
+        flags_at = len(buf)
+        buf.append(0)
+        flags = 0
+        q0 = _scaled(n.start, p)
+        if q0 is None:
+            flags |= _F_START_RAW
+            buf += _f64.pack(n.start)
+            q0 = 0
+        else:
+            _sint(buf, q0 - base)
+        q1 = _scaled(n.end, p)
+        if q1 is None:
+            flags |= _F_END_RAW
+            buf += _f64.pack(n.end)
+        else:
+            _sint(buf, q1 - q0)
+        if n.nid:
+            flags |= _F_NID
+            _uint(buf, n.nid)
+        extra = n.extra
+        if extra:
+            flags |= _F_EXTRA
+            sf._value(buf, extra)
+        buf[flags_at] = flags
+        nodes = n.nodes
+        _uint(buf, len(nodes))
+        for c in nodes:
+            sf._node(buf, c, p, q0)
+
+    def _value(sf, buf: bytearray, v):
+        t = type(v)
+        if v is None:
+            buf.append(_T_NONE)
+        elif t is bool:
+            buf.append(_T_TRUE if v else _T_FALSE)
+        elif t is int:
+            buf.append(_T_INT)
+            _sint(buf, v)
+        elif t is float:
+            buf.append(_T_FLOAT)
+            buf += _f64.pack(v)
+        elif t is str:
+            buf.append(_T_STR)
+            sf._str(buf, v)
+        elif t is bytes:
+            buf.append(_T_BYTES)
+            _uint(buf, len(v))
+            buf += v
+        elif t is list or t is tuple:
+            buf.append(_T_LIST if t is list else _T_TUPLE)
+            _uint(buf, len(v))
+            for i in v:
+                sf._value(buf, i)
+        elif t is dict:
+            buf.append(_T_DICT)
+            _uint(buf, len(v))
+            for k, i in v.items():
+                sf._value(buf, k)
+                sf._value(buf, i)
+        else:
+            # e.g. an exception in the extra of a node
+            buf.append(_T_REPR)
+            sf._str(buf, repr(v))
+
+
+class TreeDecoder(object):
+    """Read the trees written by `TreeEncoder`, one record at a time
+
+    Args:
+        stream (BinaryIO): a readable binary stream.
+    """
+
+    def __init__(sf, stream: BinaryIO):
+        sf.stream = stream
+        sf.strings = []
+        head = stream.read(len(HIQ_BINARY_MAGIC) + 1)
+        if head[:-1] != HIQ_BINARY_MAGIC:
+            raise ValueError("🦉 not a binary hiq stream")
+        if head[-1] > HIQ_BINARY_VERSION:
+            raise ValueError(f"🦉 unsupported binary hiq version: {head[-1]}")
+        sf.buf = b""
+        sf.pos = 0
+
+    def __iter__(sf) -> Iterator[Tuple[object, Tree]]:
+        while True:
+            r = sf.read()
+            if r is None:
+                return
+            yield r
+
+    def read(sf):
+        """the next (key, tree), or None at the end of the stream"""
+        size, shift = 0, 0
+        while True:
+            b = sf.stream.read(1)
+            if not b:
+                if shift:
+                    raise ValueError("🦉 truncated binary hiq stream")
+                return None
+            size |= (b[0] & 0x7F) << shift
+            shift += 7
+            if b[0] < 0x80:
+                break
+        sf.buf = sf.stream.read(size)
+        if len(sf.buf) != size:
+            raise ValueError("🦉 truncated binary hiq stream")
+        sf.pos = 0
+        key = sf._value()
+        tid = sf._str()
+        pid = sf._str()
+        mode, count, depth = sf._uint(), sf._uint(), sf._uint()
+        monotonic = sf.buf[sf.pos]
+        (zin,) = _f64.unpack_from(sf.buf, sf.pos + 1)
+        e = sf.buf[sf.pos + 9]
+        sf.pos += 10
+        extra = sf._value()
+        tree = Tree(
+            f"t1^{tid},{pid},{mode},{count},{depth},{monotonic},{zin!r},0#%n1*[None,inf,inf,0$0#]"
+        )
+        tree.extra = extra
+        tree.root = sf._node(10**e, 0)
+        return key, tree
+
+    def _uint(sf) -> int:
+        buf = sf.buf
+        b = buf[sf.pos]
+        sf.pos += 1
+        if b < 0x80:
+            return b
+        r, shift = b & 0x7F, 7
+        while True:
+            b = buf[sf.pos]
+            sf.pos += 1
+            r |= (b & 0x7F) << shift
+            if b < 0x80:
+                return r
+            shift += 7
+
+    def _sint(sf) -> int:
+        u = sf._uint()
+        return (u >> 1) ^ -(u & 1)
+
+    def _str(sf) -> str:
+        i = sf._uint()
+        if i < len(sf.strings):
+            return sf.strings[i]
+        size = sf._uint()
+        s = sf.buf[sf.pos : sf.pos + size].decode("utf-8")
+        sf.pos += size
+        sf.strings.append(s)
+        return s
+
+    def _f64(sf) -> float:
+        (v,) = _f64.unpack_from(sf.buf, sf.pos)
+        sf.pos += 8
+        return v
+
+    def _node(sf, p: int, base: int):
+        name = sf._str()
+        flags = sf.buf[sf.pos]
+        sf.pos += 1
+        if flags & _F_START_RAW:
+            start, q0 = sf._f64(), 0
+        else:
+            q0 = base + sf._sint()
+            start = q0 / p
+        end = sf._f64() if flags & _F_END_RAW else (q0 + sf._sint()) / p
+        nid = sf._uint() if flags & _F_NID else 0
+        extra = sf._value() if flags & _F_EXTRA else {}
+        n = itree._itree.Node(name, start, end, extra)
+        if nid:
+            n.nid = nid
+        for _ in range(sf._uint()):
+            n.append(sf._node(p, q0))
+        return n
+
+    def _value(sf):
+        t = sf.buf[sf.pos]
+        sf.pos += 1
+        if t == _T_STR:
+            return sf._str()
+        if t == _T_FLOAT:
+            return sf._f64()
+        if t == _T_INT:
+            return sf._sint()
+        if t == _T_DICT:
+            n = sf._uint()
+            return {sf._value(): sf._value() for _ in range(n)}
+        if t == _T_TUPLE or t == _T_LIST:
+            r = [sf._value() for _ in range(sf._uint())]
+            return tuple(r) if t == _T_TUPLE else r
+        if t == _T_NONE:
+            return None
+        if t == _T_TRUE or t == _T_FALSE:
+            return t == _T_TRUE
+        if t == _T_BYTES:
+            size = sf._uint()
+            sf.pos += size
+            return bytes(sf.buf[sf.pos - size : sf.pos])
+        if t == _T_REPR:
+            return sf._str()
+        raise ValueError(f"🦉 bad value tag {t} in binary hiq stream")
+
+
+def _uint(buf: bytearray, v: int):
+    while v > 0x7F:
+        buf.append((v & 0x7F) | 0x80)
+        v >>= 7
+    buf.append(v)
+
+
+def _sint(buf: bytearray, v: int):
+    _uint(buf, (v << 1) if v >= 0 else ((-v << 1) - 1))
+
+
+def dumps(tree: Tree) -> bytes:
+    """encode one tree"""
+    out = io.BytesIO()
+    TreeEncoder(out).write(tree)
+    return out.getvalue()
+
+
+def loads(data: bytes) -> Tree:
+    """decode the tree of `dumps()`"""
+    return TreeDecoder(io.BytesIO(data)).read()[1]
+
+
+def dumps_forest(forest: Dict[str, Tree]) -> bytes:
+    """encode the trees of a request, the names are shared by its trees"""
+    out = io.BytesIO()
+    TreeEncoder(out).write_forest(forest)
+    return out.getvalue()
+
+
+def loads_forest(data: bytes) -> Dict[str, Tree]:
+    """decode the trees of `dumps_forest()`"""
+    return dict(TreeDecoder(io.BytesIO(data)))
@@ -0,0 +1,126 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+"""Columnar metric forest
+
+A driver with several metric functions, like `[time.time, get_memory_mb]`,
+records one latency tree per request instead of one tree per metric function.
+Each node carries the other metrics in a vector, the list of their start values
+while the node is open, then the fixed-width tuple:
+
+    node.extra[EXTRA_METRICS_KEY] = (start_1, ..., start_k, end_1, ..., end_k)
+
+and the tree extra lists their names, so a serialized latency tree holds the
+whole forest and `MetricForest.from_tree()` recovers it.
+"""
+
+from typing import Dict, Iterable, List, Tuple
+
+from hiq.constants import (
+    EXTRA_END_TIME_KEY,
+    EXTRA_METRICS_KEY,
+    EXTRA_START_TIME_KEY,
+    KEY_LATENCY,
+)
+import hiq
+from hiq.node import Node
+from hiq.tree import Tree
+
+
+class MetricForest(dict):
+    """The trees of one request, stored as one latency tree with metric vectors
+
+    The dict holds the latency tree only, so iterating the forest gives the trees
+    which are recorded into. `forest[name]` of another metric returns a view: a
+    `Tree` with the same node structure built from the vectors. A view is cached
+    until the latency tree changes, and it is not recorded into. `metrics()`
+    gives the latency tree and the views, in the order of the metric functions.
+
+    Args:
+        tree (Tree): the latency tree.
+        names (Iterable[str]): the names of the other metrics, in vector order.
+        attach_timestamp (bool, optional): put the start and end time in the extra of view nodes. Defaults to False.
+    """
+
+    def __init__(sf, tree: Tree, names: Iterable[str], attach_timestamp=False):
+        super().__init__({KEY_LATENCY: tree})
+        sf.names = tuple(names)
+        sf.attach_timestamp = attach_timestamp
+        # metric index -> (stamp of the latency tree, view)
+        sf.views = {}
+        tree.extra[EXTRA_METRICS_KEY] = list(sf.names)
+
+    @staticmethod
+    def from_tree(tree: Tree, attach_timestamp=False) -> "MetricForest":
+        """the forest of a latency tree recorded in columnar layout, e.g. a deserialized one"""
+        return MetricForest(tree, tree.extra.get(EXTRA_METRICS_KEY, ()), attach_timestamp)
+
+    def __missing__(sf, name: str) -> Tree:
+        if name not in sf.names:
+            raise KeyError(name)
+        return sf.view(sf.names.index(name))
+
+    def get(sf, name: str, default=None):
+        if name in sf.names:
+            return sf[name]
+        return dict.get(sf, name, default)
+
+    def metrics(sf) -> List[Tuple[str, Tree]]:
+        """(name, tree) of every metric"""
+        return [(KEY_LATENCY, sf[KEY_LATENCY])] + [
+            (name, sf.view(i)) for i, name in enumerate(sf.names)
+        ]
+
+    def view(sf, i: int) -> Tree:
+        """the tree of the metric at index `i` of the vectors"""
+        tree = sf[KEY_LATENCY]
+        stamp = (tree.count, tree.n_open)
+        cached = sf.views.get(i)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        extra = {
+            k: v
+            for k, v in tree.extra.items()
+            if k not in (EXTRA_METRICS_KEY, "overhead", "overhead_start")
+        }
+        r = Tree(tid=sf.names[i], extra=extra, monotonic=False)
+        zin = hiq.tree.global_zin_threshold
+        r.count = _fill(r.root, tree.root, i, len(sf.names), sf.attach_timestamp, zin)
+        r.depth = tree.depth
+        sf.views[i] = (stamp, r)
+        return r
+
+
+def _fill(parent: Node, node: Node, i: int, k: int, attach_timestamp: bool, zin: float):
+    """append the view of `node` and its children to `parent`, return the number
+    of nodes appended
+
+    Like `Tree.end()` does, an ended node without children is dropped when its
+    span is below `zin`.
+    """
+    vec = node.extra.get(EXTRA_METRICS_KEY)
+    if vec is None:
+        # the virtual root, or a consolidated one
+        return sum(_fill(parent, c, i, k, attach_timestamp, zin) for c in node.nodes)
+    extra = {x: v for x, v in node.extra.items() if x != EXTRA_METRICS_KEY}
+    if attach_timestamp:
+        extra[EXTRA_START_TIME_KEY] = node.start
+        extra[EXTRA_END_TIME_KEY] = node.end
+    # the end values are missing until the node is ended
+    ended = len(vec) > k
+    n = Node(node.name, vec[i], vec[k + i] if ended else 0, extra)
+    count = sum(_fill(n, c, i, k, attach_timestamp, zin) for c in node.nodes)
+    if ended and not count and abs(n.end - n.start) < zin:
+        return 0
+    parent.append(n)
+    return count + 1
+
+
+def metric_items(forest: Dict[str, Tree]) -> List[Tuple[str, Tree]]:
+    """(name, tree) of every metric of a forest, columnar or not"""
+    if isinstance(forest, MetricForest):
+        return forest.metrics()
+    return list(forest.items())
@@ -8,6 +8,8 @@ from enum import Enum
 
 EXTRA_START_TIME_KEY = "start"
 EXTRA_END_TIME_KEY = "end"
+# the metric vector of a node in a columnar forest, see `hiq.columnar.MetricForest`
+EXTRA_METRICS_KEY = "metrics"
 
 TREE_ROOT_NAME = "root"
 FORMAT_TIMESTAMP = "_timestamp_"
@@ -53,7 +55,19 @@ TRACING_TYPE_PROM = "prometheus"
 
 # 1 Page, 32K slots for our hash table
 HIQ_SHARED_MEMORY = 1024 * 4
-GLOBAL_HIQ_TTL_S = 60
+
+# global hiq status segment: [status, generation] as two int64 words
+HIQ_STATUS_SHM_SUFFIX = "_status"
+HIQ_STATUS_IDX_ON = 0
+HIQ_STATUS_IDX_GEN = 1
+HIQ_STATUS_SHM_SIZE = 8 * 2
+
+# retention of the hiq map(`HiQBase.tau`), see `hiq.retention.TauStore`
+RETENTION_FIFO = "fifo"
+RETENTION_LRU = "lru"
+# estimated memory of one tree node and of one entry in an `extra` dict
+HIQ_NODE_BYTES = 160
+HIQ_EXTRA_BYTES = 96
 
 HIQ_C_SET = {"_io.TextIOWrapper.read", "_io.TextIOWrapper.write"}
 
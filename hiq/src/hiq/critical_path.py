@@ -0,0 +1,173 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+"""The critical path of a tree
+
+When the children of a node overlap, like the calls in a thread pool or an
+`asyncio.gather`, the sum of their spans does not explain the span of the node.
+The critical path is the chain of nodes which decided when the root call ended.
+It is found backwards from the end of the root: the child ending last is on the
+path, then the child ending last before that one started, and so on down to the
+leaves. A child still running when the next one on the path started ran
+alongside it, and is off the path. What a node on the path does not spend in its children on the path
+is its self time, and the self times add up to the span of the root.
+
+A node off the path has slack, the time it could take longer without delaying
+the root: until the next node on the path under the same parent starts, or
+until its parent has to end. Nodes are assumed to wait only for their parent
+and for the earlier nodes on the path, the trees do not record other
+dependencies.
+
+    >>> cp = tree.critical_path()
+    >>> [(n.name, s) for n, s in zip(cp.nodes, cp.self_s)]
+    >>> print(tree.get_graph(mode="critical"))
+    >>> critical_path_summary(trees)["__main"]  # the optimization targets of endpoint `__main`
+"""
+
+import math
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from typing import Dict, Iterable, List, Tuple
+
+from hiq.node_utils import is_none
+
+# the nodes are the keys of the dicts below, not their `id()`: the object of an
+# `itree` node is made again, with another id, once it is not referenced
+GRAPH_MODE_CRITICAL = "critical"
+
+CriticalPath = namedtuple("CriticalPath", ["nodes", "self_s", "slack"])
+CriticalPath.__doc__ = """The critical path of a tree or a node
+
+    nodes: the nodes on the path, in the order they started
+    self_s: the time of each node of `nodes` not spent in its children on the path
+    slack: `(node, slack)` of the nodes off the path, in pre-order
+"""
+
+
+def _on_path(node, end: float) -> List[Tuple[object, float]]:
+    """the children of `node` on the path ending at `end`, latest first, with
+    the end of each on the path"""
+    picked, cursor = [], end
+    for c in sorted(node.nodes, key=lambda c: c.end, reverse=True):
+        # a child ending after its parent is cut at the end of the parent
+        e = min(c.end, end)
+        if e <= cursor and c.start < cursor:
+            picked.append((c, e))
+            cursor = c.start
+    return picked
+
+
+def _end_of(node) -> float:
+    """the end of `node`, or of its last child if it is not set, like the virtual root"""
+    if math.isfinite(node.end) or not node.nodes:
+        return node.end
+    return max(c.end for c in node.nodes)
+
+
+def critical_path(node) -> CriticalPath:
+    """the `CriticalPath` under `node`, the root of a tree or a root call. The
+    virtual root of a tree, named `None`, is left out of the path"""
+    nodes, self_s, slack = [], [], []
+    # (node, the end of the node on the path or None if off the path, latest finish)
+    end = _end_of(node)
+    stk = [(node, end, end)]
+    while stk:
+        n, end, latest = stk.pop()
+        children = n.nodes
+        if end is None:
+            # a node ending after its parent has none
+            slack.append((n, max(latest - n.end, 0.0)))
+            stk.extend((c, None, latest) for c in reversed(children))
+            continue
+        picked = _on_path(n, end)[::-1]
+        if not (n is node and is_none(n.name)):
+            nodes.append(n)
+            self_s.append(end - n.start - sum(e - c.start for c, e in picked))
+        on_path = dict(picked)
+        starts = [c.start for c, _ in picked]
+        todo = []
+        for c in children:
+            e = on_path.get(c)
+            if e is not None:
+                todo.append((c, e, e))
+                continue
+            # until the next node on the path under `n` starts
+            i = bisect_left(starts, c.end)
+            todo.append((c, None, starts[i] if i < len(starts) else end))
+        stk.extend(reversed(todo))
+    return CriticalPath(nodes, self_s, slack)
+
+
+def critical_path_marks(cp: CriticalPath) -> Dict[object, str]:
+    """node -> the text `get_graph` adds to the node in mode `critical`"""
+    marks = {n: f" 🔥self={s:.4f}" for n, s in zip(cp.nodes, cp.self_s)}
+    marks.update((n, f" slack={s:.4f}") for n, s in cp.slack)
+    return marks
+
+
+def critical_path_summary(trees: Iterable, by: str = "name") -> Dict[str, Dict[str, dict]]:
+    """the critical paths of many trees, by endpoint(the name of the root call)
+
+    Args:
+        trees (Iterable): `Tree`s, their root nodes or the text of `Tree.repr()`. The trees not finished yet are left out.
+        by (str, optional): "name" or "path", the call path of the nodes like `__main/__run`. Defaults to "name".
+
+    Returns:
+        Dict[str, Dict[str, dict]]: `{endpoint: {name: {"count", "self_s", "share", "slack_s"}}}`, where `count` is the number of times the name is on the path, `self_s` the sum of its self time, `share` the part of the latency of the endpoint it explains, and `slack_s` the mean slack of the name when it is off the path. The names are sorted by `self_s`, the optimization targets first.
+    """
+    if by not in ("name", "path"):
+        raise ValueError(f"🦉 can not summarize critical paths by {by}")
+    from hiq.tree import Tree
+
+    on = defaultdict(lambda: defaultdict(lambda: [0, 0.0, 0, 0.0]))
+    latency = defaultdict(float)
+    for t in trees:
+        if isinstance(t, str):
+            t = Tree(t)
+        elif getattr(t, "n_open", 0):
+            # not finished yet
+            continue
+        root = getattr(t, "root", t)
+        for call in root.nodes if is_none(root.name) else (root,):
+            cp = critical_path(call)
+            keys = _path_keys(call) if by == "path" else None
+            acc = on[call.name]
+            latency[call.name] += _end_of(call) - call.start
+            for n, s in zip(cp.nodes, cp.self_s):
+                a = acc[keys[n] if keys else n.name]
+                a[0] += 1
+                a[1] += s
+            for n, s in cp.slack:
+                a = acc[keys[n] if keys else n.name]
+                a[2] += 1
+                a[3] += s
+    r = {}
+    for endpoint, acc in on.items():
+        total = latency[endpoint]
+        rows = sorted(acc.items(), key=lambda x: -x[1][1])
+        r[endpoint] = {
+            k: {
+                "count": a[0],
+                "self_s": a[1],
+                "share": a[1] / total if total else math.nan,
+                "slack_s": a[3] / a[2] if a[2] else math.nan,
+            }
+            for k, a in rows
+        }
+    return r
+
+
+def _path_keys(node) -> Dict[object, str]:
+    """n -> the call path of n, for the nodes under `node`"""
+    keys = {node: node.name}
+    stk = [node]
+    while stk:
+        n = stk.pop()
+        prefix = keys[n]
+        for c in n.nodes:
+            keys[c] = f"{prefix}/{c.name}"
+            stk.append(c)
+    return keys
@@ -143,6 +143,10 @@ class HiQOpenTelemetryContext(object):
 
         if __name__ == "__main__":
             run_main()
+
+    With `deferred=True`, the traced calls do not open spans. The spans are built
+    from the HiQ trees on a background thread once the root calls complete, see
+    `hiq.otm_export`.
     """
 
     from opentelemetry import trace
@@ -158,9 +162,11 @@ class HiQOpenTelemetryContext(object):
         self,
         exporter_type: OtmExporterType = OtmExporterType.JAEGER_THRIFT,
         *args,
+        deferred: bool = False,
         **kwargs,
     ):
         self.exporter_type = exporter_type
+        self.deferred = deferred
         if self.exporter_type in [
             OtmExporterType.JAEGER_THRIFT,
             OtmExporterType.JAEGER_PROTOBUF,
@@ -179,6 +185,8 @@ class HiQOpenTelemetryContext(object):
     def __enter__(self):
         """To enable OpenTelemetry support, you need to set environment variable TRACE_TYPE equal to opentelemetry."""
         os.environ["TRACE_TYPE"] = TRACING_TYPE_OTM
+        if self.deferred:
+            os.environ["HIQ_OTM_DEFERRED"] = "1"
         self.old_get_tracer = HiQOpenTelemetryContext.trace.get_tracer
         HiQOpenTelemetryContext.trace.get_tracer = (
             HiQOpenTelemetryContext.get_tracer_by_name
@@ -189,3 +197,8 @@ class HiQOpenTelemetryContext(object):
     def __exit__(self, exc_type, exc_value, exc_tb):
         HiQOpenTelemetryContext.trace.get_tracer = self.old_get_tracer
         del os.environ["TRACE_TYPE"]
+        if self.deferred:
+            from hiq.otm_export import get_otm_exporter
+
+            get_otm_exporter().flush()
+            del os.environ["HIQ_OTM_DEFERRED"]
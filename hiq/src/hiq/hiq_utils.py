@@ -4,53 +4,167 @@
 # Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
 #
 
+import atexit
 import contextvars
 import gc
+import inspect
 import os
 import re
+import threading
 import time
+from array import array
 from multiprocessing import resource_tracker, shared_memory
 from typing import *
 
-from cachetools import TTLCache, cached
-
 from hiq.constants import *
 from hiq.ddict import ddjson
 from hiq.utils import get_env_bool
 
-DEFAULT_HIQ_STATUS = get_env_bool("HIQ_ENABLED", True)
-HIQ_STATUS_CACHED = get_env_bool("HIQ_STATUS_CACHED", False)
-
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-def __remove_shm_from_resource_tracker():
-    """Monkey-patch multiprocessing.resource_tracker so SharedMemory won't be tracked
+DEFAULT_HIQ_STATUS = get_env_bool("HIQ_ENABLED", True)
 
-    More details at: https://bugs.python.org/issue38119
-    """
-    from multiprocessing import Process, resource_tracker
-    from multiprocessing.shared_memory import SharedMemory
 
-    def fix_register(name, rtype):
-        if rtype == "shared_memory":
-            return
-        return resource_tracker._resource_tracker.register(self, name, rtype)
+class HiQStatusWord(object):
+    """The global HiQ status, mapped into the current process
 
-    resource_tracker.register = fix_register
+    The status lives in a tiny shared memory segment made of two 64-bit words:
+    the status itself and a generation counter which is bumped on every
+    `set_global_hiq_status`. The segment is attached once per process and once
+    more in every forked child, so reading the status is a plain memory load
+    instead of a `shm_open`+`mmap`+`munmap` round trip(~100us) per call. Since
+    every process reads the same page, a new status is visible to all of them
+    on their very next read.
 
-    def fix_unregister(name, rtype):
-        if rtype == "shared_memory":
-            return
-        return resource_tracker._resource_tracker.unregister(self, name, rtype)
+    If the segment cannot be created(no `/dev/shm`, no permission), the status
+    falls back to a process-local word initialized with `default`.
 
-    resource_tracker.unregister = fix_unregister
+    Setting the status takes an exclusive `flock` on the segment, so the
+    generation bumps of concurrent setters in different processes are not lost.
+    """
 
-    if "shared_memory" in resource_tracker._CLEANUP_FUNCS:
-        del resource_tracker._CLEANUP_FUNCS["shared_memory"]
+    def __init__(self, name="hiq", default=DEFAULT_HIQ_STATUS):
+        self.name = name
+        self.default = default
+        self.shm = None
+        self.words = None
+        self.pid = None
+        # the threads of this process share the fd, and so its flock
+        self.lock = threading.Lock()
+
+    @property
+    def shm_name(self):
+        return f"{self.name}{HIQ_STATUS_SHM_SUFFIX}"
+
+    def attach(self):
+        """map the status segment, creating it with the default status if needed"""
+        shm = None
+        try:
+            try:
+                shm = shared_memory.SharedMemory(name=self.shm_name)
+            except FileNotFoundError:
+                try:
+                    shm = shared_memory.SharedMemory(
+                        name=self.shm_name, create=True, size=HIQ_STATUS_SHM_SIZE
+                    )
+                    words = shm.buf[:HIQ_STATUS_SHM_SIZE].cast("q")
+                    words[HIQ_STATUS_IDX_ON] = int(bool(self.default))
+                    words[HIQ_STATUS_IDX_GEN] = 0
+                    words.release()
+                except FileExistsError:
+                    # another process won the race to create it
+                    shm = shared_memory.SharedMemory(name=self.shm_name)
+            # the segment must outlive this process: https://bugs.python.org/issue38119
+            try:
+                resource_tracker.unregister(shm._name, "shared_memory")
+            except Exception:
+                pass
+            self.words = shm.buf[:HIQ_STATUS_SHM_SIZE].cast("q")
+            self.shm = shm
+        except (PermissionError, OSError, ValueError):
+            if shm is not None:
+                shm.close()
+            self.shm = None
+            self.words = memoryview(array("q", [int(bool(self.default)), 0]))
+        self.pid = os.getpid()
+        return self.words
+
+    def detach(self):
+        """unmap the status segment. The next access maps it again."""
+        words, shm = self.words, self.shm
+        self.words = self.shm = None
+        if words is not None:
+            words.release()
+        if shm is not None:
+            try:
+                shm.close()
+            except BufferError:
+                pass
+
+    def is_on(self) -> bool:
+        words = self.words
+        if words is None:
+            words = self.attach()
+        return words[HIQ_STATUS_IDX_ON] != 0
+
+    def generation(self) -> int:
+        words = self.words
+        if words is None:
+            words = self.attach()
+        return words[HIQ_STATUS_IDX_GEN]
+
+    def set(self, on) -> int:
+        """set the status and bump the generation. Returns the new generation."""
+        words = self.words
+        if words is None:
+            words = self.attach()
+        with self.lock:
+            fd = getattr(self.shm, "_fd", -1) if fcntl is not None else -1
+            if fd >= 0:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                words[HIQ_STATUS_IDX_ON] = int(bool(on))
+                words[HIQ_STATUS_IDX_GEN] += 1
+                return words[HIQ_STATUS_IDX_GEN]
+            finally:
+                if fd >= 0:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+_status_words: Dict[str, HiQStatusWord] = {}
+
+
+def get_status_word(name="hiq", default=DEFAULT_HIQ_STATUS) -> HiQStatusWord:
+    w = _status_words.get(name)
+    if w is None:
+        w = _status_words.setdefault(name, HiQStatusWord(name, default))
+    return w
+
+
+def _remap_status_words():
+    # the child inherits the parent's mapping; drop it and attach lazily on its own
+    for w in _status_words.values():
+        w.detach()
+
+
+def _release_status_words():
+    for w in _status_words.values():
+        w.detach()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_remap_status_words)
+atexit.register(_release_status_words)
 
 
 def set_global_hiq_status(on=True, name="hiq", debug=False):
     """Set the global HiQ status. True is to enable HiQ, and False disable.
 
+    The new status takes effect in every process on the machine at their next traced call.
+
     >>> import hiq
     >>> hiq.get_global_hiq_status()
     True
@@ -59,27 +173,19 @@ def set_global_hiq_status(on=True, name="hiq", debug=False):
     >>> hiq.get_global_hiq_status()
     False
     """
-    try:
-        c = shared_memory.ShareableList(name=name)
-        c[0] = on
-        if debug:
+    w = get_status_word(name)
+    w.set(on)
+    if debug:
+        if w.shm is not None:
             print(f"😇 set global hiq to {on}")
-    except FileNotFoundError:
-        __remove_shm_from_resource_tracker()
-        c = shared_memory.ShareableList([on], name=name)
-        resource_tracker.unregister(name, "shared_memory")
-        if debug:
-            print(f"😤 set global hiq to {on}")
-    except PermissionError as e:
-        return False
-    except Exception as e:
-        raise e
+        else:
+            print(f"😤 set hiq to {on} in process {os.getpid()} only")
 
 
 def get_global_hiq_status(name="hiq", default=DEFAULT_HIQ_STATUS) -> bool:
     """Get the global HiQ status. True means HiQ is enabled, and False disabled.
 
-    When `HIQ_STATUS_CACHED` is set as True, the global hiq status will be cached for 5 seconds. Otherwise, it will read shared memory.
+    The status segment is mapped once per process, so this is a memory read(tens of nanoseconds).
 
     >>> import hiq
     >>> hiq.get_global_hiq_status()
@@ -89,35 +195,22 @@ def get_global_hiq_status(name="hiq", default=DEFAULT_HIQ_STATUS) -> bool:
     >>> hiq.get_global_hiq_status()
     True
     """
-    if HIQ_STATUS_CACHED:
-        return _get_global_hiq_on_cached(name, default)
-    return _get_global_hiq_on(name, default)
-
+    w = _status_words.get(name)
+    if w is None:
+        w = get_status_word(name, default)
+    words = w.words
+    if words is None:
+        words = w.attach()
+    return words[HIQ_STATUS_IDX_ON] != 0
 
-# cache data for no longer than 2 minutes
-@cached(cache=TTLCache(maxsize=1024, ttl=GLOBAL_HIQ_TTL_S))
-def _get_global_hiq_on_cached(name="hiq", default=DEFAULT_HIQ_STATUS):
-    """
-    time cost: 102.04315185546875 us.
-    """
-    try:
-        return bool(shared_memory.ShareableList(name=name)[0])
-    except FileNotFoundError as e:
-        return default
-    except Exception as e:
-        raise e
 
+def get_global_hiq_generation(name="hiq") -> int:
+    """Get the generation of the global HiQ status
 
-def _get_global_hiq_on(name="hiq", default=DEFAULT_HIQ_STATUS):
-    """
-    time cost: 102.04315185546875 us.
+    The generation is increased by one on every `set_global_hiq_status`, so a
+    caller can cheaply tell whether the status has changed since it last looked.
     """
-    try:
-        return bool(shared_memory.ShareableList(name=name)[0])
-    except (FileNotFoundError, PermissionError) as e:
-        return default
-    except Exception as e:
-        raise e
+    return get_status_word(name).generation()
 
 
 class HiQStatusContext(object):
@@ -319,7 +412,7 @@ def call_decorated(f: Callable, args=None, kwargs=None, tracing_type=TRACING_TYP
     HIQ is to build the HiQTree and then output or send to agent.
     OCI is to collect span and send data to OCI APM server.
 
-    HIQ is the default way for monolithic application. OCI APM sends data in the same thread so it has longer latency but it is better for distributed applications.
+    HIQ is the default way for monolithic application. OCI APM is better for distributed applications; its spans are posted in batches by a background thread.
 
     """
     if not args:
@@ -336,7 +429,7 @@ def call_decorated(f: Callable, args=None, kwargs=None, tracing_type=TRACING_TYP
             span_name=f.__name__,
         ):
             return f(*args, **kwargs)
-    elif tracing_type == TRACING_TYPE_OTM:
+    elif tracing_type == TRACING_TYPE_OTM and not get_env_bool("HIQ_OTM_DEFERRED"):
         from opentelemetry import trace
 
         tracer_name = os.environ.get("OTM_TRACER_NAME", "otm_hiq")
@@ -344,15 +437,67 @@ def call_decorated(f: Callable, args=None, kwargs=None, tracing_type=TRACING_TYP
         with tracer.start_as_current_span(f.__name__):
             return f(*args, **kwargs)
     elif tracing_type == TRACING_TYPE_PROM:
-        from hiq.prometheus import get_summary
+        from hiq.prometheus import get_default_conf
 
-        with get_summary(f.__name__).time():
+        with get_default_conf().timer(f.__name__)():
             return f(*args, **kwargs)
 
     else:
         return f(*args, **kwargs)
 
 
+def get_decorated_caller(
+    f: Callable, tracing_type=TRACING_TYPE_HIQ, span_name=None, prometheus=None
+) -> Callable:
+    """Resolve `call_decorated` for one function ahead of time
+
+    The returned callable takes the same arguments as `f`. The tracing type and
+    everything derived from it are looked up once here instead of on every call.
+    For HIQ tracing type, `f` itself is returned. For a coroutine function, the
+    returned callable is a coroutine function too and the span covers the awaited
+    work. `prometheus` is the `hiq.prometheus.PrometheusConf` of the driver, the
+    one from the env variables if it is None.
+    """
+    if span_name is None:
+        span_name = f.__name__
+    if tracing_type == TRACING_TYPE_OCI:
+        from py_zipkin.zipkin import zipkin_span
+
+        service_name = os.environ.get("SERVICE_NAME", "hiq")
+        span = lambda: zipkin_span(service_name=service_name, span_name=span_name)
+    elif tracing_type == TRACING_TYPE_OTM:
+        if get_env_bool("HIQ_OTM_DEFERRED"):
+            # the spans are built from the tree, see `hiq.otm_export`
+            return f
+        from opentelemetry import trace
+
+        tracer_name = os.environ.get("OTM_TRACER_NAME", "otm_hiq")
+        # `get_tracer` is memoized by `HiQOpenTelemetryContext`
+        span = lambda: trace.get_tracer(tracer_name).start_as_current_span(span_name)
+    elif tracing_type == TRACING_TYPE_PROM:
+        if prometheus is None:
+            from hiq.prometheus import get_default_conf
+
+            prometheus = get_default_conf()
+        span = prometheus.timer(span_name)
+    else:
+        return f
+
+    if inspect.iscoroutinefunction(f):
+
+        async def __async_span(*args, **kwargs):
+            with span():
+                return await f(*args, **kwargs)
+
+        return __async_span
+
+    def __span(*args, **kwargs):
+        with span():
+            return f(*args, **kwargs)
+
+    return __span
+
+
 SERVER_NAME = "flask"
 flask_dependency_ok = True
 
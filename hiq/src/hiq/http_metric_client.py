@@ -4,12 +4,17 @@
 # Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
 #
 
+import atexit
+import gzip
 import os
 import json
+import random
 import syslog
+import threading
 import time
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
 from hiq.utils import read_file
 import queue
 
@@ -25,7 +30,7 @@ urllib3.disable_warnings(urllib3.exceptions.SecurityWarning)
 import datetime
 
 
-def __emit_log(sev, msg):
+def _emit_log(sev, msg):
     """
     Emit a log to stdout. sev should be a syslog error level; msg can be any
     text string.
@@ -38,6 +43,16 @@ class HttpMetricsClient(object):
     HttpMetricsClient is a generic class for transmitting metrics to any metrics server by HTTP
 
     This includes the config needed to create and submit metrics, along with the requests.Session we use to send the data.
+    The session keeps the connections to the server alive, so only the first submit
+    pays for the TCP and TLS handshakes. The metrics are sent in batches of at
+    most `max_batch` points and `max_batch_bytes` bytes of JSON, gzip-compressed
+    with `compress` if the server accepts `Content-Encoding: gzip`. A
+    batch which fails on a connection error, a timeout, 429 or 5xx is retried up to
+    `retries` times, after an exponential backoff with jitter.
+
+    With `flush_interval`, a background thread drains `metrics_queue` and submits
+    it every `flush_interval` seconds, and `close()`, which is also called at exit,
+    submits what is left.
 
     Examples:
 
@@ -56,6 +71,10 @@ class HttpMetricsClient(object):
         client.gauge_metric("operation_retry_count", retry_count)
         client.submit_metrics_queue()
 
+        # or let a background thread submit them every 10 seconds
+        client = Client(url=..., flush_interval=10)
+        client.gauge_metric("operation_retry_count", retry_count)
+
     """
 
     @staticmethod
@@ -79,6 +98,14 @@ class HttpMetricsClient(object):
         trusted_cert=None,
         project="hiq",
         timeout=5,
+        flush_interval=None,
+        max_batch=500,
+        max_batch_bytes=1 << 20,
+        compress=False,
+        retries=3,
+        backoff=0.5,
+        max_backoff=30.0,
+        pool_size=4,
     ):
         """Constructor
 
@@ -87,6 +114,14 @@ class HttpMetricsClient(object):
             ad_longform: the long-form name of the availability domain of the style like `eu-frankfurt-ad-1`
             metrics_queue: a Python queue.Queue object used for queuing metrics
             trusted_cert: The filename of the root certificate for authenticating the server, if needed
+            flush_interval: submit the metrics queue every `flush_interval` seconds from a background thread, if set
+            max_batch: the max number of metrics in one request
+            max_batch_bytes: the max size of the JSON of the metrics in one request, before compression
+            compress: send the requests gzip-compressed, only for a server which accepts it
+            retries: the max number of retries of a failed request
+            backoff: the base of the exponential backoff between retries, in seconds
+            max_backoff: the max backoff between retries, in seconds
+            pool_size: the number of connections kept alive by the session
         """
         self.conf = {}
         self.conf["hostname"] = read_file("/etc/hostname", by_line=False, strip=True)
@@ -100,28 +135,87 @@ class HttpMetricsClient(object):
         self.trusted_cert = trusted_cert if os.path.exists(trusted_cert) else None
         self.timeout = timeout
         self.project = project
+        self.max_batch = max_batch
+        self.max_batch_bytes = max_batch_bytes
+        self.compress = compress
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # requests and metrics sent, retried and given up
+        self.stats = {"requests": 0, "metrics": 0, "retries": 0, "failed": 0}
+        self.flush_interval = flush_interval
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="hiq-metrics-flusher", daemon=True
+            )
+            self._flusher.start()
+            atexit.register(self.close)
 
-    def timing_metric_data(self, metric_data):
+    def timing_metric_data(self, metric_data) -> bool:
         """Send a list of metrics server
 
         :param metric_data list of metrics
+        :return: True if all the metrics have been accepted by the server
         """
-        info = self.wrap_metric_data(metric_data=metric_data)
+        ok = True
+        for batch in self._batches(metric_data):
+            ok = self._send(self.wrap_metric_data(metric_data=batch)) and ok
+        return ok
 
-        try:
-            resp = requests.put(
-                f'{self.conf["url"]}aggregation',
-                timeout=self.timeout,
-                json=info,
-                verify=self.trusted_cert,
-            )
-        except requests.exceptions.ConnectionError as err:
-            __emit_log(syslog.LOG_ERR, f"network connection error: {err}")
-        else:
-            if resp.status_code < 200 or resp.status_code >= 300:
-                __emit_log(
-                    syslog.LOG_ERR, f"server status error: {resp} {info} {resp.text}"
+    def _batches(self, metric_data):
+        """split `metric_data` into lists within `max_batch` and `max_batch_bytes`"""
+        batch, size = [], 0
+        for m in metric_data:
+            n = len(json.dumps(m)) + 1
+            if batch and (len(batch) >= self.max_batch or size + n > self.max_batch_bytes):
+                yield batch
+                batch, size = [], 0
+            batch.append(m)
+            size += n
+        if batch:
+            yield batch
+
+    def _send(self, info) -> bool:
+        """PUT `info` to the server, with retries"""
+        body = json.dumps(info).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.compress:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        url = f'{self.conf["url"]}aggregation'
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                cap = min(self.max_backoff, self.backoff * (1 << (attempt - 1)))
+                # jitter, so that clients do not retry in lockstep
+                time.sleep(random.uniform(cap / 2, cap))
+            try:
+                resp = self.session.put(
+                    url,
+                    data=body,
+                    headers=headers,
+                    timeout=self.timeout,
+                    verify=self.trusted_cert,
                 )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                error = f"network connection error: {err}"
+                continue
+            self.stats["requests"] += 1
+            if 200 <= resp.status_code < 300:
+                self.stats["metrics"] += len(info["metrics"])
+                return True
+            error = f"server status error: {resp} {resp.text}"
+            if resp.status_code != 429 and resp.status_code < 500:
+                break
+        self.stats["failed"] += len(info["metrics"])
+        _emit_log(syslog.LOG_ERR, f"{error}, {len(info['metrics'])} metrics dropped")
+        return False
 
     def wrap_metric_data(self, metric_data) -> dict:
         """
@@ -143,7 +237,7 @@ class HttpMetricsClient(object):
 
     def submit_metrics_queue(self):
         """drain metrics_queue and submit the metrics to server"""
-        metric_data = list(self.metrics_queue.queue)
+        metric_data = self._drain()
         if not metric_data:
             msg = "metric_data must not be empty!"
             raise ValueError(msg)
@@ -152,6 +246,41 @@ class HttpMetricsClient(object):
         # __emit_log(syslog.LOG_DEBUG,
         #          f'json: {json.dumps(self.wrap_metric_data(metric_data))}')
 
+    def _drain(self) -> list:
+        """take the metrics in metrics_queue"""
+        metric_data = []
+        try:
+            while True:
+                metric_data.append(self.metrics_queue.get_nowait())
+        except queue.Empty:
+            pass
+        return metric_data
+
+    def flush(self) -> bool:
+        """submit the metrics in metrics_queue, if any
+
+        :return: True if all the metrics have been accepted by the server
+        """
+        metric_data = self._drain()
+        return self.timing_metric_data(metric_data) if metric_data else True
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                _emit_log(syslog.LOG_ERR, f"failed to submit metrics: {e}")
+
+    def close(self):
+        """stop the background thread, submit what is left and release the connections"""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._flusher:
+            self._flusher.join(self.timeout)
+        self.flush()
+        self.session.close()
+
     def gauge_metric(self, metric, value):
         """emit a gauge metric with the given name and value."""
         metric_data = {
@@ -176,7 +305,7 @@ class HttpMetricsClient(object):
         """
         method for mock metrics server API during testing, not applicable to prod
         """
-        resp = requests.get(
+        resp = self.session.get(
             f'{self.conf["url"]}{query}',
             params=params,
             timeout=self.timeout,
@@ -4,9 +4,21 @@
 # Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
 #
 
+import atexit
 import os
-from multiprocessing import Process, Queue, Lock
-from hiq.utils import _check_overhead, get_env_bool, ensure_folder, get_home
+import sys
+import threading
+import traceback
+from collections import deque
+from multiprocessing import Event, Process, Lock
+from typing import Dict, List, Tuple, Union
+from hiq.constants import KEY_EXC_SUM, KEY_LATENCY
+from hiq.overflow import Overflow, export_stats, offer
+from hiq.shm_ring import CODECS, SLOT_HEAD, ShmRing, append_record, decode_frame, frame_of
+from hiq.span_store import SPAN_KEY_SEP, SpanStore, span_key, split_span_key, tree_span
+from hiq.tree import Tree
+from hiq.utils import _check_overhead, get_env_bool, get_env_int, ensure_folder, get_home
+from hiq.zipkin_json import encode_tree
 import time
 
 
@@ -54,6 +66,18 @@ def log_jack_rotated(
     return app_log
 
 
+def _literal_exceptions(tree):
+    """replace the exceptions in the extras of `tree` by their repr, so its text
+    can be read back by `Tree`"""
+    stk = [tree.root]
+    while stk:
+        n = stk.pop()
+        extra = n.extra
+        if extra and isinstance(extra.get(KEY_EXC_SUM), BaseException):
+            n.extra = {**extra, KEY_EXC_SUM: repr(extra[KEY_EXC_SUM])}
+        stk.extend(n.nodes)
+
+
 def get_kafka():
     if get_env_bool("HIQ_OCI_STREAMING"):
         from hiq.vendor_oci_streaming import OciStreamingClient
@@ -66,10 +90,37 @@ class Jack(object):
     """Jack is a lumberjack to send trees to remote HiQ server in his own process space
     Jack is disabled by default. To enable it, set env variable JACK=1:
         export JACK=1
+
+    The request thread only queues the forests of evicted requests in memory. A
+    flusher thread formats their trees and batches them into frames, which go to
+    the Jack process through a shared-memory ring(`hiq.shm_ring`). A frame is sent
+    when it reaches `HIQ_JACK_FRAME_KB`(256) KB or is `HIQ_JACK_FRAME_MS`(50) ms
+    old, compressed by `HIQ_JACK_COMPRESS`(none, zlib or zstd). The ring has
+    `HIQ_JACK_RING_MB`(16) MB.
+
+    At most `HIQ_JACK_CAPACITY`(10000) trees wait for the flusher, the overflow
+    policy is `HIQ_JACK_OVERFLOW`, see `hiq.overflow`. `jack_stats()` gives the
+    counters.
+
+    With `HIQ_JACK_STORE=1`, the Jack process also appends the trees to an
+    indexed store at `HIQ_JACK_STORE_PATH`(~/.hiq/jack_store), where they can
+    be found by request id, root call and time, see `hiq.span_store`.
+
+    With `HIQ_JACK_APM=1`, the Jack process also encodes the latency trees as
+    Zipkin v2 spans(`hiq.zipkin_json`) and ships them to OCI APM in batches,
+    see `hiq.vendor_oci_apm.SpanShipper`.
+
+    With `HIQ_OCI_STREAMING=1`, the Jack process also sends the trees to OCI
+    Streaming, see `hiq.vendor_oci_streaming.OciStreamingClient`. They are
+    counted as exported once they are sent. `close_jack()`, run at exit, waits
+    for the Jack process to send what is left.
+
+    Jack stays with the process which created it, a forked child does not send
+    trees.
     """
 
     @staticmethod
-    def consumer_func(queue, lock):
+    def consumer_func(ring, lock, stop=None):
         if os.cpu_count() >= 2 and os.uname().sysname == "Linux":
             affinity_list = list(os.sched_getaffinity(0))
             os.sched_setaffinity(0, set(affinity_list[len(affinity_list) // 2 :]))
@@ -77,53 +128,226 @@ class Jack(object):
         pid = os.getpid()
         logger = log_jack_rotated()
         kafka_client = get_kafka()
+        store = SpanStore.from_env() if get_env_bool("HIQ_JACK_STORE") else None
+        apm = None
+        if get_env_bool("HIQ_JACK_APM"):
+            from hiq.vendor_oci_apm import get_oci_apm_endpoint, get_span_shipper
+
+            apm = get_span_shipper(get_oci_apm_endpoint())
+        # the trees OCI Streaming has taken or given up on, as counted so far
+        streamed = [0, 0]
+
+        def count_streamed():
+            st = kafka_client.stats()
+            sent, failed = st["sent"], st["failed"] + st["dropped"]
+            ring.ack(exported=sent - streamed[0], failed=failed - streamed[1])
+            streamed[:] = sent, failed
+
         with lock:
             print("🅹 🅰 🅒 Ⓚ {} is started".format(pid))
         while True:
+            slot = ring.take()
+            if slot is None:
+                if kafka_client:
+                    count_streamed()
+                if stop is not None and stop.is_set():
+                    break
+                time.sleep(0.005)
+                continue
+            frame, n = slot
             try:
-                data = queue.get()
-                for key, value in data.items():
-                    """
-                    tree = Tree(value)
-                    itree._itree.consolidate(tree.root)
-                    # tree.show()
-                    data = tree.repr()
-                    """
-                    if logger:
-                        logger.info(key + "," + value)
-                    if kafka_client:
+                records = list(decode_frame(frame))
+                if store:
+                    store.append(records)
+                if apm:
+                    for k, v in records:
+                        key, req_id = split_span_key(k)[:2]
+                        if key == KEY_LATENCY:
+                            apm.put(encode_tree(Tree(v), req_id=req_id or None))
+                if store or apm:
+                    records = [(k.partition(SPAN_KEY_SEP)[0], v) for k, v in records]
+                if logger:
+                    # one log record per frame, still a line per tree in the file
+                    logger.info("\n".join(key + "," + value for key, value in records))
+                if kafka_client:
+                    for key, value in records:
                         kafka_client.produce_messages(key, value)
-                    # with lock:
-                    #    print(k, t)
-                    #    print("🅹 {} got {} {}".format(pid, key, data))
-            except Exception as e:
+            except Exception:
+                # counted as failed, and reported, but Jack goes on
+                ring.ack(failed=n)
+                with lock:
+                    print(f"🦉 Jack failed to export {n} trees", file=sys.stderr)
+                    traceback.print_exc()
                 time.sleep(0.1)
-                print(e)
+            else:
+                # a tree for OCI Streaming is exported once the batcher has sent it
+                ring.ack(exported=0 if kafka_client else len(records))
+        if kafka_client:
+            kafka_client.close()
+            count_streamed()
+        if apm:
+            apm.close()
+        if store:
+            store.close()
 
     def __init__(sf, *args, **kwargs):
         sf.invite_jack = get_env_bool("JACK")
+        # trees the flusher failed to encode
+        sf.jack_enqueued = sf.jack_dropped = sf.jack_failed = 0
+        sf.jack_ring = None
         if not sf.invite_jack:
             sf.queue_jack = sf.consumer = None
             return
-        sf.queue_jack = Queue()
+        codec = os.environ.get("HIQ_JACK_COMPRESS", "none").lower()
+        if codec not in CODECS:
+            raise ValueError(f"🦉 unknown HIQ_JACK_COMPRESS: {codec}")
+        sf.jack_codec = CODECS[codec]
+        sf.jack_frame_bytes = get_env_int("HIQ_JACK_FRAME_KB", 256) << 10
+        sf.jack_frame_age = get_env_int("HIQ_JACK_FRAME_MS", 50) / 1000
+        # the store and the APM export need the request id and time of the trees
+        sf.jack_span_keys = get_env_bool("HIQ_JACK_STORE") or get_env_bool("HIQ_JACK_APM")
+        sf.queue_jack = sf.jack_ring = ShmRing(get_env_int("HIQ_JACK_RING_MB", 16) << 20)
+        # (key, tree, request id) waiting for the flusher, appended by the request threads
+        sf.jack_pending = deque()
+        sf.jack_overflow = Overflow.from_env("jack", 10_000)
+        sf.jack_force = False
+        sf.jack_wake = threading.Event()
         sf.lock = Lock()
-        sf.consumer = Process(target=Jack.consumer_func, args=(sf.queue_jack, sf.lock))
-        # This is critical! The consumer function has an infinite loop
-        # Which means it will never exit unless we set daemon to true
+        sf.jack_stop = Event()
+        sf.consumer = Process(
+            target=Jack.consumer_func, args=(sf.queue_jack, sf.lock, sf.jack_stop)
+        )
+        # This is critical! The consumer function loops until `close_jack()`
+        # Which may never be called, so we set daemon to true
         sf.consumer.daemon = True
         sf.consumer.start()
+        sf.jack_flusher = threading.Thread(
+            target=sf._jack_flush_loop, name="hiq-jack-flusher", daemon=True
+        )
+        sf.jack_flusher.start()
+        sf.jack_pid = os.getpid()
+        atexit.register(sf.close_jack)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=sf._jack_after_fork)
+
+    def _jack_after_fork(sf):
+        """Jack stays with the process which created it, the ring has a single
+        producer: a forked child does not send trees"""
+        if sf.queue_jack is None:
+            return
+        # the stop event and the Jack process are the parent's
+        sf.queue_jack = sf.jack_ring = sf.consumer = sf.jack_stop = None
+        sf.jack_pending = deque()
+        sf.jack_enqueued = sf.jack_dropped = sf.jack_failed = 0
 
     def __del__(sf):
         if sf.consumer:
             sf.consumer.join()
 
     @_check_overhead
-    def send_trees_to_jack(sf, d: dict, debug=False):
+    def send_trees_to_jack(sf, d: Union[dict, List[dict], List[Tuple]], debug=False):
+        """send the trees of one request, or of a batch of requests given as
+        forests or as (request id, forest)"""
         if not sf.queue_jack:
             if debug:
                 print("Jack is working")
             return
-        data = {}
-        for k, val in d.items():
-            data[k] = val.repr()
-        sf.queue_jack.put_nowait(data)
+        items = []
+        for f in d if isinstance(d, list) else [d]:
+            req_id, f = f if isinstance(f, tuple) else (None, f)
+            items.extend((k, tree, req_id) for k, tree in f.items())
+        sf.jack_enqueued += len(items)
+        if len(sf.jack_pending) + len(items) > sf.jack_overflow.capacity:
+            sf.jack_wake.set()
+        sf.jack_dropped += offer(sf.jack_pending, items, sf.jack_overflow)
+
+    def jack_stats(sf) -> Dict[str, int]:
+        """the counters of Jack in trees: enqueued, dropped, exported, failed and depth"""
+        return export_stats(sf.jack_enqueued, sf.jack_dropped, sf.jack_ring, sf.jack_failed)
+
+    def flush_jack(sf, timeout=5.0) -> bool:
+        """send the pending trees now, and wait until the Jack process has taken them
+
+        Returns:
+            bool: False if it timed out.
+        """
+        ring = sf.queue_jack
+        if not ring or os.getpid() != sf.jack_pid:
+            return True
+        deadline = time.monotonic() + timeout
+        sf.jack_force = True
+        sf.jack_wake.set()
+        while sf.jack_force or sf.jack_pending or ring.pending():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def close_jack(sf, timeout=15.0):
+        """flush the pending trees, wait for the Jack process to send them and stop,
+        and release the ring"""
+        if not sf.queue_jack or os.getpid() != sf.jack_pid:
+            return
+        sf.flush_jack()
+        ring, sf.queue_jack = sf.queue_jack, None
+        sf.jack_wake.set()
+        sf.jack_flusher.join(1)
+        sf.jack_stop.set()
+        sf.consumer.join(timeout)
+        ring.close()
+
+    def _jack_flush_loop(sf):
+        pending, wake = sf.jack_pending, sf.jack_wake
+        buf, since, n = bytearray(), 0.0, 0
+        while sf.queue_jack:
+            wake.wait(sf.jack_frame_age)
+            wake.clear()
+            force = sf.jack_force
+            while pending:
+                if not buf:
+                    since = time.monotonic()
+                try:
+                    key, tree, req_id = pending.popleft()
+                except IndexError:
+                    # dropped by the overflow policy meanwhile
+                    break
+                try:
+                    if sf.jack_span_keys:
+                        key = span_key(key, req_id, *tree_span(tree, key == KEY_LATENCY))
+                    text = tree.repr()
+                    if KEY_EXC_SUM in text:
+                        _literal_exceptions(tree)
+                        text = tree.repr()
+                    append_record(buf, key, text)
+                except Exception:
+                    # counted as failed, and reported, but the flusher goes on
+                    sf.jack_failed += 1
+                    print(f"🦉 Jack failed to encode the tree of {key}", file=sys.stderr)
+                    traceback.print_exc()
+                    continue
+                n += 1
+                if len(buf) >= sf.jack_frame_bytes:
+                    sf._put_jack_frame(buf, n)
+                    buf, n = bytearray(), 0
+            if buf and (force or time.monotonic() - since >= sf.jack_frame_age):
+                sf._put_jack_frame(buf, n)
+                buf, n = bytearray(), 0
+            if force:
+                sf.jack_force = False
+
+    def _put_jack_frame(sf, payload: bytearray, n: int):
+        """put a frame of `n` trees into the ring, wait while the Jack process
+        makes room"""
+        frame = frame_of(payload, sf.jack_codec)
+        ring = sf.queue_jack
+        if ring is None:
+            return
+        if len(frame) + SLOT_HEAD > ring.capacity:
+            print(f"🦉 a Jack frame of {len(frame)} bytes is larger than the ring, dropped")
+            sf.jack_dropped += n
+            return
+        while not ring.put(frame, n):
+            if sf.queue_jack is None:
+                return
+            time.sleep(0.001)
+        sf.jack_overflow.progress()
@@ -0,0 +1,275 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+"""Buffered start and end events of Log Monkey King
+
+Every thread appends its events to its own deque, as fixed-layout tuples:
+
+    (tree id, node name, value, extra, is_start, timestamp in ns)
+
+A flusher thread drains them and packs them into frames, which are sent to the
+LMK process through a `hiq.shm_ring.ShmRing`. The payload of a frame holds the
+events by column and its own tag table, so it can be decoded alone, e.g. from a
+binary LMK file:
+
+    payload := n_events:u32 n_tags:u32 extras_len:u32
+               (tid_len:u16 name_len:u16 tid name)*       # tag i
+               tag:u32[n] flags:u8[n] ns:i64[n] value:f64[n]
+               extras                                     # pickle of [(event index, extra)]
+
+Numbers are little endian. Only non-empty extras are pickled.
+"""
+
+import json
+import pickle
+import struct
+import sys
+import threading
+from array import array
+from collections import deque
+from time import time_ns
+from typing import Iterator, List, Tuple
+
+from hiq.overflow import OVERFLOW_DROP_OLDEST, Overflow
+from hiq.shm_ring import _u32, payload_of
+
+FLAG_START = 1
+
+_head = struct.Struct("<III")
+_tag_head = struct.Struct("<HH")
+_BIG_ENDIAN = sys.byteorder == "big"
+
+# (tree id, node name, value, extra, is_start, ns)
+Event = Tuple[str, str, float, dict, bool, int]
+
+
+def _ignore(*args):
+    pass
+
+
+class EventBuffer(object):
+    """Per-thread append-only buffers of LMK events
+
+    `Tree.start()` and `Tree.end()` call `add()` on the request thread, which
+    only appends a tuple to the deque of the thread. `drain()` is called by the
+    flusher thread.
+
+    Args:
+        overflow (Overflow, optional): the bound of the deque of each thread. Defaults to 100k events, dropping the oldest.
+    """
+
+    def __init__(sf, overflow: Overflow = None):
+        sf.local = threading.local()
+        # (thread, deque, [dropped]) of every thread which has added events
+        sf.buffers = []
+        sf.lock = threading.Lock()
+        sf.overflow = overflow if overflow else Overflow(100_000)
+        # events taken by drain(), and dropped by threads which have ended or
+        # after drain()
+        sf.drained = sf.dropped = 0
+
+    def add(sf, tid: str, name: str, value: float, extra: dict, is_start: bool):
+        try:
+            events = sf.local.events
+        except AttributeError:
+            events = sf._register()
+        if len(events) >= sf.overflow.capacity and not sf._make_room(events):
+            return
+        events.append((tid, name, value, extra, is_start, time_ns()))
+
+    def close(sf):
+        """forget the buffered events, and ignore the ones added from now on, e.g.
+        in a forked child, where no flusher drains them"""
+        sf.add = _ignore
+        sf.local = threading.local()
+        sf.lock = threading.Lock()
+        sf.buffers = []
+
+    def _make_room(sf, events: deque) -> bool:
+        """apply the overflow policy to the full deque of this thread, False if
+        the new event is dropped"""
+        overflow, dropped = sf.overflow, sf.local.dropped
+        if overflow.wait(events):
+            return True
+        dropped[0] += 1
+        if overflow.policy != OVERFLOW_DROP_OLDEST:
+            return False
+        try:
+            events.popleft()
+        except IndexError:
+            # drained meanwhile, so the oldest was not dropped
+            dropped[0] -= 1
+        return True
+
+    def _register(sf) -> deque:
+        events = sf.local.events = deque()
+        dropped = sf.local.dropped = [0]
+        with sf.lock:
+            sf.buffers.append((threading.current_thread(), events, dropped))
+        return events
+
+    def __len__(sf) -> int:
+        return sum(len(events) for _, events, _ in sf.buffers)
+
+    def counts(sf) -> Tuple[int, int]:
+        """the number of events (enqueued, dropped) so far"""
+        with sf.lock:
+            buffers = list(sf.buffers)
+        dropped = sum(d[0] for _, _, d in buffers) + sf.dropped
+        return sf.drained + sum(len(e) for _, e, _ in buffers) + dropped, dropped
+
+    def __bool__(sf):
+        # `if tree.queue_lmk:` must not depend on the number of buffered events
+        return True
+
+    def drain(sf) -> List[Event]:
+        """take the buffered events of all threads, and forget the threads which
+        have ended"""
+        r = []
+        with sf.lock:
+            buffers = list(sf.buffers)
+        for entry in buffers:
+            thread, events, dropped = entry
+            # popleft is atomic against append of the owner thread
+            try:
+                for _ in range(len(events)):
+                    r.append(events.popleft())
+            except IndexError:
+                # the owner thread dropped the oldest meanwhile
+                pass
+            if not events and not thread.is_alive():
+                with sf.lock:
+                    sf.buffers.remove(entry)
+                    sf.dropped += dropped[0]
+        sf.drained += len(r)
+        return r
+
+
+def encode_events(events: List[Event]) -> bytes:
+    """the payload of a frame of `events`"""
+    tags, tag_bytes = {}, bytearray()
+    ids = array("I")
+    flags = bytearray()
+    ns = array("q")
+    values = array("d")
+    extras = []
+    for i, (tid, name, value, extra, is_start, t) in enumerate(events):
+        k = tags.get((tid, name))
+        if k is None:
+            k = tags[(tid, name)] = len(tags)
+            a, b = tid.encode("utf-8"), name.encode("utf-8")
+            tag_bytes += _tag_head.pack(len(a), len(b))
+            tag_bytes += a
+            tag_bytes += b
+        ids.append(k)
+        flags.append(FLAG_START if is_start else 0)
+        ns.append(t)
+        values.append(value)
+        if extra:
+            extras.append((i, extra))
+    if _BIG_ENDIAN:
+        for col in (ids, ns, values):
+            col.byteswap()
+    x = _pickle_extras(extras) if extras else b""
+    return b"".join(
+        (
+            _head.pack(len(events), len(tags), len(x)),
+            tag_bytes,
+            ids.tobytes(),
+            flags,
+            ns.tobytes(),
+            values.tobytes(),
+            x,
+        )
+    )
+
+
+def _pickle_extras(extras: List[Tuple[int, dict]]) -> bytes:
+    """pickle `extras`, with `repr()` of the values which can not be pickled,
+    like an exception holding a lock"""
+    try:
+        return pickle.dumps(extras, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        pass
+    safe = []
+    for i, extra in extras:
+        try:
+            pickle.dumps(extra, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            extra = {k: _picklable(v) for k, v in extra.items()}
+        safe.append((i, extra))
+    return pickle.dumps(safe, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _picklable(v):
+    try:
+        pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL)
+        return v
+    except Exception:
+        return repr(v)
+
+
+def decode_events(payload: bytes) -> List[Event]:
+    """the events of a payload made by `encode_events()`"""
+    payload = memoryview(payload)
+    n, n_tags, x_len = _head.unpack_from(payload, 0)
+    i = _head.size
+    tags = []
+    for _ in range(n_tags):
+        a, b = _tag_head.unpack_from(payload, i)
+        i += _tag_head.size
+        tags.append(
+            (str(payload[i : i + a], "utf-8"), str(payload[i + a : i + a + b], "utf-8"))
+        )
+        i += a + b
+    ids, ns, values = array("I"), array("q"), array("d")
+    ids.frombytes(payload[i : i + 4 * n])
+    i += 4 * n
+    flags = bytes(payload[i : i + n])
+    i += n
+    ns.frombytes(payload[i : i + 8 * n])
+    i += 8 * n
+    values.frombytes(payload[i : i + 8 * n])
+    i += 8 * n
+    if _BIG_ENDIAN:
+        for col in (ids, ns, values):
+            col.byteswap()
+    extras = dict(pickle.loads(payload[i : i + x_len])) if x_len else {}
+    return [
+        tags[k] + (values[j], extras.get(j, {}), flags[j] & FLAG_START == FLAG_START, ns[j])
+        for j, k in enumerate(ids)
+    ]
+
+
+def events_to_jsonl(events: List[Event], pid: int) -> str:
+    """JSON lines of `events`, one object per event"""
+    prefixes = {}
+    lines = []
+    for tid, name, value, extra, is_start, t in events:
+        prefix = prefixes.get((tid, name))
+        if prefix is None:
+            prefix = prefixes[(tid, name)] = (
+                f'{{"id":{json.dumps(tid)},"name":{json.dumps(name)},"pid":{pid},'
+            )
+        line = f'{prefix}"start":{"true" if is_start else "false"},"value":{value!r},"ns":{t}'
+        if extra:
+            line += f',"extra":{json.dumps(extra, default=str)}'
+        lines.append(line + "}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def iter_lmk_file(path: str) -> Iterator[Event]:
+    """the events of a binary LMK file, i.e. `HIQ_LMK_FORMAT=binary`"""
+    with open(path, "rb") as f:
+        while True:
+            head = f.read(4)
+            if len(head) < 4:
+                return
+            (size,) = _u32.unpack(head)
+            frame = f.read(size)
+            if len(frame) < size:
+                return
+            yield from decode_events(payload_of(frame))
@@ -4,15 +4,27 @@
 # Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
 #
 
-from hiq.utils import ts_to_dt, get_env_bool, lmk_data_handler
+from hiq.utils import ts_to_dt, get_env_bool, get_env_int, lmk_data_handler
 from hiq.constants import *
+from hiq.lmk_events import EventBuffer, decode_events, encode_events, events_to_jsonl
+from hiq.overflow import Overflow, export_stats
+from hiq.shm_ring import SLOT_HEAD, ShmRing, _u32, frame_of, payload_of
+from typing import Dict
+import atexit
 import os
+import sys
+import threading
 import time
-from multiprocessing import Process, Queue, Lock
+import traceback
+from multiprocessing import Process, Lock
 
 import signal
 import functools
 
+LMK_FORMATS = ("text", "jsonl", "binary")
+# events per frame sent to the LMK process
+LMK_FRAME_EVENTS = 8192
+
 
 # https://www.cloudcity.io/blog/2019/02/27/things-i-wish-they-told-me-about-multiprocessing-in-python/
 class SignalObject:
@@ -48,10 +60,30 @@ def init_signals(shutdown_event, int_handler, term_handler):
 
 
 class LogMonkeyKing(object):
-    """A multi-process Log Monkey"""
+    """A multi-process Log Monkey
+
+    LMK is disabled by default. To enable it, set env variable LMK=1. The request
+    threads append their start and end events to per-thread buffers
+    (`hiq.lmk_events.EventBuffer`), and a flusher thread sends them in frames to
+    the LMK process every `HIQ_LMK_FLUSH_MS`(20) ms, through a shared-memory ring
+    of `HIQ_LMK_RING_MB`(16) MB. The LMK process writes them in the format of
+    `HIQ_LMK_FORMAT`:
+
+        text    a line per event by `lmk_handler`(default `lmk_data_handler`),
+                logged by `lmk_logger` or printed
+        jsonl   a JSON object per event, appended to `lmk_path`, or logged or printed
+        binary  the frames, appended to `lmk_path`, see `hiq.lmk_events.iter_lmk_file`
+
+    A thread buffers at most `HIQ_LMK_CAPACITY`(100000) events, the overflow
+    policy is `HIQ_LMK_OVERFLOW`, see `hiq.overflow`. `lmk_stats()` gives the
+    counters.
+
+    LMK stays with the process which created it, a forked child does not log
+    events.
+    """
 
     @staticmethod
-    def consumer_func(log_queue, lock, lmk_path, lmk_handler, logger):
+    def consumer_func(ring, lock, lmk_path, lmk_handler, logger, fmt="text"):
         if os.cpu_count() >= 2 and os.uname().sysname == "Linux":
             affinity_list = list(os.sched_getaffinity(0))
             os.sched_setaffinity(0, set(affinity_list[len(affinity_list) // 2 :]))
@@ -59,47 +91,119 @@ class LogMonkeyKing(object):
         pid = os.getpid()
         # with lock:
         #    print("process 🐒 {}".format(pid))
-        if lmk_path:
-            if hasattr(logger, "add"):
+        out = None
+        if fmt == "text":
+            if lmk_path and hasattr(logger, "add"):
                 logger.add(lmk_path, rotation="500 MB")
+        elif lmk_path:
+            out = open(lmk_path, "ab" if fmt == "binary" else "a")
+        handler = lmk_handler if lmk_handler else lmk_data_handler
         while True:
-            # If the log_queue is empty, log_queue.get() will block until the log_queue has data
-            data = log_queue.get()
-            if data:
-                if lmk_handler:
-                    data = lmk_handler(data=data, pid=pid)
-                else:
-                    data = lmk_data_handler(data=data, pid=pid)
+            slot = ring.take()
+            if slot is None:
+                if out:
+                    out.flush()
+                time.sleep(0.005)
+                continue
+            frame, n = slot
+            try:
+                events = decode_events(payload_of(frame))
+                LogMonkeyKing._export(frame, events, out, fmt, pid, handler, logger, lock)
+            except Exception:
+                # counted as failed, and reported, but LMK goes on
+                ring.ack(failed=n)
                 with lock:
-                    if logger:
-                        logger.info(data)
-                    else:
-                        print(data)
+                    print(f"🦉 LMK failed to export {n} events", file=sys.stderr)
+                    traceback.print_exc()
+                time.sleep(0.1)
+            else:
+                ring.ack(exported=len(events))
+
+    @staticmethod
+    def _export(frame, events, out, fmt, pid, handler, logger, lock):
+        """write the `events` of `frame` in the LMK process"""
+        if fmt == "binary":
+            out.write(_u32.pack(len(frame)))
+            out.write(frame)
+            return
+        if fmt == "jsonl":
+            lines = events_to_jsonl(events, pid)
+            if out:
+                out.write(lines)
+                return
+            lines = lines.splitlines()
+        else:
+            lines = [
+                handler(
+                    data={
+                        "id_": tid,
+                        "name": name,
+                        "value": value,
+                        "extra": extra,
+                        "is_start": is_start,
+                    },
+                    pid=pid,
+                )
+                for tid, name, value, extra, is_start, _ in events
+            ]
+        with lock:
+            if logger:
+                for data in lines:
+                    logger.info(data)
+            else:
+                print("\n".join(lines))
 
     def __init__(sf, lmk_path=None, lmk_handler=None, lmk_logger=None, *args, **kwargs):
         # to use a cache ttl
         sf.summon_log_monkey_king = get_env_bool("LMK")
+        sf.lmk_ring = None
+        # events the flusher failed to encode
+        sf.lmk_failed = 0
         if not sf.summon_log_monkey_king:
             sf.queue_lmk = sf.consumer = None
             return
-
-        sf.queue_lmk = Queue()
+        fmt = os.environ.get("HIQ_LMK_FORMAT", "text").lower()
+        if fmt not in LMK_FORMATS:
+            raise ValueError(f"🦉 unknown HIQ_LMK_FORMAT: {fmt}")
+        if fmt == "binary" and not lmk_path:
+            raise ValueError("🦉 lmk_path is required by HIQ_LMK_FORMAT=binary")
+        sf.lmk_flush_interval = get_env_int("HIQ_LMK_FLUSH_MS", 20) / 1000
+        sf.lmk_ring = ShmRing(get_env_int("HIQ_LMK_RING_MB", 16) << 20)
+        sf.queue_lmk = sf.lmk_events = EventBuffer(Overflow.from_env("lmk", 100_000))
+        sf.lmk_force = False
+        sf.lmk_wake = threading.Event()
         sf.lock = Lock()
         sf.consumer = Process(
             target=LogMonkeyKing.consumer_func,
-            args=(sf.queue_lmk, sf.lock, lmk_path, lmk_handler, lmk_logger),
+            args=(sf.lmk_ring, sf.lock, lmk_path, lmk_handler, lmk_logger, fmt),
         )
         # This is critical! The consumer function has an infinite loop
         # Which means it will never exit unless we set daemon to true
         sf.consumer.daemon = True
         sf.consumer.start()
+        sf.lmk_flusher = threading.Thread(
+            target=sf._lmk_flush_loop, name="hiq-lmk-flusher", daemon=True
+        )
+        sf.lmk_flusher.start()
+        sf.lmk_pid = os.getpid()
+        atexit.register(sf.close_lmk)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=sf._lmk_after_fork)
+
+    def _lmk_after_fork(sf):
+        """LMK stays with the process which created it, the ring has a single
+        producer: a forked child does not log events"""
+        if sf.queue_lmk is None:
+            return
+        # the trees copied from the parent still hold the buffer
+        sf.lmk_events.close()
+        sf.queue_lmk = sf.lmk_ring = sf.consumer = None
+        sf.lmk_failed = 0
 
     def __del__(sf):
-        sleep_count = 0
         if hasattr(sf, "queue_lmk"):
-            while sf.queue_lmk and sf.queue_lmk.qsize() and sleep_count < 1:
-                time.sleep(2)
-                sleep_count += 1
+            if sf.queue_lmk:
+                sf.flush_lmk(timeout=2)
         else:
             # TODO
             pass
@@ -111,6 +215,75 @@ class LogMonkeyKing(object):
             # TODO
             pass
 
+    def flush_lmk(sf, timeout=5.0) -> bool:
+        """send the buffered events now, and wait until the LMK process has written them
+
+        Returns:
+            bool: False if it timed out.
+        """
+        if not sf.queue_lmk or os.getpid() != sf.lmk_pid:
+            return True
+        deadline = time.monotonic() + timeout
+        sf.lmk_force = True
+        sf.lmk_wake.set()
+        while sf.lmk_force or sf.lmk_ring.pending():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def lmk_stats(sf) -> Dict[str, int]:
+        """the counters of LMK in events: enqueued, dropped, exported, failed and depth"""
+        if sf.lmk_ring is None:
+            return export_stats(0, 0, None)
+        return export_stats(*sf.lmk_events.counts(), sf.lmk_ring, sf.lmk_failed)
+
+    def close_lmk(sf):
+        """flush the buffered events and release the ring"""
+        if not sf.queue_lmk or os.getpid() != sf.lmk_pid:
+            return
+        sf.flush_lmk()
+        sf.queue_lmk = None
+        sf.lmk_wake.set()
+        sf.lmk_flusher.join(1)
+        sf.lmk_ring.close()
+
+    def _lmk_flush_loop(sf):
+        events, wake = sf.queue_lmk, sf.lmk_wake
+        while sf.queue_lmk:
+            wake.wait(sf.lmk_flush_interval)
+            wake.clear()
+            force = sf.lmk_force
+            batch = events.drain()
+            for i in range(0, len(batch), LMK_FRAME_EVENTS):
+                chunk = batch[i : i + LMK_FRAME_EVENTS]
+                try:
+                    payload = encode_events(chunk)
+                except Exception:
+                    # counted as failed, and reported, but the flusher goes on
+                    sf.lmk_failed += len(chunk)
+                    print(f"🦉 LMK failed to encode {len(chunk)} events", file=sys.stderr)
+                    traceback.print_exc()
+                    continue
+                sf._put_lmk_frame(payload, len(chunk))
+            if force:
+                sf.lmk_force = False
+
+    def _put_lmk_frame(sf, payload: bytes, n: int):
+        """put a frame of `n` events into the ring, wait while the LMK process
+        makes room"""
+        frame = frame_of(payload)
+        ring = sf.lmk_ring
+        if len(frame) + SLOT_HEAD > ring.capacity:
+            print(f"🦉 an LMK frame of {len(frame)} bytes is larger than the ring, dropped")
+            sf.lmk_events.dropped += n
+            return
+        while not ring.put(frame, n):
+            if sf.queue_lmk is None:
+                return
+            time.sleep(0.001)
+        sf.lmk_events.overflow.progress()
+
     # def tree_send_log_to_monkey(sf, **kwargs):
     #    sf.queue_lmk.put(kwargs)
 
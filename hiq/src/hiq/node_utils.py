@@ -6,16 +6,14 @@
 
 import ast
 import base64
+import functools
+import re
 
 import itree
 from hiq.node import Node
 from hiq.constants import *
 from hiq.utils import ts_pair_to_dt, memoize
-from typing import Union
-
-
-def __create_tmp_node():
-    return Node("", 0, 0)
+from typing import Iterable, Iterator, Union
 
 
 def _d(n: Node, s: str = ""):
@@ -50,57 +48,87 @@ def str_to_number(x) -> Union[int, float]:
         return x
 
 
-def __parse_node(s):
-    _start, _end, _extra = s.split(",")
+_NUM = r"[-+]?(?:\d+\.?\d*(?:[eE][-+]?\d+)?|inf|nan)"
+# the tokens of the format of `_d`: `{"name":start,end,extra` up to the first
+# child or the end of the node, a run of `}`, white space, or a bad character.
+# The name is the shortest match, so it can have separators.
+_C_TOKEN = re.compile(
+    r'\{"(.*?)":(%s),(%s),([A-Za-z0-9+/=]*)(?=[{}])|(\}+)|\s+|(.)' % (_NUM, _NUM), re.S
+)
+
 
-    if _extra and _extra != "inf":
-        _extra = b64_str_to_dict(_extra)
-    # _extra should be a dictionary
-    if _extra and isinstance(_extra, str) and not is_str_dict(_extra):
-        _extra = {}
-    _sta = str_to_number(_start)
-    _end = str_to_number(_end)
-    if _extra == "":
-        _extra = {}
-    return _sta, _end, _extra
+@functools.lru_cache(maxsize=4096)
+def __b64_extra(s: str) -> dict:
+    try:
+        r = ast.literal_eval(base64.b64decode(s).decode("utf-8"))
+    except Exception:
+        return {}
+    return r if isinstance(r, dict) else {}
 
 
 def _c(bs: str) -> Node:
-    """de-serialize a string to a node"""
+    """de-serialize a string to a node
+
+    One pass of a regex over the string, a node is one token, so the time is
+    linear in its length.
+    """
     if not bs:
         return None
-    stk_ = [itree.create_virtual_node()]
-    s = ""
-    for ch in bs:
-        if ch == "{":
-            if len(stk_) == 1:
-                stk_.append(__create_tmp_node())
-                stk_[0].append(stk_[1])
-            else:
-                if s:
-                    kv = s.split(":")
-                    stk_[-1].name = kv[0][1:-1]
-                    stk_[-1].start, stk_[-1].end, stk_[-1].extra = __parse_node(kv[1])
-                    s = ""
-
-                t = __create_tmp_node()
-                stk_[-1].append(t)
-                stk_.append(t)
-        elif ch == "}":
-            if s:
-                kv = s.split(":")
-                stk_[-1].name = kv[0][1:-1]
-                stk_[-1].start, stk_[-1].end, stk_[-1].extra = __parse_node(kv[1])
-                s = ""
-            if len(stk_) > 1:
-                stk_.pop()
-        else:
-            s += ch
+    new_node = itree._itree.Node
+    stk_ = [itree._itree.create_virtual_node_()]
+    for m in _C_TOKEN.finditer(bs):
+        name, start, end, extra, close, bad = m.groups()
+        if name is not None:
+            # copy the cached extra, a node keeps a reference to its dict
+            n = new_node(name, float(start), float(end), dict(__b64_extra(extra)) if extra else {})
+            stk_[-1].append(n)
+            stk_.append(n)
+        elif close:
+            del stk_[max(1, len(stk_) - len(close)) :]
+        elif bad:
+            raise ValueError(f"🦉 bad tree data at {m.start()}: {bs[m.start():m.start() + 64]}")
     assert len(stk_) == 1, "bad tree data"
     n = itree._itree.consolidate(stk_[0])
     return n
 
 
+def iter_nodes(lines: Iterable[str], with_key=False, strict=False) -> Iterator:
+    """parse the trees of many lines lazily, like the lines of `~/.hiq/log_jack.log`
+
+    A line is `key,` followed by a tree, either in the format of `_d`, or of
+    `Tree.repr()` as Jack writes it now. Lines without a tree are skipped.
+
+    Args:
+        lines (Iterable[str]): the lines, e.g. an open file.
+        with_key (bool, optional): yield `(key, node)` instead of the node. Defaults to False.
+        strict (bool, optional): raise on a bad line instead of skipping it, like a line cut by log rotation. Defaults to False.
+
+    Yields:
+        Node: the root node of the tree of each line.
+    """
+    from hiq.tree import Tree
+
+    for line in lines:
+        i = line.find('{"')
+        j = line.find("t1^", 0, i if i >= 0 else len(line))
+        try:
+            if j >= 0:
+                i = j
+                node = Tree(line[i:].rstrip()).root
+            elif i >= 0:
+                node = _c(line[i:].rstrip())
+            else:
+                continue
+        except Exception:
+            if strict:
+                raise
+            continue
+        if with_key:
+            yield line[:i].split(",", 1)[0], node
+        else:
+            yield node
+
+
 def __peek_tree(node, debug=False):
     """look 2 levels deep to find the meta information of the tree
 
@@ -158,8 +186,9 @@ def _pp_tree(
     _type="float",
     _float_digit=DEFAULT_FLOAT_DIGIT,
     tree_extra=None,
+    marks=None,
 ):
-    """pretty print in tree format"""
+    """pretty print in tree format, `marks` is node -> text added to the node"""
     if not tree_extra:
         tree_extra = {}
     _p = ""
@@ -237,10 +266,14 @@ def _pp_tree(
         if wide_output:
             del node.extra[EXTRA_START_TIME_KEY], node.extra[EXTRA_END_TIME_KEY]
         contents = f"{_node_name}({node.span():6.4f})"  # TODO: no time to do it
-        if node.extra:
-            contents += f" ({str(node.extra)})"
+        # the metric vector of a columnar tree is shown in the views
+        node_extra = {k: v for k, v in node.extra.items() if k != EXTRA_METRICS_KEY}
+        if node_extra:
+            contents += f" ({str(node_extra)})"
     else:
         contents = f"{_node_name}({node.span():6.4f})"
+    if marks:
+        contents += marks.get(node, "")
     if level == 1 and tree_extra:
         # print("🤑" * 40, id(tree_extra))
         overhead_str, tree_extra_str = "", ""
@@ -273,13 +306,16 @@ def _pp_tree(
             wide_output=wide_output,
             value_column_len=value_column_len,
             _type=_type,
+            marks=marks,
         )
 
 
 def concise_dict(d: dict):
     _d = {}
     for k, v in d.items():
-        if isinstance(v, str) and len(v) > 20:
+        if k == EXTRA_METRICS_KEY:
+            pass
+        elif isinstance(v, str) and len(v) > 20:
             _d[k] = "..." + v[-20:]
         elif not v:
             pass
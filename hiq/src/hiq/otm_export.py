@@ -0,0 +1,175 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+"""Deferred OpenTelemetry export of HiQ trees
+
+With `TRACE_TYPE=opentelemetry`, every traced call opens an OpenTelemetry span
+on the request thread. With `HIQ_OTM_DEFERRED=1` too, the traced calls only
+build the HiQ latency tree. When a root call of a request completes, its nodes
+are queued, and a background thread turns them into spans with the start and
+end times of the nodes and the same parent/child links. The spans go through the
+tracer provider set by `hiq.distributed`, so they are exported by its
+`BatchSpanProcessor`.
+
+If a span is current on the request thread when the root call completes, like
+the server span of a web framework, the spans of the call go under it. Otherwise
+every root call is a trace of its own. At most `HIQ_OTM_CAPACITY`(10000) root
+calls wait for the thread, see `hiq.overflow`.
+"""
+
+import atexit
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from opentelemetry import trace
+from opentelemetry.trace import NonRecordingSpan, Status, StatusCode
+
+from hiq.constants import KEY_EXC_SUM, KEY_EXC_TRA
+from hiq.overflow import Overflow, offer
+from hiq.utils import get_env_int
+
+_ATTRIBUTE_TYPES = (str, bool, int, float)
+
+
+def _attribute(v):
+    if isinstance(v, _ATTRIBUTE_TYPES):
+        return v
+    if isinstance(v, (list, tuple)) and v and all(type(i) is type(v[0]) for i in v):
+        if isinstance(v[0], _ATTRIBUTE_TYPES):
+            return list(v)
+    return str(v)
+
+
+def _ns(t: float) -> int:
+    return int(t * 1e9)
+
+
+class OtmTreeExporter(object):
+    """Turn the completed root calls of HiQ latency trees into OpenTelemetry spans
+    on a background thread
+
+    Args:
+        tracer_name (str, optional): the tracer of the spans. Defaults to env variable `OTM_TRACER_NAME` or "otm_hiq".
+        interval (float, optional): the seconds the thread waits for more root calls. Defaults to 0.05.
+    """
+
+    def __init__(sf, tracer_name: str = None, interval: float = 0.05):
+        sf.tracer_name = tracer_name or os.environ.get("OTM_TRACER_NAME", "otm_hiq")
+        sf.interval = interval
+        sf.pending = deque()
+        sf.overflow = Overflow.from_env("otm", 10_000)
+        sf.stats = {"calls": 0, "spans": 0, "dropped": 0, "failed": 0}
+        sf.busy = False
+        sf.closed = False
+        sf.wake = threading.Event()
+        sf.thread = threading.Thread(target=sf._loop, name="hiq-otm-exporter", daemon=True)
+        sf.thread.start()
+
+    def put(sf, req_id, tree):
+        """queue the root calls of `tree` completed since the last call, called
+        when the root call of the request returns, on its thread and in its
+        context, where the span of the request is current"""
+        nodes = tree.root.nodes
+        done = tree.n_exported
+        if len(nodes) <= done:
+            return
+        tree.n_exported = len(nodes)
+        parent = trace.get_current_span().get_span_context()
+        item = (req_id, nodes[done:], parent if parent.is_valid else None)
+        sf.stats["dropped"] += offer(sf.pending, [item], sf.overflow)
+
+    def flush(sf, timeout: float = 5.0) -> bool:
+        """wait until the queued root calls are handed to the tracer provider
+
+        Returns:
+            bool: False if it timed out.
+        """
+        deadline = time.monotonic() + timeout
+        sf.wake.set()
+        while sf.pending or sf.busy:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def close(sf):
+        if sf.closed:
+            return
+        sf.flush()
+        sf.closed = True
+        sf.wake.set()
+        sf.thread.join(1)
+
+    def _loop(sf):
+        pending = sf.pending
+        while not sf.closed:
+            sf.wake.wait(sf.interval)
+            sf.wake.clear()
+            if not pending:
+                continue
+            sf.busy = True
+            tracer = trace.get_tracer(sf.tracer_name)
+            while pending:
+                try:
+                    req_id, nodes, parent = pending.popleft()
+                except IndexError:
+                    break
+                try:
+                    sf.stats["spans"] += sf._export(tracer, req_id, nodes, parent)
+                    sf.stats["calls"] += len(nodes)
+                except Exception:
+                    sf.stats["failed"] += len(nodes)
+                    print("🦉 failed to export hiq tree to opentelemetry", file=sys.stderr)
+                    traceback.print_exc()
+            sf.overflow.progress()
+            sf.busy = False
+
+    @staticmethod
+    def _export(tracer, req_id, nodes, parent) -> int:
+        """start and end the spans of `nodes` and their descendants, return the
+        number of spans"""
+        ctx = trace.set_span_in_context(NonRecordingSpan(parent)) if parent else None
+        stk = [(n, ctx, True) for n in reversed(nodes)]
+        n_spans = 0
+        while stk:
+            n, ctx, is_root = stk.pop()
+            if not (math.isfinite(n.start) and math.isfinite(n.end)):
+                continue
+            attributes = {k: _attribute(v) for k, v in n.extra.items()} if n.extra else {}
+            if is_root and req_id is not None:
+                attributes["hiq.request_id"] = str(req_id)
+            exc = attributes.pop(KEY_EXC_SUM, None)
+            attributes.pop(KEY_EXC_TRA, None)
+            span = tracer.start_span(
+                n.name, context=ctx, start_time=_ns(n.start), attributes=attributes
+            )
+            if exc is not None:
+                span.set_status(Status(StatusCode.ERROR, exc))
+            span.end(end_time=_ns(n.end))
+            n_spans += 1
+            child_ctx = trace.set_span_in_context(span)
+            stk.extend((c, child_ctx, False) for c in reversed(n.nodes))
+        return n_spans
+
+
+__exporter = None
+__exporter_lock = threading.Lock()
+
+
+def get_otm_exporter() -> OtmTreeExporter:
+    """the exporter of this process, created on first use and flushed at exit"""
+    global __exporter
+    if __exporter is None or __exporter.closed:
+        with __exporter_lock:
+            if __exporter is None or __exporter.closed:
+                __exporter = OtmTreeExporter(interval=get_env_int("HIQ_OTM_BATCH_MS", 50) / 1000)
+                atexit.register(__exporter.close)
+    return __exporter
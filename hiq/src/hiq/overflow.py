@@ -0,0 +1,135 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+"""Bounded buffers of the exporters
+
+Jack and LMK keep what they export in memory until their process takes it. If
+that process stalls, on a slow OCI Streaming endpoint or a full disk, the buffer
+would grow without limit, so it is bounded, and a full buffer is handled by the
+policy of the exporter:
+
+    drop_oldest  drop the oldest items to make room for the new ones(default)
+    drop_newest  drop the new items
+    block        wait up to the timeout for room, then drop the new items. After a
+                 timeout, new items are dropped without waiting until the
+                 exporter takes something again
+
+Items are trees for Jack and start or end events for LMK. The counters of an
+exporter are:
+
+    enqueued  items given to the exporter
+    dropped   items dropped by the policy
+    exported  items written out by the exporter process
+    failed    items the exporter failed to encode or its process failed to write
+    depth     items not exported yet, in the buffer or in flight
+"""
+
+import os
+import time
+from collections import deque
+from typing import Dict, List
+
+from hiq.utils import get_env_int
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_BLOCK = "block"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_BLOCK)
+
+
+class Overflow(object):
+    """The bound of a buffer and what to do when it is full
+
+    Args:
+        capacity (int): the max number of items in the buffer.
+        policy (str, optional): one of `OVERFLOW_POLICIES`. Defaults to `OVERFLOW_DROP_OLDEST`.
+        timeout (float, optional): the max seconds to wait with `OVERFLOW_BLOCK`. Defaults to 0.1.
+    """
+
+    __slots__ = ("capacity", "policy", "timeout", "stalled")
+
+    def __init__(sf, capacity: int, policy: str = OVERFLOW_DROP_OLDEST, timeout: float = 0.1):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"🦉 unknown overflow policy: {policy}")
+        if capacity < 1:
+            raise ValueError(f"🦉 capacity must be positive: {capacity}")
+        sf.capacity = capacity
+        sf.policy = policy
+        sf.timeout = timeout
+        # a wait has timed out, and the exporter has not made progress since
+        sf.stalled = False
+
+    @staticmethod
+    def from_env(exporter: str, capacity: int) -> "Overflow":
+        """read `HIQ_<EXPORTER>_CAPACITY`, `HIQ_<EXPORTER>_OVERFLOW` and `HIQ_<EXPORTER>_BLOCK_MS`"""
+        prefix = f"HIQ_{exporter.upper()}"
+        return Overflow(
+            get_env_int(f"{prefix}_CAPACITY", capacity),
+            os.environ.get(f"{prefix}_OVERFLOW", OVERFLOW_DROP_OLDEST).lower(),
+            get_env_int(f"{prefix}_BLOCK_MS", 100) / 1000,
+        )
+
+    def wait(sf, buf, n: int = 1) -> bool:
+        """with `OVERFLOW_BLOCK`, wait until `buf` has room for `n` items"""
+        if sf.policy != OVERFLOW_BLOCK or sf.stalled:
+            return False
+        deadline = time.monotonic() + sf.timeout
+        while len(buf) + n > sf.capacity:
+            if time.monotonic() > deadline:
+                sf.stalled = True
+                return False
+            time.sleep(0.001)
+        return True
+
+    def progress(sf):
+        """the exporter has taken items, so waiting for room makes sense again"""
+        sf.stalled = False
+
+    def __repr__(sf):
+        return f"Overflow(capacity={sf.capacity}, policy={sf.policy}, timeout={sf.timeout})"
+
+
+def offer(buf: deque, items: List, overflow: Overflow) -> int:
+    """append `items` to `buf` within the bound of `overflow`, return the number
+    of items dropped
+
+    Request threads offer concurrently, so `buf` can exceed the capacity by the
+    items of one call per thread.
+    """
+    n = len(items)
+    if len(buf) + n <= overflow.capacity or overflow.wait(buf, n):
+        buf.extend(items)
+        return 0
+    room = max(overflow.capacity - len(buf), 0)
+    if overflow.policy != OVERFLOW_DROP_OLDEST:
+        buf.extend(items[:room])
+        return n - room
+    dropped = 0
+    if n > overflow.capacity:
+        dropped, items = n - overflow.capacity, items[n - overflow.capacity :]
+    try:
+        for _ in range(len(items) - room):
+            buf.popleft()
+            dropped += 1
+    except IndexError:
+        # taken by the flusher meanwhile
+        pass
+    buf.extend(items)
+    return dropped
+
+
+def export_stats(enqueued: int, dropped: int, ring, failed: int = 0) -> Dict[str, int]:
+    """the counters of an exporter whose process acknowledges items on `ring`,
+    `failed` are the items the producer failed to encode"""
+    exported, n = ring.items() if ring is not None else (0, 0)
+    failed += n
+    return {
+        "enqueued": enqueued,
+        "dropped": dropped,
+        "exported": exported,
+        "failed": failed,
+        "depth": enqueued - dropped - exported - failed,
+    }
@@ -0,0 +1,112 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+"""Tracing overhead accounting
+
+The overhead of every traced call is added in nanoseconds(`perf_counter_ns`)
+to the counters of its tag. With stages on, it is split by stage too:
+
+    status  the status word and the sampling check of the request
+    id      the request id function and the sampling decision
+    tree    finding or creating the trees of the request
+    extra   capturing node extra, like the arguments of the call
+    metric  reading the metric functions
+    record  the rest: starting and ending nodes, retention of the hiq map
+
+Stages cost a few clock reads per call, so they are off by default. Turn them on
+with `HiQBase.set_overhead_breakdown(stages=True)` or env variable
+`HIQ_OVERHEAD_STAGES`.
+"""
+
+from time import perf_counter_ns
+from typing import Callable, Dict, List
+
+OVERHEAD_STAGES = ("status", "id", "tree", "extra", "metric", "record")
+
+# indices in the counters of a tag, `record` is what is left of `total`
+OH_CALLS, OH_TOTAL, OH_STATUS, OH_ID, OH_TREE, OH_EXTRA, OH_METRIC = range(7)
+
+
+class OverheadMeter(object):
+    """The counters of the tracing overhead of a driver, by tag
+
+    Args:
+        stages (bool, optional): split the overhead by stage. Defaults to False.
+    """
+
+    __slots__ = ("tags", "stages")
+
+    def __init__(sf, stages=False):
+        # tag -> [calls, total, status, id, tree, extra, metric] in nanoseconds
+        sf.tags = {}
+        sf.stages = stages
+
+    def of(sf, tag: str) -> List[int]:
+        """the counters of `tag`, which the wrapper of the target updates"""
+        acc = sf.tags.get(tag)
+        if acc is None:
+            acc = sf.tags[tag] = [0] * 7
+        return acc
+
+    def charge(sf, tag: str, ns: int):
+        """add one call of `ns` nanoseconds to `tag`"""
+        acc = sf.of(tag)
+        acc[OH_CALLS] += 1
+        acc[OH_TOTAL] += ns
+
+    def timed(sf, f: Callable, acc: List[int], i: int) -> Callable:
+        """`f` adding its time to the counter `i` of `acc`"""
+
+        def __t(*args, **kwargs):
+            t = perf_counter_ns()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                acc[i] += perf_counter_ns() - t
+
+        __t.__name__ = getattr(f, "__name__", "__t")
+        return __t
+
+    def total_ns(sf) -> int:
+        return sum(a[OH_TOTAL] + a[OH_STATUS] for a in sf.tags.values())
+
+    def reset(sf):
+        for acc in sf.tags.values():
+            acc[:] = [0] * 7
+
+    def breakdown(sf) -> Dict[str, Dict[str, int]]:
+        """{tag: {"calls": n, "total": ns, stage: ns, ...}}, stages only if they are on"""
+        r = {}
+        for tag, acc in sf.tags.items():
+            if not acc[OH_CALLS]:
+                continue
+            total = acc[OH_TOTAL] + acc[OH_STATUS]
+            d = {"calls": acc[OH_CALLS], "total": total}
+            if sf.stages:
+                d.update(zip(OVERHEAD_STAGES, acc[OH_STATUS:]))
+                d["record"] = total - sum(acc[OH_STATUS:])
+            r[tag] = d
+        return r
+
+    def table(sf) -> str:
+        """the breakdown as a table in nanoseconds per call, most expensive tag first"""
+        rows = sorted(sf.breakdown().items(), key=lambda x: -x[1]["total"])
+        if not rows:
+            return ""
+        columns = ["calls", "total"] + (list(OVERHEAD_STAGES) if sf.stages else [])
+        width = max(len("tag"), *(len(tag) for tag, _ in rows))
+        lines = [
+            "🦉 tracing overhead(ns/call)",
+            f"{'tag':<{width}}" + "".join(f"{c:>10}" for c in columns),
+        ]
+        for tag, d in rows:
+            calls = d["calls"]
+            cells = [f"{calls:>10}"] + [f"{d[c] // calls:>10}" for c in columns[1:]]
+            lines.append(f"{tag:<{width}}" + "".join(cells))
+        return "\n".join(lines)
+
+    def __repr__(sf):
+        return f"OverheadMeter(tags={len(sf.tags)}, stages={sf.stages}, total_ns={sf.total_ns()})"
@@ -4,16 +4,207 @@
 # Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
 #
 
+"""Prometheus metrics of the HiQ targets
+
+With `TRACE_TYPE=prometheus`, every target records its latency in seconds to a
+metric named `hiq_<target>`. The metric is a `Summary` by default. A `Histogram`
+can be aggregated across processes and replicas(`histogram_quantile` over the sum
+of the buckets), so it is the one to use for the p99 of a fleet. It is set by the
+env variables:
+
+    HIQ_PROM_TYPE     summary or histogram
+    HIQ_PROM_BUCKETS  the upper bounds of the buckets in seconds, like `0.01,0.1,1`
+    HIQ_PROM_LABELS   static labels of the metrics, like `service=api,region=phx`
+
+or by the `@prometheus` rows of the hiq conf, which win over the env variables:
+
+    "@prometheus", "type", "histogram"
+    "@prometheus", "buckets", "0.005,0.01,0.05,0.1,0.5,1"
+    "@prometheus", "buckets", "0.1,1,10,60", "func1"
+    "@prometheus", "label", "service", "api"
+
+The row with a fourth column sets the buckets of that target only.
+
+Under a pre-fork server like gunicorn, set `PROMETHEUS_MULTIPROC_DIR` to an empty
+folder before the workers start, and expose the metrics with `start_http_server`
+or `get_registry` of this module. The metrics of all the workers are then
+collected from the folder. Summaries only keep count and sum in that mode, so the
+metrics are histograms unless `HIQ_PROM_TYPE` says otherwise. Call
+`mark_process_dead` from the `child_exit` hook of gunicorn.
+"""
+
+import os
+from typing import Callable, Dict, Iterable, List, Optional
+
 from prometheus_client import Summary, push_to_gateway, CollectorRegistry, Counter
+from prometheus_client import Histogram, REGISTRY
+import prometheus_client
 from hiq.utils import memoize_first
 import asyncio
 
+PROM_SUMMARY = "summary"
+PROM_HISTOGRAM = "histogram"
+PROM_TYPES = (PROM_SUMMARY, PROM_HISTOGRAM)
 
-@memoize_first
-def get_summary(name, desc=None):
+
+def metric_name(name: str) -> str:
     if name[0:2] == "__":
         name = "hiq_" + name[2:]
-    return Summary(name, name if desc is None else desc)
+    return name
+
+
+@memoize_first
+def get_summary(name, desc=None, labelnames=()):
+    return Summary(metric_name(name), name if desc is None else desc, labelnames)
+
+
+@memoize_first
+def get_histogram(name, desc=None, buckets=None, labelnames=()):
+    """the histogram of `name`, created by the first call, so the buckets and
+    label names of the later calls are ignored"""
+    return Histogram(
+        metric_name(name),
+        name if desc is None else desc,
+        labelnames,
+        buckets=buckets or Histogram.DEFAULT_BUCKETS,
+    )
+
+
+def is_multiprocess() -> bool:
+    return bool(
+        os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+        or os.environ.get("prometheus_multiproc_dir")
+    )
+
+
+def get_registry():
+    """the registry to expose: in multi-process mode, a registry collecting the
+    metrics of all the processes, otherwise the default registry"""
+    if not is_multiprocess():
+        return REGISTRY
+    from prometheus_client import multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def start_http_server(port: int, addr: str = "0.0.0.0"):
+    """`prometheus_client.start_http_server` with the registry of `get_registry`"""
+    return prometheus_client.start_http_server(port, addr, registry=get_registry())
+
+
+def mark_process_dead(pid: Optional[int] = None):
+    """remove the live gauges of a dead worker in multi-process mode"""
+    if is_multiprocess():
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(os.getpid() if pid is None else pid)
+
+
+def target_name(name: str) -> str:
+    """the tag of a target in the hiq conf, without the prefix of its function name"""
+    return name[2:] if name[0:2] == "__" else name
+
+
+def parse_buckets(value: str) -> List[float]:
+    buckets = sorted(float(i) for i in value.split(",") if i.strip())
+    if not buckets:
+        raise ValueError(f"🦉 empty prometheus buckets: {value}")
+    return buckets
+
+
+class PrometheusConf(object):
+    """How the targets of a driver are recorded to Prometheus
+
+    Args:
+        metric_type (str, optional): `PROM_SUMMARY` or `PROM_HISTOGRAM`. Defaults to histogram in multi-process mode, summary otherwise.
+        buckets (Iterable[float], optional): the default buckets of the histograms. Defaults to `Histogram.DEFAULT_BUCKETS`.
+        labels (Dict[str, str], optional): static labels of the metrics. Defaults to None.
+    """
+
+    def __init__(
+        sf,
+        metric_type: Optional[str] = None,
+        buckets: Optional[Iterable[float]] = None,
+        labels: Optional[Dict[str, str]] = None,
+    ):
+        if metric_type is None:
+            metric_type = PROM_HISTOGRAM if is_multiprocess() else PROM_SUMMARY
+        if metric_type not in PROM_TYPES:
+            raise ValueError(f"🦉 unknown prometheus metric type: {metric_type}")
+        sf.metric_type = metric_type
+        sf.buckets = tuple(buckets) if buckets else None
+        sf.labels = dict(labels) if labels else {}
+        sf.target_buckets = {}
+
+    def set_buckets(sf, buckets: Iterable[float], target: Optional[str] = None):
+        """set the default buckets, or the buckets of `target`"""
+        if target is None:
+            sf.buckets = tuple(buckets)
+        else:
+            sf.target_buckets[target_name(target)] = tuple(buckets)
+
+    @staticmethod
+    def from_env(rows: Iterable[List[str]] = ()) -> "PrometheusConf":
+        """read `HIQ_PROM_TYPE`, `HIQ_PROM_BUCKETS` and `HIQ_PROM_LABELS`, then the
+        `@prometheus` rows of the hiq conf"""
+        labels = {}
+        for i in os.environ.get("HIQ_PROM_LABELS", "").split(","):
+            if i.strip():
+                k, _, v = i.partition("=")
+                labels[k.strip()] = v.strip()
+        conf = PrometheusConf(
+            os.environ.get("HIQ_PROM_TYPE", "").lower() or None, labels=labels
+        )
+        if os.environ.get("HIQ_PROM_BUCKETS"):
+            conf.set_buckets(parse_buckets(os.environ["HIQ_PROM_BUCKETS"]))
+        for row in rows:
+            key = row[1] if len(row) > 1 else None
+            if key == "type" and len(row) == 3:
+                conf = PrometheusConf(row[2].lower(), conf.buckets, conf.labels)
+            elif key == "buckets" and len(row) in (3, 4):
+                conf.set_buckets(parse_buckets(row[2]), row[3] if len(row) == 4 else None)
+            elif key == "label" and len(row) == 4:
+                conf.labels[row[2]] = row[3]
+            else:
+                raise ValueError(f"🦉 unknown prometheus option: {row}")
+        return conf
+
+    def get_metric(sf, name: str):
+        """the metric of target `name`, with the label values applied"""
+        labelnames = tuple(sf.labels)
+        if sf.metric_type == PROM_HISTOGRAM:
+            buckets = sf.target_buckets.get(target_name(name), sf.buckets)
+            metric = get_histogram(name, None, buckets, labelnames)
+        else:
+            metric = get_summary(name, None, labelnames)
+        return metric.labels(**sf.labels) if labelnames else metric
+
+    def timer(sf, name: str) -> Callable:
+        """the factory of the context managers timing target `name`
+
+        The metric and its label child are resolved here, when the target is
+        patched, instead of on every call.
+        """
+        return sf.get_metric(name).time
+
+    def __repr__(sf):
+        return (
+            f"PrometheusConf(metric_type={sf.metric_type}, buckets={sf.buckets}, "
+            f"labels={sf.labels}, target_buckets={sf.target_buckets})"
+        )
+
+
+__default_conf = None
+
+
+def get_default_conf() -> PrometheusConf:
+    """the conf from the env variables, for targets without a driver"""
+    global __default_conf
+    if __default_conf is None:
+        __default_conf = PrometheusConf.from_env()
+    return __default_conf
 
 
 """
@@ -0,0 +1,109 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+from collections import OrderedDict, deque
+from typing import Dict, List, Tuple
+
+from hiq.constants import HIQ_EXTRA_BYTES, HIQ_NODE_BYTES, RETENTION_FIFO, RETENTION_LRU
+
+
+class TauStore(OrderedDict):
+    """The hiq map: request id -> metric trees of the request, with bounded retention
+
+    Requests are kept in insertion order(FIFO), or in the order their root calls
+    completed(LRU). The oldest request is evicted in O(1) when there are more than
+    `max_size + 1` requests, or when the estimated memory exceeds `max_bytes`.
+    The estimate of a request is updated when one of its root calls completes,
+    from the node count and the extras of its trees.
+
+    Evicted forests are queued with their request ids and handed out in batches
+    of `batch` by `drain()`.
+
+    Args:
+        max_size (int, optional): the max number of requests. Defaults to 30.
+        max_bytes (int, optional): the memory budget in bytes, 0 means no budget. Defaults to 0.
+        policy (str, optional): `RETENTION_FIFO` or `RETENTION_LRU`. Defaults to RETENTION_FIFO.
+        batch (int, optional): the number of evicted forests to hand out at once. Defaults to 1.
+        node_bytes (int, optional): the estimated memory of one node with its extra. Defaults to HIQ_NODE_BYTES.
+    """
+
+    def __init__(
+        sf,
+        max_size=30,
+        max_bytes=0,
+        policy=RETENTION_FIFO,
+        batch=1,
+        node_bytes=HIQ_NODE_BYTES,
+    ):
+        super().__init__()
+        if policy not in (RETENTION_FIFO, RETENTION_LRU):
+            raise ValueError(f"🦉 unknown retention policy: {policy}")
+        sf.max_size = max_size
+        sf.max_bytes = max_bytes
+        sf.policy = policy
+        sf.batch = max(1, batch)
+        sf.node_bytes = node_bytes
+        sf.sizes = {}
+        sf.nbytes = 0
+        sf.evicted = deque()
+
+    def empty_copy(sf) -> "TauStore":
+        """an empty store with the same settings"""
+        return TauStore(sf.max_size, sf.max_bytes, sf.policy, sf.batch, sf.node_bytes)
+
+    def put(sf, k, forest: Dict) -> Dict:
+        """insert the forest of a new request unless another thread was first, and
+        return the forest in the store"""
+        forest = sf.setdefault(k, forest)
+        if len(sf) > sf.max_size + 1:
+            sf.evict()
+        return forest
+
+    def weigh(sf, forest: Dict) -> int:
+        """estimated memory of a forest in bytes"""
+        size = 0
+        for tree in forest.values():
+            size += tree.count * sf.node_bytes + len(tree.extra) * HIQ_EXTRA_BYTES
+        return size
+
+    def touch(sf, k, forest: Dict):
+        """update the estimate of request `k` after one of its root calls completed"""
+        # a request evicted while it was in flight is not counted again
+        if sf.policy == RETENTION_LRU:
+            try:
+                sf.move_to_end(k)
+            except KeyError:
+                return
+        elif k not in sf:
+            return
+        size = sf.weigh(forest)
+        sf.nbytes += size - sf.sizes.get(k, 0)
+        sf.sizes[k] = size
+        while sf.max_bytes and sf.nbytes > sf.max_bytes and len(sf) > 1:
+            sf.evict()
+
+    def evict(sf):
+        """evict the oldest request"""
+        try:
+            k, forest = sf.popitem(last=False)
+        except KeyError:
+            return
+        sf.nbytes -= sf.sizes.pop(k, 0)
+        sf.evicted.append((k, forest))
+
+    def drain(sf, force=False) -> List[Tuple[object, Dict]]:
+        """the evicted (request id, forest) once a batch is complete, or all of
+        them with `force`"""
+        evicted = sf.evicted
+        if not evicted or (len(evicted) < sf.batch and not force):
+            return []
+        r = []
+        while force or len(r) < sf.batch:
+            try:
+                r.append(evicted.popleft())
+            except IndexError:
+                break
+        return r
@@ -0,0 +1,75 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import re
+from random import random
+from time import monotonic
+from typing import Optional
+
+
+class HiQSampler(object):
+    """Head-based sampling of requests
+
+    The decision is made once, when the root call of a request starts, and the
+    whole request is recorded or not. A request is sampled when its id matches
+    `id_pattern`, or else with `probability` and as long as its endpoint(the
+    tag of the root call) has not used up `rate` traces in the last second.
+
+    Args:
+        probability (float, optional): the probability to sample a request. Defaults to 1.0.
+        rate (float, optional): the max traces per second per endpoint, 0 means no limit. Defaults to 0.
+        id_pattern (str, optional): a regex, requests with matching id are always sampled. Defaults to None.
+    """
+
+    __slots__ = ("probability", "rate", "id_pattern", "buckets", "sampled", "dropped")
+
+    def __init__(
+        sf, probability: float = 1.0, rate: float = 0, id_pattern: Optional[str] = None
+    ):
+        if not 0.0 <= probability <= 1.0:
+            raise ValueError(f"🦉 sampling probability must be in [0, 1]: {probability}")
+        if rate < 0:
+            raise ValueError(f"🦉 sampling rate must not be negative: {rate}")
+        sf.probability = probability
+        sf.rate = rate
+        sf.id_pattern = re.compile(id_pattern) if id_pattern else None
+        # endpoint -> [tokens, last refill time]
+        sf.buckets = {}
+        sf.sampled = 0
+        sf.dropped = 0
+
+    def __call__(sf, req_id, endpoint: str) -> bool:
+        if sf.id_pattern is not None and sf.id_pattern.search(str(req_id)):
+            sf.sampled += 1
+            return True
+        if (sf.probability < 1.0 and random() >= sf.probability) or (
+            sf.rate and not sf.take(endpoint)
+        ):
+            sf.dropped += 1
+            return False
+        sf.sampled += 1
+        return True
+
+    def take(sf, endpoint: str) -> bool:
+        """take a token from the bucket of `endpoint`, which holds up to one second of traces"""
+        now = monotonic()
+        bucket = sf.buckets.get(endpoint)
+        if bucket is None:
+            bucket = sf.buckets[endpoint] = [max(1.0, sf.rate), now]
+        else:
+            bucket[0] = min(max(1.0, sf.rate), bucket[0] + (now - bucket[1]) * sf.rate)
+            bucket[1] = now
+        if bucket[0] < 1.0:
+            return False
+        bucket[0] -= 1.0
+        return True
+
+    def __repr__(sf):
+        pattern = sf.id_pattern.pattern if sf.id_pattern is not None else None
+        return (
+            f"HiQSampler(probability={sf.probability}, rate={sf.rate}, "
+            f"id_pattern={pattern!r}, sampled={sf.sampled}, dropped={sf.dropped})"
+        )
@@ -0,0 +1,197 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+"""Shared-memory ring buffer of framed records
+
+One producer process and one consumer process exchange frames through a
+`multiprocessing.shared_memory` segment, without pickling and without a pipe
+write per message:
+
+    header  := write:u64 read:u64 done:u64       # total bytes written, read and processed
+               exported:u64 failed:u64            # total items the consumer handled
+    data    := slot*                             # wraps around at the capacity
+    slot    := length:u32 items:u32 frame        # items: the records of the frame
+    frame   := codec:u8 payload
+    payload := (key_len:u32 value_len:u32 key value)*, compressed by the codec
+
+The producer only moves `write` and the consumer only moves `read` and `done`,
+each after copying the bytes of a frame, so no lock is shared between the
+processes. The consumer moves `done` with `ack()` once it has handled the frames
+it got, so the producer can wait for them to be written out, and counts the
+items it exported or failed to export. The number of items of a frame is in its
+slot, so a frame the consumer fails to decode is still counted.
+"""
+
+import os
+import struct
+import zlib
+from multiprocessing import shared_memory
+from typing import Iterable, Iterator, Optional, Tuple
+
+import hiq
+
+CODEC_NONE, CODEC_ZLIB, CODEC_ZSTD = 0, 1, 2
+CODECS = {"": CODEC_NONE, "none": CODEC_NONE, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+_HEADER = 40
+_u32 = struct.Struct("<I")
+_slot_head = struct.Struct("<II")
+# the bytes a frame takes in the ring besides its own
+SLOT_HEAD = _slot_head.size
+_record_head = struct.Struct("<II")
+
+
+class ShmRing(object):
+    """A single-producer single-consumer ring buffer in shared memory
+
+    The producer creates it, the consumer gets it as an argument of its process,
+    which attaches the segment by name under the `spawn` start method.
+
+    Args:
+        capacity (int): the bytes of the data region.
+        name (str, optional): attach to an existing segment instead of creating one.
+    """
+
+    def __init__(sf, capacity: int = 16 << 20, name: str = None):
+        if name is None:
+            sf.shm = shared_memory.SharedMemory(create=True, size=_HEADER + capacity)
+            sf.shm.buf[:_HEADER] = bytes(_HEADER)
+            # the pid of the creator, which removes the segment
+            sf.owner = os.getpid()
+        else:
+            sf.shm = shared_memory.SharedMemory(name=name)
+            sf.owner = None
+        sf.capacity = sf.shm.size - _HEADER
+        sf.pos = sf.shm.buf[:_HEADER].cast("Q")
+        sf.data = sf.shm.buf[_HEADER : _HEADER + sf.capacity]
+
+    def __getstate__(sf):
+        return {"name": sf.shm.name}
+
+    def __setstate__(sf, state):
+        sf.__init__(name=state["name"])
+
+    def used(sf) -> int:
+        return sf.pos[0] - sf.pos[1]
+
+    def pending(sf) -> int:
+        """bytes written but not yet acknowledged by the consumer"""
+        return sf.pos[0] - sf.pos[2]
+
+    def ack(sf, exported: int = 0, failed: int = 0):
+        """mark the frames taken so far as processed, with their number of items
+        exported and failed"""
+        sf.pos[3] += exported
+        sf.pos[4] += failed
+        sf.pos[2] = sf.pos[1]
+
+    def items(sf) -> Tuple[int, int]:
+        """the number of items (exported, failed) by the consumer"""
+        if sf.shm is None:
+            return sf.final_items
+        return sf.pos[3], sf.pos[4]
+
+    def put(sf, frame: bytes, items: int = 0) -> bool:
+        """append one frame of `items` items, False if there is no room for it"""
+        size = len(frame)
+        w = sf.pos[0]
+        if size + SLOT_HEAD > sf.capacity - (w - sf.pos[1]):
+            return False
+        sf._copy_in(w, _slot_head.pack(size, items))
+        sf._copy_in(w + SLOT_HEAD, frame)
+        sf.pos[0] = w + SLOT_HEAD + size
+        return True
+
+    def take(sf) -> Optional[Tuple[bytes, int]]:
+        """take the oldest frame with its number of items, None if the ring is empty"""
+        r = sf.pos[1]
+        if r == sf.pos[0]:
+            return None
+        size, items = _slot_head.unpack(sf._copy_out(r, SLOT_HEAD))
+        frame = sf._copy_out(r + SLOT_HEAD, size)
+        sf.pos[1] = r + SLOT_HEAD + size
+        return frame, items
+
+    def get(sf) -> Optional[bytes]:
+        """take the oldest frame, None if the ring is empty"""
+        slot = sf.take()
+        return slot[0] if slot is not None else None
+
+    def _copy_in(sf, at: int, b: bytes):
+        i = at % sf.capacity
+        n = min(len(b), sf.capacity - i)
+        sf.data[i : i + n] = b[:n]
+        if n < len(b):
+            sf.data[: len(b) - n] = b[n:]
+
+    def _copy_out(sf, at: int, size: int) -> bytes:
+        i = at % sf.capacity
+        n = min(size, sf.capacity - i)
+        if n == size:
+            return bytes(sf.data[i : i + n])
+        return bytes(sf.data[i:]) + bytes(sf.data[: size - n])
+
+    def close(sf):
+        """detach, and remove the segment if this process created it"""
+        if sf.shm is None:
+            return
+        sf.final_items = sf.items()
+        sf.pos.release()
+        sf.data.release()
+        sf.shm.close()
+        if sf.owner == os.getpid():
+            sf.shm.unlink()
+        sf.shm = None
+
+
+def encode_frame(records: Iterable[Tuple[str, str]], codec: int = CODEC_NONE) -> bytes:
+    """a frame of (key, value) records"""
+    buf = bytearray()
+    for key, value in records:
+        append_record(buf, key, value)
+    return frame_of(buf, codec)
+
+
+def append_record(buf: bytearray, key: str, value: str):
+    """append one (key, value) record to the payload of a frame"""
+    k, v = key.encode("utf-8"), value.encode("utf-8")
+    buf += _record_head.pack(len(k), len(v))
+    buf += k
+    buf += v
+
+
+def frame_of(payload: bytes, codec: int = CODEC_NONE) -> bytes:
+    """compress the encoded records `payload` into a frame"""
+    if codec == CODEC_ZLIB:
+        payload = zlib.compress(payload, 1)
+    elif codec == CODEC_ZSTD:
+        payload = hiq.mod("zstandard").ZstdCompressor(level=1).compress(payload)
+    return bytes((codec,)) + payload
+
+
+def payload_of(frame: bytes) -> memoryview:
+    """the decompressed payload of a frame"""
+    codec, payload = frame[0], memoryview(frame)[1:]
+    if codec == CODEC_ZLIB:
+        payload = memoryview(zlib.decompress(payload))
+    elif codec == CODEC_ZSTD:
+        payload = memoryview(hiq.mod("zstandard").ZstdDecompressor().decompress(payload))
+    elif codec != CODEC_NONE:
+        raise ValueError(f"🦉 unknown frame codec: {codec}")
+    return payload
+
+
+def decode_frame(frame: bytes) -> Iterator[Tuple[str, str]]:
+    """the (key, value) records of a frame"""
+    payload = payload_of(frame)
+    i, size = 0, len(payload)
+    while i < size:
+        k, v = _record_head.unpack_from(payload, i)
+        i += 8
+        key = str(payload[i : i + k], "utf-8")
+        i += k
+        yield key, str(payload[i : i + v], "utf-8")
+        i += v
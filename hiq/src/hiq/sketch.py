@@ -0,0 +1,264 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+"""Streaming latency statistics
+
+A driver adds the latency of every traced call to the sketch of its tag, and the
+latency of every completed request to the sketch of its endpoint, the root call
+of the request. A sketch keeps the count, the sum, the max and a DDSketch of the
+values: value `x` goes to bucket `ceil(log(x) / log(gamma))` with
+`gamma = (1 + alpha) / (1 - alpha)`, so a quantile is within a relative error of
+`alpha` of the true one, in memory that only depends on the range of the values.
+
+Sketches with the same `alpha` merge by adding up their buckets, so the stats
+of many processes can be shipped with `to_dict()` and merged into one:
+
+    >>> total = LatencyStats()
+    >>> for d in stats_of_the_workers:
+    ...     total.merge(LatencyStats.from_dict(d))
+    >>> total.summary()["endpoints"]["__main"]["p99"]
+
+Like the overhead counters, the sketches are updated without a lock.
+"""
+
+import math
+from math import ceil, fsum, log
+from typing import Dict, Iterable
+
+from hiq.utils import get_env_int
+
+# the smallest latency told apart from zero, in seconds
+MIN_VALUE = 1e-9
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+# the values added before the buckets are updated
+BATCH = 64
+
+
+def _default_alpha() -> float:
+    return get_env_int("HIQ_SKETCH_ALPHA_PPM", 10_000) / 1e6
+
+
+class LatencySketch(object):
+    """count, sum, max and quantiles of latencies in seconds
+
+    Args:
+        alpha (float, optional): the relative accuracy of the quantiles. Defaults to 0.01, or env variable `HIQ_SKETCH_ALPHA_PPM` in parts per million.
+        max_bins (int, optional): the max number of buckets, the lowest ones are merged beyond it. Defaults to 2048.
+    """
+
+    __slots__ = ("alpha", "max_bins", "count", "sum", "max", "zeros", "bins", "pending", "_gamma", "_inv_log_gamma")
+
+    def __init__(sf, alpha: float = None, max_bins: int = 2048):
+        if alpha is None:
+            alpha = _default_alpha()
+        if not 0 < alpha < 1:
+            raise ValueError(f"🦉 alpha must be in (0, 1), got {alpha}")
+        sf.alpha = alpha
+        sf.max_bins = max_bins
+        sf.count = 0
+        sf.sum = 0.0
+        sf.max = 0.0
+        sf.zeros = 0
+        # bucket index -> count
+        sf.bins = {}
+        sf.pending = []
+        sf._gamma = (1 + alpha) / (1 - alpha)
+        sf._inv_log_gamma = 1 / math.log(sf._gamma)
+
+    def add(sf, x: float):
+        """add latency `x`, the buckets are updated in batches of `BATCH` values"""
+        pending = sf.pending
+        pending.append(x)
+        if len(pending) >= BATCH:
+            sf.flush()
+
+    def flush(sf):
+        """add the pending values to the buckets"""
+        values, sf.pending = sf.pending, []
+        if not values:
+            return
+        sf.count += len(values)
+        sf.sum += fsum(values)
+        sf.max = max(sf.max, max(values))
+        inv_log_gamma = sf._inv_log_gamma
+        bins = sf.bins
+        zeros = 0
+        for x in values:
+            if x < MIN_VALUE:
+                zeros += 1
+                continue
+            k = ceil(log(x) * inv_log_gamma)
+            bins[k] = bins.get(k, 0) + 1
+        sf.zeros += zeros
+        while len(bins) > sf.max_bins:
+            sf._collapse()
+
+    def _collapse(sf):
+        """merge the lowest buckets into one, the high quantiles stay accurate"""
+        keys = sorted(sf.bins)
+        n = len(keys) - sf.max_bins + 1
+        merged = sum(sf.bins.pop(k) for k in keys[:n])
+        sf.bins[keys[n - 1]] = merged
+
+    def merge(sf, other: "LatencySketch"):
+        """add the values of `other` to this sketch"""
+        if other.alpha != sf.alpha:
+            raise ValueError(f"🦉 can not merge sketches of alpha {sf.alpha} and {other.alpha}")
+        sf.flush()
+        other.flush()
+        sf.count += other.count
+        sf.sum += other.sum
+        sf.max = max(sf.max, other.max)
+        sf.zeros += other.zeros
+        bins = sf.bins
+        for k, n in other.bins.items():
+            bins[k] = bins.get(k, 0) + n
+        while len(bins) > sf.max_bins:
+            sf._collapse()
+        return sf
+
+    def quantile(sf, q: float) -> float:
+        """the `q` quantile, within `alpha` of the true value; nan if empty"""
+        sf.flush()
+        if not sf.count:
+            return math.nan
+        rank = q * (sf.count - 1)
+        seen = sf.zeros
+        if seen > rank:
+            return 0.0
+        for k in sorted(sf.bins):
+            seen += sf.bins[k]
+            if seen > rank:
+                return min(2 * sf._gamma ** k / (sf._gamma + 1), sf.max)
+        return sf.max
+
+    @property
+    def mean(sf) -> float:
+        sf.flush()
+        return sf.sum / sf.count if sf.count else math.nan
+
+    def summary(sf, quantiles: Iterable[float] = DEFAULT_QUANTILES) -> Dict[str, float]:
+        sf.flush()
+        r = {"count": sf.count, "sum": sf.sum, "mean": sf.mean}
+        for q in quantiles:
+            r[f"p{q * 100:g}"] = sf.quantile(q)
+        r["max"] = sf.max
+        return r
+
+    def to_dict(sf) -> dict:
+        """a JSON friendly dict, see `from_dict`"""
+        sf.flush()
+        return {
+            "alpha": sf.alpha,
+            "count": sf.count,
+            "sum": sf.sum,
+            "max": sf.max,
+            "zeros": sf.zeros,
+            "bins": sorted(sf.bins.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict, max_bins: int = 2048) -> "LatencySketch":
+        sk = cls(alpha=d["alpha"], max_bins=max_bins)
+        sk.count = d["count"]
+        sk.sum = d["sum"]
+        sk.max = d["max"]
+        sk.zeros = d["zeros"]
+        sk.bins = {int(k): n for k, n in d["bins"]}
+        return sk
+
+    def __repr__(sf):
+        sf.flush()
+        return f"LatencySketch(count={sf.count}, mean={sf.mean:.6f}, p99={sf.quantile(0.99):.6f}, max={sf.max:.6f})"
+
+
+class LatencyStats(object):
+    """The latency sketches of a driver, by target tag and by endpoint
+
+    Args:
+        alpha (float, optional): the relative accuracy of the quantiles, see `LatencySketch`.
+    """
+
+    __slots__ = ("alpha", "targets", "endpoints")
+
+    def __init__(sf, alpha: float = None):
+        sf.alpha = _default_alpha() if alpha is None else alpha
+        sf.targets = {}
+        sf.endpoints = {}
+
+    def target(sf, tag: str) -> LatencySketch:
+        """the sketch of `tag`, which the wrapper of the target updates"""
+        sk = sf.targets.get(tag)
+        if sk is None:
+            sk = sf.targets[tag] = LatencySketch(sf.alpha)
+        return sk
+
+    def endpoint(sf, name: str) -> LatencySketch:
+        """the sketch of the requests whose root call is `name`"""
+        sk = sf.endpoints.get(name)
+        if sk is None:
+            sk = sf.endpoints[name] = LatencySketch(sf.alpha)
+        return sk
+
+    def merge(sf, other: "LatencyStats"):
+        """add the sketches of `other`, like the stats of another process"""
+        for name, sk in other.targets.items():
+            sf.target(name).merge(sk)
+        for name, sk in other.endpoints.items():
+            sf.endpoint(name).merge(sk)
+        return sf
+
+    def reset(sf):
+        # the wrappers hold the sketches of the targets, clear them in place
+        for sk in (*sf.targets.values(), *sf.endpoints.values()):
+            sk.count, sk.sum, sk.max, sk.zeros = 0, 0.0, 0.0, 0
+            sk.bins.clear()
+            sk.pending = []
+
+    def summary(sf, quantiles: Iterable[float] = DEFAULT_QUANTILES) -> Dict[str, Dict[str, dict]]:
+        """`{"targets": {tag: {"count", "sum", "mean", "p50", "p90", "p99", "max"}}, "endpoints": {...}}` in seconds"""
+        return {
+            "targets": {k: v.summary(quantiles) for k, v in sf.targets.items() if v.count or v.pending},
+            "endpoints": {k: v.summary(quantiles) for k, v in sf.endpoints.items() if v.count or v.pending},
+        }
+
+    def to_dict(sf) -> dict:
+        """a JSON friendly dict of the sketches, see `from_dict`"""
+        return {
+            "alpha": sf.alpha,
+            "targets": {k: v.to_dict() for k, v in sf.targets.items() if v.count or v.pending},
+            "endpoints": {k: v.to_dict() for k, v in sf.endpoints.items() if v.count or v.pending},
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "LatencyStats":
+        st = cls(alpha=d["alpha"])
+        st.targets = {k: LatencySketch.from_dict(v) for k, v in d["targets"].items()}
+        st.endpoints = {k: LatencySketch.from_dict(v) for k, v in d["endpoints"].items()}
+        return st
+
+    def table(sf, quantiles: Iterable[float] = DEFAULT_QUANTILES) -> str:
+        """the summary as a table in milliseconds, endpoints first"""
+        summary = sf.summary(quantiles)
+        rows = [("endpoint", k, v) for k, v in summary["endpoints"].items()]
+        rows += [("target", k, v) for k, v in sorted(summary["targets"].items(), key=lambda x: -x[1]["sum"])]
+        if not rows:
+            return ""
+        columns = [c for c in rows[0][2] if c not in ("count", "sum")]
+        width = max(len(k) for _, k, _ in rows)
+        lines = [
+            "🦉 latency(ms)",
+            f"{'':<9}{'tag':<{width}}{'count':>10}" + "".join(f"{c:>10}" for c in columns),
+        ]
+        for kind, k, d in rows:
+            cells = "".join(f"{d[c] * 1e3:>10.3f}" for c in columns)
+            lines.append(f"{kind:<9}{k:<{width}}{d['count']:>10}" + cells)
+        return "\n".join(lines)
+
+    def __repr__(sf):
+        return f"LatencyStats(targets={len(sf.targets)}, endpoints={len(sf.endpoints)})"
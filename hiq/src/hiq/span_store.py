@@ -0,0 +1,513 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+"""Indexed on-disk store of the trees exported by Jack
+
+The trees are appended to segment files, one block per batch, and every tree
+gets an entry in the index file next to its segment:
+
+    <seq>.seg  := block*
+    block      := length:u32 crc32:u32 frame   # a frame of `hiq.shm_ring`, compressed
+    <seq>.idx  := entry*
+    entry      := offset:u64 item:u32 start:f64 end:f64 req_len:u16 name_len:u16 key_len:u16
+                  req_id name key             # utf8
+
+The records of a frame are (span key, text of the tree). The span key carries
+the metric key, the request id, the name of the root call and the time range of
+the tree(see `span_key`), so an index file can always be rebuilt from its
+segment. `offset` is the offset of the block in the segment and `item` the
+position of the tree in the block.
+
+A segment is closed once it is larger than `segment_bytes`, and closed segments
+are removed by `compact()` when they are older than `max_age` or the store is
+larger than `max_bytes`. A block is written before its index entries, and a
+store opened for writing drops what follows the last complete block, so a crash
+loses at most the batch being written.
+
+Queries load the index files once and follow the new entries, and read the
+blocks through `mmap`. A store can be opened with `readonly=True` by another
+process while Jack writes to it:
+
+    >>> store = SpanStore("~/.hiq/jack_store", readonly=True)
+    >>> forest = store.get_forest(req_id)
+    >>> trees = store.query(name="__main", start=time.time() - 60)
+"""
+
+import bisect
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from hiq.constants import KEY_LATENCY
+from hiq.shm_ring import (
+    CODECS,
+    CODEC_ZLIB,
+    append_record,
+    decode_frame,
+    frame_of,
+    payload_of,
+)
+from hiq.tree import Tree
+from hiq.utils import get_env_bool, get_env_int, get_home
+
+SPAN_KEY_SEP = "\x1f"
+
+_block_head = struct.Struct("<II")
+_record_head = struct.Struct("<II")
+_entry_head = struct.Struct("<QIddHHH")
+
+SpanEntry = namedtuple("SpanEntry", "segment offset item start end req_id name key")
+SpanEntry.__doc__ = "the index entry of a stored tree"
+
+
+def span_key(key: str, req_id, name: str, start: float, end: float) -> str:
+    """the key of a record in the store"""
+    return SPAN_KEY_SEP.join(
+        (key, "" if req_id is None else str(req_id), name, repr(start), repr(end))
+    )
+
+
+def split_span_key(s: str) -> Tuple[str, str, str, float, float]:
+    """(key, request id, root name, start, end) of a span key, a plain key has
+    no request id, name and time range"""
+    parts = s.split(SPAN_KEY_SEP)
+    if len(parts) != 5:
+        return s, "", "", math.nan, math.nan
+    return parts[0], parts[1], parts[2], float(parts[3]), float(parts[4])
+
+
+def tree_span(tree, timed=True) -> Tuple[str, float, float]:
+    """the name of the first root call of `tree`, and the time range of its root
+    calls if the tree records time"""
+    nodes = tree.root.nodes if tree.root is not None else []
+    if not nodes:
+        return "", math.nan, math.nan
+    if not timed:
+        return nodes[0].name, math.nan, math.nan
+    return nodes[0].name, min(n.start for n in nodes), max(n.end for n in nodes)
+
+
+def get_store_path() -> str:
+    return os.path.expanduser(os.environ.get("HIQ_JACK_STORE_PATH", f"{get_home()}/.hiq/jack_store"))
+
+
+def _offsets(payload: memoryview):
+    """the payload of a frame with the (offset, key length, value length) of its
+    records, without decoding them"""
+    offsets, i, size = [], 0, len(payload)
+    while i < size:
+        k, v = _record_head.unpack_from(payload, i)
+        i += _record_head.size
+        offsets.append((i, k, v))
+        i += k + v
+    return payload, offsets
+
+
+class _Segment(object):
+    """a segment file with its index, loaded from the index file"""
+
+    def __init__(sf, path: str, seq: int):
+        sf.seq = seq
+        sf.seg_path = os.path.join(path, f"{seq:012d}.seg")
+        sf.idx_path = os.path.join(path, f"{seq:012d}.idx")
+        sf.entries = []
+        sf.by_req = {}
+        sf.by_name = {}
+        sf.by_start = None
+        sf.max_dur = 0.0
+        sf.t_min, sf.t_max = math.inf, -math.inf
+        sf.idx_pos = 0
+        sf.loaded = False
+        sf.mm = None
+
+    def size(sf) -> int:
+        try:
+            return os.path.getsize(sf.seg_path)
+        except FileNotFoundError:
+            return 0
+
+    def refresh(sf) -> int:
+        """parse the entries appended to the index file, return the position
+        after the last complete entry"""
+        try:
+            with open(sf.idx_path, "rb") as f:
+                f.seek(sf.idx_pos)
+                buf = f.read()
+        except FileNotFoundError:
+            return sf.idx_pos
+        i, n = 0, len(buf)
+        while i + _entry_head.size <= n:
+            offset, item, start, end, lr, ln, lk = _entry_head.unpack_from(buf, i)
+            j = i + _entry_head.size + lr + ln + lk
+            if j > n:
+                break
+            s = str(buf[i + _entry_head.size : j], "utf-8")
+            sf.add(offset, item, start, end, s[:lr], s[lr : lr + ln], s[lr + ln :])
+            i = j
+        sf.idx_pos += i
+        sf.loaded = True
+        return sf.idx_pos
+
+    def add(sf, offset, item, start, end, req_id, name, key):
+        i = len(sf.entries)
+        sf.entries.append((offset, item, start, end, req_id, name, key))
+        sf.by_req.setdefault(req_id, []).append(i)
+        sf.by_name.setdefault(name, []).append(i)
+        sf.by_start = None
+        if start < sf.t_min:
+            sf.t_min = start
+        if end > sf.t_max:
+            sf.t_max = end
+        if end - start > sf.max_dur:
+            sf.max_dur = end - start
+
+    def in_range(sf, start: float, end: float) -> List[int]:
+        """the entries whose time range overlaps [start, end]"""
+        if sf.by_start is None:
+            sf.by_start = sorted((e[2], i) for i, e in enumerate(sf.entries))
+        lo = bisect.bisect_left(sf.by_start, (start - sf.max_dur, -1))
+        hi = bisect.bisect_right(sf.by_start, (end, math.inf))
+        entries = sf.entries
+        return sorted(i for _, i in sf.by_start[lo:hi] if entries[i][3] >= start)
+
+    def block(sf, offset: int) -> bytes:
+        """the frame of the block at `offset`"""
+        if sf.mm is None or offset + _block_head.size > len(sf.mm):
+            sf.remap()
+        size, _ = _block_head.unpack_from(sf.mm, offset)
+        if offset + _block_head.size + size > len(sf.mm):
+            sf.remap()
+        i = offset + _block_head.size
+        return sf.mm[i : i + size]
+
+    def remap(sf):
+        sf.unmap()
+        with open(sf.seg_path, "rb") as f:
+            sf.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def unmap(sf):
+        if sf.mm is not None:
+            sf.mm.close()
+            sf.mm = None
+
+
+class SpanStore(object):
+    """An append-only store of trees with indexes by request id, root name and time
+
+    Args:
+        path (str): the folder of the segment files.
+        segment_bytes (int, optional): the size to close a segment at. Defaults to 64 MB.
+        max_bytes (int, optional): the size of the closed segments to keep, 0 for no limit. Defaults to 10 GB.
+        max_age (float, optional): the seconds to keep a closed segment after its last tree, 0 for no limit. Defaults to 0.
+        codec (int, optional): the compression of the blocks, see `hiq.shm_ring.CODECS`. Defaults to CODEC_ZLIB.
+        fsync (bool, optional): fsync every block, to survive a crash of the host too. Defaults to False.
+        readonly (bool, optional): open the store of another process to query it. Defaults to False.
+    """
+
+    def __init__(
+        sf,
+        path: str,
+        segment_bytes: int = 64 << 20,
+        max_bytes: int = 10 << 30,
+        max_age: float = 0,
+        codec: int = CODEC_ZLIB,
+        fsync: bool = False,
+        readonly: bool = False,
+    ):
+        sf.path = os.path.expanduser(path)
+        sf.segment_bytes = segment_bytes
+        sf.max_bytes = max_bytes
+        sf.max_age = max_age
+        sf.codec = codec
+        sf.fsync = fsync
+        sf.readonly = readonly
+        sf.lock = threading.RLock()
+        sf.segments = {}
+        sf.seg_file = sf.idx_file = None
+        if not readonly:
+            os.makedirs(sf.path, exist_ok=True)
+        sf._scan()
+        if not readonly:
+            if not sf.segments:
+                sf.segments[0] = _Segment(sf.path, 0)
+            sf._recover(sf.segments[max(sf.segments)])
+            sf._open_active()
+
+    @staticmethod
+    def from_env(readonly: bool = False) -> "SpanStore":
+        """the store at `HIQ_JACK_STORE_PATH`(~/.hiq/jack_store), with the limits of
+        `HIQ_JACK_STORE_SEGMENT_MB`(64), `HIQ_JACK_STORE_MAX_MB`(10240),
+        `HIQ_JACK_STORE_MAX_HOURS`(0), `HIQ_JACK_STORE_COMPRESS`(zlib) and
+        `HIQ_JACK_STORE_FSYNC`"""
+        codec = os.environ.get("HIQ_JACK_STORE_COMPRESS", "zlib").lower()
+        if codec not in CODECS:
+            raise ValueError(f"🦉 unknown HIQ_JACK_STORE_COMPRESS: {codec}")
+        return SpanStore(
+            get_store_path(),
+            segment_bytes=get_env_int("HIQ_JACK_STORE_SEGMENT_MB", 64) << 20,
+            max_bytes=get_env_int("HIQ_JACK_STORE_MAX_MB", 10240) << 20,
+            max_age=get_env_int("HIQ_JACK_STORE_MAX_HOURS", 0) * 3600,
+            codec=CODECS[codec],
+            fsync=get_env_bool("HIQ_JACK_STORE_FSYNC"),
+            readonly=readonly,
+        )
+
+    def _scan(sf):
+        """follow the segments created and removed since the last scan"""
+        try:
+            names = os.listdir(sf.path)
+        except FileNotFoundError:
+            names = []
+        seqs = {int(n[:-4]) for n in names if n.endswith(".seg") and n[:-4].isdigit()}
+        for seq in set(sf.segments) - seqs:
+            sf.segments.pop(seq).unmap()
+        for seq in sorted(seqs - set(sf.segments)):
+            sf.segments[seq] = _Segment(sf.path, seq)
+        sf.segments = dict(sorted(sf.segments.items()))
+
+    def _recover(sf, seg: _Segment):
+        """drop an incomplete block at the end of the active segment, and index
+        the complete blocks missing from its index"""
+        idx_end = seg.refresh()
+        last = seg.entries[-1][0] if seg.entries else 0
+        size = seg.size()
+        blocks, pos = [], last
+        with open(seg.seg_path, "ab+") as f:
+            f.seek(pos)
+            data = f.read()
+            i = 0
+            while i + _block_head.size <= len(data):
+                n, crc = _block_head.unpack_from(data, i)
+                frame = data[i + _block_head.size : i + _block_head.size + n]
+                if len(frame) < n or zlib.crc32(frame) != crc:
+                    break
+                blocks.append((pos + i, frame))
+                i += _block_head.size + n
+            if pos + i < size:
+                f.truncate(pos + i)
+        # index the last indexed block again, its entries may be incomplete
+        keep = [e for e in seg.entries if e[0] < last]
+        if len(keep) < len(seg.entries):
+            idx_end = sum(
+                _entry_head.size + len("".join(e[4:]).encode("utf-8")) for e in keep
+            )
+        if os.path.exists(seg.idx_path) and os.path.getsize(seg.idx_path) > idx_end:
+            os.truncate(seg.idx_path, idx_end)
+        fresh = _Segment(sf.path, seg.seq)
+        for e in keep:
+            fresh.add(*e)
+        fresh.idx_pos, fresh.loaded = idx_end, True
+        now = time.time()
+        with open(seg.idx_path, "ab") as f:
+            for offset, frame in blocks:
+                buf = bytearray()
+                for entry in sf._entries(offset, [k for k, _ in decode_frame(frame)], now):
+                    sf._pack_entry(buf, entry)
+                    fresh.add(*entry)
+                f.write(buf)
+                fresh.idx_pos += len(buf)
+        seg.unmap()
+        sf.segments[seg.seq] = fresh
+
+    def _open_active(sf):
+        seg = sf.segments[max(sf.segments)]
+        sf.seg_file = open(seg.seg_path, "ab")
+        sf.idx_file = open(seg.idx_path, "ab")
+
+    @staticmethod
+    def _entries(offset: int, keys: List[str], now: float) -> List[tuple]:
+        """the index entries of the records of a block
+
+        A tree without a time range gets the one of the latency tree of its
+        request in the block, or `now`.
+        """
+        entries = []
+        for item, k in enumerate(keys):
+            key, req_id, name, start, end = split_span_key(k)
+            entries.append((offset, item, start, end, req_id, name, key))
+        spans = {
+            e[4]: (e[2], e[3])
+            for e in entries
+            if e[6] == KEY_LATENCY and not math.isnan(e[2])
+        }
+        for i, e in enumerate(entries):
+            if math.isnan(e[2]):
+                entries[i] = e[:2] + spans.get(e[4], (now, now)) + e[4:]
+        return entries
+
+    @staticmethod
+    def _pack_entry(buf: bytearray, entry):
+        offset, item, start, end, req_id, name, key = entry
+        r, n, k = req_id.encode("utf-8"), name.encode("utf-8"), key.encode("utf-8")
+        buf += _entry_head.pack(offset, item, start, end, len(r), len(n), len(k))
+        buf += r + n + k
+
+    def append(sf, records: Iterable[Tuple[str, str]]) -> int:
+        """append a batch of (span key, text of a tree) as one block, return the
+        number of trees"""
+        if sf.readonly:
+            raise ValueError("🦉 the span store is read only")
+        records = list(records)
+        if not records:
+            return 0
+        payload = bytearray()
+        for k, v in records:
+            append_record(payload, k, v)
+        frame = frame_of(payload, sf.codec)
+        with sf.lock:
+            seg = sf.segments[max(sf.segments)]
+            offset = sf.seg_file.tell()
+            sf.seg_file.write(_block_head.pack(len(frame), zlib.crc32(frame)) + frame)
+            sf.seg_file.flush()
+            buf = bytearray()
+            for e in sf._entries(offset, [k for k, _ in records], time.time()):
+                sf._pack_entry(buf, e)
+                seg.add(*e)
+            sf.idx_file.write(buf)
+            sf.idx_file.flush()
+            seg.idx_pos += len(buf)
+            if sf.fsync:
+                os.fsync(sf.seg_file.fileno())
+                os.fsync(sf.idx_file.fileno())
+            if sf.seg_file.tell() >= sf.segment_bytes:
+                sf._roll()
+        return len(records)
+
+    def _roll(sf):
+        """close the active segment and start a new one"""
+        sf.seg_file.close()
+        sf.idx_file.close()
+        seq = max(sf.segments) + 1
+        sf.segments[seq] = _Segment(sf.path, seq)
+        sf._open_active()
+        sf.compact()
+
+    def compact(sf, now: Optional[float] = None) -> int:
+        """remove the closed segments beyond `max_age` and `max_bytes`, return the
+        number of segments removed"""
+        if sf.readonly:
+            raise ValueError("🦉 the span store is read only")
+        now = time.time() if now is None else now
+        with sf.lock:
+            closed = [s for seq, s in sf.segments.items() if seq != max(sf.segments)]
+            for s in closed:
+                if not s.loaded:
+                    s.refresh()
+            sizes = {s.seq: s.size() for s in closed}
+            total = sum(sizes.values())
+            removed = 0
+            for s in closed:
+                expired = sf.max_age and s.t_max < now - sf.max_age
+                if not expired and not (sf.max_bytes and total > sf.max_bytes):
+                    continue
+                s.unmap()
+                for p in (s.seg_path, s.idx_path):
+                    try:
+                        os.remove(p)
+                    except FileNotFoundError:
+                        pass
+                del sf.segments[s.seq]
+                total -= sizes[s.seq]
+                removed += 1
+            return removed
+
+    def find(
+        sf,
+        req_id=None,
+        name: Optional[str] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        key: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[SpanEntry]:
+        """the index entries of the trees matching all the given conditions, oldest
+        first
+
+        Args:
+            req_id (optional): the request id.
+            name (str, optional): the name of the root call, like `__main`.
+            start (float, optional): trees ending at or after this time.
+            end (float, optional): trees starting at or before this time.
+            key (str, optional): the metric key, like `time`.
+            limit (int, optional): the max number of entries, the latest ones.
+        """
+        if req_id is not None:
+            req_id = str(req_id)
+        lo = -math.inf if start is None else start
+        hi = math.inf if end is None else end
+        r = []
+        with sf.lock:
+            if sf.readonly:
+                sf._scan()
+            active = max(sf.segments, default=None)
+            for seg in list(sf.segments.values()):
+                # closed segments do not change, the active one is followed when
+                # another process writes it
+                if not seg.loaded or (sf.readonly and seg.seq == active):
+                    seg.refresh()
+                if not seg.entries or seg.t_max < lo or seg.t_min > hi:
+                    continue
+                if req_id is not None:
+                    ids = seg.by_req.get(req_id, ())
+                elif name is not None:
+                    ids = seg.by_name.get(name, ())
+                elif start is not None or end is not None:
+                    ids = seg.in_range(lo, hi)
+                else:
+                    ids = range(len(seg.entries))
+                for i in ids:
+                    e = seg.entries[i]
+                    if (
+                        (name is None or e[5] == name)
+                        and (key is None or e[6] == key)
+                        and e[3] >= lo
+                        and e[2] <= hi
+                    ):
+                        r.append(SpanEntry(seg.seq, *e))
+        return r[-limit:] if limit else r
+
+    def load(sf, entries: Iterable[SpanEntry]) -> List[Tree]:
+        """the trees of `entries`, each block is read once"""
+        entries = list(entries)
+        frames = {}
+        with sf.lock:
+            for e in entries:
+                if (e.segment, e.offset) not in frames:
+                    frames[e.segment, e.offset] = sf.segments[e.segment].block(e.offset)
+        payloads = {}
+        r = []
+        for e in entries:
+            at = (e.segment, e.offset)
+            if at not in payloads:
+                payloads[at] = _offsets(payload_of(frames[at]))
+            payload, offsets = payloads[at]
+            i, k, v = offsets[e.item]
+            r.append(Tree(str(payload[i + k : i + k + v], "utf-8")))
+        return r
+
+    def query(sf, *args, **kwargs) -> List[Tree]:
+        """the trees matching the conditions of `find`"""
+        return sf.load(sf.find(*args, **kwargs))
+
+    def get_forest(sf, req_id) -> Dict[str, Tree]:
+        """the trees of request `req_id`, by metric key"""
+        entries = sf.find(req_id=req_id)
+        return dict(zip((e.key for e in entries), sf.load(entries)))
+
+    def close(sf):
+        with sf.lock:
+            for f in (sf.seg_file, sf.idx_file):
+                if f is not None:
+                    f.close()
+            sf.seg_file = sf.idx_file = None
+            for seg in sf.segments.values():
+                seg.unmap()
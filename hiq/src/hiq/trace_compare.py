@@ -0,0 +1,302 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+"""A/B comparison of two sets of trees, like the traces of two builds
+
+`compare(baseline, candidate)` matches the nodes of the two sets by call path.
+The sample of a path is the sum of the spans of its nodes in each request, the
+latency of the path per request, or its memory delta for the trees of
+`get_memory_mb`. For every path it gives the count, mean and p50 of both sides,
+the delta of the means with a confidence interval(Welch), and the p-value of a
+Mann-Whitney U test, which does not assume a distribution of the values:
+
+    >>> r = hiq.compare(old_trees, "~/.hiq/log_jack.log")
+    >>> print(r.table())
+    >>> print(r.flame())        # the differential flame summary, as a tree
+    >>> r.folded()              # the input of `difffolded.pl` and `flamegraph.pl`
+    >>> assert r.passed, r.regressions()
+
+A path regressed when its p-value is under `alpha`, divided by the number of
+paths compared(Bonferroni), and its mean grew by more than `min_change`. The
+statistics of all the paths are computed together, with a few sorts over the
+samples of both sides, so 100k requests per side take seconds, most of it
+reading the trees. It needs `numpy`.
+"""
+
+import math
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from hiq.constants import KEY_LATENCY
+from hiq.node_table import PATH_SEP, NodeTable, group_stats
+
+STATUS_REGRESSED = "regressed"
+STATUS_IMPROVED = "improved"
+STATUS_SAME = "same"
+STATUS_ADDED = "added"
+STATUS_REMOVED = "removed"
+
+_MARKS = {
+    STATUS_REGRESSED: "🔺",
+    STATUS_IMPROVED: "🔻",
+    STATUS_ADDED: "➕",
+    STATUS_REMOVED: "➖",
+    STATUS_SAME: " ",
+}
+
+# the two-sided z of a confidence level
+_Z = {0.9: 1.6449, 0.95: 1.96, 0.99: 2.5758}
+
+
+def as_node_table(x, metrics_key: str = KEY_LATENCY) -> NodeTable:
+    """the `NodeTable` of one side of a comparison
+
+    Args:
+        x: a `NodeTable`, the path of a Jack log file, a dict of forests like `HiQBase.tau`, or the trees: `Tree`s, their text, or `(request id, tree)` pairs.
+        metrics_key (str, optional): the key of the trees in a Jack log or in the forests. Defaults to "time".
+    """
+    if isinstance(x, NodeTable):
+        return x
+    if isinstance(x, (str, os.PathLike)):
+        with open(os.path.expanduser(x)) as f:
+            return NodeTable.from_jack_log(f, metrics_key)
+    if isinstance(x, dict):
+        return NodeTable.from_tau(x, metrics_key)
+    return NodeTable.from_trees(
+        t if isinstance(t, tuple) else (i, t) for i, t in enumerate(x)
+    )
+
+
+def _per_request(table: NodeTable, path_ids: Dict[str, int]):
+    """the global path id and the sum of the spans of each path in each request"""
+    nodes = table.nodes
+    n = max(len(table.paths), 1)
+    key = nodes["req"].astype(np.int64) * n + nodes["path"]
+    uniq, inv = np.unique(key, return_inverse=True)
+    totals = np.bincount(inv.ravel(), weights=table.span, minlength=len(uniq))
+    local = np.array(
+        [path_ids.setdefault(table.path_name(i), len(path_ids)) for i in range(len(table.paths))],
+        dtype=np.int64,
+    )
+    return local[uniq % n] if len(uniq) else np.zeros(0, dtype=np.int64), totals, len(np.unique(nodes["req"]))
+
+
+def mann_whitney(groups: np.ndarray, values: np.ndarray, side: np.ndarray, n_groups: int):
+    """the Mann-Whitney U test of side 1 against side 0, in every group at once
+
+    The values are ranked within their group, ties get the mean of their ranks.
+    The p-value is two-sided, from the normal approximation with the tie and
+    continuity corrections.
+
+    Args:
+        groups (np.ndarray): the group id of each value, in `[0, n_groups)`.
+        values (np.ndarray): the values.
+        side (np.ndarray): 0 or 1, the sample of each value.
+        n_groups (int): the number of groups.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: `U / (n0 * n1)` of side 1, the chance a value of side 1 is larger, and the p-value, by group; nan where a side is empty.
+    """
+    n1 = np.bincount(groups, weights=side, minlength=n_groups)
+    n0 = np.bincount(groups, minlength=n_groups) - n1
+    if len(values) == 0:
+        nan = np.full(n_groups, np.nan)
+        return nan, nan
+    order = np.lexsort((values, groups))
+    g, v, s = groups[order], values[order], side[order]
+    size = len(g)
+    idx = np.arange(size)
+    first = np.r_[True, g[1:] != g[:-1]]
+    pos = idx - np.maximum.accumulate(np.where(first, idx, 0))
+    run = first | np.r_[True, v[1:] != v[:-1]]
+    run_start = np.flatnonzero(run)
+    run_len = np.diff(np.r_[run_start, size])
+    # the ranks from 1 in the group, the mean rank of each run of ties
+    rank = (2 * pos[run_start] + run_len + 1) / 2
+    ranks = np.repeat(rank, run_len)
+    r1 = np.bincount(g, weights=ranks * s, minlength=n_groups)
+    ties = np.bincount(g[run_start], weights=run_len.astype(np.float64) ** 3 - run_len, minlength=n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        u1 = r1 - n1 * (n1 + 1) / 2
+        n = n0 + n1
+        mu = n0 * n1 / 2
+        sigma = np.sqrt(n0 * n1 / 12 * ((n + 1) - ties / (n * (n - 1))))
+        z = (np.abs(u1 - mu) - 0.5).clip(0) / sigma
+        p = np.array([math.erfc(x / math.sqrt(2)) if x == x else math.nan for x in z])
+        p[sigma == 0] = 1.0
+        p[(n0 == 0) | (n1 == 0)] = np.nan
+        return u1 / (n0 * n1), p
+
+
+def compare(
+    baseline,
+    candidate,
+    metrics_key: str = KEY_LATENCY,
+    alpha: float = 0.05,
+    min_change: float = 0.05,
+    confidence: float = 0.95,
+) -> "Comparison":
+    """compare the trees of `candidate` with the trees of `baseline`, by call path
+
+    Args:
+        baseline: the trees of the baseline, see `as_node_table` for the accepted inputs, like the path of a Jack log or a list of `Tree`.
+        candidate: the trees of the candidate, the same.
+        metrics_key (str, optional): the metric of the trees in the Jack logs or the forests, like "get_memory_mb". Defaults to "time".
+        alpha (float, optional): the significance level of the test, for all the paths together. Defaults to 0.05.
+        min_change (float, optional): the relative change of the mean of a path to report it. Defaults to 0.05.
+        confidence (float, optional): the level of the confidence interval of the delta, 0.9, 0.95 or 0.99. Defaults to 0.95.
+
+    Returns:
+        Comparison: the statistics by path.
+    """
+    if confidence not in _Z:
+        raise ValueError(f"🦉 confidence must be one of {sorted(_Z)}, got {confidence}")
+    path_ids = {}
+    g0, v0, t0 = _per_request(as_node_table(baseline, metrics_key), path_ids)
+    g1, v1, t1 = _per_request(as_node_table(candidate, metrics_key), path_ids)
+    n_paths = len(path_ids)
+    paths = sorted(path_ids, key=path_ids.get)
+
+    groups = np.concatenate([g0, g1])
+    side = np.r_[np.zeros(len(g0)), np.ones(len(g1))]
+    p_larger, p_value = mann_whitney(groups, np.concatenate([v0, v1]), side, n_paths)
+
+    cols = {}
+    for name, g, v in (("base", g0, v0), ("cand", g1, v1)):
+        count = np.bincount(g, minlength=n_paths)
+        total = np.bincount(g, weights=v, minlength=n_paths)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = total / count
+            var = np.bincount(g, weights=(v - mean[g]) ** 2, minlength=n_paths) / (count - 1)
+        p50 = np.full(n_paths, np.nan)
+        keys, stats = group_stats(g, v, (0.5,))
+        p50[keys] = stats["p50"]
+        cols[name] = count, total, mean, var, p50
+
+    c0, s0, m0, var0, p50_0 = cols["base"]
+    c1, s1, m1, var1, p50_1 = cols["cand"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta = m1 - m0
+        half = _Z[confidence] * np.sqrt(np.nan_to_num(var0 / c0) + np.nan_to_num(var1 / c1))
+        change = delta / np.abs(m0)
+    compared = int(np.sum((c0 > 0) & (c1 > 0)))
+    cut = alpha / max(compared, 1)
+
+    rows = {}
+    for i, path in enumerate(paths):
+        if not c1[i]:
+            status = STATUS_REMOVED
+        elif not c0[i]:
+            status = STATUS_ADDED
+        elif p_value[i] < cut and abs(change[i]) > min_change:
+            status = STATUS_REGRESSED if delta[i] > 0 else STATUS_IMPROVED
+        else:
+            status = STATUS_SAME
+        rows[path] = {
+            "status": status,
+            "count_base": int(c0[i]),
+            "count_cand": int(c1[i]),
+            "mean_base": m0[i].item(),
+            "mean_cand": m1[i].item(),
+            "p50_base": p50_0[i].item(),
+            "p50_cand": p50_1[i].item(),
+            "delta": delta[i].item(),
+            "delta_lo": (delta[i] - half[i]).item(),
+            "delta_hi": (delta[i] + half[i]).item(),
+            "change": change[i].item(),
+            "p_value": p_value[i].item(),
+            "p_larger": p_larger[i].item(),
+            # the change of the sum of the path per request of its side
+            "impact": (s1[i] / max(t1, 1) - s0[i] / max(t0, 1)).item(),
+        }
+    return Comparison(rows, t0, t1, metrics_key)
+
+
+class Comparison(object):
+    """The result of `compare`
+
+    Attributes:
+        rows (Dict[str, dict]): path -> `status`, `count_base` and `count_cand` the number of requests with the path, `mean_base`, `mean_cand`, `p50_base`, `p50_cand`, `delta` with `delta_lo` and `delta_hi` of its confidence interval, `change` as a ratio of `mean_base`, `p_value`, `p_larger` and `impact`, the change of the sum of the path per request. A path is the node names joined by "/".
+        n_base (int): the number of requests of the baseline.
+        n_cand (int): the number of requests of the candidate.
+    """
+
+    def __init__(sf, rows: Dict[str, dict], n_base: int, n_cand: int, metrics_key: str = KEY_LATENCY):
+        sf.rows = rows
+        sf.n_base = n_base
+        sf.n_cand = n_cand
+        sf.metrics_key = metrics_key
+
+    def regressions(sf) -> List[str]:
+        """the paths which regressed, the largest impact first"""
+        r = [k for k, v in sf.rows.items() if v["status"] == STATUS_REGRESSED]
+        return sorted(r, key=lambda k: -sf.rows[k]["impact"])
+
+    @property
+    def passed(sf) -> bool:
+        """no path regressed, for a regression gate"""
+        return not sf.regressions()
+
+    def table(sf, limit: int = 30) -> str:
+        """the paths which changed the most per request, in a table"""
+        rows = sorted(sf.rows.items(), key=lambda x: -abs(x[1]["impact"]))[:limit]
+        if not rows:
+            return ""
+        width = max(len("path"), *(len(k) for k, _ in rows))
+        lines = [
+            f"🦉 {sf.metrics_key}: baseline {sf.n_base} vs candidate {sf.n_cand} requests",
+            f"  {'path':<{width}}{'base':>12}{'cand':>12}{'delta':>12}{'change':>9}{'p-value':>10}",
+        ]
+        for k, d in rows:
+            lines.append(
+                f"{_MARKS[d['status']]} {k:<{width}}{d['mean_base']:>12.6g}{d['mean_cand']:>12.6g}"
+                f"{d['delta']:>12.4g}{d['change'] * 100:>8.1f}%{d['p_value']:>10.2g}"
+            )
+        return "\n".join(lines)
+
+    def flame(sf) -> str:
+        """the differential flame summary: the call tree with the sum of every
+        path per request on both sides, and how it changed"""
+        lines = []
+        for k in sorted(sf.rows, key=lambda k: k.split(PATH_SEP)):
+            d = sf.rows[k]
+            names = k.split(PATH_SEP)
+            base = d["mean_base"] * d["count_base"] / max(sf.n_base, 1) if d["count_base"] else 0.0
+            cand = d["mean_cand"] * d["count_cand"] / max(sf.n_cand, 1) if d["count_cand"] else 0.0
+            change = f"{(cand - base) / base * 100:+.1f}%" if base else "new"
+            lines.append(
+                f"{_MARKS[d['status']]} {'   ' * (len(names) - 1)}{names[-1]}({base:.6g} -> {cand:.6g}, {change})"
+            )
+        return "\n".join(lines)
+
+    def folded(sf, scale: float = None) -> List[str]:
+        """the paths as the folded stacks of both sides, `a;b;c base cand`, the
+        input of `difffolded.pl`/`flamegraph.pl`. The values are the self value,
+        the part not in the children, per request times `scale`, which is 1e6
+        (micro-seconds) for latency and 1 for other metrics by default"""
+        if scale is None:
+            scale = 1e6 if sf.metrics_key == KEY_LATENCY else 1
+        per_request = {}
+        for k, d in sf.rows.items():
+            per_request[k] = [
+                d["mean_base"] * d["count_base"] / max(sf.n_base, 1) if d["count_base"] else 0.0,
+                d["mean_cand"] * d["count_cand"] / max(sf.n_cand, 1) if d["count_cand"] else 0.0,
+            ]
+        own = {k: list(v) for k, v in per_request.items()}
+        for k, v in per_request.items():
+            parent = k.rpartition(PATH_SEP)[0]
+            if parent in own:
+                own[parent][0] -= v[0]
+                own[parent][1] -= v[1]
+        return [
+            f"{k.replace(PATH_SEP, ';')} {max(round(b * scale), 0)} {max(round(c * scale), 0)}"
+            for k, (b, c) in sorted(own.items())
+        ]
+
+    def __repr__(sf):
+        return f"Comparison({len(sf.rows)} paths, {len(sf.regressions())} regressed)"
@@ -54,10 +54,17 @@ def init(
     if s:
         sf.recover(s)
     sf.queue_lmk = queue_lmk
+    # number of started but not yet ended nodes, i.e. `len(sf.stk) - 1` without
+    # converting the whole stack into a python list
+    sf.n_open = 0
+    # number of root calls handed to `hiq.otm_export`
+    sf.n_exported = 0
+    # (count and n_open when computed, `TreeStats`), see `tree_func.tree_stats`
+    sf.stats_cache = None
 
 
 def get_map():
-    _map = {"__init__": init, "__slots__": ("queue_lmk",)}
+    _map = {"__init__": init, "__slots__": ("queue_lmk", "n_open", "n_exported", "stats_cache")}
     PREFIX = "tree_"
     for i in dir(tree_func):
         if i.startswith(PREFIX):
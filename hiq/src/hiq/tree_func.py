@@ -11,11 +11,12 @@ import os
 
 import sys
 import traceback
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from typing import List
 
 import itree
 from hiq.constants import FORMAT_TIMESTAMP
+from hiq.critical_path import GRAPH_MODE_CRITICAL, critical_path, critical_path_marks
 from hiq.node_utils import _c, _d
 from hiq.tree_utils import split_extra
 from hiq.node_utils import __peek_tree, _pp_tree
@@ -30,10 +31,9 @@ def tree_start(sf, a, b, extra=None):
     if extra is None:
         extra = {}
     sf.discover(a, b, extra)
+    sf.n_open += 1
     if sf.queue_lmk:
-        sf.queue_lmk.put_nowait(
-            get_dict(id_=sf.tid, name=a, value=b, extra=extra, is_start=True)
-        )
+        sf.queue_lmk.add(sf.tid, a, b, extra, True)
 
 
 def tree_end(sf, a, b, extra=None):
@@ -41,12 +41,11 @@ def tree_end(sf, a, b, extra=None):
         extra = {}
     try:
         sf.finish(a, b, extra)
+        sf.n_open -= 1
     except Exception as e:
         traceback.print_exc(file=sys.stdout)
     if sf.queue_lmk:
-        sf.queue_lmk.put_nowait(
-            get_dict(id_=sf.tid, name=a, value=b, extra=extra, is_start=False)
-        )
+        sf.queue_lmk.add(sf.tid, a, b, extra, False)
 
 
 def tree_consolidate(sf):
@@ -54,11 +53,13 @@ def tree_consolidate(sf):
         # print("no need to consolidate an incomplete tree")
         return
     sf.root = itree._itree.consolidate(sf.root)
+    sf.stats_cache = None
 
 
 def tree_recover(sf, s):
     if s:
         sf.deserialize(s)
+        sf.stats_cache = None
 
 
 def tree_repr(sf) -> str:
@@ -72,52 +73,62 @@ def tree_total_duration_s(sf):
         raise NotImplementedError("TODO")
 
 
+TreeStats = namedtuple("TreeStats", ["by_name", "leaf_by_name", "by_level", "names"])
+TreeStats.__doc__ = """The sums of the spans of a tree, from one walk
+
+    by_name: name -> the spans of the nodes of the name, the root included
+    leaf_by_name: name -> the spans of the nodes without children of the name
+    by_level: level -> name -> the spans, the root calls are level 0
+    names: the distinct names
+"""
+
+
+def tree_stats(sf) -> TreeStats:
+    """the `TreeStats` of the tree, computed by one iterative walk and cached
+    until a node is started or ended, or the tree is consolidated. Do not modify
+    the dicts, they are shared by the callers."""
+    stamp = (sf.count, sf.n_open)
+    cached = sf.stats_cache
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    by_name, leaf_by_name, by_level = defaultdict(float), defaultdict(float), {}
+    root = sf.root
+    if root:
+        by_name[root.name] += root.span()
+        if not root.nodes:
+            leaf_by_name[root.name] += root.span()
+        # in pre-order, so the dicts are in the order of the first node of a name
+        stk = [(n, 0) for n in reversed(root.nodes)]
+        while stk:
+            n, level = stk.pop()
+            name, span = n.name, n.span()
+            by_name[name] += span
+            level_sums = by_level.get(level)
+            if level_sums is None:
+                level_sums = by_level[level] = defaultdict(float)
+            level_sums[name] += span
+            children = n.nodes
+            if children:
+                stk.extend((c, level + 1) for c in reversed(children))
+            else:
+                leaf_by_name[name] += span
+    names = set(by_name)
+    names.discard(None)
+    r = TreeStats(dict(by_name), dict(leaf_by_name), {k: dict(v) for k, v in by_level.items()}, names)
+    sf.stats_cache = (stamp, r)
+    return r
+
+
 def tree_duration_by_name_s(sf) -> dict:
     if not sf.root:
         return {}
-    visited = [sf.root]
-    stack = [sf.root]
-    res = defaultdict(float)
-    res[sf.root.name] = sf.root.span()
-    while stack:
-        nd = stack[-1]
-        if nd not in visited:
-            visited.append(nd)
-        remove_from_stack = True
-        for nex in nd.nodes:
-            if nex not in visited:
-                stack.append(nex)
-                res[nex.name] += nex.span()
-                remove_from_stack = False
-                break
-        if remove_from_stack:
-            stack.pop()
-    return dict(res)
+    return dict(sf.stats().by_name)
 
 
 def tree_leaf_duration_by_name_s(sf, ordered=0):
     if not sf.root:
         return {}
-    visited = [sf.root]
-    stack = [sf.root]
-    res = defaultdict(float)
-    if not sf.root.nodes:
-        res[sf.root.name] = sf.root.span()
-    while stack:
-        nd = stack[-1]
-        if nd not in visited:
-            visited.append(nd)
-        remove_from_stack = True
-        for nex in nd.nodes:
-            if nex not in visited:
-                stack.append(nex)
-                remove_from_stack = False
-                break
-        if remove_from_stack and stack:
-            if stack[-1] and not stack[-1].nodes:  # leaf node
-                res[stack[-1].name] += stack[-1].span()
-            stack.pop()
-    res = dict(res)
+    res = dict(sf.stats().leaf_by_name)
     if ordered == 1:
         return dict(sorted(res.items(), key=operator.itemgetter(1), reverse=True))
     elif ordered == 2:
@@ -128,7 +139,7 @@ def tree_leaf_duration_by_name_s(sf, ordered=0):
         for key, value in dt.items():
             print(f"{key}:{value:6.4f}, ", end="", file=sio)
         return sio.getvalue().strip(", ")
-    return dict(res)
+    return res
 
 
 def tree_leaf_duration_total_s(sf) -> float:
@@ -138,59 +149,39 @@ def tree_leaf_duration_total_s(sf) -> float:
 
 
 def tree_get_distinct_node_names(sf) -> List[str]:
-    r = set()
-
-    def __d(n):
-        if not n:
-            return
-        nonlocal r
-        r.add(n.name)
-        for i in n.nodes:
-            __d(i)
-
-    __d(sf.root)
-    r.discard(None)
-    return list(r)
+    return list(sf.stats().names)
 
 
 def tree_get_duration_by_node_name(s, name) -> float:
-    r = 0.0
-
-    def __d(n):
-        if not n:
-            return
-        nonlocal r
-        if n.name == name:
-            r += n.span()
-        [__d(i) for i in n.nodes]
-
-    __d(s.root)
-    return r
+    return s.stats().by_name.get(name, 0.0)
 
 
 def tree_get_duration_by_node_name_and_level(s, name, level) -> float:
-    """root(None node) is level 0"""
-    r = 0.0
-    q, level_ = [s.root], 0
-    while len(q) > 0:
-        tmp = []
-        for i in q:
-            for j in i.nodes:
-                tmp.append(j)
-                if level_ == level:
-                    if j.name == name:
-                        r += j.span()
-        level_ += 1
-        q = tmp
-    return r
+    """the root calls are level 0"""
+    return s.stats().by_level.get(level, {}).get(name, 0.0)
 
 
 def tree_show(s, time_format=FORMAT_TIMESTAMP):
     print(s.get_graph(time_format))
 
 
-def tree_get_graph(sf, time_format=FORMAT_TIMESTAMP) -> str:
+def tree_critical_path(sf):
+    """the `hiq.critical_path.CriticalPath` of the tree: the nodes which decided
+    when the last root call ended, and the slack of the others"""
+    sf.consolidate()
+    return critical_path(sf.root)
+
+
+def tree_get_graph(sf, time_format=FORMAT_TIMESTAMP, mode=None) -> str:
+    """the tree as text, with mode `critical` the nodes on the critical path are
+    marked with 🔥 and their self time, the others with their slack"""
     sf.consolidate()
+    if mode is None:
+        marks = None
+    elif mode == GRAPH_MODE_CRITICAL:
+        marks = critical_path_marks(critical_path(sf.root))
+    else:
+        raise ValueError(f"🦉 unknown graph mode: {mode}")
     sio = io.StringIO()
     wide_output, value_column_len, _type = __peek_tree(sf.root)
     wide_output = get_env_bool("WIDE_OUTPUT", wide_output)
@@ -203,12 +194,13 @@ def tree_get_graph(sf, time_format=FORMAT_TIMESTAMP) -> str:
         value_column_len=value_column_len,
         _type=_type,
         tree_extra=sf.extra,
+        marks=marks,
     )
     return sio.getvalue()
 
 
 def tree_just_before_ending_root(s):
-    return len(s.stk) <= 2
+    return s.n_open <= 1
 
 
 # It is pickale, and serializable!!!
@@ -225,3 +217,5 @@ def tree___setstate__(self, state):
     self.__dict__ = b_state
     self.queue_lmk = None
     itree.Tree.__setstate__(self, a_state)
+    self.n_open = len(self.stk) - 1
+    self.stats_cache = None
@@ -17,7 +17,7 @@ import sys
 import traceback
 from datetime import datetime
 from functools import wraps
-from time import monotonic, sleep
+from time import monotonic, perf_counter_ns, sleep
 from typing import Callable, List, Tuple, Union
 from types import FunctionType, MethodType
 
@@ -191,8 +191,8 @@ def ts_to_dt(timestamp: float) -> str:
         # print(f"warning: {timestamp} is not a timestamp")
         return str(timestamp)
     try:
-        dt_object = datetime.fromtimestamp(timestamp)
-        return dt_object.strftime(r"%Y-%m-%d %H:%M:%S.%f")
+        # same as strftime(r"%Y-%m-%d %H:%M:%S.%f"), 3 times faster
+        return datetime.fromtimestamp(timestamp).isoformat(" ", "microseconds")
     except OverflowError as e:
         print(f"error: timestamp {timestamp} cased overflow")
         return ""
@@ -532,12 +532,14 @@ def get_proxies() -> dict:
 
 
 def _check_overhead(f, *args, **kwargs):
+    tag = f"<{f.__name__}>"
+
     @wraps(f)
     def __y(s, *args, **kwargs):
-        start = monotonic()
+        start = perf_counter_ns()
         r = f(s, *args, **kwargs)
         s.check_oh_counter += 1
-        s.overhead_us += int((monotonic() - start) * 1e6)
+        s.overhead_meter.charge(tag, perf_counter_ns() - start)
         return r
 
     return __y
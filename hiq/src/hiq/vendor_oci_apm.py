@@ -4,13 +4,21 @@
 # Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
 #
 
+import atexit
+import random
+import threading
 import time
 import requests
 import os
+from collections import deque
+from typing import Dict, List
 
 from py_zipkin import Encoding
 from py_zipkin.zipkin import zipkin_span
 
+from hiq.overflow import Overflow, offer
+from hiq.utils import get_env_bool, get_env_int
+
 
 def get_oci_apm_endpoint(APM_BASE_URL="", key=""):
     endpoint = os.environ.get("APM_BASE_URL", APM_BASE_URL)
@@ -25,11 +33,167 @@ def get_oci_apm_endpoint(APM_BASE_URL="", key=""):
     return final_endpoint
 
 
+class SpanShipper(object):
+    """Posts encoded spans to an APM endpoint from a background worker
+
+    `put()` only queues a span, as encoded by py_zipkin in `Encoding.V2_JSON`, a
+    JSON array of spans. The worker merges the queued arrays into one array of at
+    most `max_batch_bytes` bytes, every `interval` seconds, and posts it over a
+    keep-alive session. A post failing on a connection error, a timeout, 429 or
+    5xx is retried up to `retries` times after an exponential backoff with jitter.
+
+    Args:
+        apm_url (str): the endpoint which spans are posted to.
+        interval (float, optional): seconds between two posts. Defaults to 0.2.
+        max_batch_bytes (int, optional): the max size of a post. Defaults to 1 MiB.
+        retries (int, optional): the max retries of a post. Defaults to 3.
+        backoff (float, optional): the base of the backoff between retries, in seconds. Defaults to 0.2.
+        capacity (int, optional): the max spans waiting for the worker, the oldest are dropped. Defaults to 10000.
+        timeout (float, optional): the timeout of a post, in seconds. Defaults to 5.
+    """
+
+    def __init__(
+        s,
+        apm_url: str,
+        interval: float = 0.2,
+        max_batch_bytes: int = 1 << 20,
+        retries: int = 3,
+        backoff: float = 0.2,
+        max_backoff: float = 5.0,
+        capacity: int = 10_000,
+        timeout: float = 5,
+    ):
+        s.apm_url = apm_url
+        s.interval = interval
+        s.max_batch_bytes = max_batch_bytes
+        s.retries = retries
+        s.backoff = backoff
+        s.max_backoff = max_backoff
+        s.timeout = timeout
+        s.overflow = Overflow(capacity)
+        s.pending = deque()
+        s.busy = False
+        s.session = requests.Session()
+        s.stats = {"spans": 0, "posts": 0, "retries": 0, "failed": 0, "dropped": 0}
+        s.wake = threading.Event()
+        s.closed = False
+        s.worker = threading.Thread(target=s._loop, name="hiq-apm-shipper", daemon=True)
+        s.worker.start()
+
+    def put(s, encoded_span):
+        """queue the spans of `encoded_span`"""
+        if isinstance(encoded_span, str):
+            encoded_span = encoded_span.encode()
+        s.stats["dropped"] += offer(s.pending, [encoded_span], s.overflow)
+
+    def flush(s, timeout: float = 10.0) -> bool:
+        """post the queued spans now and wait for them, False if it timed out"""
+        deadline = time.monotonic() + timeout
+        while s.pending or s.busy:
+            s.wake.set()
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def close(s, timeout: float = 10.0):
+        """post what is left and stop the worker"""
+        if s.closed:
+            return
+        s.flush(timeout)
+        s.closed = True
+        s.wake.set()
+        s.worker.join(timeout)
+        s.session.close()
+
+    def _loop(s):
+        while not s.closed:
+            s.wake.wait(s.interval)
+            s.wake.clear()
+            while s.pending:
+                s.busy = True
+                try:
+                    s._post(*s._next_batch())
+                except Exception as e:
+                    print(f"🦉 failed to post spans to APM: {e}")
+                finally:
+                    s.busy = False
+
+    def _next_batch(s):
+        """take the queued arrays of one post, and merge them into one array"""
+        items, size = [], 2
+        while s.pending:
+            body = s.pending[0].strip()[1:-1].strip()
+            if items and size + len(body) + 1 > s.max_batch_bytes:
+                break
+            s.pending.popleft()
+            if body:
+                items.append(body)
+                size += len(body) + 1
+        # every V2 span has one traceId, and a quote in a string is escaped
+        n = sum(b.count(b'"traceId"') for b in items)
+        return b"[" + b",".join(items) + b"]", n
+
+    def _post(s, data: bytes, n: int):
+        if n == 0:
+            return
+        error = None
+        for attempt in range(s.retries + 1):
+            if attempt:
+                s.stats["retries"] += 1
+                cap = min(s.max_backoff, s.backoff * (1 << (attempt - 1)))
+                time.sleep(random.uniform(cap / 2, cap))
+            try:
+                res = s.session.post(
+                    s.apm_url,
+                    data=data,
+                    headers={"Content-Type": "application/json"},
+                    timeout=s.timeout,
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+                continue
+            s.stats["posts"] += 1
+            if 200 <= res.status_code < 300:
+                s.stats["spans"] += n
+                return
+            error = f"{res.status_code} {res.text[:200]}"
+            if res.status_code != 429 and res.status_code < 500:
+                break
+        s.stats["failed"] += n
+        print(f"🦉 failed to post {n} spans to APM: {error}")
+
+
+# apm url -> the shipper of the spans posted to it
+__shippers: Dict[str, SpanShipper] = {}
+__shippers_lock = threading.Lock()
+
+
+def get_span_shipper(apm_url: str) -> SpanShipper:
+    """the shipper of `apm_url`, created on the first call and closed at exit
+
+    The interval between two posts is env variable `APM_BATCH_MS`(200).
+    """
+    shipper = __shippers.get(apm_url)
+    if shipper is None or shipper.closed:
+        with __shippers_lock:
+            shipper = __shippers.get(apm_url)
+            if shipper is None or shipper.closed:
+                shipper = SpanShipper(apm_url, interval=get_env_int("APM_BATCH_MS", 200) / 1000)
+                atexit.register(shipper.close)
+                __shippers[apm_url] = shipper
+    return shipper
+
+
 class OciApmHttpTransport(object):
     """a zipkin transport_handler class to emit traces to Oracle APM
 
     To make it work, you need to set two environment variables: `APM_BASE_URL`, `APM_PUB_KEY`
 
+    The span is queued and posted in a batch by the `SpanShipper` of the endpoint,
+    so the traced request does not wait for APM. Set env variable `APM_SYNC=1` to
+    post it right away instead.
+
     Example:
 
     .. highlight:: python
@@ -66,7 +230,10 @@ class OciApmHttpTransport(object):
         s.encoded_span = encoded_span
         s.apm_url = apm_url
         s.debug = debug
-        s.call()
+        if get_env_bool("APM_SYNC"):
+            s.call()
+        else:
+            get_span_shipper(apm_url).put(encoded_span)
 
     def call(s):
         if s.debug:
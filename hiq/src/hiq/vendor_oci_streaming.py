@@ -4,20 +4,203 @@
 # Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
 #
 
-import oci
-
-from base64 import b64encode
-from hiq.utils import Singleton
+import gzip
 import os
+import random
+import threading
+import time
+from base64 import b64decode, b64encode
+from collections import deque
+from typing import Dict, List, Tuple
+
+import hiq
+from hiq.overflow import Overflow, offer
+from hiq.utils import Singleton, get_env_bool, get_env_int
+
+# the limits of a put_messages call
+MAX_MESSAGES_PER_REQUEST = 100
+MAX_REQUEST_BYTES = 1 << 20
+# the bytes of an entry in the JSON of the request, besides its key and value
+_ENTRY_OVERHEAD = 32
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def decode_message_value(value: str) -> str:
+    """the text of a message value read from the stream, compressed or not"""
+    b = b64decode(value)
+    if b[:2] == _GZIP_MAGIC:
+        b = gzip.decompress(b)
+    return b.decode()
+
+
+class StreamBatcher(object):
+    """Batches messages into `put_messages` calls of OCI Streaming
+
+    `put()` only queues a message. A worker thread sends them every `interval`
+    seconds, or as soon as a request is full, in requests of at most
+    `max_messages` messages and `max_bytes` bytes. Values are gzip-compressed
+    with `compress`, see `decode_message_value()`. The entries a request fails
+    on, as given by its per-entry results, or all of them if the request itself
+    fails, are retried up to `retries` times after an exponential backoff with
+    jitter.
+
+    Args:
+        client: an `oci.streaming.StreamClient`, or anything with its `put_messages(stream_id, details)`.
+        stream_id (str): the OCID of the stream.
+        models (optional): the module of `PutMessagesDetails` and `PutMessagesDetailsEntry`. Defaults to `oci.streaming.models`.
+        max_messages (int, optional): the max messages in a request. Defaults to 100.
+        max_bytes (int, optional): the max bytes of a request. Defaults to 1 MiB.
+        interval (float, optional): seconds between two sends. Defaults to 0.1.
+        compress (bool, optional): gzip the message values. Defaults to False.
+        retries (int, optional): the max retries of a message. Defaults to 3.
+        backoff (float, optional): the base of the backoff between retries, in seconds. Defaults to 0.2.
+        capacity (int, optional): the max messages waiting for the worker, the oldest are dropped. Defaults to 100000.
+    """
+
+    def __init__(
+        sf,
+        client,
+        stream_id: str,
+        models=None,
+        max_messages: int = MAX_MESSAGES_PER_REQUEST,
+        max_bytes: int = MAX_REQUEST_BYTES,
+        interval: float = 0.1,
+        compress: bool = False,
+        retries: int = 3,
+        backoff: float = 0.2,
+        max_backoff: float = 5.0,
+        capacity: int = 100_000,
+    ):
+        sf.client = client
+        sf.stream_id = stream_id
+        sf.models = models if models is not None else hiq.mod("oci").streaming.models
+        sf.max_messages = max_messages
+        sf.max_bytes = max_bytes
+        sf.interval = interval
+        sf.compress = compress
+        sf.retries = retries
+        sf.backoff = backoff
+        sf.max_backoff = max_backoff
+        sf.overflow = Overflow(capacity)
+        # (key, value) waiting for the worker
+        sf.pending = deque()
+        sf.busy = False
+        sf.stats = {"sent": 0, "failed": 0, "dropped": 0, "requests": 0, "retries": 0}
+        sf.wake = threading.Event()
+        sf.closed = False
+        sf.worker = threading.Thread(target=sf._loop, name="hiq-oci-streaming", daemon=True)
+        sf.worker.start()
+
+    def put(sf, key: str, value: str):
+        """queue a message"""
+        sf.stats["dropped"] += offer(sf.pending, [(key, value)], sf.overflow)
+        if len(sf.pending) >= sf.max_messages:
+            sf.wake.set()
+
+    def flush(sf, timeout: float = 10.0) -> bool:
+        """send the queued messages now and wait for them, False if it timed out"""
+        deadline = time.monotonic() + timeout
+        while sf.pending or sf.busy:
+            sf.wake.set()
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def close(sf, timeout: float = 10.0):
+        sf.flush(timeout)
+        sf.closed = True
+        sf.wake.set()
+        sf.worker.join(timeout)
+
+    def _loop(sf):
+        while not sf.closed:
+            sf.wake.wait(sf.interval)
+            sf.wake.clear()
+            while sf.pending:
+                sf.busy = True
+                try:
+                    sf._send(sf._next_batch())
+                except Exception as e:
+                    print(f"🦉 failed to send messages to OCI streaming: {e}")
+                finally:
+                    sf.busy = False
+
+    def _encode(sf, key: str, value: str) -> Tuple[str, str]:
+        v = value.encode()
+        if sf.compress:
+            v = gzip.compress(v, compresslevel=5)
+        return b64encode(key.encode()).decode(), b64encode(v).decode()
+
+    def _next_batch(sf) -> List[Tuple[str, str]]:
+        """take the messages of one request from the queue, encoded"""
+        batch, size = [], 0
+        while sf.pending and len(batch) < sf.max_messages:
+            k, v = sf._encode(*sf.pending[0])
+            n = len(k) + len(v) + _ENTRY_OVERHEAD
+            if n > sf.max_bytes:
+                sf.pending.popleft()
+                sf.stats["failed"] += 1
+                print(f"🦉 a message of {n} bytes is over the limit of OCI streaming, dropped")
+                continue
+            if size + n > sf.max_bytes:
+                break
+            sf.pending.popleft()
+            batch.append((k, v))
+            size += n
+        return batch
+
+    def _send(sf, batch: List[Tuple[str, str]]):
+        """put `batch`, and retry the entries which failed"""
+        models, error = sf.models, None
+        for attempt in range(sf.retries + 1):
+            if not batch:
+                return
+            if attempt:
+                sf.stats["retries"] += len(batch)
+                cap = min(sf.max_backoff, sf.backoff * (1 << (attempt - 1)))
+                time.sleep(random.uniform(cap / 2, cap))
+            details = models.PutMessagesDetails(
+                messages=[models.PutMessagesDetailsEntry(key=k, value=v) for k, v in batch]
+            )
+            try:
+                sf.stats["requests"] += 1
+                result = sf.client.put_messages(sf.stream_id, details)
+            except Exception as e:
+                # throttled, unavailable or a network error: retry all of them
+                error = e
+                status = getattr(e, "status", None)
+                if status is not None and status != 429 and status < 500:
+                    break
+                continue
+            entries = result.data.entries
+            failed = [m for m, r in zip(batch, entries) if r.error]
+            sf.stats["sent"] += len(batch) - len(failed)
+            if failed:
+                r = next(r for r in entries if r.error)
+                error = f"{r.error}: {r.error_message}"
+            batch = failed
+        if batch:
+            sf.stats["failed"] += len(batch)
+            print(f"🦉 failed to put {len(batch)} messages to OCI streaming: {error}")
 
 
 class OciStreamingClient(metaclass=Singleton):
+    """The producer of the OCI Streaming stream `OCI_STM_OCID` at `OCI_STM_END`
+
+    `produce_messages()` queues the messages of a `StreamBatcher`, which sends
+    them in batches every `OCI_STM_BATCH_MS`(100) ms. Values are sent as they
+    are, or gzip-compressed with `OCI_STM_COMPRESS=1`.
+    """
+
     def __init__(
         self,
         ociMessageEndpoint=None,
         ociStreamOcid=None,
         ociConfigFilePath="~/.oci/config",
         ociProfileName="DEFAULT",
+        client=None,
+        models=None,
     ):
         if ociMessageEndpoint is None:
             ociMessageEndpoint = os.environ.get("OCI_STM_END", "")
@@ -32,44 +215,63 @@ class OciStreamingClient(metaclass=Singleton):
         self.ociConfigFilePath = ociConfigFilePath
         self.ociProfileName = ociProfileName
 
-        self.config = oci.config.from_file(self.ociConfigFilePath, self.ociProfileName)
-        self.client = oci.streaming.StreamClient(
-            self.config, service_endpoint=ociMessageEndpoint
-        )
-
-    def __create_message(self, key, message):
-        encoded_key = b64encode(key.encode()).decode()
-        encoded_value = b64encode(message.encode()).decode()
-        return [
-            oci.streaming.models.PutMessagesDetailsEntry(
-                key=encoded_key, value=encoded_value
+        if client is None:
+            oci = hiq.mod("oci")
+            self.config = oci.config.from_file(self.ociConfigFilePath, self.ociProfileName)
+            client = oci.streaming.StreamClient(
+                self.config, service_endpoint=ociMessageEndpoint
             )
-        ]
+        self.client = client
+        self.batcher = StreamBatcher(
+            client,
+            ociStreamOcid,
+            models=models,
+            interval=get_env_int("OCI_STM_BATCH_MS", 100) / 1000,
+            compress=get_env_bool("OCI_STM_COMPRESS"),
+        )
 
     def produce_messages(self, key, message, check=False):
         """produce message to OCI streaming
 
         Emits messages to a stream. There's no limit to the number of messages in a request, but the total size of a message or request must be 1 MiB or less. The service calculates the partition ID from the message key and stores messages that share a key on the same partition. If a message does not contain a key or if the key is null, the service generates a message key for you. The partition ID cannot be passed as a parameter.
 
+        The message is queued and sent in a batch by a worker thread, unless `check` is True.
+
         Args:
             key (str): message key
             message (str): message value
-            check (bool, optional): if True, check the response from OCI streaming server. Defaults to False.
+            check (bool, optional): if True, send the message now and check the response from OCI streaming server. Defaults to False.
         """
-        message_list = self.__create_message(key, message)
-        messages = oci.streaming.models.PutMessagesDetails(messages=message_list)
+        if not check:
+            self.batcher.put(key, message)
+            return
+        models = self.batcher.models
+        k, v = self.batcher._encode(key, message)
+        messages = models.PutMessagesDetails(
+            messages=[models.PutMessagesDetailsEntry(key=k, value=v)]
+        )
         put_message_result = self.client.put_messages(self.ociStreamOcid, messages)
-
-        if check:
-            for entry in put_message_result.data.entries:
-                if entry.error:
-                    print("Error ({}) : {}".format(entry.error, entry.error_message))
-                else:
-                    print(
-                        "Published message to partition {} , offset {}".format(
-                            entry.partition, entry.offset
-                        )
+        for entry in put_message_result.data.entries:
+            if entry.error:
+                print("Error ({}) : {}".format(entry.error, entry.error_message))
+            else:
+                print(
+                    "Published message to partition {} , offset {}".format(
+                        entry.partition, entry.offset
                     )
+                )
+
+    def flush(self, timeout=10.0) -> bool:
+        """send the queued messages and wait for them"""
+        return self.batcher.flush(timeout)
+
+    def close(self, timeout=10.0):
+        """send the queued messages and stop the worker"""
+        self.batcher.close(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """the number of messages sent, failed, dropped and retried, and of requests"""
+        return dict(self.batcher.stats)
 
 
 if __name__ == "__main__":
@@ -78,6 +280,7 @@ if __name__ == "__main__":
 
     start = time.monotonic()
     client.produce_messages("hiq", "v2main,[🍁 n=fruit,s=0.00,e=40.00,x=0,c=0]")
+    client.flush()
     end = time.monotonic()
     # 1396091.409958899 super slow
     print((end - start) * 1e6)
@@ -0,0 +1,109 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+"""Zipkin v2 JSON spans of HiQ trees
+
+`encode_tree` walks a finished latency tree once and returns the JSON array of
+its spans, ready to be posted to a Zipkin v2 collector like OCI APM. It does not
+need `py_zipkin`. A tree is a trace: its root calls are root spans and every
+node is a span of the node it is called from. The extras of a node are the tags
+of its span. A node with `exception_summary` gets an `error` tag and an
+annotation at its end.
+
+With `JACK=1` and `HIQ_JACK_APM=1`, the Jack process encodes the trees it
+receives and ships them to the endpoint of `APM_BASE_URL` and `APM_PUB_KEY`, see
+`hiq.jack`. Leave `TRACE_TYPE` unset then, so the traced calls only build the
+HiQ tree on the request thread.
+"""
+
+import json
+import math
+import os
+import random
+from typing import Dict, List, Optional
+
+from hiq.constants import KEY_EXC_SUM, KEY_EXC_TRA
+
+_EXC_KEYS = (KEY_EXC_SUM, KEY_EXC_TRA)
+
+
+def new_id(bits: int = 64) -> str:
+    """a random, non-zero id of `bits` bits in lower-case hex, like the Zipkin
+    trace id(64 or 128 bits) and span id(64 bits)"""
+    return "%0*x" % (bits // 4, random.getrandbits(bits) or 1)
+
+
+def _us(t: float) -> int:
+    return int(round(t * 1e6))
+
+
+def tree_to_spans(
+    tree,
+    service_name: Optional[str] = None,
+    trace_id: Optional[str] = None,
+    parent_id: Optional[str] = None,
+    req_id=None,
+) -> List[Dict]:
+    """the Zipkin v2 spans of the nodes of `tree`, in depth-first order
+
+    Args:
+        tree (hiq.Tree): a latency tree, with `time.time()` start and end time.
+        service_name (str, optional): the local service of the spans. Defaults to env variable `SERVICE_NAME` or "hiq".
+        trace_id (str, optional): the trace of the spans. Defaults to a new 64-bit id.
+        parent_id (str, optional): the span the root calls are called from. Defaults to None.
+        req_id (optional): the request id, tagged as `hiq.request_id` on the root spans. Defaults to None.
+
+    Returns:
+        List[Dict]: one span per node; nodes not yet finished are skipped with their descendants.
+    """
+    if tree.root is None:
+        return []
+    endpoint = {"serviceName": service_name or os.environ.get("SERVICE_NAME", "hiq")}
+    trace_id = trace_id or new_id()
+    spans = []
+    stk = [(n, parent_id, True) for n in reversed(tree.root.nodes)]
+    while stk:
+        n, pid, is_root = stk.pop()
+        start, end = n.start, n.end
+        if not (math.isfinite(start) and math.isfinite(end)):
+            continue
+        sid = new_id()
+        ts = _us(start)
+        span = {
+            "traceId": trace_id,
+            "id": sid,
+            "name": n.name,
+            "timestamp": ts,
+            # zipkin takes a duration under 1us as unknown
+            "duration": max(_us(end) - ts, 1),
+            "localEndpoint": endpoint,
+        }
+        if pid:
+            span["parentId"] = pid
+        extra = n.extra
+        tags = {}
+        exc = None
+        if extra:
+            tags = {str(k): str(v) for k, v in extra.items() if k not in _EXC_KEYS}
+            exc = extra.get(KEY_EXC_SUM)
+        if is_root and req_id is not None:
+            tags["hiq.request_id"] = str(req_id)
+        if exc is not None:
+            # the exception is the repr of it in a tree read from Jack, see `hiq.jack`
+            exc = repr(exc) if isinstance(exc, BaseException) else str(exc)
+            tags["error"] = exc
+            span["annotations"] = [{"timestamp": _us(end), "value": f"error: {exc}"}]
+        if tags:
+            span["tags"] = tags
+        spans.append(span)
+        stk.extend((c, sid, False) for c in reversed(n.nodes))
+    return spans
+
+
+def encode_tree(tree, service_name: Optional[str] = None, **kwargs) -> bytes:
+    """the compact Zipkin v2 JSON array of the spans of `tree`, see `tree_to_spans`"""
+    spans = tree_to_spans(tree, service_name, **kwargs)
+    return json.dumps(spans, separators=(",", ":")).encode("utf-8")
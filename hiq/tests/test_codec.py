@@ -0,0 +1,89 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import io
+import os
+import random
+import sys
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+from hiq.codec import TreeDecoder, TreeEncoder, dumps, dumps_forest, loads, loads_forest
+from hiq.tree import Tree
+
+
+def random_tree(n_nodes, seed=0, tid="time", open_nodes=0):
+    rnd = random.Random(seed)
+    t = Tree(tid=tid, extra={"req": "abc", "flags": [1, -2.5, None, True, b"\x00"]})
+    now, names, started = 1637008247.9725869, [], 0
+    while started < n_nodes:
+        if len(names) < 6 and rnd.random() < 0.6:
+            names.append(f"func_{rnd.randint(0, 30)}")
+            extra = {"size": rnd.randint(-5, 1 << 40)} if rnd.random() < 0.3 else {}
+            t.start(names[-1], now, extra)
+            started += 1
+        elif names:
+            end_extra = {"metrics": (1.5, now, 2, 3.25)} if rnd.random() < 0.2 else {}
+            t.end(names.pop(), now, end_extra)
+        now += rnd.random() / 100
+    while len(names) > open_nodes:
+        t.end(names.pop(), now)
+        now += 0.001
+    return t
+
+
+@pytest.mark.parametrize("open_nodes", [0, 2])
+def test_round_trip_matches_text_format(open_nodes):
+    t = random_tree(1000, open_nodes=open_nodes)
+    s = t.repr()
+    b = dumps(t)
+    assert len(b) < len(s)
+    assert loads(b).repr() == s
+    assert loads(b).repr() == Tree(s).repr()
+
+
+def test_exact_timestamps():
+    t = Tree(tid="x")
+    t.start("a", 1.0)
+    t.start("b", 0.1 + 0.2)
+    t.end("b", 1e-300)
+    t.start("c", -3.0)
+    t.end("c", float("-inf"))
+    t.end("a", 12345.678901)
+    assert loads(dumps(t)).repr() == t.repr()
+
+
+def test_stream_of_forests():
+    out = io.BytesIO()
+    enc = TreeEncoder(out)
+    forests = [
+        {"time": random_tree(50, seed=i), "memory": random_tree(20, seed=i, tid="memory")}
+        for i in range(3)
+    ]
+    for forest in forests:
+        enc.write_forest(forest)
+    enc.write(random_tree(5), key=7)
+    out.seek(0)
+    records = list(TreeDecoder(out))
+    assert [k for k, _ in records] == ["time", "memory"] * 3 + [7]
+    expected = [t for forest in forests for t in forest.values()] + [random_tree(5)]
+    assert [t.repr() for _, t in records] == [t.repr() for t in expected]
+
+    forest = forests[0]
+    decoded = loads_forest(dumps_forest(forest))
+    assert {k: t.repr() for k, t in decoded.items()} == {k: t.repr() for k, t in forest.items()}
+
+
+def test_bad_stream():
+    with pytest.raises(ValueError):
+        loads(b"HQX\x01")
+    with pytest.raises(ValueError):
+        loads(b"HQB\x09")
+    with pytest.raises(ValueError):
+        loads(dumps(random_tree(10))[:-3])
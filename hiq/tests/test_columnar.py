@@ -0,0 +1,108 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import asyncio
+import itertools
+import os
+import sys
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+import hiq
+from hiq.columnar import MetricForest
+from hiq.constants import EXTRA_METRICS_KEY, KEY_LATENCY
+from hiq.tree import Tree
+
+
+def counters():
+    """metric functions counting their own calls, so both layouts see the same values"""
+    ticks = [itertools.count(1), itertools.count(1000, 10), itertools.count(5000, 3)]
+
+    def time():
+        return float(next(ticks[0]))
+
+    def memory():
+        return float(next(ticks[1]))
+
+    def disk():
+        return float(next(ticks[2]))
+
+    return [time, memory, disk]
+
+
+def leaf(fail=False):
+    if fail:
+        raise ValueError("boom")
+
+
+def mid():
+    leaf()
+    leaf()
+
+
+def handler(fail=False):
+    mid()
+    try:
+        leaf(fail)
+    except ValueError:
+        pass
+
+
+async def ahandler():
+    await asyncio.sleep(0)
+    mid()
+
+
+def shape(node):
+    return (node.name, node.start, node.end, [shape(c) for c in node.nodes])
+
+
+def record(columnar, monkeypatch):
+    monkeypatch.setenv("HIQ_COLUMNAR", "1" if columnar else "0")
+    mod = __name__
+    table = [[mod, "", x, x] for x in ("handler", "mid", "leaf", "ahandler")]
+    driver = hiq.HiQMemory(hiq_table_or_path=table, metric_funcs=counters(), max_hiq_size=10)
+    m = sys.modules[__name__]
+    try:
+        for i in range(3):
+            driver.get_tau_id = lambda: f"req-{i}"
+            m.handler(fail=i == 1)
+            asyncio.run(m.ahandler())
+    finally:
+        driver.disable_hiq()
+    return driver
+
+
+def test_same_trees(monkeypatch):
+    col = record(True, monkeypatch)
+    per = record(False, monkeypatch)
+    assert col.columnar and not per.columnar
+    for i in range(3):
+        k0 = f"req-{i}"
+        forest = col.tau[k0]
+        assert isinstance(forest, MetricForest) and list(forest) == [KEY_LATENCY]
+        assert [name for name, _ in forest.metrics()] == ["time", "memory", "disk"]
+        for name in ("time", "memory", "disk"):
+            view, tree = forest[name], per.tau[k0][name]
+            assert shape(view.root) == shape(tree.root), name
+            assert view.count == tree.count
+        assert forest["disk"] is forest["disk"]
+    # the vectors are fixed width once the nodes end
+    node = col.tau["req-0"][KEY_LATENCY].root.nodes[0]
+    assert len(node.extra[EXTRA_METRICS_KEY]) == 4
+    with pytest.raises(KeyError):
+        col.tau["req-0"]["cpu"]
+
+
+def test_serialized(monkeypatch):
+    col = record(True, monkeypatch)
+    tree = col.tau["req-2"][KEY_LATENCY]
+    forest = MetricForest.from_tree(Tree(tree.repr()))
+    assert forest.names == ("memory", "disk")
+    assert shape(forest["memory"].root) == shape(col.tau["req-2"]["memory"].root)
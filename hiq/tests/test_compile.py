@@ -0,0 +1,225 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import asyncio
+import contextlib
+import os
+import sys
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+import hiq
+
+
+def plain(x):
+    return x + 1
+
+
+def boom():
+    raise ValueError("boom")
+
+
+async def coro(fail=False):
+    await asyncio.sleep(0.001)
+    if fail:
+        raise ValueError("boom")
+    return 1
+
+
+async def agen(n, fail=False):
+    for i in range(n):
+        await asyncio.sleep(0.001)
+        yield i
+    if fail:
+        raise ValueError("boom")
+
+
+@contextlib.asynccontextmanager
+async def acm(fail=False):
+    if fail:
+        raise ValueError("boom")
+    await asyncio.sleep(0.001)
+    yield 1
+
+
+@contextlib.asynccontextmanager
+async def quiet():
+    try:
+        yield 2
+    except KeyError:
+        pass
+
+
+class C(object):
+    k = 10
+
+    def bound(self, x):
+        return self.k + x
+
+    @staticmethod
+    def sm(x):
+        return x * 2
+
+    @classmethod
+    def cm(cls, x):
+        return cls.k * x
+
+
+class D(C):
+    k = 100
+
+
+def make_driver(cls=hiq.HiQLatency, **kwargs):
+    mod = __name__
+    table = [
+        [mod, "", "plain", "plain"],
+        [mod, "", "boom", "boom"],
+        [mod, "C", "bound", "bound"],
+        [mod, "C", "sm", "sm"],
+        [mod, "C", "cm", "cm"],
+    ]
+    return cls(hiq_table_or_path=table, max_hiq_size=20, **kwargs)
+
+
+@pytest.mark.parametrize("cls", [hiq.HiQLatency, hiq.HiQMemory])
+def test_methods(cls, monkeypatch):
+    # one tree per metric: the generic path of `_compile` for `HiQMemory`
+    monkeypatch.setenv("HIQ_COLUMNAR", "0")
+    driver = make_driver(cls)
+    m = sys.modules[__name__]
+    try:
+        driver.get_tau_id = lambda: "req"
+        assert m.plain(1) == 2
+        assert m.C().bound(1) == 11
+        assert m.C.sm(3) == 6 and m.C().sm(3) == 6
+        assert m.C.cm(3) == 30 and m.C().cm(3) == 30
+        # bound to the class it is called on
+        assert m.D.cm(3) == 300 and m.D().cm(3) == 300
+        assert isinstance(C.__dict__["sm"], staticmethod)
+        assert isinstance(C.__dict__["cm"], classmethod)
+        calls = {k: v["calls"] for k, v in driver.get_overhead_breakdown().items()}
+        assert calls["__plain"] == 1 and calls["__bound"] == 1
+        assert calls["__sm"] == 2 and calls["__cm"] == 4
+    finally:
+        driver.disable_hiq()
+    # the original descriptors are back
+    assert C.__dict__["sm"].__func__.__name__ == "sm"
+    assert m.C().sm(3) == 6 and m.D().cm(3) == 300 and m.plain(1) == 2
+
+
+@pytest.mark.parametrize("cls", [hiq.HiQLatency, hiq.HiQMemory])
+def test_raise(cls, monkeypatch):
+    monkeypatch.setenv("HIQ_COLUMNAR", "0")
+    driver = make_driver(cls)
+    m = sys.modules[__name__]
+    try:
+        driver.get_tau_id = lambda: "req"
+        for _ in range(3):
+            with pytest.raises(ValueError):
+                m.boom()
+        oh = driver.get_overhead_breakdown()["__boom"]
+        assert oh["calls"] == 3 and oh["total"] > 0
+        tree = driver.get_metrics_by_k0("req")
+        assert [n.name for n in tree.root.nodes] == ["__boom"] * 3
+        assert tree.n_open == 0
+    finally:
+        driver.disable_hiq()
+
+
+def test_swallow():
+    driver = make_driver(fast_fail=False)
+    m = sys.modules[__name__]
+    try:
+        driver.get_tau_id = lambda: "req"
+        assert m.boom() is None
+        assert driver.get_overhead_breakdown()["__boom"]["calls"] == 1
+    finally:
+        driver.disable_hiq()
+
+
+async def use_all(fail=False):
+    r = [await coro(fail)]
+    r.append([i async for i in agen(2, fail)])
+    async with acm(fail) as v:
+        r.append(v)
+    return r
+
+
+@pytest.fixture
+def adriver():
+    mod = __name__
+    table = [
+        [mod, "", "use_all", "use_all"],
+        [mod, "", "coro", "coro"],
+        [mod, "", "agen", "agen"],
+        [mod, "", "acm", "acm"],
+        [mod, "", "quiet", "quiet"],
+    ]
+    yield lambda **kwargs: hiq.HiQLatency(hiq_table_or_path=table, max_hiq_size=20, **kwargs)
+
+
+def names(driver, k0):
+    return [(n.name, [c.name for c in n.nodes]) for n in driver.get_metrics_by_k0(k0).root.nodes]
+
+
+def test_async(adriver):
+    driver = adriver()
+    m = sys.modules[__name__]
+    try:
+        driver.get_tau_id = lambda: "req"
+        assert asyncio.run(m.use_all()) == [1, [0, 1], 1]
+        assert names(driver, "req") == [("__use_all", ["__coro", "__agen", "__acm"])]
+        calls = {k: v["calls"] for k, v in driver.get_overhead_breakdown().items()}
+        assert calls == {"__use_all": 1, "__coro": 1, "__agen": 1, "__acm": 1}
+        for target in (m.coro(True), m.use_all(True)):
+            driver.get_tau_id = lambda: "raise"
+            with pytest.raises(ValueError):
+                asyncio.run(target)
+
+        async def enter_acm():
+            async with m.acm(True):
+                pass
+
+        driver.get_tau_id = lambda: "raise-acm"
+        with pytest.raises(ValueError):
+            asyncio.run(enter_acm())
+        assert "ValueError" in str(driver.get_metrics_by_k0("raise-acm").root.nodes[0].extra)
+    finally:
+        driver.disable_hiq()
+
+
+def test_async_swallow(adriver):
+    driver = adriver(fast_fail=False)
+    m = sys.modules[__name__]
+    try:
+        driver.get_tau_id = lambda: "req"
+        # each kind of wrapper swallows the exception, like a sync call
+        assert asyncio.run(m.use_all(True)) == [None, [0, 1], None]
+        assert names(driver, "req") == [("__use_all", ["__coro", "__agen", "__acm"])]
+        assert driver.get_overhead_breakdown()["__acm"]["calls"] == 1
+
+        async def raise_in_body():
+            async with m.acm() as v:
+                raise KeyError(v)
+
+        # the exception of the body is the caller's, it is recorded and raised
+        driver.get_tau_id = lambda: "raise-body"
+        with pytest.raises(KeyError):
+            asyncio.run(raise_in_body())
+        assert "KeyError" in str(driver.get_metrics_by_k0("raise-body").root.nodes[0].extra)
+
+        async def suppressed():
+            async with m.quiet() as v:
+                raise KeyError(v)
+            return v
+
+        # unless the target suppresses it
+        assert asyncio.run(suppressed()) == 2
+    finally:
+        driver.disable_hiq()
@@ -0,0 +1,103 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import asyncio
+import math
+import os
+import sys
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+import hiq
+from hiq.critical_path import critical_path_summary
+from hiq.tree import Tree
+
+
+def make_tree(offset=0.0):
+    """main runs a thread pool of a, b and c, then d
+
+    main [0, 10]
+      a  [1, 4]
+        x [1, 2]
+        y [2.5, 3.5]
+      b  [1, 6]
+      c  [1, 3]
+      d  [6, 9]
+    """
+    t = Tree(extra={}, tid="t")
+    spans = [
+        ("main", 0, None),
+        ("a", 1, None),
+        ("x", 1, 2),
+        ("y", 2.5, 3.5),
+        ("a", None, 4),
+        ("b", 1, 6),
+        ("c", 1, 3),
+        ("d", 6, 9),
+        ("main", None, 10),
+    ]
+    for name, start, end in spans:
+        if start is not None:
+            t.start(name, start + offset)
+        if end is not None:
+            t.end(name, end + offset)
+    return t
+
+
+def test_critical_path():
+    t = make_tree()
+    cp = t.critical_path()
+    assert [n.name for n in cp.nodes] == ["main", "b", "d"]
+    assert cp.self_s == [2.0, 5.0, 3.0]
+    assert math.isclose(sum(cp.self_s), 10.0)
+    slack = {n.name: s for n, s in cp.slack}
+    # a, c and the children of a may end as late as d starts
+    assert slack == {"a": 2.0, "x": 4.0, "y": 2.5, "c": 3.0}
+    graph = t.get_graph(mode="critical")
+    assert "b(5.0000) 🔥self=5.0000" in graph and "c(2.0000) slack=3.0000" in graph
+    assert "🔥" not in t.get_graph()
+    with pytest.raises(ValueError):
+        t.get_graph(mode="flame")
+
+
+def test_summary():
+    trees = [make_tree(100.0 * i) for i in range(3)]
+    by_name = critical_path_summary(trees + [trees[0].repr()])
+    main = by_name["main"]
+    assert list(main) == ["b", "d", "main", "a", "x", "y", "c"]
+    assert main["b"]["count"] == 4 and main["b"]["self_s"] == 20.0
+    assert main["b"]["share"] == 0.5 and main["c"]["slack_s"] == 3.0
+    assert main["a"]["count"] == 0 and math.isnan(main["d"]["slack_s"])
+    assert "main/a/x" in critical_path_summary(trees, by="path")["main"]
+
+
+async def work(n):
+    await asyncio.sleep(0.002 * n)
+
+
+async def fan_out():
+    await asyncio.gather(work(1), work(5), work(2))
+    await work(1)
+
+
+def test_driver():
+    mod = __name__
+    table = [[mod, "", "fan_out", "fan_out"], [mod, "", "work", "work"]]
+    driver = hiq.HiQLatency(hiq_table_or_path=table, max_hiq_size=4)
+    try:
+        for i in range(2):
+            driver.get_tau_id = lambda: f"req-{i}"
+            asyncio.run(sys.modules[__name__].fan_out())
+    finally:
+        driver.disable_hiq()
+    summary = driver.get_critical_path_summary()["__fan_out"]
+    # the longest of the gathered calls and the last call are on the path
+    assert summary["__work"]["count"] == 4
+    assert summary["__work"]["share"] > 0.7
+    assert summary["__work"]["slack_s"] >= 0.005
@@ -0,0 +1,60 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import multiprocessing as mp
+import os
+import sys
+import threading
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+from multiprocessing import shared_memory
+
+from hiq.hiq_utils import HiQStatusWord
+
+N_PROC, N_SET = 4, 20000
+
+
+def setter(name, i):
+    w = HiQStatusWord(name)
+    for j in range(N_SET):
+        w.set((i + j) % 2)
+    assert w.generation() >= N_SET
+    w.detach()
+
+
+def test_concurrent_set():
+    name = f"hiq_test_{os.getpid()}"
+    w = HiQStatusWord(name, default=True)
+    try:
+        assert w.is_on() and w.generation() == 0
+        ctx = mp.get_context("fork")
+        procs = [ctx.Process(target=setter, args=(name, i)) for i in range(N_PROC)]
+        threads = [threading.Thread(target=setter, args=(name, i)) for i in range(2)]
+        for p in procs:
+            p.start()
+        for t in threads:
+            t.start()
+        for p in procs:
+            p.join()
+            assert p.exitcode == 0
+        for t in threads:
+            t.join()
+        # no bump is lost, and a fresh mapping sees the same words
+        other = HiQStatusWord(name)
+        assert w.generation() == other.generation() == (N_PROC + 2) * N_SET
+        w.set(False)
+        assert not other.is_on()
+        other.detach()
+    finally:
+        w.detach()
+        try:
+            shm = shared_memory.SharedMemory(name=w.shm_name)
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
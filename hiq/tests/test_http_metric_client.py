@@ -0,0 +1,161 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+from hiq.http_metric_client import HttpMetricsClient
+from hiq.vendor_oci_t2 import OciT2Client
+
+
+class MetricsServer(object):
+    """a local stand-in of the metrics server, failing the first `fail` requests"""
+
+    def __init__(self, fail=0, status=503):
+        self.bodies, self.ports, self.fail, self.status = [], set(), fail, status
+        self.encodings = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                server.ports.add(self.client_address[1])
+                if server.fail > 0:
+                    server.fail -= 1
+                    self.send_response(server.status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                encoding = self.headers.get("Content-Encoding")
+                server.encodings.append(encoding)
+                if encoding == "gzip":
+                    body = gzip.decompress(body)
+                server.bodies.append((self.path, json.loads(body)))
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def metrics(self):
+        return [m for _, info in self.bodies for m in info["metrics"]]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    s = MetricsServer()
+    yield s
+    s.close()
+
+
+def test_submit_drains_the_queue(server):
+    client = HttpMetricsClient(url=server.url, ad_longform="ad-1")
+    for i in range(10):
+        client.gauge_metric("retry_count", i)
+    client.submit_metrics_queue()
+    assert client.metrics_queue.empty()
+    assert [m["datapoints"][0]["value"] for m in server.metrics()] == list(range(10))
+    path, info = server.bodies[0]
+    assert path == "/aggregation" and info["availabilityDomain"] == "ad-1"
+    with pytest.raises(ValueError):
+        client.submit_metrics_queue()
+    client.gauge_metric("retry_count", 10)
+    client.submit_metrics_queue()
+    # nothing is sent twice
+    assert len(server.metrics()) == 11
+    client.close()
+    # plain JSON, unless gzip is asked for
+    client = HttpMetricsClient(url=server.url, compress=True)
+    client.gauge_metric("retry_count", 11)
+    client.submit_metrics_queue()
+    assert server.encodings == [None, None, "gzip"]
+    assert server.metrics()[-1]["datapoints"][0]["value"] == 11
+    client.close()
+
+
+def test_batches_are_capped_and_share_a_connection(server):
+    client = HttpMetricsClient(url=server.url, max_batch=7, max_batch_bytes=600)
+    for i in range(50):
+        client.gauge_metric(f"m{i}", i)
+    assert client.flush()
+    sizes = [len(info["metrics"]) for _, info in server.bodies]
+    assert sum(sizes) == 50 and max(sizes) <= 7
+    assert all(len(json.dumps(info["metrics"])) <= 600 for _, info in server.bodies)
+    assert len(server.bodies) > 50 // 7
+    # keep-alive: one TCP connection for all the requests
+    assert len(server.ports) == 1
+    assert client.stats["requests"] == len(server.bodies)
+    client.close()
+
+
+def test_retry_with_backoff():
+    server = MetricsServer(fail=2)
+    client = HttpMetricsClient(url=server.url, retries=3, backoff=0.01)
+    client.gauge_metric("m", 1)
+    assert client.flush()
+    assert len(server.metrics()) == 1
+    assert client.stats["retries"] == 2 and client.stats["failed"] == 0
+    server.close()
+
+
+def test_give_up_and_do_not_retry_client_errors():
+    server = MetricsServer(fail=10)
+    client = HttpMetricsClient(url=server.url, retries=2, backoff=0.01)
+    client.gauge_metric("m", 1)
+    assert not client.flush()
+    assert client.stats["retries"] == 2 and client.stats["failed"] == 1
+    server.close()
+
+    server = MetricsServer(fail=10, status=400)
+    client = HttpMetricsClient(url=server.url, retries=2, backoff=0.01)
+    client.gauge_metric("m", 1)
+    assert not client.flush()
+    assert client.stats["retries"] == 0 and client.stats["failed"] == 1
+    server.close()
+
+
+def test_connection_error_is_retried():
+    server = MetricsServer()
+    url = server.url
+    server.close()
+    client = HttpMetricsClient(url=url, retries=1, backoff=0.01, timeout=1)
+    client.gauge_metric("m", 1)
+    assert not client.flush()
+    assert client.stats["retries"] == 1 and client.stats["failed"] == 1
+
+
+def test_background_flusher(server):
+    client = OciT2Client(url=server.url, flush_interval=0.05)
+    client.timing_metric("latency", time.monotonic())
+    deadline = time.monotonic() + 5
+    while not server.bodies and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(server.metrics()) == 1
+    client.gauge_metric("m", 2)
+    client.close()
+    # close() submits what is left
+    assert len(server.metrics()) == 2
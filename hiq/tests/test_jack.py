@@ -0,0 +1,86 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import multiprocessing as mp
+import os
+import sys
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+from hiq.jack import Jack
+from hiq.overhead import OverheadMeter
+from hiq.tree import Tree
+
+
+class BadTree(object):
+    def repr(sf):
+        raise RuntimeError("can not format")
+
+
+def tree(name="__main"):
+    t = Tree(extra={}, tid="time")
+    t.start(name, 1.0)
+    t.end(name, 2.0)
+    return t
+
+
+@pytest.fixture
+def jack(monkeypatch):
+    monkeypatch.setenv("JACK", "1")
+    monkeypatch.setenv("NO_JACK_LOG", "1")
+    monkeypatch.setenv("HIQ_JACK_RING_MB", "1")
+    j = Jack()
+    # what `send_trees_to_jack` needs of a driver
+    j.check_oh_counter, j.overhead_meter = 0, OverheadMeter()
+    yield j
+    j.close_jack()
+    # the Jack process stops by itself
+    assert not j.consumer.is_alive()
+
+
+def test_flusher_goes_on(jack, capsys):
+    jack.send_trees_to_jack([("r1", {"time": BadTree()}), ("r2", {"time": tree()})])
+    assert jack.flush_jack()
+    jack.send_trees_to_jack({"time": tree()})
+    assert jack.flush_jack()
+    assert jack.jack_flusher.is_alive()
+    assert jack.jack_stats() == {"enqueued": 3, "dropped": 0, "exported": 2, "failed": 1, "depth": 0}
+    assert "Jack failed to encode the tree of time" in capsys.readouterr().err
+
+
+def test_bad_frame(jack):
+    ring = jack.queue_jack
+    # the trees of a frame the Jack process can not decode are counted as failed
+    assert ring.put(b"\x09not a frame", 5)
+    jack.send_trees_to_jack({"time": tree()})
+    assert jack.flush_jack()
+    assert ring.items() == (1, 5) and jack.consumer.is_alive()
+
+
+def in_child(jack):
+    # Jack is off in a forked child, and its teardown leaves the parent's alone
+    assert jack.queue_jack is None and jack.consumer is None and jack.jack_stop is None
+    jack.send_trees_to_jack({"time": tree()})
+    assert jack.flush_jack(timeout=0.1)
+    assert jack.jack_stats()["enqueued"] == 0
+    jack.close_jack()
+
+
+def test_fork(jack):
+    jack.send_trees_to_jack({"time": tree()})
+    assert jack.flush_jack()
+    p = mp.get_context("fork").Process(target=in_child, args=(jack,))
+    p.start()
+    p.join(30)
+    assert p.exitcode == 0
+    assert jack.consumer.is_alive() and jack.jack_flusher.is_alive()
+    assert not jack.jack_stop.is_set()
+    jack.send_trees_to_jack({"time": tree()})
+    assert jack.flush_jack()
+    assert jack.jack_stats()["exported"] == 2
@@ -0,0 +1,143 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import json
+import multiprocessing as mp
+import os
+import sys
+import threading
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+from hiq.lmk_events import EventBuffer, decode_events, encode_events, events_to_jsonl
+from hiq.monkeyking import LogMonkeyKing
+from hiq.overflow import OVERFLOW_DROP_NEWEST, Overflow
+
+
+class Locked(Exception):
+    """an exception which can not be pickled"""
+
+    def __init__(sf):
+        super().__init__("locked")
+        sf.lock = threading.Lock()
+
+
+def test_buffer_threads():
+    buf = EventBuffer()
+
+    def add(i):
+        for j in range(100):
+            buf.add(f"t{i}", "__f", float(j), {}, j % 2 == 0)
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(buf) == 800 and buf.counts() == (800, 0)
+    events = buf.drain()
+    assert len(events) == 800
+    # in order within a thread
+    t3 = [e[2] for e in events if e[0] == "t3"]
+    assert t3 == [float(j) for j in range(100)]
+    # the buffers of the threads which have ended are forgotten once empty
+    assert buf.buffers == [] and buf.counts() == (800, 0) and bool(buf)
+
+
+@pytest.mark.parametrize("policy", ["drop_oldest", OVERFLOW_DROP_NEWEST])
+def test_buffer_overflow(policy):
+    buf = EventBuffer(Overflow(3, policy))
+    for j in range(5):
+        buf.add("t", "__f", float(j), {}, True)
+    assert buf.counts() == (5, 2)
+    values = [e[2] for e in buf.drain()]
+    assert values == ([2.0, 3.0, 4.0] if policy == "drop_oldest" else [0.0, 1.0, 2.0])
+
+
+def test_encode():
+    events = [
+        ("t1", "__main", 1.5, {}, True, 10),
+        ("t1", "__f", 2.0, {"args": "(1,)"}, True, 11),
+        ("t1", "__f", 3.0, {"exception": ValueError("boom")}, False, 12),
+        ("t🦉", "__main", 4.0, {}, False, 13),
+    ]
+    got = decode_events(encode_events(events))
+    assert [e[:3] + e[4:] for e in got] == [e[:3] + e[4:] for e in events]
+    assert got[1][3] == {"args": "(1,)"} and repr(got[2][3]["exception"]) == "ValueError('boom')"
+    lines = [json.loads(x) for x in events_to_jsonl(got, 7).splitlines()]
+    assert lines[2]["extra"] == {"exception": "boom"} and lines[3]["id"] == "t🦉"
+    # the values which can not be pickled are kept as their repr()
+    events[2] = ("t1", "__f", 3.0, {"exception": Locked(), "n": 1}, False, 12)
+    got = decode_events(encode_events(events))
+    assert got[2][3] == {"exception": "Locked('locked')", "n": 1}
+    assert got[1][3] == {"args": "(1,)"}
+
+
+@pytest.fixture
+def lmk(monkeypatch, tmp_path):
+    monkeypatch.setenv("LMK", "1")
+    monkeypatch.setenv("HIQ_LMK_FORMAT", "jsonl")
+    monkeypatch.setenv("HIQ_LMK_RING_MB", "1")
+    path = tmp_path / "lmk.jsonl"
+    m = LogMonkeyKing(lmk_path=str(path))
+    yield m, path
+    m.close_lmk()
+    m.consumer.terminate()
+    m.consumer.join()
+
+
+def test_flusher_goes_on(lmk, capsys):
+    m, path = lmk
+    m.queue_lmk.add("t1", "__f", 1.0, {"exception": Locked()}, True)
+    assert m.flush_lmk()
+    # a value `array('d')` rejects fails the frame, not the flusher
+    m.queue_lmk.add("t2", "__f", "not a number", {}, True)
+    assert m.flush_lmk()
+    m.queue_lmk.add("t3", "__f", 2.0, {}, False)
+    assert m.flush_lmk()
+    assert m.lmk_flusher.is_alive()
+    stats = m.lmk_stats()
+    assert stats == {"enqueued": 3, "dropped": 0, "exported": 2, "failed": 1, "depth": 0}
+    lines = [json.loads(x) for x in path.read_text().splitlines()]
+    assert [x["id"] for x in lines] == ["t1", "t3"]
+    assert lines[0]["extra"] == {"exception": "Locked('locked')"}
+    assert "LMK failed to encode 1 events" in capsys.readouterr().err
+
+
+def test_bad_frame(lmk):
+    m, path = lmk
+    ring = m.lmk_ring
+    # the events of a frame the LMK process can not decode are counted as failed
+    assert ring.put(b"\x00\x01", 7)
+    m.queue_lmk.add("t1", "__f", 1.0, {}, True)
+    assert m.flush_lmk()
+    assert ring.items() == (1, 7) and m.consumer.is_alive()
+    assert [json.loads(x)["id"] for x in path.read_text().splitlines()] == ["t1"]
+
+
+def in_child(m):
+    # LMK is off in a forked child, and its teardown leaves the parent's alone
+    assert m.queue_lmk is None and m.consumer is None
+    m.lmk_events.add("child", "__f", 1.0, {}, True)
+    assert len(m.lmk_events) == 0
+    assert m.flush_lmk(timeout=0.1)
+    m.close_lmk()
+
+
+def test_fork(lmk):
+    m, path = lmk
+    m.queue_lmk.add("t1", "__f", 1.0, {}, True)
+    p = mp.get_context("fork").Process(target=in_child, args=(m,))
+    p.start()
+    p.join(30)
+    assert p.exitcode == 0
+    assert m.consumer.is_alive() and m.lmk_flusher.is_alive()
+    m.queue_lmk.add("t2", "__f", 2.0, {}, True)
+    assert m.flush_lmk()
+    assert [json.loads(x)["id"] for x in path.read_text().splitlines()] == ["t1", "t2"]
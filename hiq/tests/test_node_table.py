@@ -0,0 +1,108 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import os
+import sys
+import time
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+np = pytest.importorskip("numpy")
+
+import hiq
+from hiq.node_table import NodeTable, group_stats
+from hiq.tree import Tree
+
+
+def leaf():
+    time.sleep(0.001)
+
+
+def handler(n=2):
+    for _ in range(n):
+        leaf()
+
+
+def make_tree(i):
+    t = Tree(extra={}, tid=str(i))
+    t.start("main", 100.0 * i)
+    t.start("f", 100.0 * i + 1)
+    t.start("g", 100.0 * i + 1)
+    # an extra looking like nodes does not break the text
+    t.end("g", 100.0 * i + 1 + i, {"tag": "[x,1,2,0$0#]]"} if i == 2 else None)
+    t.end("f", 100.0 * i + 3 + i)
+    t.start("g", 100.0 * i + 4 + i)
+    t.end("g", 100.0 * i + 5 + i)
+    t.end("main", 100.0 * i + 10 + i)
+    return t
+
+
+def rows(nt):
+    """the rows with the path names, the path ids depend on the order they are found"""
+    return [
+        (int(n["req"]), nt.path_name(n["path"]), nt.names[n["name"]], int(n["depth"]), n["start"], n["end"])
+        for n in nt.nodes
+    ]
+
+
+def test_group_stats():
+    keys = np.array([1, 0, 1, 1, 0, 1])
+    values = np.array([4.0, 10.0, 1.0, 3.0, 20.0, 2.0])
+    k, cols = group_stats(keys, values)
+    assert list(k) == [0, 1]
+    assert list(cols["count"]) == [2, 4]
+    assert list(cols["sum"]) == [30.0, 10.0]
+    assert list(cols["max"]) == [20.0, 4.0]
+    for q in (0.5, 0.9, 0.99):
+        expected = [np.quantile(values[keys == i], q) for i in (0, 1)]
+        assert np.allclose(cols[f"p{q * 100:g}"], expected)
+
+
+def test_trees_and_text():
+    trees = [(f"req-{i}", make_tree(i)) for i in range(1, 4)]
+    nt = NodeTable.from_trees(trees)
+    assert len(nt) == 12 and nt.req_ids == ["req-1", "req-2", "req-3"]
+    assert nt.names == ["main", "f", "g"]
+    assert [nt.path_name(i) for i in range(len(nt.paths))] == ["main", "main/f", "main/f/g", "main/g"]
+    assert list(nt.nodes["depth"][:4]) == [0, 1, 2, 1]
+    by_name = nt.group_by("name")
+    assert list(by_name) == ["main", "f", "g"]
+    assert by_name["main"]["count"] == 3 and by_name["main"]["sum"] == 36.0
+    assert by_name["g"]["count"] == 6 and by_name["g"]["max"] == 3.0
+    by_path = nt.group_by("path")
+    assert by_path["main/f/g"]["mean"] == 2.0 and by_path["main/g"]["p99"] == 1.0
+    # the same table from the text of the trees, as Jack logs them
+    lines = [f"time,{t.repr()}\n" for _, t in trees] + [f"other,{trees[0][1].repr()}\n"]
+    from_log = NodeTable.from_jack_log(lines)
+    assert from_log.req_ids == [0, 1, 2]
+    assert rows(from_log) == rows(nt)
+    with pytest.raises(ValueError):
+        nt.group_by("depth")
+
+
+def test_driver():
+    mod = __name__
+    table = [[mod, "", "handler", "handler"], [mod, "", "leaf", "leaf"]]
+    driver = hiq.HiQLatency(hiq_table_or_path=table, max_hiq_size=10)
+    try:
+        for i in range(3):
+            driver.get_tau_id = lambda: f"req-{i}"
+            sys.modules[__name__].handler(i + 1)
+        nt = driver.get_node_table()
+    finally:
+        driver.disable_hiq()
+    assert nt.req_ids == ["req-0", "req-1", "req-2"]
+    stats = nt.group_by("path")
+    assert stats["__handler"]["count"] == 3
+    assert stats["__handler/__leaf"]["count"] == 6
+    assert stats["__handler/__leaf"]["p50"] >= 0.001
+    spans = {k: t["time"].duration_by_name_s() for k, t in driver.tau.items()}
+    assert nt.group_by()["__leaf"]["sum"] == pytest.approx(
+        sum(d["__leaf"] for d in spans.values())
+    )
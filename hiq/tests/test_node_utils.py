@@ -0,0 +1,113 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import os
+import sys
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+import itree
+from hiq.node import Node
+from hiq.node_utils import _c, _d, b64_str_to_dict, is_str_dict, iter_nodes, str_to_number
+from hiq.tree import Tree
+
+LOG = os.path.join(cur_dir, "data/log_jack.log")
+
+
+def old_c(bs: str) -> Node:
+    """the parser `_c` replaced, character by character"""
+
+    def parse(s):
+        _start, _end, _extra = s.split(",")
+        if _extra and _extra != "inf":
+            _extra = b64_str_to_dict(_extra)
+        if _extra and isinstance(_extra, str) and not is_str_dict(_extra):
+            _extra = {}
+        if _extra == "":
+            _extra = {}
+        return str_to_number(_start), str_to_number(_end), _extra
+
+    def close(node, s):
+        kv = s.split(":")
+        node.name = kv[0][1:-1]
+        node.start, node.end, node.extra = parse(kv[1])
+
+    stk_ = [itree.create_virtual_node()]
+    s = ""
+    for ch in bs:
+        if ch == "{":
+            if len(stk_) == 1:
+                stk_.append(Node("", 0, 0))
+                stk_[0].append(stk_[1])
+            else:
+                if s:
+                    close(stk_[-1], s)
+                    s = ""
+                t = Node("", 0, 0)
+                stk_[-1].append(t)
+                stk_.append(t)
+        elif ch == "}":
+            if s:
+                close(stk_[-1], s)
+                s = ""
+            if len(stk_) > 1:
+                stk_.pop()
+        else:
+            s += ch
+    assert len(stk_) == 1, "bad tree data"
+    return itree._itree.consolidate(stk_[0])
+
+
+def shape(node):
+    return (node.name, node.start, node.end, dict(node.extra), [shape(c) for c in node.nodes])
+
+
+def lines():
+    with open(LOG) as f:
+        return f.read().splitlines()
+
+
+def test_c_matches_old_parser():
+    n = 0
+    for line in lines():
+        i = line.find('{"')
+        if i < 0 or not line.endswith("}"):
+            continue
+        new = _c(line[i:])
+        assert shape(new) == shape(old_c(line[i:]))
+        assert shape(_c(_d(new))) == shape(old_c(_d(new)))
+        n += 1
+    assert n == 6
+
+
+def test_c_names():
+    t = Tree(extra={}, tid="time")
+    t.start('a:{b}"c"', 1.0, {"k": "v:1,{}"})
+    t.end('a:{b}"c"', 2.0)
+    # the old parser split the name at ':' and the nodes at '{'
+    node = _c(_d(t.root))
+    assert node.nodes[0].name == 'a:{b}"c"' and node.nodes[0].extra == {"k": "v:1,{}"}
+    with pytest.raises(ValueError):
+        _c('{"None":1,2,{"f":1,2,}}x')
+
+
+def test_iter_nodes():
+    with open(LOG) as f:
+        nodes = list(iter_nodes(f, with_key=True))
+    # the line cut by log rotation and the one without a tree are skipped
+    assert [k for k, _ in nodes] == ["time"] * 7
+    by_d = [old_c(line[line.find('{"') :]) for line in lines()[:6]]
+    assert [shape(n) for _, n in nodes[:6]] == [shape(n) for n in by_d]
+    # a line of `Tree.repr()` parses like the `_d` line of the same tree
+    repr_line = lines()[6]
+    root = Tree(repr_line[repr_line.find("t1^") :]).root
+    assert shape(nodes[6][1]) == shape(root)
+    assert [c.name for c in nodes[6][1].nodes[0].nodes] == ["__load", "__run"]
+    with pytest.raises(Exception):
+        list(iter_nodes(lines(), strict=True))
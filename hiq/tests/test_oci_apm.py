@@ -0,0 +1,143 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+pytest.importorskip("py_zipkin")
+pytest.importorskip("requests")
+
+from py_zipkin import Encoding
+from py_zipkin.zipkin import zipkin_span
+
+from hiq.vendor_oci_apm import (
+    OciApmHttpTransport,
+    SpanShipper,
+    get_oci_apm_endpoint,
+    get_span_shipper,
+)
+
+
+class ApmServer(object):
+    """a local stand-in of the APM endpoint, slow, and failing the first `fail` posts"""
+
+    def __init__(self, delay=0.0, fail=0):
+        self.posts, self.ports, self.delay, self.fail = [], set(), delay, fail
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                server.ports.add(self.client_address[1])
+                time.sleep(server.delay)
+                status = 200
+                if server.fail > 0:
+                    server.fail -= 1
+                    status = 503
+                else:
+                    server.posts.append((self.path, json.loads(body)))
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def spans(self):
+        return [span for _, spans in self.posts for span in spans]
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def apm(monkeypatch):
+    server = ApmServer(delay=0.3)
+    monkeypatch.setenv("APM_BASE_URL", server.url)
+    monkeypatch.setenv("APM_PUB_KEY", "KEY")
+    yield server
+    server.close()
+
+
+def traced(n):
+    for i in range(n):
+        with zipkin_span(
+            service_name="hiq_test_apm",
+            span_name=f"request_{i}",
+            transport_handler=OciApmHttpTransport,
+            encoding=Encoding.V2_JSON,
+            sample_rate=100,
+        ):
+            with zipkin_span(service_name="hiq_test_apm", span_name="child"):
+                pass
+
+
+def test_spans_are_shipped_in_batches(apm):
+    start = time.monotonic()
+    traced(20)
+    # the server takes 0.3s per post, the traced requests do not wait for it
+    assert time.monotonic() - start < 0.3
+    shipper = get_span_shipper(get_oci_apm_endpoint())
+    assert shipper.flush()
+    spans = apm.spans()
+    assert len(spans) == 40
+    assert sorted(s["name"] for s in spans if s["name"] != "child") == sorted(
+        f"request_{i}" for i in range(20)
+    )
+    assert len(apm.posts) < 20
+    path, _ = apm.posts[0]
+    assert path.startswith("/20200101/observations/public-span?") and "dataKey=KEY" in path
+    assert len(apm.ports) == 1
+    assert shipper.stats["spans"] == 40 and shipper.stats["failed"] == 0
+    shipper.close()
+
+
+def test_sync_mode(apm, monkeypatch):
+    monkeypatch.setenv("APM_SYNC", "1")
+    start = time.monotonic()
+    traced(1)
+    assert time.monotonic() - start >= 0.3
+    assert len(apm.spans()) == 2
+
+
+def test_retries_and_size_cap():
+    server = ApmServer(fail=2)
+    shipper = SpanShipper(server.url, interval=0.01, backoff=0.001, max_batch_bytes=400)
+    span = json.dumps([{"traceId": "a" * 16, "id": "b" * 16, "name": "x" * 100}])
+    for _ in range(10):
+        shipper.put(span)
+    assert shipper.flush()
+    assert len(server.spans()) == 10
+    assert all(len(json.dumps(spans)) <= 400 for _, spans in server.posts)
+    assert shipper.stats["retries"] == 2 and shipper.stats["failed"] == 0
+    shipper.close()
+    server.close()
+
+
+def test_give_up_after_retries():
+    server = ApmServer(fail=10)
+    shipper = SpanShipper(server.url, interval=0.01, backoff=0.001, retries=2)
+    shipper.put('[{"traceId": "a", "id": "b"}, {"traceId": "a", "id": "c"}]')
+    assert shipper.flush()
+    assert shipper.stats["failed"] == 2 and shipper.stats["retries"] == 2
+    shipper.close()
+    server.close()
@@ -0,0 +1,199 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import multiprocessing as mp
+import os
+import sys
+from base64 import b64decode
+from types import SimpleNamespace
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+import hiq.jack
+from hiq.jack import Jack
+from hiq.shm_ring import ShmRing, encode_frame
+from hiq.utils import Singleton
+from hiq.vendor_oci_streaming import (
+    MAX_MESSAGES_PER_REQUEST,
+    MAX_REQUEST_BYTES,
+    OciStreamingClient,
+    StreamBatcher,
+    decode_message_value,
+)
+
+
+class PutMessagesDetails(object):
+    def __init__(self, messages):
+        self.messages = messages
+
+
+class PutMessagesDetailsEntry(object):
+    def __init__(self, key, value):
+        self.key, self.value = key, value
+
+
+models = SimpleNamespace(
+    PutMessagesDetails=PutMessagesDetails, PutMessagesDetailsEntry=PutMessagesDetailsEntry
+)
+
+
+class ServiceError(Exception):
+    def __init__(self, status):
+        self.status = status
+
+
+class FakeStreamClient(object):
+    """a local stand-in of `oci.streaming.StreamClient`, which checks the limits of
+    a request, and fails the entries of `fail_keys` once and the first `errors`
+    requests"""
+
+    def __init__(self, fail_keys=(), errors=(), reject_once=True):
+        self.messages, self.requests = [], 0
+        self.fail_keys, self.errors, self.reject_once = set(fail_keys), list(errors), reject_once
+
+    def put_messages(self, stream_id, details):
+        assert stream_id == "ocid1.stream"
+        self.requests += 1
+        if self.errors:
+            raise ServiceError(self.errors.pop(0))
+        entries = details.messages
+        assert len(entries) <= MAX_MESSAGES_PER_REQUEST
+        assert sum(len(e.key) + len(e.value) for e in entries) <= MAX_REQUEST_BYTES
+        results = []
+        for e in entries:
+            key = decode_message_value(e.key)
+            if key in self.fail_keys:
+                if self.reject_once:
+                    self.fail_keys.discard(key)
+                results.append(SimpleNamespace(error="InternalServerError", error_message="retry"))
+            else:
+                self.messages.append((key, decode_message_value(e.value)))
+                results.append(SimpleNamespace(error=None, partition="0", offset=len(self.messages)))
+        return SimpleNamespace(data=SimpleNamespace(entries=results))
+
+
+def new_batcher(client, **kwargs):
+    kwargs.setdefault("interval", 0.01)
+    kwargs.setdefault("backoff", 0.001)
+    return StreamBatcher(client, "ocid1.stream", models=models, **kwargs)
+
+
+def test_batches_within_the_limits():
+    client = FakeStreamClient()
+    batcher = new_batcher(client, compress=False)
+    big = "x" * 300_000
+    for i in range(250):
+        batcher.put(f"k{i}", big if i % 50 == 0 else f"tree {i}")
+    assert batcher.flush()
+    assert [k for k, _ in client.messages] == [f"k{i}" for i in range(250)]
+    assert client.messages[1] == ("k1", "tree 1")
+    assert client.requests < 250 // 10
+    assert batcher.stats["sent"] == 250 and batcher.stats["failed"] == 0
+    batcher.close()
+
+
+def test_compressed_values():
+    client = FakeStreamClient()
+    batcher = new_batcher(client, compress=True)
+    value = "time,v2,0," + "[🍁 n=fruit,s=0.00,e=40.00,x=0,c=0]" * 1000
+    assert len(batcher._encode("hiq", value)[1]) < len(value) // 10
+    batcher.put("hiq", value)
+    assert batcher.flush()
+    assert client.messages == [("hiq", value)]
+    batcher.close()
+    # opt-in only
+    batcher = new_batcher(client)
+    assert b64decode(batcher._encode("hiq", value)[1]) == value.encode()
+    batcher.close()
+
+
+def test_retry_failed_entries_only():
+    client = FakeStreamClient(fail_keys={"k3", "k7"})
+    batcher = new_batcher(client)
+    for i in range(10):
+        batcher.put(f"k{i}", str(i))
+    assert batcher.flush()
+    keys = [k for k, _ in client.messages]
+    assert sorted(keys) == sorted(f"k{i}" for i in range(10))
+    assert len(keys) == 10
+    assert batcher.stats["retries"] == 2 and batcher.stats["sent"] == 10
+    batcher.close()
+
+
+def test_retry_throttled_requests_and_give_up():
+    client = FakeStreamClient(errors=[429, 503])
+    batcher = new_batcher(client)
+    batcher.put("k", "v")
+    assert batcher.flush()
+    assert client.messages == [("k", "v")] and client.requests == 3
+
+    client = FakeStreamClient(errors=[400])
+    batcher = new_batcher(client)
+    batcher.put("k", "v")
+    assert batcher.flush()
+    assert client.requests == 1 and batcher.stats["failed"] == 1
+
+    client = FakeStreamClient(fail_keys={"k"}, reject_once=False)
+    batcher = new_batcher(client, retries=2)
+    batcher.put("k", "v")
+    assert batcher.flush()
+    assert client.requests == 3 and batcher.stats["failed"] == 1
+    batcher.close()
+
+
+def test_oversized_message_is_dropped():
+    client = FakeStreamClient()
+    batcher = new_batcher(client, compress=False)
+    batcher.put("big", "x" * MAX_REQUEST_BYTES)
+    batcher.put("small", "y")
+    assert batcher.flush()
+    assert client.messages == [("small", "y")]
+    assert batcher.stats["failed"] == 1
+    batcher.close()
+
+
+def test_produce_messages_is_queued():
+    Singleton._instances.pop(OciStreamingClient, None)
+    client = FakeStreamClient()
+    producer = OciStreamingClient("https://streaming", "ocid1.stream", client=client, models=models)
+    try:
+        for i in range(20):
+            producer.produce_messages("hiq", f"tree {i}")
+        assert producer.flush()
+        assert len(client.messages) == 20 and client.requests < 20
+        assert producer.stats()["sent"] == 20
+    finally:
+        producer.batcher.close()
+        Singleton._instances.pop(OciStreamingClient, None)
+
+
+def test_jack_counts_sent_trees(monkeypatch):
+    monkeypatch.setenv("NO_JACK_LOG", "1")
+    monkeypatch.delenv("OCI_STM_COMPRESS", raising=False)
+    Singleton._instances.pop(OciStreamingClient, None)
+    client = FakeStreamClient()
+    monkeypatch.setattr(
+        hiq.jack,
+        "get_kafka",
+        lambda: OciStreamingClient("https://streaming", "ocid1.stream", client=client, models=models),
+    )
+    ctx = mp.get_context("fork")
+    ring, stop = ShmRing(4 << 20), ctx.Event()
+    try:
+        p = ctx.Process(target=Jack.consumer_func, args=(ring, ctx.Lock(), stop))
+        p.start()
+        # the big tree is over the limit of a request, so the batcher fails it
+        assert ring.put(encode_frame([("time", "x" * MAX_REQUEST_BYTES), ("time", "t1")]), 2)
+        assert ring.put(encode_frame([("time", "t2")]), 1)
+        # the Jack process sends what is queued before it stops
+        stop.set()
+        p.join(30)
+        assert p.exitcode == 0
+        assert ring.items() == (2, 1) and ring.pending() == 0
+    finally:
+        ring.close()
+        Singleton._instances.pop(OciStreamingClient, None)
@@ -0,0 +1,182 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+pytest.importorskip("opentelemetry.sdk")
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import StatusCode
+
+import hiq
+from hiq.otm_export import get_otm_exporter
+
+exporter = InMemorySpanExporter()
+provider = TracerProvider()
+provider.add_span_processor(BatchSpanProcessor(exporter))
+trace.set_tracer_provider(provider)
+
+inside = []
+
+
+def leaf():
+    inside.append(trace.get_current_span().get_span_context().is_valid)
+    time.sleep(0.001)
+
+
+def handler(fail=False):
+    leaf()
+    leaf()
+    if fail:
+        raise ValueError("boom")
+
+
+rid = ContextVar("rid", default=None)
+local = threading.local()
+
+
+def get_id():
+    return rid.get() or local.rid
+
+
+def pool_leaf(req_id):
+    local.rid = req_id
+    with trace.get_tracer("test").start_as_current_span("work"):
+        leaf()
+
+
+def fan_out():
+    with ThreadPoolExecutor(4) as ex:
+        list(ex.map(pool_leaf, [local.rid] * 4))
+
+
+async def achild():
+    # the child runs under a span of its own
+    with trace.get_tracer("test").start_as_current_span("work"):
+        await asyncio.sleep(0.001)
+        leaf()
+
+
+async def aserve():
+    await asyncio.gather(*(achild() for _ in range(3)))
+
+
+@pytest.fixture
+def driver(monkeypatch):
+    monkeypatch.setenv("TRACE_TYPE", "opentelemetry")
+    monkeypatch.setenv("HIQ_OTM_DEFERRED", "1")
+    mod = __name__
+    table = [[mod, "", x, x] for x in ("handler", "leaf", "fan_out", "achild", "aserve")]
+    exporter.clear()
+    inside.clear()
+    d = hiq.HiQLatency(hiq_table_or_path=table, max_hiq_size=2)
+    yield d
+    d.disable_hiq()
+
+
+def spans():
+    assert get_otm_exporter().flush()
+    provider.force_flush()
+    return exporter.get_finished_spans()
+
+
+def test_spans_from_tree(driver):
+    ids = iter(["req-1", "req-2"])
+    for _ in range(2):
+        req_id = next(ids)
+        driver.get_tau_id = lambda: req_id
+        sys.modules[__name__].handler()
+    # no span is open on the hot path
+    assert inside == [False] * 4
+    r = spans()
+    assert sorted(s.name for s in r) == ["__handler"] * 2 + ["__leaf"] * 4
+    roots = [s for s in r if s.name == "__handler"]
+    assert sorted(s.attributes["hiq.request_id"] for s in roots) == ["req-1", "req-2"]
+    for root in roots:
+        assert root.parent is None
+        children = [s for s in r if s.parent is not None and s.parent.span_id == root.context.span_id]
+        assert len(children) == 2
+        assert all(c.context.trace_id == root.context.trace_id for c in children)
+        assert all(root.start_time <= c.start_time <= c.end_time <= root.end_time for c in children)
+    tree = driver.tau["req-2"]["time"]
+    node = tree.root.nodes[0]
+    root = [s for s in roots if s.attributes["hiq.request_id"] == "req-2"][0]
+    assert root.start_time == int(node.start * 1e9) and root.end_time == int(node.end * 1e9)
+
+
+def test_parent_span_and_error(driver):
+    driver.get_tau_id = lambda: "req-3"
+    with trace.get_tracer("test").start_as_current_span("server") as server:
+        with pytest.raises(ValueError):
+            sys.modules[__name__].handler(fail=True)
+    r = spans()
+    root = [s for s in r if s.name == "__handler"][0]
+    assert root.parent.span_id == server.get_span_context().span_id
+    assert root.context.trace_id == server.get_span_context().trace_id
+    assert root.status.status_code == StatusCode.ERROR
+    # the next root call of the same request only exports itself
+    sys.modules[__name__].leaf()
+    assert [s.name for s in spans() if s.name != "server"].count("__leaf") == 3
+
+
+def test_concurrent_children(driver):
+    # the requests are in flight together
+    driver.set_retention(max_size=10)
+    driver.get_tau_id = get_id
+    tracer = trace.get_tracer("test")
+    m = sys.modules[__name__]
+    servers = {}
+
+    async def arequest(i):
+        rid.set(f"areq-{i}")
+        with tracer.start_as_current_span("server") as server:
+            servers[f"areq-{i}"] = server.get_span_context()
+            await m.aserve()
+
+    async def main():
+        await asyncio.gather(*(arequest(i) for i in range(4)))
+
+    def request(i):
+        local.rid = f"req-{i}"
+        with tracer.start_as_current_span("server") as server:
+            servers[f"req-{i}"] = server.get_span_context()
+            m.fan_out()
+
+    asyncio.run(main())
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    r = spans()
+    # each root call is handed off once, under the server span of its own request
+    roots = [s for s in r if s.name in ("__aserve", "__fan_out")]
+    assert len(roots) == 8
+    for root in roots:
+        server = servers[root.attributes["hiq.request_id"]]
+        assert root.parent.span_id == server.span_id
+        assert root.context.trace_id == server.trace_id
+    hiq_spans = [s for s in r if s.name.startswith("__")]
+    assert len(hiq_spans) == 4 * (1 + 3 + 3) + 4 * (1 + 4)
+    for root in roots:
+        tree = [s for s in hiq_spans if s.context.trace_id == root.context.trace_id]
+        assert len(tree) == (7 if root.name == "__aserve" else 5)
+        children = [s for s in tree if s.name == "__achild"]
+        assert all(s.parent.span_id == root.context.span_id for s in children)
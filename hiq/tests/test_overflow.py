@@ -0,0 +1,98 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+from hiq.overflow import (
+    OVERFLOW_BLOCK,
+    OVERFLOW_DROP_NEWEST,
+    OVERFLOW_DROP_OLDEST,
+    Overflow,
+    export_stats,
+    offer,
+)
+
+
+def test_drop_oldest():
+    buf, of = deque(), Overflow(5, OVERFLOW_DROP_OLDEST)
+    assert offer(buf, [1, 2, 3], of) == 0
+    assert offer(buf, [4, 5, 6, 7], of) == 2
+    assert list(buf) == [3, 4, 5, 6, 7]
+    # more than the capacity at once keeps the newest
+    assert offer(buf, list(range(10, 18)), of) == 8
+    assert list(buf) == [13, 14, 15, 16, 17]
+
+
+def test_drop_newest():
+    buf, of = deque(), Overflow(5, OVERFLOW_DROP_NEWEST)
+    assert offer(buf, [1, 2, 3], of) == 0
+    assert offer(buf, [4, 5, 6, 7], of) == 2
+    assert list(buf) == [1, 2, 3, 4, 5]
+    assert offer(buf, [8], of) == 1 and len(buf) == 5
+
+
+def test_block():
+    buf, of = deque(), Overflow(3, OVERFLOW_BLOCK, timeout=2)
+    offer(buf, [1, 2, 3], of)
+
+    def take():
+        time.sleep(0.05)
+        buf.popleft()
+        buf.popleft()
+
+    t = threading.Thread(target=take)
+    t.start()
+    # waits until the consumer makes room
+    assert offer(buf, [4, 5], of) == 0
+    t.join()
+    assert list(buf) == [3, 4, 5] and not of.stalled
+    # times out, then drops without waiting until the consumer makes progress
+    of.timeout = 0.05
+    t0 = time.monotonic()
+    assert offer(buf, [6], of) == 1
+    assert time.monotonic() - t0 >= 0.05 and of.stalled
+    t0 = time.monotonic()
+    assert offer(buf, [7], of) == 1 and time.monotonic() - t0 < 0.05
+    buf.popleft()
+    of.progress()
+    assert offer(buf, [8], of) == 0 and list(buf) == [4, 5, 8]
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv("HIQ_JACK_CAPACITY", "7")
+    monkeypatch.setenv("HIQ_JACK_OVERFLOW", "BLOCK")
+    monkeypatch.setenv("HIQ_JACK_BLOCK_MS", "250")
+    of = Overflow.from_env("jack", 10)
+    assert (of.capacity, of.policy, of.timeout) == (7, OVERFLOW_BLOCK, 0.25)
+    assert Overflow.from_env("lmk", 10).capacity == 10
+    with pytest.raises(ValueError):
+        Overflow(10, "drop_random")
+    with pytest.raises(ValueError):
+        Overflow(0)
+
+
+def test_export_stats():
+    class Ring:
+        def items(sf):
+            return 5, 1
+
+    assert export_stats(10, 2, Ring(), failed=1) == {
+        "enqueued": 10,
+        "dropped": 2,
+        "exported": 5,
+        "failed": 2,
+        "depth": 1,
+    }
+    assert export_stats(3, 0, None)["depth"] == 3
@@ -0,0 +1,84 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import asyncio
+import os
+import sys
+import time
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+import hiq
+from hiq.overhead import OH_METRIC, OVERHEAD_STAGES, OverheadMeter
+
+
+def test_meter():
+    meter = OverheadMeter()
+    meter.charge("a", 100)
+    meter.charge("a", 300)
+    meter.charge("b", 50)
+    meter.of("c")
+    assert meter.breakdown() == {"a": {"calls": 2, "total": 400}, "b": {"calls": 1, "total": 50}}
+    assert meter.total_ns() == 450
+    table = meter.table().splitlines()
+    # ns per call, the most expensive tag first
+    assert table[2].split() == ["a", "2", "200"] and table[3].split() == ["b", "1", "50"]
+
+    meter = OverheadMeter(stages=True)
+    acc = meter.of("a")
+    f = meter.timed(lambda: time.sleep(0.001) or 7, acc, OH_METRIC)
+    assert f() == 7 and acc[OH_METRIC] >= 1_000_000
+    meter.charge("a", 2_000_000)
+    d = meter.breakdown()["a"]
+    assert set(d) == {"calls", "total", *OVERHEAD_STAGES}
+    assert d["metric"] == acc[OH_METRIC] and d["record"] == d["total"] - d["metric"]
+    meter.reset()
+    assert meter.breakdown() == {} and meter.table() == ""
+
+
+def leaf():
+    pass
+
+
+def handler():
+    for _ in range(10):
+        leaf()
+
+
+async def ahandler():
+    leaf()
+
+
+def test_driver_stages():
+    mod = __name__
+    table = [[mod, "", x, x] for x in ("handler", "leaf", "ahandler")]
+    driver = hiq.HiQLatency(hiq_table_or_path=table, max_hiq_size=5)
+    m = sys.modules[__name__]
+    try:
+        driver.set_overhead_breakdown(stages=True)
+        for i in range(5):
+            driver.get_tau_id = lambda: f"req-{i}"
+            m.handler()
+            asyncio.run(m.ahandler())
+        oh = driver.get_overhead_breakdown()
+        assert oh["__leaf"]["calls"] == 55 and oh["__handler"]["calls"] == 5
+        assert oh["__ahandler"]["calls"] == 5
+        for tag, d in oh.items():
+            assert d["record"] >= 0 and d["metric"] > 0, tag
+            assert sum(d[k] for k in OVERHEAD_STAGES) == d["total"]
+        assert oh["__handler"]["id"] > 0 and oh["__handler"]["tree"] > 0
+        assert driver.overhead_us == driver.overhead_meter.total_ns() // 1000
+        tree = driver.get_metrics_by_k0("req-4")
+        assert 0 <= tree.extra["overhead"] <= driver.overhead_us
+        driver.set_overhead_breakdown(stages=False, reset=True)
+        m.handler()
+        oh = driver.get_overhead_breakdown()
+        assert {k: v["calls"] for k, v in oh.items()} == {"__handler": 1, "__leaf": 10}
+        assert set(oh["__leaf"]) == {"calls", "total"}
+        assert "__leaf" in driver.overhead_meter.table()
+    finally:
+        driver.disable_hiq()
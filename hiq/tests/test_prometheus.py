@@ -0,0 +1,99 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import os
+import sys
+import time
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+pytest.importorskip("prometheus_client")
+
+from prometheus_client import REGISTRY
+
+import hiq
+from hiq.prometheus import PROM_HISTOGRAM, PROM_SUMMARY, PrometheusConf
+
+
+def fast():
+    pass
+
+
+def slow():
+    fast()
+    time.sleep(0.02)
+
+
+def run(rows, monkeypatch):
+    monkeypatch.setenv("TRACE_TYPE", "prometheus")
+    mod = sys.modules[__name__].__name__
+    table = [[mod, "", "slow", "prom_slow"], [mod, "", "fast", "prom_fast"]] + rows
+    with hiq.HiQLatency(hiq_table_or_path=table) as driver:
+        for _ in range(3):
+            sys.modules[mod].slow()
+    return driver
+
+
+def test_conf(monkeypatch):
+    monkeypatch.setenv("HIQ_PROM_TYPE", "histogram")
+    monkeypatch.setenv("HIQ_PROM_BUCKETS", "1,0.1")
+    monkeypatch.setenv("HIQ_PROM_LABELS", "service=api, region=phx")
+    conf = PrometheusConf.from_env([["@prometheus", "buckets", "5,50", "func1"]])
+    assert conf.metric_type == PROM_HISTOGRAM
+    assert conf.buckets == (0.1, 1.0)
+    assert conf.target_buckets == {"func1": (5.0, 50.0)}
+    assert conf.labels == {"service": "api", "region": "phx"}
+    monkeypatch.delenv("HIQ_PROM_TYPE")
+    assert PrometheusConf.from_env().metric_type == PROM_SUMMARY
+    with pytest.raises(ValueError):
+        PrometheusConf.from_env([["@prometheus", "quantiles", "0.99"]])
+    with pytest.raises(ValueError):
+        PrometheusConf("gauge")
+
+
+def test_histograms_with_buckets(monkeypatch):
+    rows = [
+        ["@prometheus", "type", "histogram"],
+        ["@prometheus", "buckets", "0.001,0.01,0.1"],
+        ["@prometheus", "buckets", "0.005,0.05", "prom_fast"],
+        ["@prometheus", "label", "service", "api"],
+    ]
+    run(rows, monkeypatch)
+    get = REGISTRY.get_sample_value
+    labels = {"service": "api"}
+    assert get("hiq_prom_slow_count", labels) == 3
+    assert get("hiq_prom_slow_bucket", {"le": "0.01", **labels}) == 0
+    assert get("hiq_prom_slow_bucket", {"le": "0.1", **labels}) == 3
+    assert get("hiq_prom_fast_bucket", {"le": "0.05", **labels}) == 3
+    assert get("hiq_prom_fast_count", labels) == 3
+    assert get("hiq_prom_fast_bucket", {"le": "0.01", **labels}) is None
+
+
+def test_multiprocess(tmp_path, monkeypatch):
+    from prometheus_client import values
+
+    from hiq.hiq_utils import get_decorated_caller
+    from hiq.prometheus import get_registry
+
+    # prometheus_client picks the value class at import, when the env variable is
+    # read, so switch it here as if the env variable had been set before
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    monkeypatch.setattr(values, "ValueClass", values.MultiProcessValue())
+    conf = PrometheusConf()
+    assert conf.metric_type == PROM_HISTOGRAM
+    pids = []
+    for _ in range(3):
+        pid = os.fork()
+        if pid == 0:
+            get_decorated_caller(time.sleep, "prometheus", "__mp_work", conf)(0.001)
+            os._exit(0)
+        pids.append(pid)
+    for pid in pids:
+        os.waitpid(pid, 0)
+    assert get_registry().get_sample_value("hiq_mp_work_count") == 3
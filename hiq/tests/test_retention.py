@@ -0,0 +1,91 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import os
+import sys
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+from hiq.constants import RETENTION_FIFO, RETENTION_LRU
+from hiq.retention import TauStore
+from hiq.tree import Tree
+
+
+def forest(n):
+    """a forest of one latency tree of `n` nodes"""
+    t = Tree(extra={}, tid="t")
+    for i in range(n):
+        t.start("f", float(i))
+        t.end("f", i + 0.5)
+    return {"time": t}
+
+
+def store(policy, max_bytes=0, max_size=100, batch=1):
+    return TauStore(max_size, max_bytes, policy, batch, node_bytes=100)
+
+
+def test_max_size():
+    tau = store(RETENTION_FIFO, max_size=2)
+    for k in range(5):
+        tau.put(k, forest(1))
+    # one more than `max_size`, the request being recorded
+    assert list(tau) == [2, 3, 4]
+    assert [k for k, _ in tau.drain(force=True)] == [0, 1]
+
+
+@pytest.mark.parametrize("policy", [RETENTION_FIFO, RETENTION_LRU])
+def test_byte_budget(policy):
+    tau = store(policy, max_bytes=1000)
+    for k in range(3):
+        f = tau.put(k, forest(3))
+        tau.touch(k, f)
+    assert tau.nbytes == 900 and tau.sizes == {0: 300, 1: 300, 2: 300}
+    # request 0 completes another root call
+    f = tau[0]
+    f["time"].start("g", 10.0)
+    f["time"].end("g", 11.0)
+    tau.touch(0, f)
+    f = tau.put(3, forest(3))
+    tau.touch(3, f)
+    # FIFO evicts the oldest request, LRU the least recently completed one
+    assert list(tau) == ([1, 2, 3] if policy == RETENTION_FIFO else [2, 0, 3])
+    assert tau.nbytes == sum(tau.sizes.values()) <= 1000
+    assert set(tau.sizes) == set(tau)
+    # the last request is kept even over the budget
+    f = tau.put(4, forest(20))
+    tau.touch(4, f)
+    assert list(tau) == [4] and tau.nbytes == 2000
+    assert len(tau.drain()) == 1 and len(tau.drain(force=True)) == 3
+
+
+@pytest.mark.parametrize("policy", [RETENTION_FIFO, RETENTION_LRU])
+def test_evicted_in_flight(policy):
+    tau = store(policy, max_size=1)
+    f0 = tau.put(0, forest(2))
+    tau.put(1, forest(2))
+    tau.put(2, forest(2))
+    assert 0 not in tau
+    # the root call of request 0 completes after the eviction
+    tau.touch(0, f0)
+    assert 0 not in tau.sizes and tau.nbytes == 0
+    tau.touch(1, tau[1])
+    assert tau.nbytes == 200
+    assert list(tau) == ([1, 2] if policy == RETENTION_FIFO else [2, 1])
+
+
+def test_drain_batch():
+    tau = store(RETENTION_FIFO, max_size=0, batch=3)
+    for k in range(3):
+        tau.put(k, forest(1))
+    assert tau.drain() == []
+    tau.put(3, forest(1))
+    assert [k for k, _ in tau.drain()] == [0, 1, 2]
+    assert tau.drain() == [] and len(tau.drain(force=True)) == 0
+    with pytest.raises(ValueError):
+        TauStore(policy="random")
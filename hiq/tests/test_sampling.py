@@ -0,0 +1,99 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+import hiq
+from hiq import sampling
+from hiq.sampling import HiQSampler
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(sampling, "monotonic", lambda: now[0])
+    return now
+
+
+def test_rate(clock):
+    s = HiQSampler(rate=5)
+    # a full bucket holds one second of traces, per endpoint
+    assert [s(i, "a") for i in range(7)] == [True] * 5 + [False] * 2
+    assert s("x", "b")
+    clock[0] += 0.2
+    assert [s(i, "a") for i in range(2)] == [True, False]
+    clock[0] += 10
+    assert sum(s(i, "a") for i in range(10)) == 5
+    assert s.sampled == 12 and s.dropped == 8
+    # below one trace per second, one trace every 1/rate seconds
+    s = HiQSampler(rate=0.5)
+    assert [s(1, "a"), s(2, "a")] == [True, False]
+    clock[0] += 1
+    assert not s(3, "a")
+    clock[0] += 1
+    assert s(4, "a")
+
+
+def test_probability_and_id(monkeypatch, clock):
+    draws = iter([0.05, 0.5, 0.09, 0.95])
+    monkeypatch.setattr(sampling, "random", lambda: next(draws))
+    s = HiQSampler(probability=0.1, id_pattern=r"^debug-")
+    assert [s(i, "a") for i in range(4)] == [True, False, True, False]
+    # a matching id neither draws nor takes a token
+    assert s("debug-1", "a") and s("debug-2", "a")
+    s = HiQSampler(probability=1.0, rate=1, id_pattern="keep")
+    assert s(1, "a") and not s(2, "a") and s("keep-3", "a")
+    with pytest.raises(ValueError):
+        HiQSampler(probability=1.5)
+    with pytest.raises(ValueError):
+        HiQSampler(rate=-1)
+
+
+def leaf():
+    return 1
+
+
+def handler():
+    return leaf() + leaf()
+
+
+async def ahandler():
+    await asyncio.sleep(0)
+    return leaf()
+
+
+def test_driver():
+    mod = __name__
+    table = [[mod, "", x, x] for x in ("handler", "leaf", "ahandler")]
+    driver = hiq.HiQLatency(hiq_table_or_path=table, max_hiq_size=100)
+    m = sys.modules[__name__]
+    try:
+        driver.set_sampling(id_pattern=r"^keep-")
+        assert driver.sampler.probability == 0.0
+        for req_id in ("keep-1", "drop-1", "keep-2", "drop-2"):
+            driver.get_tau_id = lambda: req_id
+            assert m.handler() == 2
+            assert asyncio.run(m.ahandler()) == 1
+        assert sorted(driver.tau) == ["keep-1", "keep-2"]
+        tree = driver.get_metrics_by_k0("keep-1")
+        assert [n.name for n in tree.root.nodes] == ["__handler", "__ahandler"]
+        # the calls of a request not sampled are not counted either
+        assert driver.get_overhead_breakdown()["__leaf"]["calls"] == 6
+        assert driver.sampler.sampled == 4 and driver.sampler.dropped == 4
+        driver.set_sampling()
+        assert driver.sampler is None
+        driver.get_tau_id = lambda: "drop-3"
+        m.handler()
+        assert "drop-3" in driver.tau
+    finally:
+        driver.disable_hiq()
@@ -0,0 +1,138 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import importlib.util
+import multiprocessing as mp
+import os
+import pickle
+import sys
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+from hiq.shm_ring import (
+    CODEC_NONE,
+    CODEC_ZLIB,
+    CODEC_ZSTD,
+    SLOT_HEAD,
+    ShmRing,
+    decode_frame,
+    encode_frame,
+)
+
+
+@pytest.fixture
+def ring():
+    r = ShmRing(capacity=64)
+    yield r
+    r.close()
+
+
+def test_wraparound(ring):
+    frames = [bytes([i]) * (5 + i % 7) for i in range(200)]
+    got = []
+    for f in frames:
+        # the consumer is always one frame behind
+        assert ring.put(f)
+        if ring.used() > 20:
+            got.append(ring.get())
+    while True:
+        f = ring.get()
+        if f is None:
+            break
+        got.append(f)
+    assert got == frames
+    # the positions only grow, the data wraps many times
+    assert ring.pos[0] == ring.pos[1] == sum(SLOT_HEAD + len(f) for f in frames)
+    assert ring.pos[0] > 10 * ring.capacity
+
+
+def test_full(ring):
+    assert not ring.put(b"x" * 57)
+    assert ring.put(b"x" * 56) and ring.used() == 64
+    assert not ring.put(b"")
+    assert ring.get() == b"x" * 56 and ring.get() is None
+    # a frame and a slot head across the end of the data region
+    assert ring.put(b"a" * 10, 1) and ring.put(bytes(range(34)), 2)
+    assert ring.take() == (b"a" * 10, 1)
+    assert ring.put(b"b" * 10, 3)
+    assert ring.take() == (bytes(range(34)), 2) and ring.take() == (b"b" * 10, 3)
+    assert ring.take() is None
+
+
+def test_counters(ring):
+    for i in range(3):
+        ring.put(b"f%d" % i)
+    assert ring.pending() == ring.used() == 30
+    ring.get()
+    ring.get()
+    ring.ack(exported=5, failed=1)
+    assert ring.pending() == ring.used() == 10
+    assert ring.items() == (5, 1)
+    # the consumer attaches by name
+    other = pickle.loads(pickle.dumps(ring))
+    assert other.get() == b"f2"
+    other.ack(exported=2)
+    assert ring.pending() == 0 and ring.items() == (7, 1)
+    other.close()
+    ring.close()
+    # the counters stay readable once the segment is gone
+    assert ring.items() == (7, 1)
+
+
+def consume(name, n):
+    ring = ShmRing(name=name)
+    for _ in range(n):
+        frame = None
+        while frame is None:
+            frame = ring.get()
+        ring.ack(exported=len(list(decode_frame(frame))))
+    ring.close()
+
+
+def test_processes():
+    ring = ShmRing(capacity=256)
+    try:
+        p = mp.get_context("fork").Process(target=consume, args=(ring.shm.name, 100))
+        p.start()
+        for i in range(100):
+            frame = encode_frame([(f"k{i}", "v" * (i % 50))] * 3)
+            while not ring.put(frame):
+                assert p.is_alive()
+        p.join(60)
+        assert p.exitcode == 0
+        assert ring.items() == (300, 0) and ring.pending() == 0
+    finally:
+        ring.close()
+
+
+def test_fork_close():
+    ring = ShmRing(capacity=64)
+    try:
+        # a forked copy detaches, only the creator removes the segment
+        p = mp.get_context("fork").Process(target=ring.close)
+        p.start()
+        p.join(30)
+        assert p.exitcode == 0
+        other = ShmRing(name=ring.shm.name)
+        assert ring.put(b"f") and other.get() == b"f"
+        other.close()
+    finally:
+        ring.close()
+
+
+@pytest.mark.parametrize("codec", [CODEC_NONE, CODEC_ZLIB, CODEC_ZSTD])
+def test_codecs(codec):
+    if codec == CODEC_ZSTD and importlib.util.find_spec("zstandard") is None:
+        pytest.skip("zstandard is not installed")
+    records = [("time", "t1^x" * 100), ("ключ", "värde 🦉"), ("", "")]
+    frame = encode_frame(records, codec)
+    assert list(decode_frame(frame)) == records
+    assert list(decode_frame(encode_frame([], codec))) == []
+    with pytest.raises(ValueError):
+        list(decode_frame(b"\x09abc"))
@@ -0,0 +1,163 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import asyncio
+import contextlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+import hiq
+from hiq.sketch import LatencySketch, LatencyStats
+
+
+def exact(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))]
+
+
+def test_accuracy_and_merge():
+    rnd = random.Random(3)
+    values = [rnd.lognormvariate(-6, 1.5) for _ in range(20000)] + [0.0] * 10
+    a, b = LatencySketch(), LatencySketch()
+    for i, x in enumerate(values):
+        (a if i % 2 else b).add(x)
+    sk = LatencySketch().merge(a).merge(b)
+    assert sk.count == len(values) and sk.zeros == 10
+    assert math.isclose(sk.sum, sum(values)) and sk.max == max(values)
+    for q in (0.5, 0.9, 0.99, 0.999):
+        assert abs(sk.quantile(q) - exact(values, q)) <= 0.0101 * exact(values, q)
+    assert sk.quantile(0) == 0.0 and sk.quantile(1) == max(values)
+    r = LatencySketch.from_dict(json.loads(json.dumps(sk.to_dict())))
+    assert r.summary() == sk.summary()
+    small = LatencySketch(max_bins=200)
+    for x in values:
+        small.add(x)
+    assert len(small.bins) <= 200
+    assert abs(small.quantile(0.99) - exact(values, 0.99)) <= 0.0101 * exact(values, 0.99)
+    assert math.isnan(LatencySketch().quantile(0.5))
+
+
+def leaf():
+    time.sleep(0.002)
+
+
+def handler(n=2):
+    for _ in range(n):
+        leaf()
+
+
+async def ahandler():
+    await asyncio.sleep(0.002)
+
+
+def test_driver_stats():
+    mod = __name__
+    table = [
+        [mod, "", "handler", "handler"],
+        [mod, "", "leaf", "leaf"],
+        [mod, "", "ahandler", "ahandler"],
+    ]
+    driver = hiq.HiQLatency(hiq_table_or_path=table, max_hiq_size=2)
+    try:
+        m = sys.modules[__name__]
+        for i in range(5):
+            driver.get_tau_id = lambda: f"req-{i}"
+            m.handler(2)
+        driver.get_tau_id = lambda: "req-async"
+        asyncio.run(m.ahandler())
+    finally:
+        driver.disable_hiq()
+    # the stats cover the requests evicted from tau
+    assert len(driver.tau) < 6
+    summary = driver.stats().summary()
+    assert summary["targets"]["__leaf"]["count"] == 10
+    assert summary["targets"]["__leaf"]["p50"] >= 0.002 * 0.99
+    assert summary["endpoints"]["__handler"]["count"] == 5
+    assert summary["endpoints"]["__handler"]["p99"] >= 0.004 * 0.99
+    assert summary["endpoints"]["__ahandler"]["count"] == 1
+    # merged across processes
+    d = json.loads(json.dumps(driver.stats().to_dict()))
+    total = LatencyStats.from_dict(d).merge(LatencyStats.from_dict(d))
+    assert total.summary()["targets"]["__leaf"]["count"] == 20
+    assert "__handler" in total.table()
+    driver.stats().reset()
+    assert driver.stats().summary() == {"targets": {}, "endpoints": {}}
+
+
+rid = ContextVar("rid", default=None)
+local = threading.local()
+
+
+def get_id():
+    return rid.get() or local.rid
+
+
+def pool_leaf(req_id):
+    local.rid = req_id
+    leaf()
+
+
+def fan_out():
+    with ThreadPoolExecutor(4) as ex:
+        list(ex.map(pool_leaf, [local.rid] * 4))
+
+
+@contextlib.asynccontextmanager
+async def session():
+    await asyncio.gather(*(ahandler() for _ in range(3)))
+    yield
+
+
+async def serve(i):
+    # not traced, the session is the endpoint of the request
+    rid.set(f"areq-{i}")
+    async with sys.modules[__name__].session():
+        await asyncio.gather(*(ahandler() for _ in range(3)))
+
+
+def test_endpoint_per_root_call():
+    mod = __name__
+    table = [[mod, "", x, x] for x in ("leaf", "ahandler", "session", "fan_out")]
+    driver = hiq.HiQLatency(hiq_table_or_path=table, max_hiq_size=100)
+    driver.get_tau_id = get_id
+    m = sys.modules[__name__]
+
+    async def main():
+        await asyncio.gather(*(serve(i) for i in range(4)))
+        await asyncio.gather(*(serve(i) for i in range(4, 8)))
+
+    def request(i):
+        local.rid = f"req-{i}"
+        m.fan_out()
+
+    try:
+        asyncio.run(main())
+        threads = [threading.Thread(target=request, args=(i,)) for i in range(32)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        driver.disable_hiq()
+    # one sample per root call, of its own latency
+    summary = driver.stats().summary()
+    assert set(summary["endpoints"]) == {"__session", "__fan_out"}
+    assert summary["endpoints"]["__session"]["count"] == 8
+    assert summary["endpoints"]["__session"]["p50"] >= 0.004 * 0.99
+    assert summary["endpoints"]["__fan_out"]["count"] == 32
+    assert summary["endpoints"]["__fan_out"]["p50"] >= 0.002 * 0.99
+    assert summary["targets"]["__ahandler"]["count"] == 48
+    assert summary["targets"]["__leaf"]["count"] == 128
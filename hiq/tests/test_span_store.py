@@ -0,0 +1,125 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import os
+import sys
+import time
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+from hiq.shm_ring import CODEC_NONE
+from hiq.span_store import SpanStore, span_key, split_span_key, tree_span
+from hiq.tree import Tree
+
+T0 = 1_700_000_000.0
+
+
+def tree_text(name, start, end):
+    t = Tree(tid="time")
+    t.start(name, start)
+    t.end(name, end)
+    return t.repr()
+
+
+def batch(first, n, t0=T0):
+    """the latency and memory trees of requests `first` to `first + n`"""
+    r = []
+    for i in range(first, first + n):
+        name = "__get" if i % 2 else "__post"
+        start = t0 + i
+        r.append((span_key("time", f"req-{i}", name, start, start + 0.5), tree_text(name, start, start + 0.5)))
+        r.append((span_key("memory", f"req-{i}", name, float("nan"), float("nan")), tree_text(name, 10, 12)))
+    return r
+
+
+def test_span_key():
+    t = Tree(tid="time")
+    t.start("__main", T0)
+    t.end("__main", T0 + 1)
+    name, start, end = tree_span(t)
+    assert (name, start, end) == ("__main", T0, T0 + 1)
+    assert split_span_key(span_key("time", 7, name, start, end)) == ("time", "7", "__main", T0, T0 + 1)
+    assert split_span_key("time")[0] == "time"
+
+
+def test_append_and_query(tmp_path):
+    store = SpanStore(str(tmp_path))
+    for i in range(0, 100, 10):
+        assert store.append(batch(i, 10)) == 20
+    forest = store.get_forest("req-42")
+    assert sorted(forest) == ["memory", "time"]
+    assert forest["time"].get_duration_by_node_name("__post") == 0.5
+    # the memory tree gets the time range of its request
+    entries = store.find(req_id="req-42")
+    assert entries[1].key == "memory" and entries[1].start == T0 + 42
+    assert len(store.find(name="__get", key="time")) == 50
+    trees = store.query(start=T0 + 10.2, end=T0 + 12.1, key="time")
+    assert [tree_span(t)[0] for t in trees] == ["__post", "__get", "__post"]
+    assert len(store.find(name="__get", start=T0 + 90)) == 10
+    assert len(store.find(limit=3)) == 3
+    assert store.find(req_id="nope") == []
+    store.close()
+
+
+def test_reopen_and_readonly(tmp_path):
+    store = SpanStore(str(tmp_path), codec=CODEC_NONE)
+    store.append(batch(0, 5))
+    reader = SpanStore(str(tmp_path), readonly=True)
+    assert len(reader.find(key="time")) == 5
+    store.append(batch(5, 5))
+    # the reader follows the writer
+    assert len(reader.find(key="time")) == 10
+    assert tree_span(reader.get_forest("req-7")["time"])[0] == "__get"
+    store.close()
+    store = SpanStore(str(tmp_path), codec=CODEC_NONE)
+    assert len(store.find()) == 20
+    store.close()
+    reader.close()
+
+
+def test_crash_recovery(tmp_path):
+    store = SpanStore(str(tmp_path))
+    store.append(batch(0, 5))
+    store.append(batch(5, 5))
+    seg = os.path.join(str(tmp_path), "000000000000.seg")
+    idx = os.path.join(str(tmp_path), "000000000000.idx")
+    size = os.path.getsize(seg)
+    store.append(batch(10, 5))
+    store.close()
+    # the last batch is half written, and its index entries are missing
+    with open(seg, "r+b") as f:
+        f.truncate(os.path.getsize(seg) - 10)
+    with open(idx, "r+b") as f:
+        f.truncate(os.path.getsize(idx) // 3 + 3)
+    store = SpanStore(str(tmp_path))
+    assert os.path.getsize(seg) == size
+    assert sorted(e.req_id for e in store.find(key="time")) == sorted(f"req-{i}" for i in range(10))
+    store.append(batch(10, 5))
+    assert len(store.find(key="time")) == 15
+    store.close()
+    assert len(SpanStore(str(tmp_path), readonly=True).find()) == 30
+
+
+def test_segments_and_retention(tmp_path):
+    store = SpanStore(str(tmp_path), segment_bytes=2000, max_bytes=0)
+    for i in range(0, 200, 10):
+        store.append(batch(i, 10))
+    assert len(store.segments) > 3
+    assert len(store.find(key="time")) == 200
+    store.max_age = 3600
+    assert store.compact(now=T0 + 100 + 3600) > 0
+    kept = store.find(key="time")
+    assert kept[-1].req_id == "req-199" and len(kept) < 200
+    # whole segments are removed, once their last tree is too old
+    assert kept[0].start > T0
+    assert all(seg.t_max >= T0 + 100 for seg in store.segments.values())
+    store.max_age, store.max_bytes = 0, 1
+    store.compact()
+    # only the active segment is left
+    assert len(store.segments) == 1
+    assert len(os.listdir(str(tmp_path))) == 2
+    store.close()
@@ -0,0 +1,161 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+import hiq
+
+rid = ContextVar("rid", default=None)
+local = threading.local()
+
+
+def get_id():
+    return rid.get() or local.rid
+
+
+def leaf():
+    time.sleep(0.001)
+
+
+def handler(n=3):
+    for _ in range(n):
+        leaf()
+
+
+def pool_leaf(req_id):
+    local.rid = req_id
+    leaf()
+
+
+def fan_out(req_id):
+    with ThreadPoolExecutor(4) as ex:
+        list(ex.map(pool_leaf, [req_id] * 4))
+
+
+async def ajob(n, fail=False):
+    await asyncio.sleep(0.001 * n)
+    if fail:
+        raise ValueError("boom")
+
+
+async def astep(n, fail=False):
+    # a task nested in a task
+    await asyncio.create_task(ajob(n, fail))
+
+
+async def arequest(fail=False):
+    await asyncio.gather(astep(1), astep(2, fail), ajob(1))
+    await asyncio.to_thread(leaf)
+
+
+@pytest.fixture
+def driver():
+    mod = __name__
+    table = [[mod, "", x, x] for x in ("handler", "leaf", "fan_out", "ajob", "astep", "arequest")]
+    d = hiq.HiQLatency(hiq_table_or_path=table, max_hiq_size=1000)
+    d.get_tau_id = get_id
+    yield d
+    d.disable_hiq()
+
+
+def shape(node):
+    """(name, sorted shapes of the children)"""
+    return (node.name, sorted(shape(c) for c in node.nodes))
+
+
+def tree_of(driver, req_id):
+    tree = driver.get_metrics_by_k0(req_id)
+    assert tree.n_open == 0
+    return tree
+
+
+def test_threads(driver):
+    m = sys.modules[__name__]
+
+    def serve(i):
+        for j in range(4):
+            local.rid = f"t{i}-{j}"
+            m.handler()
+
+    threads = [threading.Thread(target=serve, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(driver.tau) == 64
+    for i in range(16):
+        for j in range(4):
+            tree = tree_of(driver, f"t{i}-{j}")
+            assert shape(tree.root)[1] == [("__handler", [("__leaf", [])] * 3)]
+    assert driver.tau_owner == {}
+
+
+def test_thread_pool(driver):
+    m = sys.modules[__name__]
+    for i in range(3):
+        local.rid = f"p{i}"
+        m.fan_out(f"p{i}")
+    for i in range(3):
+        tree = tree_of(driver, f"p{i}")
+        # the workers record under the roots, the calls of a request are all kept
+        names = sorted(n.name for n in tree.root.nodes)
+        assert names == ["__fan_out"] + ["__leaf"] * 4
+    assert driver.tau_owner == {}
+
+
+def test_asyncio(driver):
+    m = sys.modules[__name__]
+
+    async def serve(i):
+        rid.set(f"a{i}")
+        try:
+            await m.arequest(fail=i % 2 == 1)
+        except ValueError:
+            return False
+        return True
+
+    async def main():
+        return await asyncio.gather(*[serve(i) for i in range(8)])
+
+    assert asyncio.run(main()) == [True, False] * 4
+    local.rid = None
+    for i in range(8):
+        root = tree_of(driver, f"a{i}").root
+        job = ("__ajob", [])
+        if i % 2:
+            # the request ended at the exception, before `to_thread`
+            expected = [("__ajob", []), ("__astep", [job]), ("__astep", [job])]
+        else:
+            expected = [("__ajob", []), ("__astep", [job]), ("__astep", [job]), ("__leaf", [])]
+        assert shape(root)[1] == [("__arequest", expected)]
+        node = root.nodes[0]
+        assert ("ValueError" in str(node.extra)) == bool(i % 2)
+    assert driver.tau_owner == {}
+
+
+def test_sync_in_async(driver):
+    m = sys.modules[__name__]
+
+    async def main():
+        rid.set("s")
+        await m.ajob(1)
+        m.handler(2)
+
+    asyncio.run(main())
+    root = tree_of(driver, "s").root
+    assert shape(root)[1] == [("__ajob", []), ("__handler", [("__leaf", [])] * 2)]
+    assert driver.tau_owner == {}
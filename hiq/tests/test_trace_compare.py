@@ -0,0 +1,87 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import os
+import random
+import sys
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+np = pytest.importorskip("numpy")
+
+import hiq
+from hiq.trace_compare import mann_whitney
+from hiq.tree import Tree
+
+
+def make_tree(rnd, i, slow=1.0, extra_call=False, cache=True):
+    t = Tree(extra={}, tid=str(i))
+    now = 100.0 * i
+    t.start("main", now)
+    t.start("load", now)
+    now += rnd.uniform(0.010, 0.012)
+    t.end("load", now)
+    for _ in range(2):
+        t.start("infer", now)
+        now += rnd.uniform(0.020, 0.024) * slow
+        t.end("infer", now)
+    if extra_call:
+        t.start("log", now)
+        now += 0.001
+        t.end("log", now)
+    if cache:
+        t.start("cache", now)
+        now += 0.0005
+        t.end("cache", now)
+    t.end("main", now + 0.001)
+    return t
+
+
+def test_mann_whitney():
+    rnd = np.random.default_rng(1)
+    a, b = rnd.normal(0, 1, 40), rnd.normal(0.8, 1, 50)
+    c = np.round(rnd.normal(0, 1, 30), 1)
+    values = np.concatenate([a, b, c, c])
+    groups = np.r_[np.zeros(90, dtype=np.int64), np.ones(60, dtype=np.int64)]
+    side = np.r_[np.zeros(40), np.ones(50), np.zeros(30), np.ones(30)]
+    p_larger, p = mann_whitney(groups, values, side, 2)
+    # U and p of scipy.stats.mannwhitneyu(b, a) and (c, c)
+    u = sum((x > y) + 0.5 * (x == y) for x in b for y in a)
+    assert p_larger[0] == pytest.approx(u / 2000)
+    assert p[0] < 0.01
+    assert p_larger[1] == 0.5 and p[1] == pytest.approx(1.0)
+
+
+def test_compare(tmp_path):
+    rnd = random.Random(5)
+    base = [make_tree(rnd, i) for i in range(300)]
+    cand = [make_tree(rnd, i, slow=1.2, extra_call=True, cache=False) for i in range(300)]
+    r = hiq.compare(base, cand)
+    assert r.n_base == 300 and r.n_cand == 300
+    assert r.rows["main/infer"]["status"] == "regressed"
+    assert r.rows["main/infer"]["count_base"] == 300
+    assert 0.15 < r.rows["main/infer"]["change"] < 0.25
+    assert r.rows["main/infer"]["delta_lo"] > 0
+    assert r.rows["main/load"]["status"] == "same"
+    assert r.rows["main/log"]["status"] == "added"
+    assert r.rows["main/cache"]["status"] == "removed"
+    assert r.regressions() == ["main", "main/infer"] and not r.passed
+    assert hiq.compare(base[:150], base[150:]).passed
+    flame = r.flame().splitlines()
+    assert flame[0].startswith("🔺 main(") and flame[2].startswith("🔺    infer(")
+    folded = dict(line.rsplit(" ", 2)[0:1] + [line.rsplit(" ", 2)[1:]] for line in r.folded())
+    assert folded["main;log"] == ["0", "1000"] and folded["main;cache"] == ["500", "0"]
+    assert int(folded["main"][0]) == pytest.approx(1000, abs=2)
+    assert "main/infer" in r.table()
+    # the same from Jack logs
+    for name, trees in (("base.log", base), ("cand.log", cand)):
+        (tmp_path / name).write_text("".join(f"time,{t.repr()}\n" for t in trees))
+    r2 = hiq.compare(str(tmp_path / "base.log"), tmp_path / "cand.log")
+    assert r2.rows.keys() == r.rows.keys()
+    assert r2.rows["main/infer"]["p_value"] == pytest.approx(r.rows["main/infer"]["p_value"])
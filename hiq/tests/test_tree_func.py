@@ -0,0 +1,97 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import math
+import os
+import pickle
+import random
+import sys
+from collections import defaultdict
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+from hiq.tree import Tree
+
+
+def random_tree(rnd, n=300):
+    t = Tree(extra={}, tid="t")
+    now, open_ = 0.0, []
+    for _ in range(n):
+        if len(open_) < 6 and rnd.random() < 0.55:
+            name = rnd.choice("abcde")
+            t.start(name, now)
+            open_.append(name)
+        elif open_:
+            t.end(open_.pop(), now)
+        now += rnd.random() + 0.01
+    while open_:
+        t.end(open_.pop(), now)
+        now += 1
+    return t
+
+
+def expected(t):
+    """the sums by a plain recursion"""
+    by_name, leaf, by_level = defaultdict(float), defaultdict(float), defaultdict(float)
+
+    def walk(n, level):
+        by_name[n.name] += n.span()
+        by_level[level, n.name] += n.span()
+        if not n.nodes:
+            leaf[n.name] += n.span()
+        for c in n.nodes:
+            walk(c, level + 1)
+
+    for n in t.root.nodes:
+        walk(n, 0)
+    return by_name, leaf, by_level
+
+
+def test_sums():
+    rnd = random.Random(1)
+    for _ in range(5):
+        t = random_tree(rnd)
+        by_name, leaf, by_level = expected(t)
+        d = t.duration_by_name_s()
+        assert math.isnan(d.pop("None"))
+        assert d.keys() == by_name.keys()
+        assert all(math.isclose(d[k], by_name[k]) for k in d)
+        assert t.leaf_duration_by_name_s().keys() == leaf.keys()
+        assert all(math.isclose(v, leaf[k]) for k, v in t.leaf_duration_by_name_s().items())
+        assert math.isclose(t.leaf_duration_total_s(), sum(leaf.values()))
+        assert sorted(t.get_distinct_node_names()) == sorted(["None", *by_name])
+        for k in by_name:
+            assert math.isclose(t.get_duration_by_node_name(k), by_name[k])
+        for (level, k), v in by_level.items():
+            assert math.isclose(t.get_duration_by_node_name_and_level(k, level), v)
+        assert t.get_duration_by_node_name("zz") == 0.0
+        assert t.get_duration_by_node_name_and_level("a", 99) == 0.0
+        ordered = list(t.leaf_duration_by_name_s(ordered=1).values())
+        assert ordered == sorted(ordered, reverse=True)
+
+
+def test_cache():
+    t = Tree(extra={}, tid="t")
+    t.start("a", 0.0)
+    t.start("b", 1.0)
+    t.end("b", 3.0)
+    assert t.get_duration_by_node_name("b") == 2.0
+    assert t.stats() is t.stats()
+    t.end("a", 4.0)
+    assert t.get_duration_by_node_name("a") == 4.0
+    t.start("c", 5.0)
+    t.end("c", 6.0)
+    assert t.leaf_duration_by_name_s() == {"b": 2.0, "c": 1.0}
+    t.duration_by_name_s()["c"] = 100
+    assert t.get_duration_by_node_name("c") == 1.0
+    cached = t.stats()
+    t.consolidate()
+    assert t.stats() is not cached
+    r = Tree(t.repr())
+    assert r.get_duration_by_node_name_and_level("b", 1) == 2.0
+    r = pickle.loads(pickle.dumps(t))
+    assert r.get_duration_by_node_name("a") == 4.0
@@ -0,0 +1,125 @@
+# HiQ version 1.1
+#
+# Copyright (c) 2022, Oracle and/or its affiliates.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl/
+#
+
+import json
+import os
+import sys
+import time
+
+import pytest
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.abspath(os.path.join(cur_dir, "../src")))
+
+import hiq
+from hiq.jack import _literal_exceptions
+from hiq.tree import Tree
+from hiq.zipkin_json import encode_tree, new_id, tree_to_spans
+
+
+def leaf():
+    time.sleep(0.001)
+
+
+def handler(fail=False):
+    leaf()
+    leaf()
+    if fail:
+        raise ValueError("boom")
+
+
+@pytest.fixture
+def driver(monkeypatch):
+    monkeypatch.delenv("TRACE_TYPE", raising=False)
+    mod = __name__
+    table = [[mod, "", "handler", "handler"], [mod, "", "leaf", "leaf"]]
+    d = hiq.HiQLatency(hiq_table_or_path=table, max_hiq_size=4)
+    yield d
+    d.disable_hiq()
+
+
+def test_new_id():
+    assert len(new_id()) == 16 and len(new_id(128)) == 32
+    assert new_id() != new_id()
+    int(new_id(), 16)
+
+
+def test_spans_of_tree(driver):
+    driver.get_tau_id = lambda: "req-1"
+    sys.modules[__name__].handler()
+    with pytest.raises(ValueError):
+        sys.modules[__name__].handler(fail=True)
+    tree = driver.tau["req-1"]["time"]
+    spans = tree_to_spans(tree, "svc", req_id="req-1")
+    assert [s["name"] for s in spans] == ["__handler", "__leaf", "__leaf"] * 2
+    assert len({s["traceId"] for s in spans}) == 1
+    assert len({s["id"] for s in spans}) == 6
+    roots = [s for s in spans if "parentId" not in s]
+    assert len(roots) == 2 and all(s["tags"]["hiq.request_id"] == "req-1" for s in roots)
+    for i in (1, 2, 4, 5):
+        assert spans[i]["parentId"] == spans[i // 3 * 3]["id"]
+        assert "tags" not in spans[i]
+    node = tree.root.nodes[0]
+    assert spans[0]["timestamp"] == round(node.start * 1e6)
+    assert spans[0]["duration"] >= spans[1]["duration"] + spans[2]["duration"]
+    assert spans[0]["localEndpoint"] == {"serviceName": "svc"}
+    assert "error" not in spans[0]["tags"]
+    failed = spans[3]
+    assert "boom" in failed["tags"]["error"]
+    assert failed["annotations"][0]["value"].startswith("error: ")
+    assert failed["annotations"][0]["timestamp"] == failed["timestamp"] + failed["duration"]
+    # the same spans from the text of the tree, as the Jack process gets it
+    _literal_exceptions(tree)
+    encoded = encode_tree(Tree(tree.repr()), "svc", trace_id="abc", parent_id="def")
+    assert b'": ' not in encoded
+    r = json.loads(encoded)
+    assert [s["name"] for s in r] == [s["name"] for s in spans]
+    assert [s["timestamp"] for s in r] == [s["timestamp"] for s in spans]
+    assert {s["traceId"] for s in r} == {"abc"}
+    assert r[0]["parentId"] == "def" and r[3]["tags"]["error"] == failed["tags"]["error"]
+
+
+def test_jack_ships_spans(monkeypatch):
+    pytest.importorskip("py_zipkin")
+    from test_oci_apm import ApmServer
+
+    apm = ApmServer()
+    for k, v in {
+        "JACK": "1",
+        "HIQ_JACK_APM": "1",
+        "APM_BASE_URL": apm.url,
+        "APM_PUB_KEY": "KEY",
+        "APM_BATCH_MS": "10",
+    }.items():
+        monkeypatch.setenv(k, v)
+    for k in ("TRACE_TYPE", "http_proxy", "HTTP_PROXY"):
+        monkeypatch.delenv(k, raising=False)
+    mod = __name__
+    table = [[mod, "", "handler", "handler"], [mod, "", "leaf", "leaf"]]
+    d = hiq.HiQLatency(hiq_table_or_path=table, max_hiq_size=1)
+    try:
+        for i in range(6):
+            d.get_tau_id = lambda: f"req-{i}"
+            sys.modules[__name__].handler()
+        d.disable_hiq()
+        assert d.flush_jack()
+        deadline = time.monotonic() + 10
+        while len(apm.spans()) < 9 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        d.close_jack()
+        apm.close()
+    spans = apm.spans()
+    # the requests evicted from the driver, a trace each
+    roots = [s for s in spans if "parentId" not in s]
+    assert len(roots) >= 3
+    assert len({s["traceId"] for s in spans}) == len(roots)
+    assert len({s["tags"]["hiq.request_id"] for s in roots}) == len(roots)
+    for root in roots:
+        children = [s for s in spans if s.get("parentId") == root["id"]]
+        assert [s["name"] for s in children] == ["__leaf"] * 2
+        assert all(s["traceId"] == root["traceId"] for s in children)
+    assert len(spans) == 3 * len(roots)